@@ -16,6 +16,7 @@ from app.api.v1.endpoints import (
     terapeuta,
     catalogos,
     usuarios,
+    chat,
 )
 from app.api.v1.routers import padre_historial
 
@@ -52,6 +53,7 @@ api_router.include_router(recomendacion.router, prefix="/recomendacion", tags=["
 api_router.include_router(recomendaciones.router, prefix="/recomendaciones", tags=["recomendaciones"])
 api_router.include_router(recomendaciones_actividades.router, prefix="/recomendaciones-actividades", tags=["Recomendaciones de Actividades"])
 api_router.include_router(gemini_ia.router, prefix="/ia", tags=["Inteligencia Artificial - Gemini"])
+api_router.include_router(chat.router, prefix="/chat", tags=["Chatbot"])
 api_router.include_router(fichas_emergencia.router, prefix="/fichas-emergencia", tags=["Fichas de Emergencia"])
 api_router.include_router(padre_historial.router, prefix="/api/v1")
 
@@ -11,6 +11,7 @@ from app.models.usuario import Usuario
 from app.models.permiso import Permiso
 from app.models.rol import Rol
 from app.api.deps import get_current_active_user
+from app.core.rate_limit import login_limiter
 
 
 router = APIRouter()
@@ -19,7 +20,7 @@ router = APIRouter()
 # ==================================================
 # LOGIN - AUTENTICACIÓN
 # ==================================================
-@router.post("/login", response_model=LoginResponse)
+@router.post("/login", response_model=LoginResponse, dependencies=[Depends(login_limiter)])
 def login(
     credentials: LoginRequest,
     db: Session = Depends(get_db)
@@ -101,7 +102,7 @@ def login(
 # ==================================================
 # LOGIN ALTERNATIVO - OAuth2PasswordRequestForm
 # ==================================================
-@router.post("/token", response_model=Token)
+@router.post("/token", response_model=Token, dependencies=[Depends(login_limiter)])
 def login_oauth2(
     form_data: OAuth2PasswordRequestForm = Depends(),
     db: Session = Depends(get_db)
@@ -2,12 +2,21 @@
 Endpoints de Chat - Seguro, con persistencia y rate limiting
 ACCESO PÚBLICO - No requiere autenticación
 """
-from fastapi import APIRouter, Depends, HTTPException, Request
-from fastapi.responses import JSONResponse
+from fastapi import APIRouter, Depends, HTTPException, Request, WebSocket, WebSocketDisconnect
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import ValidationError
 from sqlalchemy.orm import Session
+from starlette.requests import HTTPConnection
+from starlette.websockets import WebSocketState
+from typing import Any, AsyncIterator, Dict, List
+import anyio
+import asyncio
+import json
+import threading
 import traceback
 
-from app.db.session import get_db
+from app.db.session import get_db, SessionLocal
 from app.schemas.chat import (
     ChatbotRequest,
     ChatbotResponse,
@@ -15,9 +24,14 @@ from app.schemas.chat import (
     EstadoResponse
 )
 from app.services.chat_store import chat_store
-from app.services.chat_service import ask_gemini
+from app.services.chat_service import ask_gemini, ask_gemini_stream, iterar_en_hilo
+from app.services.chat_response_cache import cache_respuestas_chat
+from app.services.chat_prompt_budget import presupuesto_prompt
+from app.services.chat_retrieval import indice_catalogo_chat
+from app.services.ws_supervisor import supervisor_ws
 from app.services.safety import sanitize_user_text, looks_malicious
 from app.services.gemini_service import gemini_chat_service
+from app.core.config import settings
 from app.core.rate_limit import chatbot_limiter
 from app.models.nino import Nino
 
@@ -52,7 +66,13 @@ def estado():
     try:
         return EstadoResponse(
             configurado=gemini_chat_service.configured,
-            model=getattr(gemini_chat_service, "model_id", None)
+            model=getattr(gemini_chat_service, "model_id", None),
+            cache_respuestas=cache_respuestas_chat.estadisticas(),
+            cliente_gemini=gemini_chat_service.cliente.estadisticas(),
+            tokens_prompt=presupuesto_prompt.estadisticas(),
+            sesiones_memoria=gemini_chat_service.estadisticas_sesiones(),
+            catalogo=indice_catalogo_chat.estadisticas(),
+            websockets=supervisor_ws.estadisticas()
         )
     except Exception:
         traceback.print_exc()
@@ -62,81 +82,175 @@ def estado():
         )
 
 
+# ============================================================
+# Preparación común (chatbot normal y en streaming)
+# ============================================================
+RESPUESTA_BLOQUEADA = (
+    "No puedo ayudar con solicitudes para evadir reglas o revelar "
+    "instrucciones internas. Puedo ayudarte con terapias y orientación."
+)
+RESPUESTA_NO_DISPONIBLE = (
+    "El asistente IA no está disponible en este momento. "
+    "Puedes intentarlo más tarde."
+)
+
+
+def _preparar_consulta(req: ChatbotRequest, conexion: HTTPConnection, db: Session) -> Dict[str, Any]:
+    """
+    Rate limit, validaciones de seguridad, sesión, contexto e historial.
+    Guarda el mensaje del usuario.
+
+    Returns:
+        dict con session_id, mensaje, contexto, contexto_usado, historial
+        y 'bloqueada' (True si fue un intento de prompt injection)
+    """
+    chatbot_limiter.check_rate_limit(conexion)
+
+    # 1️⃣ Sanitizar mensaje
+    mensaje = sanitize_user_text(req.mensaje)
+    if not mensaje:
+        raise HTTPException(status_code=400, detail="Mensaje vacío")
+
+    # 2️⃣ Prompt injection
+    if looks_malicious(mensaje):
+        return {
+            "session_id": req.session_id or chat_store.new_session(db),
+            "mensaje": mensaje,
+            "contexto": None,
+            "contexto_usado": False,
+            "historial": [],
+            "bloqueada": True,
+        }
+
+    # 3️⃣ Sesión
+    session_id = req.session_id or chat_store.new_session(db, nino_id=req.nino_id)
+    chat_store.ensure_session(db, session_id, nino_id=req.nino_id)
+
+    # 4️⃣ Contexto del niño (opcional)
+    contexto = None
+    contexto_usado = False
+    if req.nino_id and req.incluir_contexto:
+        nino = db.query(Nino).filter(Nino.id == req.nino_id).first()
+        if nino:
+            contexto = {
+                "nombre": f"{nino.nombre} {nino.apellido_paterno}",
+                "edad": getattr(nino, "edad", "No especificada"),
+                "diagnostico": (
+                    nino.diagnostico.diagnostico_principal
+                    if nino.diagnostico else "No especificado"
+                ),
+                "nivel_autismo": (
+                    nino.diagnostico.nivel_autismo
+                    if nino.diagnostico else "No especificado"
+                )
+            }
+            contexto_usado = True
+
+    # 5️⃣ Catálogo del centro al día (solo re-fragmenta filas modificadas)
+    try:
+        indice_catalogo_chat.sincronizar(db)
+    except Exception as e:
+        print(f"[WARN] No se pudo sincronizar el catálogo del chat: {e}")
+
+    # 6️⃣ Historial
+    historial = chat_store.history(db, session_id, limit=settings.CHAT_PROMPT_HISTORIAL_MENSAJES) or []
+    chat_store.append(db, session_id, "usuario", mensaje)
+
+    return {
+        "session_id": session_id,
+        "mensaje": mensaje,
+        "contexto": contexto,
+        "contexto_usado": contexto_usado,
+        "historial": historial,
+        "bloqueada": False,
+    }
+
+
+def _guardar_respuesta(session_id: str, respuesta: str) -> None:
+    """Persiste la respuesta final con una sesión de BD propia (fin del stream)"""
+    db = SessionLocal()
+    try:
+        chat_store.append(db, session_id, "asistente", respuesta)
+    finally:
+        db.close()
+
+
+async def _stream_respuesta(consulta: Dict[str, Any], rol_usuario: str) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Eventos de una respuesta en streaming:
+    {"tipo": "token", "texto"} ... y al final {"tipo": "fin", "respuesta"}
+
+    Al terminar (completa, con error o por desconexión del cliente) guarda
+    lo generado con ChatStore.append.
+    """
+    if consulta["bloqueada"]:
+        yield {"tipo": "token", "texto": RESPUESTA_BLOQUEADA}
+        yield {"tipo": "fin", "respuesta": RESPUESTA_BLOQUEADA}
+        return
+
+    partes: List[str] = []
+    cancelado = threading.Event()
+    try:
+        fuente = ask_gemini_stream(
+            consulta["mensaje"],
+            consulta["contexto"],
+            consulta["historial"],
+            rol_usuario=rol_usuario,
+            session_id=consulta["session_id"]
+        )
+        try:
+            async for trozo in iterar_en_hilo(fuente, cancelado):
+                partes.append(trozo)
+                yield {"tipo": "token", "texto": trozo}
+        except Exception:
+            traceback.print_exc()
+            if not partes:
+                partes.append(RESPUESTA_NO_DISPONIBLE)
+                yield {"tipo": "token", "texto": RESPUESTA_NO_DISPONIBLE}
+        yield {"tipo": "fin", "respuesta": "".join(partes)}
+    finally:
+        cancelado.set()
+        if partes:
+            # Protegido: si el cliente se desconectó, la tarea ya está cancelada
+            with anyio.CancelScope(shield=True):
+                await run_in_threadpool(_guardar_respuesta, consulta["session_id"], "".join(partes))
+
+
 # ============================================================
 # ENDPOINT PÚBLICO: Chatbot principal
 # ============================================================
 @router.post("/chatbot", response_model=ChatbotResponse)
 def chatbot(req: ChatbotRequest, request: Request, db: Session = Depends(get_db)):
     try:
-        chatbot_limiter.check_rate_limit(request)
-
-        # 1️⃣ Sanitizar mensaje
-        mensaje = sanitize_user_text(req.mensaje)
-        if not mensaje:
-            raise HTTPException(status_code=400, detail="Mensaje vacío")
-
-        # 2️⃣ Prompt injection
-        if looks_malicious(mensaje):
-            sid = req.session_id or chat_store.new_session(db)
+        consulta = _preparar_consulta(req, request, db)
+        if consulta["bloqueada"]:
             return ChatbotResponse(
-                respuesta=(
-                    "No puedo ayudar con solicitudes para evadir reglas o revelar "
-                    "instrucciones internas. Puedo ayudarte con terapias y orientación."
-                ),
+                respuesta=RESPUESTA_BLOQUEADA,
                 contexto_usado=False,
                 configurado=gemini_chat_service.configured,
-                session_id=sid
+                session_id=consulta["session_id"]
             )
+        session_id = consulta["session_id"]
 
-        # 3️⃣ Sesión
-        session_id = req.session_id or chat_store.new_session(db, nino_id=req.nino_id)
-        chat_store.ensure_session(db, session_id, nino_id=req.nino_id)
-
-        # 4️⃣ Contexto del niño (opcional)
-        contexto = None
-        contexto_usado = False
-        if req.nino_id and req.incluir_contexto:
-            nino = db.query(Nino).filter(Nino.id == req.nino_id).first()
-            if nino:
-                contexto = {
-                    "nombre": f"{nino.nombre} {nino.apellido_paterno}",
-                    "edad": getattr(nino, "edad", "No especificada"),
-                    "diagnostico": (
-                        nino.diagnostico.diagnostico_principal
-                        if nino.diagnostico else "No especificado"
-                    ),
-                    "nivel_autismo": (
-                        nino.diagnostico.nivel_autismo
-                        if nino.diagnostico else "No especificado"
-                    )
-                }
-                contexto_usado = True
-
-        # 5️⃣ Historial
-        historial = chat_store.history(db, session_id, limit=8) or []
-        chat_store.append(db, session_id, "usuario", mensaje)
-
-        # 6️⃣ Gemini (PROTEGIDO) con soporte para rol del usuario
+        # 7️⃣ Gemini (PROTEGIDO) con soporte para rol del usuario
         try:
             respuesta = ask_gemini(
-                mensaje, 
-                contexto, 
-                historial,
-                rol_usuario=req.rol_usuario  # Pasar el rol del usuario
+                consulta["mensaje"],
+                consulta["contexto"],
+                consulta["historial"],
+                rol_usuario=req.rol_usuario,  # Pasar el rol del usuario
+                session_id=session_id
             )
         except Exception:
             traceback.print_exc()
-            respuesta = (
-                "El asistente IA no está disponible en este momento. "
-                "Puedes intentarlo más tarde."
-            )
+            respuesta = RESPUESTA_NO_DISPONIBLE
 
-        # 7️⃣ Guardar respuesta
+        # 8️⃣ Guardar respuesta
         chat_store.append(db, session_id, "asistente", respuesta)
 
         return ChatbotResponse(
             respuesta=respuesta,
-            contexto_usado=contexto_usado,
+            contexto_usado=consulta["contexto_usado"],
             configurado=gemini_chat_service.configured,
             session_id=session_id
         )
@@ -149,3 +263,169 @@ def chatbot(req: ChatbotRequest, request: Request, db: Session = Depends(get_db)
             status_code=500,
             content={"detail": "Error interno del chatbot"}
         )
+
+
+# ============================================================
+# ENDPOINT PÚBLICO: Chatbot en streaming (Server-Sent Events)
+# ============================================================
+def _evento_sse(evento: str, datos: Dict[str, Any]) -> str:
+    return f"event: {evento}\ndata: {json.dumps(datos, ensure_ascii=False)}\n\n"
+
+
+@router.post("/chatbot/stream")
+def chatbot_stream(req: ChatbotRequest, request: Request, db: Session = Depends(get_db)):
+    """
+    Igual que /chatbot pero la respuesta llega token a token (text/event-stream)
+
+    Eventos: 'inicio' (session_id, contexto_usado, configurado), 'token'
+    (texto) y 'fin' (respuesta completa). Si el cliente se desconecta se
+    deja de consumir Gemini y se guarda lo generado hasta ese momento.
+    """
+    try:
+        consulta = _preparar_consulta(req, request, db)
+    except HTTPException:
+        raise
+    except Exception:
+        traceback.print_exc()
+        return JSONResponse(
+            status_code=500,
+            content={"detail": "Error interno del chatbot"}
+        )
+
+    async def eventos():
+        yield _evento_sse("inicio", {
+            "session_id": consulta["session_id"],
+            "contexto_usado": consulta["contexto_usado"],
+            "configurado": gemini_chat_service.configured,
+        })
+        # Starlette cancela este generador al desconectarse el cliente
+        respuesta = _stream_respuesta(consulta, req.rol_usuario)
+        try:
+            async for evento in respuesta:
+                tipo = evento.pop("tipo")
+                yield _evento_sse(tipo, evento)
+        finally:
+            await respuesta.aclose()
+
+    return StreamingResponse(
+        eventos(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+# ============================================================
+# ENDPOINT PÚBLICO: Chatbot en streaming (WebSocket)
+# ============================================================
+# Mensajes del cliente en espera mientras se transmite una respuesta
+MAX_SOLICITUDES_WS_PENDIENTES = 8
+
+
+def _preparar_consulta_ws(req: ChatbotRequest, websocket: WebSocket) -> Dict[str, Any]:
+    db = SessionLocal()
+    try:
+        return _preparar_consulta(req, websocket, db)
+    finally:
+        db.close()
+
+
+@router.websocket("/chatbot/ws")
+async def chatbot_ws(websocket: WebSocket):
+    """
+    Canal WebSocket del chatbot: cada mensaje JSON del cliente es un
+    ChatbotRequest; se responde con {"tipo": "inicio"|"token"|"fin"|"error", ...}.
+    Al desconectarse el cliente se cancela la respuesta en curso.
+    Latidos: el servidor envía {"tipo": "ping"} y el cliente responde {"tipo": "pong"};
+    las tramas se leen también durante una respuesta, y los mensajes que
+    llegan mientras tanto se atienden en orden al terminarla.
+    """
+    await websocket.accept()
+    # Un solo envío a la vez: el ping puede llegar en medio de una respuesta
+    envio = asyncio.Lock()
+
+    async def enviar(evento: Dict[str, Any]) -> None:
+        async with envio:
+            await websocket.send_json(evento)
+
+    async def _ping() -> None:
+        try:
+            await enviar({"tipo": "ping"})
+        except Exception:
+            pass
+
+    def enviar_ping() -> bool:
+        if websocket.client_state != WebSocketState.CONNECTED:
+            return False
+        asyncio.get_running_loop().create_task(_ping())
+        return True
+
+    vigilada = supervisor_ws.vigilar("chatbot", websocket, enviar_ping=enviar_ping)
+    solicitudes: asyncio.Queue = asyncio.Queue(maxsize=MAX_SOLICITUDES_WS_PENDIENTES)
+
+    async def leer() -> None:
+        # Se sigue leyendo mientras se transmite una respuesta: los pongs
+        # llegan al supervisor y una respuesta larga no se corta por latido
+        while True:
+            datos = await websocket.receive_json()
+            tipo = datos.get("tipo") if isinstance(datos, dict) else None
+            supervisor_ws.recibido(vigilada, pong=tipo == "pong", actividad=tipo not in ("ping", "pong"))
+            if tipo == "pong":
+                continue
+            if tipo == "ping":
+                await enviar({"tipo": "pong"})
+                continue
+            try:
+                solicitudes.put_nowait(datos)
+            except asyncio.QueueFull:
+                await enviar({"tipo": "error", "status_code": 429, "detail": "Demasiados mensajes pendientes"})
+
+    async def atender() -> None:
+        while True:
+            datos = await solicitudes.get()
+            try:
+                req = ChatbotRequest(**datos)
+                consulta = await run_in_threadpool(_preparar_consulta_ws, req, websocket)
+            except ValidationError as e:
+                await enviar({"tipo": "error", "detail": e.errors(include_url=False)})
+                continue
+            except HTTPException as e:
+                await enviar({"tipo": "error", "status_code": e.status_code, "detail": e.detail})
+                continue
+
+            await enviar({
+                "tipo": "inicio",
+                "session_id": consulta["session_id"],
+                "contexto_usado": consulta["contexto_usado"],
+                "configurado": gemini_chat_service.configured,
+            })
+            respuesta = _stream_respuesta(consulta, req.rol_usuario)
+            try:
+                async for evento in respuesta:
+                    await enviar(evento)
+            finally:
+                await respuesta.aclose()
+
+    fallido = False
+
+    async def hasta_terminar(tarea) -> None:
+        # Si una de las dos termina (desconexión o error) se cancela la otra:
+        # una desconexión detectada por el lector corta la respuesta en curso
+        nonlocal fallido
+        try:
+            await tarea()
+        except WebSocketDisconnect:
+            pass
+        except Exception:
+            traceback.print_exc()
+            fallido = True
+        finally:
+            grupo.cancel_scope.cancel()
+
+    try:
+        async with anyio.create_task_group() as grupo:
+            grupo.start_soon(hasta_terminar, leer)
+            grupo.start_soon(hasta_terminar, atender)
+        if fallido and websocket.client_state == WebSocketState.CONNECTED:
+            await websocket.close(code=1011)
+    finally:
+        supervisor_ws.soltar(vigilada)
@@ -4,13 +4,20 @@ Endpoints para el módulo de Recomendación Basada en Contenido
 Permite al COORDINADOR y TERAPEUTA obtener recomendaciones personalizadas
 """
 from fastapi import APIRouter, Depends, HTTPException, status, Query
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
 from typing import List
+import json
 
 from app.api.deps import get_db, get_current_user
 from app.models.usuario import Usuario
-from app.schemas.recomendacion import RecomendacionActividad, RecomendacionTerapia
+from app.schemas.recomendacion import (
+    RecomendacionActividad,
+    RecomendacionTerapia,
+    RecomendacionLoteRequest
+)
 from app.services import recommend_service
+from app.db.session import SessionLocal
 
 
 router = APIRouter(tags=["Recomendación"])
@@ -88,3 +95,56 @@ def get_recomendacion_terapias(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Error al generar recomendaciones: {str(e)}"
         )
+
+
+# ============================================================
+# ENDPOINTS POR LOTE (NDJSON)
+# ============================================================
+
+def _stream_lote(funcion_lote, request: RecomendacionLoteRequest) -> StreamingResponse:
+    """Una línea JSON por niño: {"nino_id", "recomendaciones", "error"}"""
+    def generar():
+        # Sesión propia: la respuesta se sigue enviando después del endpoint
+        db = SessionLocal()
+        try:
+            for nino_id, recomendaciones in funcion_lote(db, request.nino_ids, request.top_n):
+                yield json.dumps({
+                    "nino_id": nino_id,
+                    "recomendaciones": [r.model_dump() for r in recomendaciones or []],
+                    "error": None if recomendaciones is not None else f"Niño con ID {nino_id} no encontrado"
+                }, ensure_ascii=False) + "\n"
+        except Exception as e:
+            yield json.dumps({"error": f"Error al generar recomendaciones: {str(e)}"}) + "\n"
+        finally:
+            db.close()
+
+    return StreamingResponse(generar(), media_type="application/x-ndjson")
+
+
+@router.post("/lote/actividades")
+def post_recomendacion_actividades_lote(
+    request: RecomendacionLoteRequest,
+    current_user: Usuario = Depends(get_current_user)
+):
+    """
+    Recomendaciones de actividades para muchos niños (o todos los activos)
+    
+    El catálogo y los perfiles se cargan una sola vez y los scores de todos
+    los niños salen de un solo producto de matrices. La respuesta es NDJSON.
+    
+    Accesible para COORDINADOR y TERAPEUTA
+    """
+    return _stream_lote(recommend_service.recomendar_actividades_lote, request)
+
+
+@router.post("/lote/terapias")
+def post_recomendacion_terapias_lote(
+    request: RecomendacionLoteRequest,
+    current_user: Usuario = Depends(get_current_user)
+):
+    """
+    Recomendaciones de terapias para muchos niños (o todos los activos)
+    
+    Accesible para COORDINADOR y TERAPEUTA
+    """
+    return _stream_lote(recommend_service.recomendar_terapias_lote, request)
@@ -40,15 +40,14 @@ def test_perfil_nino(
         if not perfil_db:
             return {"error": "No se encontró perfil para este niño", "nino_id": nino_id}
         
-        # Verificar embedding
-        import json
-        embedding_data = json.loads(perfil_db.embedding) if isinstance(perfil_db.embedding, str) else perfil_db.embedding
+        # Verificar embedding (np.ndarray decodificado del BLOB)
+        embedding_data = perfil_db.embedding
         
         return {
             "success": True,
             "nino_id": nino_id,
             "tiene_embedding": embedding_data is not None,
-            "embedding_dimensiones": len(embedding_data) if embedding_data else 0,
+            "embedding_dimensiones": len(embedding_data) if embedding_data is not None else 0,
             "edad": perfil_db.edad,
             "diagnosticos": perfil_db.diagnosticos[:2] if perfil_db.diagnosticos else [],
             "dificultades": perfil_db.dificultades[:2] if perfil_db.dificultades else [],
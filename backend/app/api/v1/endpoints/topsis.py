@@ -22,6 +22,7 @@ from app.schemas.topsis import (
 )
 from app.schemas.topsis_terapeutas import (
     TopsisEvaluacionRequest,
+    TopsisEvaluacionMultipleRequest,
     TopsisResultado as TopsisResultadoTerapeutas
 )
 from app.services import topsis_service
@@ -414,6 +415,42 @@ def evaluar_terapeutas_topsis(
         )
 
 
+@router.post(
+    "/terapeutas/por-terapia",
+    response_model=List[TopsisResultadoTerapeutas],
+    status_code=status.HTTP_200_OK,
+    summary="Rankear terapeutas para varias terapias",
+    description="""
+    Calcula en una sola llamada el ranking TOPSIS de terapeutas para cada
+    terapia solicitada (por defecto todas las activas). Las métricas se
+    cargan una vez y todas las terapias se evalúan en una sola pasada.
+    
+    **Acceso:** Solo usuarios con rol COORDINADOR
+    """
+)
+def evaluar_terapeutas_por_terapia(
+    request: TopsisEvaluacionMultipleRequest,
+    db: Session = Depends(get_db),
+    current_user: Usuario = Depends(get_current_user)
+) -> List[TopsisResultadoTerapeutas]:
+    """
+    Rankea terapeutas para varias terapias con un solo cálculo TOPSIS en lote
+    """
+    try:
+        service = TopsisEvaluacionService(db)
+        return service.evaluar_por_terapias(request)
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Error al evaluar terapeutas por terapia: {str(e)}"
+        )
+
+
 @router.get(
     "/terapeutas/pesos-default",
     response_model=dict,
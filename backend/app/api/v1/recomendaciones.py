@@ -3,9 +3,11 @@
 Endpoints para sistema de recomendaciones inteligentes
 Integra: Similitud de contenido + TOPSIS + Gemini
 """
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
 from typing import List, Optional
+import json
 
 from app.api.deps import get_db, get_current_user
 from app.schemas.recomendacion import (
@@ -13,11 +15,14 @@ from app.schemas.recomendacion import (
     SeleccionTerapeutaResponse,
     RecomendacionCompletaResponse,
     GenerarPerfilRequest,
+    RecomendacionLoteRequest,
+    ExplicacionEstadoResponse,
     RegistrarProgresoRequest,
     SugerenciaClinicaRequest,
     SugerenciaClinicaResponse
 )
 from app.services.recomendacion_service import get_recomendacion_service
+from app.db.session import SessionLocal
 from app.models.personal import Personal
 
 router = APIRouter()
@@ -34,7 +39,8 @@ router = APIRouter()
     1. Obtiene/genera el perfil vectorizado del niño usando Gemini
     2. Calcula similitud con todas las actividades disponibles
     3. Retorna las top N actividades más similares
-    4. Incluye explicación generada por Gemini
+    4. La explicación de Gemini se genera en segundo plano: consultar
+       `/explicaciones/actividades/{explicacion_id}` (o `explicacion_async=false`)
     
     **Uso:** Coordinadores y terapeutas pueden usar esto para planificar sesiones
     """
@@ -43,6 +49,7 @@ def recomendar_actividades_nino(
     nino_id: int,
     top_n: int = 5,
     incluir_explicacion: bool = True,
+    explicacion_async: bool = True,
     db: Session = Depends(get_db),
     current_user: Personal = Depends(get_current_user)
 ):
@@ -54,7 +61,8 @@ def recomendar_actividades_nino(
         resultado = servicio.recomendar_actividades(
             nino_id=nino_id,
             top_n=top_n,
-            incluir_explicacion=incluir_explicacion
+            incluir_explicacion=incluir_explicacion,
+            explicacion_async=explicacion_async
         )
         return resultado
     except ValueError as e:
@@ -87,7 +95,8 @@ def recomendar_actividades_nino(
     1. Recopila datos de todos los terapeutas disponibles
     2. Aplica TOPSIS con pesos configurables
     3. Genera ranking ordenado
-    4. Gemini explica por qué es la mejor opción
+    4. Gemini explica por qué es la mejor opción (en segundo plano;
+       consultar `/explicaciones/terapeuta/{explicacion_id}`)
     
     **Uso:** Coordinadores para asignar terapeutas de forma objetiva
     """
@@ -96,6 +105,7 @@ def seleccionar_terapeuta_optimo(
     nino_id: int,
     terapia_tipo: str,
     criterios_pesos: Optional[dict] = None,
+    explicacion_async: bool = True,
     db: Session = Depends(get_db),
     current_user: Personal = Depends(get_current_user)
 ):
@@ -107,7 +117,8 @@ def seleccionar_terapeuta_optimo(
         resultado = servicio.seleccionar_terapeuta_optimo(
             nino_id=nino_id,
             terapia_tipo=terapia_tipo,
-            criterios_pesos=criterios_pesos
+            criterios_pesos=criterios_pesos,
+            explicacion_async=explicacion_async
         )
         return resultado
     except ValueError as e:
@@ -204,7 +215,7 @@ def generar_perfil_vectorizado(
             "fortalezas": perfil.fortalezas,
             "fecha_generacion": perfil.fecha_generacion.isoformat(),
             "fecha_actualizacion": perfil.fecha_actualizacion.isoformat(),
-            "embedding_dimension": len(perfil.embedding) if perfil.embedding else 0
+            "embedding_dimension": len(perfil.embedding) if perfil.embedding is not None else 0
         }
     except ValueError as e:
         raise HTTPException(
@@ -411,3 +422,178 @@ def obtener_historial_recomendaciones(
             for rec in recomendaciones
         ]
     }
+
+
+@router.post(
+    "/catalogo/vectorizar",
+    status_code=status.HTTP_202_ACCEPTED,
+    summary="Vectorizar catálogo de actividades en segundo plano",
+    description="""
+    Lanza la vectorización masiva de todas las actividades activas.
+    
+    - Solo se envían a Gemini las actividades cuyo texto cambió
+    - Los embeddings se generan en lotes con concurrencia acotada
+    - Los textos ya vectorizados salen de la caché de embeddings
+    
+    **Uso:** Coordinadores tras cargar o editar muchas actividades
+    """
+)
+def vectorizar_catalogo(
+    forzar: bool = False,
+    current_user: Personal = Depends(get_current_user)
+):
+    """
+    Inicia la vectorización del catálogo sin bloquear la petición
+    """
+    from app.services.recomendacion_service import (
+        vectorizar_catalogo_en_segundo_plano,
+        estado_vectorizacion
+    )
+    
+    iniciada = vectorizar_catalogo_en_segundo_plano(solo_cambios=not forzar)
+    return {
+        "iniciada": iniciada,
+        "mensaje": "Vectorización iniciada" if iniciada else "Ya hay una vectorización en curso",
+        "estado": estado_vectorizacion
+    }
+
+
+@router.get(
+    "/catalogo/vectorizar/estado",
+    summary="Estado de la vectorización del catálogo",
+    description="Retorna si hay una vectorización en curso, su último resultado y la caché de embeddings"
+)
+def estado_vectorizacion_catalogo(
+    current_user: Personal = Depends(get_current_user)
+):
+    """
+    Consulta el estado de la vectorización masiva
+    """
+    from app.services.recomendacion_service import estado_vectorizacion
+    from app.services.embedding_cache import embedding_cache
+    
+    return {
+        **estado_vectorizacion,
+        "cache_embeddings": embedding_cache.estadisticas()
+    }
+
+
+@router.post(
+    "/lote/actividades",
+    summary="Recomendar actividades para muchos niños (NDJSON)",
+    description="""
+    Genera recomendaciones de actividades para una lista de niños
+    (o para todos los niños activos si no se envía `nino_ids`).
+    
+    **Proceso:**
+    1. Crea en lote los perfiles vectorizados que falten
+    2. Calcula todas las similitudes con un solo producto de matrices
+    3. Envía una línea JSON por niño conforme se generan
+    4. Registra las recomendaciones con inserción en bloque (sin explicación Gemini)
+    
+    **Uso:** Planeación semanal de la carga de casos por coordinadores
+    """
+)
+def recomendar_actividades_lote(
+    request: RecomendacionLoteRequest,
+    current_user: Personal = Depends(get_current_user)
+):
+    """
+    Recomienda actividades para muchos niños con respuesta en streaming
+    """
+    def generar():
+        # Sesión propia: la respuesta se sigue enviando después del endpoint
+        db = SessionLocal()
+        try:
+            servicio = get_recomendacion_service(db)
+            for resultado in servicio.recomendar_actividades_lote(
+                nino_ids=request.nino_ids,
+                top_n=request.top_n
+            ):
+                yield json.dumps(resultado, ensure_ascii=False, default=str) + "\n"
+        except Exception as e:
+            db.rollback()
+            yield json.dumps({"error": f"Error generando recomendaciones: {str(e)}"}) + "\n"
+        finally:
+            db.close()
+
+    return StreamingResponse(generar(), media_type="application/x-ndjson")
+
+
+@router.get(
+    "/explicaciones/{tipo}/{explicacion_id}",
+    response_model=ExplicacionEstadoResponse,
+    summary="Consultar explicación generada en segundo plano",
+    description="""
+    Devuelve el estado de una explicación de Gemini (`tipo`: actividades | terapeuta).
+    
+    Con `esperar` > 0 la petición espera hasta ese número de segundos a que
+    la explicación termine (long polling) sin ocupar un hilo del servidor.
+    """
+)
+async def obtener_explicacion(
+    tipo: str,
+    explicacion_id: int,
+    esperar: float = Query(0, ge=0, le=30, description="Segundos máximos de espera"),
+    current_user: Personal = Depends(get_current_user)
+):
+    """
+    Consulta (y opcionalmente espera) una explicación pendiente
+    """
+    import asyncio
+    from starlette.concurrency import run_in_threadpool
+    from app.services.explicacion_worker import (
+        cola_explicaciones, DESTINOS
+    )
+    
+    if tipo not in DESTINOS:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Tipo de explicación desconocido: {tipo}"
+        )
+    
+    future = cola_explicaciones.future(tipo, explicacion_id)
+    if future is not None and esperar > 0 and not future.done():
+        try:
+            await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)), timeout=esperar)
+        except asyncio.TimeoutError:
+            pass
+    
+    estado = cola_explicaciones.estado(tipo, explicacion_id)
+    if estado is not None:
+        return {
+            "tipo": tipo,
+            "explicacion_id": explicacion_id,
+            "estado": estado["estado"],
+            "explicacion": estado.get("texto"),
+            "error": estado.get("error")
+        }
+    
+    # Sin estado en memoria (otro proceso o reinicio): leer la fila
+    def leer():
+        modelo, columna, creacion = DESTINOS[tipo]
+        db = SessionLocal()
+        try:
+            return db.query(
+                modelo.id,
+                getattr(modelo, columna).label("texto"),
+                getattr(modelo, creacion).label("creada")
+            ).filter(
+                modelo.id == explicacion_id
+            ).first()
+        finally:
+            db.close()
+    
+    fila = await run_in_threadpool(leer)
+    if fila is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Explicación {tipo}/{explicacion_id} no encontrada"
+        )
+    return {
+        "tipo": tipo,
+        "explicacion_id": explicacion_id,
+        "estado": cola_explicaciones.estado_sin_memoria(fila.texto, fila.creada),
+        "explicacion": fila.texto,
+        "error": None
+    }
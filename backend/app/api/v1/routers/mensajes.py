@@ -1,21 +1,23 @@
 from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File, Form
 from sqlalchemy.orm import Session
-from sqlalchemy import and_, func, desc
+from sqlalchemy import and_
 from typing import List, Optional
 from datetime import datetime
 import shutil
 from pathlib import Path
 
 from app.db.session import get_db
-from app.models import (
-    Conversacion, ConversacionParticipante, Mensaje, MensajeArchivo,
-    MensajeVisto, Usuario, Rol, Nino
+from app.models import Usuario, Rol
+from app.models.mensajes import (
+    Conversacion, ConversacionParticipante, Mensaje, MensajeArchivo, MensajeVisto
 )
-from app.schemas import (
+from app.schemas.mensajes import (
     MensajeResponse, ChatListaItemResponse, ConversacionDetalleResponse,
     MensajeCrearRequest, ConversacionCrearRequest
 )
-from app.dependencies import get_current_user
+from app.api.deps import get_current_user
+from app.core.rate_limit import uploads_limiter
+from app.services.mensajes_service import listar_chats_usuario
 
 router = APIRouter(prefix="/mensajes", tags=["mensajes"])
 
@@ -33,73 +35,9 @@ def listar_chats(
     Obtiene lista de conversaciones del usuario actual.
     Opcionalmente filtrado por hijo.
     Incluye el último mensaje y cantidad de no leídos.
+    Una sola consulta sin importar cuántas conversaciones tenga el usuario.
     """
-    # Obtener participaciones del usuario
-    participaciones = db.query(ConversacionParticipante).filter(
-        ConversacionParticipante.usuario_id == current_user.id,
-        ConversacionParticipante.activo == True
-    ).all()
-    
-    conversacion_ids = [p.conversacion_id for p in participaciones]
-    
-    if not conversacion_ids:
-        return []
-    
-    # Query de conversaciones
-    query = db.query(Conversacion).filter(
-        Conversacion.id.in_(conversacion_ids),
-        Conversacion.activa == True
-    )
-    
-    if nino_id:
-        query = query.filter(Conversacion.nino_id == nino_id)
-    
-    conversaciones = query.order_by(desc(Conversacion.updated_at)).all()
-    
-    resultado = []
-    
-    for conv in conversaciones:
-        # Obtener último mensaje
-        ultimo_msg = db.query(Mensaje).filter(
-            Mensaje.conversacion_id == conv.id,
-            Mensaje.eliminado == False
-        ).order_by(desc(Mensaje.created_at)).first()
-        
-        ultimo_mensaje = ""
-        if ultimo_msg:
-            if ultimo_msg.tipo == "TEXTO":
-                ultimo_mensaje = ultimo_msg.contenido[:50] or ""
-            elif ultimo_msg.tipo == "AUDIO":
-                ultimo_mensaje = "🎤 Mensaje de audio"
-            elif ultimo_msg.tipo == "ARCHIVO":
-                archivo = db.query(MensajeArchivo).filter(
-                    MensajeArchivo.mensaje_id == ultimo_msg.id
-                ).first()
-                ultimo_mensaje = f"📎 {archivo.nombre_original}" if archivo else "📎 Archivo"
-        
-        # Contar no leídos
-        no_leidos = db.query(func.count(MensajeVisto.id)).filter(
-            MensajeVisto.usuario_id == current_user.id,
-            MensajeVisto.visto == False,
-            Mensaje.conversacion_id == conv.id
-        ).join(Mensaje).scalar()
-        
-        # Construir título
-        if conv.nino_id:
-            nino = db.query(Nino).filter(Nino.id == conv.nino_id).first()
-            titulo = f"Chat - {nino.nombre if nino else 'Niño'}"
-        else:
-            titulo = "Chat General"
-        
-        resultado.append({
-            "conversacionId": conv.id,
-            "titulo": titulo,
-            "ultimoMensaje": ultimo_mensaje,
-            "noLeidos": no_leidos or 0,
-            "ultimaActualizacion": conv.updated_at.isoformat()
-        })
-    
-    return resultado
+    return listar_chats_usuario(db, current_user.id, nino_id)
 
 
 @router.get("/conversacion/{conversacion_id}", response_model=ConversacionDetalleResponse)
@@ -306,7 +244,7 @@ def enviar_texto(
     }
 
 
-@router.post("/enviar-archivo")
+@router.post("/enviar-archivo", dependencies=[Depends(uploads_limiter)])
 async def enviar_archivo(
     conversacion_id: int = Form(...),
     archivo: UploadFile = File(...),
@@ -4,10 +4,14 @@ from typing import List, Dict, Optional, Literal
 import json
 from datetime import datetime
 
+from app.core.config import settings
 from app.db.session import get_db
 from app.models.notificacion import Notificacion
 from app.models.usuario import Usuario
 from app.models.paciente import Paciente
+from app.services.pubsub import Receptor, bus_eventos
+from app.services.ws_fanout import DifusorWebSocket, serializar
+from app.services.ws_supervisor import supervisor_ws
 from pydantic import BaseModel
 
 router = APIRouter(prefix="/notificaciones", tags=["Notificaciones"])
@@ -42,10 +46,34 @@ class NotificacionCreate(BaseModel):
 
 # ==================== WEBSOCKET CONNECTIONS ====================
 
-_active_connections: Dict[str, Dict[int, List[WebSocket]]] = {
-    "padre": {},
-    "terapeuta": {}
-}
+# Sockets de este worker: {(tipo_usuario, usuario_id): {id(websocket): ConexionSalida}}
+# Las notificaciones se publican en el bus de eventos ("notificaciones:padre:5")
+# y cada worker entrega a los sockets que tenga de ese usuario.
+_conexiones = DifusorWebSocket(
+    nombre="notificaciones",
+    max_cola=settings.WS_COLA_SALIDA_MAX,
+    timeout_envio=settings.WS_ENVIO_TIMEOUT_SEGUNDOS,
+    max_rezagos=settings.WS_MAX_REZAGOS
+)
+_receptores: Dict[tuple, Receptor] = {}
+
+
+# Tramas de control (JSON, el cliente hace JSON.parse de todo lo que recibe)
+PING = serializar({"tipo": "ping"})
+PONG = serializar({"tipo": "pong"})
+
+
+def _canal(tipo_usuario: str, usuario_id: int) -> str:
+    return f"notificaciones:{tipo_usuario}:{usuario_id}"
+
+
+def _tipo_trama(texto: str) -> Optional[str]:
+    """Tipo de una trama del cliente: {"tipo": ...} o el texto plano "ping"/"pong" """
+    try:
+        datos = json.loads(texto)
+    except ValueError:
+        return texto.strip() or None
+    return datos.get("tipo") if isinstance(datos, dict) else None
 
 # ==================== FUNCIONES AUXILIARES ====================
 
@@ -77,20 +105,13 @@ def crear_notificacion_db(
     
     return notificacion
 
+def publicar_notificacion(usuario_id: int, tipo_usuario: str, notificacion_dict: dict):
+    """Publica una notificación para los sockets del usuario en cualquier worker (seguro desde hilos)."""
+    bus_eventos.publicar(_canal(tipo_usuario, usuario_id), serializar(notificacion_dict))
+
 async def enviar_notificacion_ws(usuario_id: int, tipo_usuario: str, notificacion_dict: dict):
     """Envía notificación por WebSocket."""
-    if tipo_usuario in _active_connections and usuario_id in _active_connections[tipo_usuario]:
-        conexiones_muertas = []
-        
-        for connection in _active_connections[tipo_usuario][usuario_id]:
-            try:
-                await connection.send_json(notificacion_dict)
-            except Exception as e:
-                print(f"Error al enviar notificación: {e}")
-                conexiones_muertas.append(connection)
-        
-        for conn in conexiones_muertas:
-            _active_connections[tipo_usuario][usuario_id].remove(conn)
+    publicar_notificacion(usuario_id, tipo_usuario, notificacion_dict)
 
 def notificacion_to_dict(notif: Notificacion) -> dict:
     """Convierte notificación a diccionario."""
@@ -125,14 +146,8 @@ def notificar_padre(
     """Crea notificación para padre."""
     notif = crear_notificacion_db(db, padre_id, tipo, mensaje, hijo_id, metadata)
     
-    # Enviar por WebSocket (async)
-    import asyncio
-    try:
-        asyncio.create_task(
-            enviar_notificacion_ws(padre_id, "padre", notificacion_to_dict(notif))
-        )
-    except:
-        pass
+    # Enviar por WebSocket
+    publicar_notificacion(padre_id, "padre", notificacion_to_dict(notif))
     
     return notif
 
@@ -147,13 +162,7 @@ def notificar_terapeuta(
     notif = crear_notificacion_db(db, terapeuta_id, tipo, mensaje, None, metadata)
     
     # Enviar por WebSocket
-    import asyncio
-    try:
-        asyncio.create_task(
-            enviar_notificacion_ws(terapeuta_id, "terapeuta", notificacion_to_dict(notif))
-        )
-    except:
-        pass
+    publicar_notificacion(terapeuta_id, "terapeuta", notificacion_to_dict(notif))
     
     return notif
 
@@ -172,9 +181,22 @@ async def websocket_endpoint(
     
     await websocket.accept()
     
-    if usuario_id not in _active_connections[tipo_usuario]:
-        _active_connections[tipo_usuario][usuario_id] = []
-    _active_connections[tipo_usuario][usuario_id].append(websocket)
+    grupo = (tipo_usuario, usuario_id)
+    clave = id(websocket)
+    conexion = _conexiones.registrar(grupo, clave, websocket)
+    if grupo not in _receptores:
+        _receptores[grupo] = lambda texto, _excluir: _conexiones.publicar_texto(grupo, texto)
+        bus_eventos.suscribir(_canal(tipo_usuario, usuario_id), _receptores[grupo])
+    # Latido del servidor: {"tipo": "ping"} (JSON, como el resto de eventos),
+    # el cliente responde {"tipo": "pong"}. Canal solo de envío: el cliente
+    # escucha sin hablar, así que no se cierra por inactividad
+    vigilada = supervisor_ws.vigilar(
+        "notificaciones",
+        websocket,
+        enviar_ping=lambda: _conexiones.encolar(conexion, PING),
+        al_cerrar=lambda: _conexiones.retirar(grupo, clave, conexion),
+        inactividad=False
+    )
     
     print(f"✅ WebSocket conectado: {tipo_usuario} {usuario_id}")
     
@@ -187,24 +209,25 @@ async def websocket_endpoint(
         ).all()
         
         for notif in notificaciones:
-            await websocket.send_json(notificacion_to_dict(notif))
+            _conexiones.enviar_texto(grupo, clave, serializar(notificacion_to_dict(notif)))
         
         db.close()
         
         # Mantener conexión
         while True:
-            data = await websocket.receive_text()
-            if data == "ping":
-                await websocket.send_text("pong")
+            tipo = _tipo_trama(await websocket.receive_text())
+            # Cualquier trama del cliente cuenta como latido
+            supervisor_ws.recibido(vigilada, pong=tipo == "pong")
+            if tipo == "ping":
+                _conexiones.enviar_texto(grupo, clave, PONG)
     
     except WebSocketDisconnect:
         print(f"❌ WebSocket desconectado: {tipo_usuario} {usuario_id}")
     finally:
-        if usuario_id in _active_connections[tipo_usuario]:
-            if websocket in _active_connections[tipo_usuario][usuario_id]:
-                _active_connections[tipo_usuario][usuario_id].remove(websocket)
-            if not _active_connections[tipo_usuario][usuario_id]:
-                del _active_connections[tipo_usuario][usuario_id]
+        supervisor_ws.soltar(vigilada)
+        _conexiones.retirar(grupo, clave, conexion)
+        if not _conexiones.claves(grupo) and grupo in _receptores:
+            bus_eventos.desuscribir(_canal(tipo_usuario, usuario_id), _receptores.pop(grupo))
 
 # ==================== ENDPOINTS REST ====================
 
@@ -278,13 +301,7 @@ def crear_notificacion_manual(
     
     # Enviar por WebSocket
     tipo_usuario = "padre" if data.hijoId else "terapeuta"
-    import asyncio
-    try:
-        asyncio.create_task(
-            enviar_notificacion_ws(data.usuarioId, tipo_usuario, notificacion_to_dict(notif))
-        )
-    except:
-        pass
+    publicar_notificacion(data.usuarioId, tipo_usuario, notificacion_to_dict(notif))
     
     return notificacion_to_dict(notif)
 
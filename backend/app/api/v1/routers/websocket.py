@@ -1,32 +1,65 @@
-from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Depends, status
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect, status
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
+from types import SimpleNamespace
 from typing import Dict, Set
 import json
 from datetime import datetime
 import logging
 
-from ..database import get_db
-from ..models import Usuario, Conversacion, ConversacionParticipante, Mensaje, MensajeArchivo, MensajeVisto, Rol
-from ..dependencies import get_current_user
+from app.core.config import settings
+from app.core.security import decode_access_token
+from app.db.session import SessionLocal
+from app.models import Usuario, Rol
+from app.models.mensajes import Mensaje, MensajeArchivo
+from app.services.chat_participantes import cache_participantes, insertar_vistos
+from app.services.pubsub import Receptor, bus_eventos
+from app.services.ws_fanout import ConexionSalida, DifusorWebSocket, serializar
+from app.services.ws_supervisor import supervisor_ws
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
-# Almacenar conexiones activas: {conversacion_id: {usuario_id: websocket}}
+# Latido del servidor (el cliente responde {"tipo": "pong"}) y respuesta a su ping
+PING = serializar({"tipo": "ping"})
+PONG = serializar({"tipo": "pong"})
+
+
+def _canal(conversacion_id: int) -> str:
+    return f"conversacion:{conversacion_id}"
+
+
+# Conexiones activas de este worker: {conversacion_id: {usuario_id: ConexionSalida}}
+# El envío lo hace el escritor de cada conexión (ver DifusorWebSocket):
+# broadcast solo serializa una vez y encola, un cliente lento no frena al resto.
+# Los broadcasts pasan por el bus de eventos: cada worker se suscribe solo a
+# las conversaciones en las que tiene sockets y entrega a los suyos.
 class ConnectionManager:
     def __init__(self):
-        self.active_connections: Dict[int, Dict[int, WebSocket]] = {}
+        self.difusor = DifusorWebSocket(
+            nombre="conversaciones",
+            max_cola=settings.WS_COLA_SALIDA_MAX,
+            timeout_envio=settings.WS_ENVIO_TIMEOUT_SEGUNDOS,
+            max_rezagos=settings.WS_MAX_REZAGOS
+        )
         self.user_conversaciones: Dict[int, Set[int]] = {}  # usuario_id -> set(conversacion_ids)
+        self._receptores: Dict[int, Receptor] = {}  # conversacion_id -> receptor suscrito al bus
+
+    @property
+    def active_connections(self) -> Dict[int, Dict[int, ConexionSalida]]:
+        return self.difusor.grupos
 
-    async def connect(self, conversacion_id: int, usuario_id: int, websocket: WebSocket):
+    async def connect(self, conversacion_id: int, usuario_id: int, websocket: WebSocket) -> ConexionSalida:
         """Registra una nueva conexión"""
         await websocket.accept()
         
-        if conversacion_id not in self.active_connections:
-            self.active_connections[conversacion_id] = {}
+        conexion = self.difusor.registrar(conversacion_id, usuario_id, websocket)
         
-        self.active_connections[conversacion_id][usuario_id] = websocket
+        if conversacion_id not in self._receptores:
+            receptor = self._receptor(conversacion_id)
+            self._receptores[conversacion_id] = receptor
+            bus_eventos.suscribir(_canal(conversacion_id), receptor)
         
         if usuario_id not in self.user_conversaciones:
             self.user_conversaciones[usuario_id] = set()
@@ -34,18 +67,20 @@ class ConnectionManager:
         self.user_conversaciones[usuario_id].add(conversacion_id)
         
         logger.info(f"Usuario {usuario_id} conectado a conversación {conversacion_id}")
+        return conexion
 
-    def disconnect(self, conversacion_id: int, usuario_id: int):
-        """Desconecta un usuario"""
-        if conversacion_id in self.active_connections:
-            if usuario_id in self.active_connections[conversacion_id]:
-                del self.active_connections[conversacion_id][usuario_id]
-                
-                if not self.active_connections[conversacion_id]:
-                    del self.active_connections[conversacion_id]
+    def disconnect(self, conversacion_id: int, usuario_id: int, conexion: ConexionSalida | None = None):
+        """Desconecta un usuario (si se indica `conexion`, solo si sigue siendo la registrada)"""
+        if not self.difusor.retirar(conversacion_id, usuario_id, conexion) and conexion is not None:
+            return
+        
+        if not self.difusor.claves(conversacion_id) and conversacion_id in self._receptores:
+            bus_eventos.desuscribir(_canal(conversacion_id), self._receptores.pop(conversacion_id))
         
         if usuario_id in self.user_conversaciones:
             self.user_conversaciones[usuario_id].discard(conversacion_id)
+            if not self.user_conversaciones[usuario_id]:
+                del self.user_conversaciones[usuario_id]
         
         logger.info(f"Usuario {usuario_id} desconectado de conversación {conversacion_id}")
 
@@ -55,25 +90,22 @@ class ConnectionManager:
         mensaje: dict,
         excluir_usuario: int | None = None
     ):
-        """Envía un mensaje a todos en una conversación"""
-        if conversacion_id not in self.active_connections:
-            return
-        
-        desconectados = []
-        
-        for usuario_id, websocket in self.active_connections[conversacion_id].items():
-            if excluir_usuario and usuario_id == excluir_usuario:
-                continue
-            
-            try:
-                await websocket.send_json(mensaje)
-            except Exception as e:
-                logger.error(f"Error enviando mensaje: {e}")
-                desconectados.append(usuario_id)
-        
-        # Limpiar conexiones muertas
-        for usuario_id in desconectados:
-            self.disconnect(conversacion_id, usuario_id)
+        """Publica un mensaje para todos en una conversación, en cualquier worker (no espera los envíos)"""
+        bus_eventos.publicar(
+            _canal(conversacion_id),
+            serializar(mensaje),
+            excluir=None if excluir_usuario is None else str(excluir_usuario)
+        )
+
+    def _receptor(self, conversacion_id: int) -> Receptor:
+        """Entrega los eventos del bus a los sockets de la conversación en este worker"""
+        def entregar(texto: str, excluir: str | None):
+            self.difusor.publicar_texto(
+                conversacion_id,
+                texto,
+                excluir=None if excluir is None else int(excluir)
+            )
+        return entregar
 
     async def broadcast_a_todos_usuarios(
         self,
@@ -84,7 +116,7 @@ class ConnectionManager:
         await self.broadcast_a_conversacion(conversacion_id, mensaje, excluir_usuario=None)
 
     def obtener_usuarios_conectados(self, conversacion_id: int) -> list:
-        """Obtiene lista de usuarios conectados en una conversación"""
+        """Obtiene lista de usuarios conectados en una conversación (en este worker)"""
         if conversacion_id not in self.active_connections:
             return []
         return list(self.active_connections[conversacion_id].keys())
@@ -116,25 +148,79 @@ class ConnectionManager:
 manager = ConnectionManager()
 
 
-async def verificar_token_websocket(token: str, db: Session) -> Usuario | None:
+def verificar_token_websocket(token: str, db: Session) -> Usuario | None:
     """Verifica el token de autenticación en WebSocket"""
-    from ..core.security import verify_token
+    payload = decode_access_token(token)
+    usuario_id = payload.get("sub") if payload else None
+    if not usuario_id:
+        return None
+    return db.query(Usuario).filter(Usuario.id == usuario_id).first()
+
+
+def _preparar_conexion(token: str, conversacion_id: int) -> SimpleNamespace | str:
+    """
+    Autentica y verifica la participación con una sesión corta (en el threadpool).
+    Devuelve los datos del usuario o el motivo del rechazo.
+    """
+    db = SessionLocal()
     try:
-        payload = verify_token(token)
-        usuario_id = payload.get("sub")
-        if usuario_id:
-            return db.query(Usuario).filter(Usuario.id == usuario_id).first()
-    except:
-        pass
-    return None
+        usuario = verificar_token_websocket(token, db)
+        if not usuario:
+            return "No autorizado"
+        participantes = cache_participantes.obtener(db, conversacion_id)
+        if usuario.id not in participantes:
+            return "No eres participante"
+        rol_id = participantes[usuario.id] or usuario.rol_id
+        rol = db.query(Rol.nombre).filter(Rol.id == rol_id).scalar()
+        return SimpleNamespace(id=usuario.id, nombre=usuario.nombre_completo, rol=rol)
+    finally:
+        db.close()
+
+
+def _guardar_mensaje(
+    conversacion_id: int,
+    emisor_id: int,
+    tipo_mensaje: str,
+    contenido: str | None = None,
+    archivo: dict | None = None
+) -> tuple[int, datetime]:
+    """
+    Guarda un mensaje y los registros de visto de los demás participantes (en el threadpool).
+    Participantes desde la caché y un solo INSERT para los vistos, sin importar el tamaño del grupo.
+    """
+    db = SessionLocal()
+    try:
+        participantes = cache_participantes.obtener(db, conversacion_id)
+        
+        nuevo_msg = Mensaje(
+            conversacion_id=conversacion_id,
+            emisor_id=emisor_id,
+            tipo=tipo_mensaje,
+            contenido=contenido
+        )
+        db.add(nuevo_msg)
+        db.flush()
+        
+        if archivo is not None:
+            db.add(MensajeArchivo(mensaje_id=nuevo_msg.id, **archivo))
+        
+        insertar_vistos(db, nuevo_msg.id, (u for u in participantes if u != emisor_id))
+        
+        mensaje_id, created_at = nuevo_msg.id, nuevo_msg.created_at
+        db.commit()
+        return mensaje_id, created_at
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
 
 
 @router.websocket("/ws/conversacion/{conversacion_id}")
 async def websocket_conversacion(
     websocket: WebSocket,
     conversacion_id: int,
-    token: str,
-    db: Session = Depends(get_db)
+    token: str
 ):
     """
     WebSocket para conversación en tiempo real.
@@ -142,36 +228,35 @@ async def websocket_conversacion(
     - Mensaje texto: {"tipo": "mensaje", "contenido": "..."}
     - Escribiendo: {"tipo": "escribiendo", "valor": true/false}
     - Nuevo mensaje (broadcast): {"tipo": "nuevo_mensaje", "id": ..., "contenido": ..., ...}
-    """
-    
-    # Autenticar
-    usuario = await verificar_token_websocket(token, db)
-    if not usuario:
-        await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason="No autorizado")
-        return
+    - Latidos: el servidor envía {"tipo": "ping"} y el cliente responde {"tipo": "pong"}
     
-    # Verificar que es participante
-    es_participante = db.query(ConversacionParticipante).filter(
-        ConversacionParticipante.conversacion_id == conversacion_id,
-        ConversacionParticipante.usuario_id == usuario.id
-    ).first()
+    El acceso a BD va al threadpool con sesiones cortas: el socket no retiene
+    una conexión del pool ni bloquea el event loop mientras se guarda.
+    """
     
-    if not es_participante:
-        await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason="No eres participante")
+    # Autenticar y verificar que es participante
+    usuario = await run_in_threadpool(_preparar_conexion, token, conversacion_id)
+    if isinstance(usuario, str):
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason=usuario)
         return
     
     # Conectar
-    await manager.connect(conversacion_id, usuario.id, websocket)
+    conexion = await manager.connect(conversacion_id, usuario.id, websocket)
+    vigilada = supervisor_ws.vigilar(
+        "chat",
+        websocket,
+        enviar_ping=lambda: manager.difusor.encolar(conexion, PING),
+        al_cerrar=lambda: manager.disconnect(conversacion_id, usuario.id, conexion)
+    )
     
     # Notificar conexión
-    rol = db.query(Rol).filter(Rol.id == es_participante.rol_id).first()
     await manager.broadcast_a_conversacion(
         conversacion_id,
         {
             "tipo": "usuario_conectado",
             "usuario_id": usuario.id,
             "usuario_nombre": usuario.nombre,
-            "usuario_rol": rol.nombre if rol else usuario.rol,
+            "usuario_rol": usuario.rol,
             "timestamp": datetime.now().isoformat()
         },
         excluir_usuario=usuario.id
@@ -183,53 +268,40 @@ async def websocket_conversacion(
         while True:
             data = await websocket.receive_json()
             tipo = data.get("tipo")
+            supervisor_ws.recibido(
+                vigilada,
+                pong=tipo == "pong",
+                actividad=tipo in ("mensaje", "escribiendo", "archivo")
+            )
+            
+            # Latidos
+            if tipo == "ping":
+                manager.difusor.encolar(conexion, PONG)
             
             # Mensaje de texto
-            if tipo == "mensaje":
+            elif tipo == "mensaje":
                 contenido = data.get("contenido", "").strip()
                 if not contenido:
                     continue
                 
-                # Guardar en BD
-                nuevo_msg = Mensaje(
-                    conversacion_id=conversacion_id,
-                    emisor_id=usuario.id,
-                    tipo="TEXTO",
-                    contenido=contenido
+                # Guardar en BD (con los registros de visto para otros usuarios)
+                mensaje_id, created_at = await run_in_threadpool(
+                    _guardar_mensaje, conversacion_id, usuario.id, "TEXTO", contenido
                 )
                 
-                db.add(nuevo_msg)
-                db.flush()
-                
-                # Crear registros de visto para otros usuarios
-                participantes = db.query(ConversacionParticipante).filter(
-                    ConversacionParticipante.conversacion_id == conversacion_id,
-                    ConversacionParticipante.usuario_id != usuario.id
-                ).all()
-                
-                for p in participantes:
-                    visto_registro = MensajeVisto(
-                        mensaje_id=nuevo_msg.id,
-                        usuario_id=p.usuario_id,
-                        visto=False
-                    )
-                    db.add(visto_registro)
-                
-                db.commit()
-                
                 # Notificar a todos
                 await manager.broadcast_a_todos_usuarios(
                     conversacion_id,
                     {
                         "tipo": "nuevo_mensaje",
-                        "id": nuevo_msg.id,
+                        "id": mensaje_id,
                         "conversacion_id": conversacion_id,
                         "emisor_id": usuario.id,
                         "tipo_mensaje": "TEXTO",
                         "contenido": contenido,
-                        "created_at": nuevo_msg.created_at.isoformat(),
+                        "created_at": created_at.isoformat(),
                         "senderNombre": usuario.nombre,
-                        "senderRol": rol.nombre if rol else usuario.rol,
+                        "senderRol": usuario.rol,
                         "archivoUrl": None,
                         "archivoNombre": None
                     }
@@ -259,52 +331,33 @@ async def websocket_conversacion(
                 archivo_url = data.get("archivoUrl")
                 archivo_nombre = data.get("archivoNombre")
                 tipo_archivo = data.get("tipoArchivo", "ARCHIVO")
+                tipo_mensaje = "ARCHIVO" if tipo_archivo == "ARCHIVO" else "AUDIO"
                 
-                nuevo_msg = Mensaje(
-                    conversacion_id=conversacion_id,
-                    emisor_id=usuario.id,
-                    tipo="ARCHIVO" if tipo_archivo == "ARCHIVO" else "AUDIO"
-                )
-                
-                db.add(nuevo_msg)
-                db.flush()
-                
-                msg_archivo = MensajeArchivo(
-                    mensaje_id=nuevo_msg.id,
-                    archivo_url=archivo_url,
-                    nombre_original=archivo_nombre,
-                    tipo_archivo=tipo_archivo
+                mensaje_id, created_at = await run_in_threadpool(
+                    _guardar_mensaje,
+                    conversacion_id,
+                    usuario.id,
+                    tipo_mensaje,
+                    None,
+                    {
+                        "archivo_url": archivo_url,
+                        "nombre_original": archivo_nombre,
+                        "tipo_archivo": tipo_archivo
+                    }
                 )
                 
-                db.add(msg_archivo)
-                
-                participantes = db.query(ConversacionParticipante).filter(
-                    ConversacionParticipante.conversacion_id == conversacion_id,
-                    ConversacionParticipante.usuario_id != usuario.id
-                ).all()
-                
-                for p in participantes:
-                    visto_registro = MensajeVisto(
-                        mensaje_id=nuevo_msg.id,
-                        usuario_id=p.usuario_id,
-                        visto=False
-                    )
-                    db.add(visto_registro)
-                
-                db.commit()
-                
                 await manager.broadcast_a_todos_usuarios(
                     conversacion_id,
                     {
                         "tipo": "nuevo_mensaje",
-                        "id": nuevo_msg.id,
+                        "id": mensaje_id,
                         "conversacion_id": conversacion_id,
                         "emisor_id": usuario.id,
-                        "tipo_mensaje": "ARCHIVO" if tipo_archivo == "ARCHIVO" else "AUDIO",
+                        "tipo_mensaje": tipo_mensaje,
                         "contenido": None,
-                        "created_at": nuevo_msg.created_at.isoformat(),
+                        "created_at": created_at.isoformat(),
                         "senderNombre": usuario.nombre,
-                        "senderRol": rol.nombre if rol else usuario.rol,
+                        "senderRol": usuario.rol,
                         "archivoUrl": archivo_url,
                         "archivoNombre": archivo_nombre
                     }
@@ -314,7 +367,7 @@ async def websocket_conversacion(
                 await manager.notificar_dejo_escribir(conversacion_id, usuario.id)
     
     except WebSocketDisconnect:
-        manager.disconnect(conversacion_id, usuario.id)
+        manager.disconnect(conversacion_id, usuario.id, conexion)
         await manager.broadcast_a_conversacion(
             conversacion_id,
             {
@@ -326,4 +379,6 @@ async def websocket_conversacion(
         )
     except Exception as e:
         logger.error(f"Error WebSocket: {e}")
-        manager.disconnect(conversacion_id, usuario.id)
\ No newline at end of file
+        manager.disconnect(conversacion_id, usuario.id, conexion)
+    finally:
+        supervisor_ws.soltar(vigilada)
@@ -22,6 +22,8 @@ class Settings(BaseSettings):
     # ==================================================
     BASE_DIR: Path = BASE_DIR
     UPLOADS_DIR: Path = BASE_DIR / "uploads"
+    # Estado interno (snapshots, índices, cachés): NO se sirve por /archivos
+    DATA_DIR: Path = BASE_DIR / "var"
 
     # ==================================================
     # API
@@ -94,11 +96,108 @@ class Settings(BaseSettings):
     ENVIRONMENT: str = "development"
     DEBUG: bool = True
 
+    # ==================================================
+    # RATE LIMIT
+    # ==================================================
+    # "memoria" (por proceso) o "sqlite" (compartido entre workers locales)
+    RATE_LIMIT_BACKEND: str = "memoria"
+    RATE_LIMIT_FRANJAS: int = 64
+    # Proxies de confianza (IPs o redes CIDR separadas por coma). Solo si la
+    # conexión viene de uno de ellos se usa X-Forwarded-For; vacío = nunca
+    RATE_LIMIT_PROXIES_CONFIABLES: str = ""
+
+    @property
+    def PROXIES_CONFIABLES(self) -> List[str]:
+        """
+        Convierte RATE_LIMIT_PROXIES_CONFIABLES en lista limpia
+        """
+        return [
+            proxy.strip()
+            for proxy in self.RATE_LIMIT_PROXIES_CONFIABLES.split(",")
+            if proxy.strip()
+        ]
+
     # ==================================================
     # GEMINI / IA
     # ==================================================
     GEMINI_API_KEY: str = ""
     GEMINI_MODEL: str = "gemini-2.5-flash"
+    # Cliente REST compartido (URL base configurable para pruebas con un servidor local)
+    GEMINI_API_BASE_URL: str = "https://generativelanguage.googleapis.com"
+    GEMINI_TIMEOUT_SEGUNDOS: float = 30
+    GEMINI_MAX_CONCURRENCIA: int = 8
+    GEMINI_MAX_REINTENTOS: int = 3
+    # Circuit breaker: se abre si en la ventana hay >= MIN_LLAMADAS y la tasa de errores >= UMBRAL
+    GEMINI_CIRCUITO_UMBRAL_ERRORES: float = 0.5
+    GEMINI_CIRCUITO_MIN_LLAMADAS: int = 10
+    GEMINI_CIRCUITO_VENTANA_SEGUNDOS: float = 30
+    GEMINI_CIRCUITO_ENFRIAMIENTO_SEGUNDOS: float = 30
+    # Precisión con que se guardan los embeddings en BD ("float32" o "float16")
+    EMBEDDING_DTYPE: str = "float32"
+    # Backend de embeddings: "auto" (Gemini si hay API key), "gemini" o "local"
+    EMBEDDING_BACKEND: str = "auto"
+    # Caché de embeddings (entradas en memoria) y generación por lotes
+    EMBEDDING_CACHE_SIZE: int = 10000
+    # Nivel en disco (DATA_DIR/embeddings_cache): tope de tamaño y antigüedad
+    EMBEDDING_CACHE_DISCO_MAX_MB: int = 512
+    EMBEDDING_CACHE_DISCO_MAX_DIAS: int = 90
+    EMBEDDING_LOTE: int = 100
+    EMBEDDING_CONCURRENCIA: int = 4
+    # Explicaciones de recomendaciones en segundo plano
+    EXPLICACIONES_CONCURRENCIA: int = 2
+    EXPLICACIONES_MAX_PENDIENTES: int = 200
+    # Espera máxima en cola; las que no arrancan a tiempo se descartan
+    EXPLICACIONES_MAX_ESPERA_SEGUNDOS: int = 300
+    # Caché de respuestas del chatbot (solo preguntas sin contexto de niño)
+    CHAT_CACHE_SIZE: int = 1000
+    CHAT_CACHE_TTL_SEGUNDOS: int = 86400
+    CHAT_CACHE_UMBRAL_SEMANTICO: float = 0.85
+    # Presupuesto de tokens del prompt del chat (estimados) y del resumen
+    # acumulado de los turnos que ya no caben; mensajes recientes que se leen
+    CHAT_PROMPT_TOKENS_MAX: int = 3000
+    CHAT_PROMPT_TOKENS_RESUMEN: int = 300
+    CHAT_PROMPT_HISTORIAL_MENSAJES: int = 32
+    # Fragmentos del catálogo del centro (actividades, recursos, terapias)
+    # que se inyectan en el prompt: cuántos, score mínimo [0, 1] y tokens por fragmento
+    CHAT_CATALOGO_TOP_K: int = 3
+    CHAT_CATALOGO_SCORE_MINIMO: float = 0.6
+    CHAT_CATALOGO_TOKENS_FRAGMENTO: int = 60
+    # Historial reciente del chat en memoria (mensajes por sesión, sesiones, caducidad)
+    CHAT_HISTORIAL_BUFFER: int = 32
+    CHAT_HISTORIAL_SESIONES: int = 2000
+    CHAT_HISTORIAL_TTL_SEGUNDOS: int = 300
+    # Sesiones de chat en memoria de GeminiChatService (LRU + caducidad por
+    # inactividad) y snapshot a disco para sobrevivir reinicios del worker
+    CHAT_SESIONES_MEMORIA_MAX: int = 1000
+    CHAT_SESIONES_TTL_SEGUNDOS: int = 1800
+    CHAT_SESION_MAX_MENSAJES: int = 100
+    CHAT_SESIONES_SNAPSHOT: bool = False
+    # Frecuencia máxima con que se actualiza chat_sessions.last_seen_at
+    CHAT_LAST_SEEN_INTERVALO_SEGUNDOS: int = 60
+    # Escritura de mensajes del chat: "diferida" (por lotes) o "sincrona"
+    CHAT_PERSISTENCIA: str = "diferida"
+    CHAT_ESCRITURA_LOTE: int = 200
+    CHAT_ESCRITURA_INTERVALO_MS: int = 250
+    CHAT_ESCRITURA_MAX_PENDIENTES: int = 5000
+    # Retención de sesiones de chat (0 horas = no programar)
+    CHAT_RETENCION_DIAS: int = 7
+    CHAT_RETENCION_BLOQUE: int = 500
+    CHAT_RETENCION_PAUSA_MS: int = 100
+    CHAT_RETENCION_INTERVALO_HORAS: float = 6
+    # WebSockets de conversaciones: cola de salida por conexión (eventos),
+    # tiempo máximo de un envío y desbordes tolerados antes de cerrar la conexión
+    WS_COLA_SALIDA_MAX: int = 256
+    WS_ENVIO_TIMEOUT_SEGUNDOS: float = 10
+    WS_MAX_REZAGOS: int = 3
+    # Supervisión de WebSockets: latido sin tráfico del cliente, espera del
+    # pong (clientes que responden pings) y cierre por inactividad
+    WS_PING_INTERVALO_SEGUNDOS: float = 25
+    WS_PONG_TIMEOUT_SEGUNDOS: float = 10
+    WS_INACTIVIDAD_SEGUNDOS: float = 1800
+    # Bus de eventos en tiempo real entre workers: "local" (un proceso) o
+    # "unix" (broker embebido en socket Unix; vacío = ruta en el directorio temporal)
+    PUBSUB_BACKEND: str = "local"
+    PUBSUB_SOCKET: str = ""
 
     # ==================================================
     # CONFIGURACIÓN Pydantic
@@ -1,77 +1,285 @@
 """
-Rate Limiting Simple por IP
+Rate Limiting por IP con token bucket
 Sin dependencias externas - producción ready
+
+Cada cliente tiene una cubeta de `max_requests` fichas que se rellena a
+max_requests / window_seconds fichas por segundo: permite ráfagas cortas y
+un promedio sostenido, en O(1) por petición.
+
+Backends (RATE_LIMIT_BACKEND):
+- "memoria": por proceso. Estado repartido en franjas con su propio lock
+  (lock striping) para que peticiones de IPs distintas no compitan.
+  Cada franja es un OrderedDict por último acceso, así las cubetas
+  inactivas (ya llenas = equivalentes a no existir) se expiran desde el
+  frente sin recorrer todo.
+- "sqlite": archivo SQLite local compartido por todos los workers de
+  uvicorn en la misma máquina (sustituto local de un Redis). Vive en
+  DATA_DIR, fuera de lo que se sirve en /archivos.
+
+La IP del cliente es la de la conexión; X-Forwarded-For solo se considera
+cuando la conexión viene de un proxy de RATE_LIMIT_PROXIES_CONFIABLES.
+
+Se usa como dependencia de FastAPI:
+
+    @router.post("/login", dependencies=[Depends(login_limiter)])
 """
-from fastapi import Request, HTTPException
-from datetime import datetime, timedelta
-from collections import defaultdict
-from typing import Dict, Tuple
+import ipaddress
+import math
+import sqlite3
 import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from pathlib import Path
+from typing import List, Optional, Tuple, Union
+
+from fastapi import Request, HTTPException
+from starlette.requests import HTTPConnection
+
+from app.core.config import settings
+
+
+class BackendRateLimit(ABC):
+    """Interfaz de almacenamiento de cubetas"""
+
+    @abstractmethod
+    def consumir(self, clave: str, capacidad: float, tasa: float, costo: float = 1.0) -> Tuple[bool, float]:
+        """
+        Intenta tomar `costo` fichas de la cubeta `clave`
+
+        Returns:
+            (permitido, segundos hasta que haya fichas suficientes)
+        """
+
+    @abstractmethod
+    def limpiar(self) -> None:
+        """Borra todas las cubetas"""
+
+
+def _recargar(tokens: float, ultimo: float, ahora: float, capacidad: float, tasa: float) -> float:
+    return min(capacidad, tokens + max(0.0, ahora - ultimo) * tasa)
+
+
+class _Cubeta:
+    __slots__ = ('tokens', 'ultimo', 'expira')
+
+    def __init__(self, tokens: float, ultimo: float, expira: float):
+        self.tokens = tokens
+        self.ultimo = ultimo
+        self.expira = expira
+
+
+class MemoriaRateLimit(BackendRateLimit):
+    """Cubetas en memoria del proceso, repartidas en franjas con lock propio"""
+
+    # Cubetas expiradas que se retiran como máximo en cada petición
+    MAX_EXPIRADAS_POR_LLAMADA = 8
+
+    def __init__(self, franjas: int = 64):
+        self._locks: List[threading.Lock] = [threading.Lock() for _ in range(franjas)]
+        self._cubetas: List["OrderedDict[str, _Cubeta]"] = [OrderedDict() for _ in range(franjas)]
+
+    def __len__(self) -> int:
+        return sum(len(franja) for franja in self._cubetas)
+
+    def consumir(self, clave: str, capacidad: float, tasa: float, costo: float = 1.0) -> Tuple[bool, float]:
+        indice = hash(clave) % len(self._locks)
+        cubetas = self._cubetas[indice]
+        ahora = time.monotonic()
+        with self._locks[indice]:
+            # Expirar desde el frente (las de acceso más antiguo)
+            for _ in range(self.MAX_EXPIRADAS_POR_LLAMADA):
+                if not cubetas:
+                    break
+                primera_clave, primera = next(iter(cubetas.items()))
+                if primera.expira > ahora or primera_clave == clave:
+                    break
+                del cubetas[primera_clave]
+
+            cubeta = cubetas.get(clave)
+            if cubeta is None:
+                tokens = capacidad
+                cubeta = cubetas[clave] = _Cubeta(tokens, ahora, ahora)
+            else:
+                tokens = _recargar(cubeta.tokens, cubeta.ultimo, ahora, capacidad, tasa)
+                cubetas.move_to_end(clave)
+
+            permitido = tokens >= costo
+            if permitido:
+                tokens -= costo
+            cubeta.tokens = tokens
+            cubeta.ultimo = ahora
+            # Momento en que vuelve a estar llena (a partir de ahí da igual borrarla)
+            cubeta.expira = ahora + (capacidad - tokens) / tasa
+        return permitido, 0.0 if permitido else (costo - tokens) / tasa
+
+    def limpiar(self) -> None:
+        for lock, cubetas in zip(self._locks, self._cubetas):
+            with lock:
+                cubetas.clear()
+
+
+class SQLiteRateLimit(BackendRateLimit):
+    """
+    Cubetas en un archivo SQLite compartido entre procesos de la misma máquina
+
+    Cada consumo es una transacción BEGIN IMMEDIATE (lectura + escritura
+    atómicas entre workers). Usa time.time(): el archivo sobrevive a
+    reinicios de la máquina, el reloj monotónico no.
+    """
+
+    # Cada cuántas llamadas se borran cubetas expiradas (índice por expira)
+    PURGA_CADA = 1000
+
+    def __init__(self, ruta: Path):
+        self.ruta = Path(ruta)
+        self._local = threading.local()
+        self._llamadas = 0
+        self.ruta.parent.mkdir(parents=True, exist_ok=True)
+        conexion = self._conexion()
+        conexion.execute("PRAGMA journal_mode=WAL")
+        conexion.execute(
+            "CREATE TABLE IF NOT EXISTS cubetas ("
+            " clave TEXT PRIMARY KEY, tokens REAL NOT NULL, ultimo REAL NOT NULL, expira REAL NOT NULL)"
+        )
+        conexion.execute("CREATE INDEX IF NOT EXISTS ix_cubetas_expira ON cubetas (expira)")
+
+    def _conexion(self) -> sqlite3.Connection:
+        conexion = getattr(self._local, 'conexion', None)
+        if conexion is None:
+            conexion = sqlite3.connect(self.ruta, timeout=5, isolation_level=None)
+            conexion.execute("PRAGMA synchronous=NORMAL")
+            self._local.conexion = conexion
+        return conexion
+
+    def consumir(self, clave: str, capacidad: float, tasa: float, costo: float = 1.0) -> Tuple[bool, float]:
+        conexion = self._conexion()
+        ahora = time.time()
+        conexion.execute("BEGIN IMMEDIATE")
+        try:
+            fila = conexion.execute(
+                "SELECT tokens, ultimo FROM cubetas WHERE clave = ?", (clave,)
+            ).fetchone()
+            tokens = capacidad if fila is None else _recargar(fila[0], fila[1], ahora, capacidad, tasa)
+            permitido = tokens >= costo
+            if permitido:
+                tokens -= costo
+            conexion.execute(
+                "INSERT OR REPLACE INTO cubetas (clave, tokens, ultimo, expira) VALUES (?, ?, ?, ?)",
+                (clave, tokens, ahora, ahora + (capacidad - tokens) / tasa)
+            )
+            self._llamadas += 1
+            if self._llamadas % self.PURGA_CADA == 0:
+                conexion.execute("DELETE FROM cubetas WHERE expira <= ?", (ahora,))
+            conexion.execute("COMMIT")
+        except Exception:
+            conexion.execute("ROLLBACK")
+            raise
+        return permitido, 0.0 if permitido else (costo - tokens) / tasa
+
+    def limpiar(self) -> None:
+        self._conexion().execute("DELETE FROM cubetas")
+
+
+def crear_backend(tipo: str) -> BackendRateLimit:
+    if tipo == "memoria":
+        return MemoriaRateLimit(franjas=settings.RATE_LIMIT_FRANJAS)
+    if tipo == "sqlite":
+        return SQLiteRateLimit(settings.DATA_DIR / "rate_limit.sqlite3")
+    raise ValueError(f"Backend de rate limit desconocido: {tipo}")
+
+
+# Backend compartido por todos los limitadores (las claves llevan el nombre)
+backend_rate_limit = crear_backend(settings.RATE_LIMIT_BACKEND)
+
+
+Red = Union[ipaddress.IPv4Network, ipaddress.IPv6Network]
+
+
+def _redes(proxies: List[str]) -> List[Red]:
+    return [ipaddress.ip_network(proxy, strict=False) for proxy in proxies]
+
+
+def _es_confiable(ip: str, redes: List[Red]) -> bool:
+    try:
+        direccion = ipaddress.ip_address(ip)
+    except ValueError:
+        return False
+    return any(direccion in red for red in redes)
+
 
 class SimpleRateLimiter:
     """
-    Rate limiter en memoria por IP
-    Thread-safe y auto-limpiante
+    Rate limiter por IP (token bucket)
+    Thread-safe y auto-limpiante; usable como dependencia de FastAPI
     """
-    def __init__(self, max_requests: int = 20, window_seconds: int = 60):
+    def __init__(
+        self,
+        max_requests: int = 20,
+        window_seconds: int = 60,
+        nombre: str = "default",
+        backend: Optional[BackendRateLimit] = None,
+        proxies_confiables: Optional[List[str]] = None
+    ):
         self.max_requests = max_requests
         self.window_seconds = window_seconds
-        # IP -> (contador, timestamp_ventana)
-        self.requests: Dict[str, Tuple[int, datetime]] = defaultdict(lambda: (0, datetime.now()))
-        self.lock = threading.Lock()
-    
-    def _get_client_ip(self, request: Request) -> str:
-        """Extrae IP del cliente (considera proxies)"""
+        self.nombre = nombre
+        self.backend = backend or backend_rate_limit
+        self.tasa = max_requests / window_seconds
+        self.proxies = _redes(
+            settings.PROXIES_CONFIABLES if proxies_confiables is None else proxies_confiables
+        )
+
+    def _get_client_ip(self, request: HTTPConnection) -> str:
+        """
+        Extrae IP del cliente
+
+        X-Forwarded-For la escribe el cliente, así que solo se lee si la
+        conexión viene de un proxy de confianza, y de derecha a izquierda:
+        la primera IP que no es de un proxy de confianza es el cliente.
+        """
+        ip = request.client.host if request.client else "unknown"
+        if not self.proxies or not _es_confiable(ip, self.proxies):
+            return ip
         forwarded = request.headers.get("X-Forwarded-For")
-        if forwarded:
-            return forwarded.split(",")[0].strip()
-        return request.client.host if request.client else "unknown"
-    
-    def _cleanup_old_entries(self):
-        """Limpia entradas antiguas (llamar periódicamente)"""
-        now = datetime.now()
-        cutoff = now - timedelta(seconds=self.window_seconds * 2)
-        
-        with self.lock:
-            to_delete = [
-                ip for ip, (_, timestamp) in self.requests.items()
-                if timestamp < cutoff
-            ]
-            for ip in to_delete:
-                del self.requests[ip]
-    
-    def check_rate_limit(self, request: Request) -> None:
+        if not forwarded:
+            return ip
+        for salto in reversed([parte.strip() for parte in forwarded.split(",")]):
+            if not salto:
+                continue
+            if not _es_confiable(salto, self.proxies):
+                return salto
+            ip = salto
+        return ip
+
+    def check_rate_limit(self, request: HTTPConnection, costo: float = 1.0) -> None:
         """
         Verifica rate limit - lanza HTTPException si se excede
         """
-        ip = self._get_client_ip(request)
-        now = datetime.now()
-        
-        with self.lock:
-            count, window_start = self.requests[ip]
-            
-            # Si la ventana expiró, reiniciar
-            if now - window_start > timedelta(seconds=self.window_seconds):
-                self.requests[ip] = (1, now)
-                return
-            
-            # Si estamos dentro de la ventana, incrementar
-            if count >= self.max_requests:
-                raise HTTPException(
-                    status_code=429,
-                    detail={
-                        "error": "Rate limit excedido",
-                        "mensaje": f"Máximo {self.max_requests} solicitudes por {self.window_seconds}s",
-                        "retry_after": self.window_seconds
-                    }
-                )
-            
-            self.requests[ip] = (count + 1, window_start)
-        
-        # Limpiar ocasionalmente (1% de probabilidad)
-        if hash(ip) % 100 == 0:
-            self._cleanup_old_entries()
+        clave = f"{self.nombre}:{self._get_client_ip(request)}"
+        permitido, espera = self.backend.consumir(clave, self.max_requests, self.tasa, costo)
+        if not permitido:
+            retry_after = max(1, math.ceil(espera))
+            raise HTTPException(
+                status_code=429,
+                detail={
+                    "error": "Rate limit excedido",
+                    "mensaje": f"Máximo {self.max_requests} solicitudes por {self.window_seconds}s",
+                    "retry_after": retry_after
+                },
+                headers={"Retry-After": str(retry_after)}
+            )
+
+    def __call__(self, request: Request) -> None:
+        """Dependencia de FastAPI: Depends(limiter)"""
+        self.check_rate_limit(request)
 
 # Instancia global para chatbot
 # 20 requests por minuto por IP
-chatbot_limiter = SimpleRateLimiter(max_requests=20, window_seconds=60)
+chatbot_limiter = SimpleRateLimiter(max_requests=20, window_seconds=60, nombre="chatbot")
+
+# Login: 10 intentos por minuto por IP
+login_limiter = SimpleRateLimiter(max_requests=10, window_seconds=60, nombre="login")
+
+# Subida de archivos: 30 por minuto por IP
+uploads_limiter = SimpleRateLimiter(max_requests=30, window_seconds=60, nombre="uploads")
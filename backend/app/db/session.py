@@ -1,10 +1,15 @@
 # app/db/session.py
-from sqlalchemy import create_engine
+import logging
+
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.pool import QueuePool
 
 from app.core.config import settings
 from app.db.base_class import Base
+from app.db.tipos import detectar_columnas_json
+
+logger = logging.getLogger(__name__)
 
 engine = create_engine(
     settings.DATABASE_URL,
@@ -16,6 +21,80 @@ engine = create_engine(
     connect_args={"charset": "utf8mb4"},
 )
 
+
+# Columnas agregadas a tablas existentes después de su creación: se agregan
+# al conectar si faltan (create_all no altera tablas que ya existen y el
+# ORM las consulta siempre). Equivale a scripts/actualizar_columnas.py.
+COLUMNAS_AGREGADAS = (
+    ("perfil_nino_vectorizado", "modelo_embedding", "VARCHAR(100) NULL"),
+    ("perfil_actividad_vectorizada", "modelo_embedding", "VARCHAR(100) NULL"),
+)
+
+
+def agregar_columnas_faltantes(conexion_dbapi) -> list:
+    """Agrega las COLUMNAS_AGREGADAS que falten en tablas ya creadas (devuelve tabla.columna)"""
+    tablas = sorted({tabla for tabla, _, _ in COLUMNAS_AGREGADAS})
+    cursor = conexion_dbapi.cursor()
+    try:
+        cursor.execute(
+            "SELECT TABLE_NAME, COLUMN_NAME FROM information_schema.COLUMNS "
+            f"WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME IN ({', '.join(['%s'] * len(tablas))})",
+            tablas
+        )
+        existentes = {
+            tuple(v.decode('utf-8').lower() if isinstance(v, (bytes, bytearray)) else v.lower() for v in fila)
+            for fila in cursor.fetchall()
+        }
+        con_tabla = {tabla for tabla, _ in existentes}
+        agregadas = []
+        for tabla, columna, definicion in COLUMNAS_AGREGADAS:
+            # Tabla inexistente: create_all la crea completa
+            if tabla in con_tabla and (tabla, columna) not in existentes:
+                cursor.execute(f"ALTER TABLE {tabla} ADD COLUMN {columna} {definicion}")
+                agregadas.append(f"{tabla}.{columna}")
+        return agregadas
+    finally:
+        cursor.close()
+
+
+@event.listens_for(engine, "first_connect")
+def _agregar_columnas(conexion_dbapi, registro):
+    if engine.dialect.name != "mysql":
+        return
+    try:
+        agregadas = agregar_columnas_faltantes(conexion_dbapi)
+    except Exception as e:
+        logger.error(
+            f"No se pudieron agregar columnas nuevas ({e}); "
+            "corre scripts/actualizar_columnas.py antes de usar las recomendaciones"
+        )
+        return
+    if agregadas:
+        logger.info(f"Columnas agregadas al esquema: {', '.join(agregadas)}")
+
+
+@event.listens_for(engine, "first_connect")
+def _revisar_columnas_vectoriales(conexion_dbapi, registro):
+    """
+    Columnas de embeddings que siguen en JSON (sin migrar a BLOB)
+
+    Se escriben como JSON para no fallar; el formato binario requiere correr
+    scripts/migrar_embeddings_binarios.py y reiniciar.
+    """
+    if engine.dialect.name != "mysql":
+        return
+    try:
+        heredadas = detectar_columnas_json(conexion_dbapi, Base.metadata)
+    except Exception as e:
+        logger.warning(f"No se pudo revisar el tipo de las columnas de embeddings: {e}")
+        return
+    if heredadas:
+        logger.warning(
+            "Columnas de embeddings sin migrar (se escriben como JSON): "
+            f"{', '.join(heredadas)}. Corre scripts/migrar_embeddings_binarios.py y reinicia."
+        )
+
+
 SessionLocal = sessionmaker(
     autocommit=False,
     autoflush=False,
@@ -0,0 +1,203 @@
+# app/db/tipos.py
+"""
+Tipos de columna personalizados
+
+VectorBinario guarda embeddings como BLOB en lugar de arreglos JSON de floats:
+
+    cabecera (8 bytes, little-endian) + datos crudos
+    ┌────────┬─────────┬───────┬───────────┐
+    │ 'EV'   │ versión │ dtype │ dimensión │
+    │ 2 B    │ 1 B     │ 1 B   │ uint32    │
+    └────────┴─────────┴───────┴───────────┘
+
+Un vector de 768 dimensiones ocupa ~3 KB en float32 (~1.5 KB en float16)
+frente a ~15 KB como texto JSON, y leerlo es un np.frombuffer sin copia
+ni parseo. Al leer se devuelve un np.ndarray de solo lectura que apunta
+directamente a los bytes recibidos del driver.
+
+Las filas que todavía estén en JSON (antes de correr
+scripts/migrar_embeddings_binarios.py) se siguen leyendo correctamente.
+
+Escribir bytes en una columna que MySQL aún tiene como JSON falla, así que
+al abrir la primera conexión se revisa el tipo real de cada columna
+(detectar_columnas_json) y las que siguen en JSON se escriben como texto
+JSON hasta que se corra la migración y se reinicie el proceso. La
+migración debe correrse antes de desplegar para obtener el formato binario.
+"""
+import json
+import struct
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+from sqlalchemy import MetaData
+from sqlalchemy.types import LargeBinary, TypeDecorator
+
+MAGIA = b'EV'
+VERSION_FORMATO = 1
+
+_CABECERA = struct.Struct('<2sBBI')
+TAMANO_CABECERA = _CABECERA.size
+
+# Código de dtype almacenado en la cabecera
+DTYPES = {
+    1: np.dtype('<f4'),
+    2: np.dtype('<f2'),
+}
+_CODIGOS = {np.dtype(dtype).name: codigo for codigo, dtype in DTYPES.items()}
+
+# MEDIUMBLOB en MySQL (hasta 16 MB), sobrado para cualquier embedding
+LONGITUD_BLOB = 2 ** 24 - 1
+
+VectorEntrada = Union[np.ndarray, Sequence[float]]
+
+
+def codificar_vector(vector: VectorEntrada, dtype: str = 'float32') -> bytes:
+    """Serializa un vector 1-D a bytes con cabecera (magia, versión, dtype, dimensión)"""
+    if dtype not in _CODIGOS:
+        raise ValueError(f"dtype no soportado para embeddings: {dtype}")
+    codigo = _CODIGOS[dtype]
+    arreglo = np.asarray(vector, dtype=DTYPES[codigo]).ravel()
+    cabecera = _CABECERA.pack(MAGIA, VERSION_FORMATO, codigo, arreglo.shape[0])
+    return cabecera + arreglo.tobytes()
+
+
+def decodificar_vector(datos: Union[bytes, bytearray, memoryview, str]) -> np.ndarray:
+    """
+    Convierte el valor almacenado en un arreglo 1-D
+
+    Para datos binarios devuelve una vista de solo lectura (sin copia)
+    sobre el buffer; para JSON heredado devuelve un arreglo float32 nuevo.
+    """
+    if isinstance(datos, str):
+        return np.asarray(json.loads(datos), dtype=np.float32)
+
+    buffer = memoryview(datos)
+    if buffer.nbytes < TAMANO_CABECERA or bytes(buffer[:2]) != MAGIA:
+        # Columna aún no migrada: texto JSON en bytes
+        return np.asarray(json.loads(bytes(buffer).decode('utf-8')), dtype=np.float32)
+
+    magia, version, codigo, dimension = _CABECERA.unpack_from(buffer)
+    if version != VERSION_FORMATO:
+        raise ValueError(f"Versión de embedding binario desconocida: {version}")
+    if codigo not in DTYPES:
+        raise ValueError(f"Código de dtype de embedding desconocido: {codigo}")
+
+    dtype = DTYPES[codigo]
+    esperado = TAMANO_CABECERA + dimension * dtype.itemsize
+    if buffer.nbytes != esperado:
+        raise ValueError(
+            f"Embedding binario truncado: {buffer.nbytes} bytes, se esperaban {esperado}"
+        )
+    return np.frombuffer(buffer, dtype=dtype, count=dimension, offset=TAMANO_CABECERA)
+
+
+class VectorBinario(TypeDecorator):
+    """
+    Columna de embedding binaria
+
+    Acepta listas de floats o np.ndarray al escribir y entrega np.ndarray
+    (vista sin copia) al leer. Con json_heredado (columna todavía JSON en
+    la BD) escribe texto JSON en lugar de bytes.
+    """
+
+    impl = LargeBinary
+    cache_ok = True
+
+    def __init__(self, dtype: Optional[str] = None, **kwargs):
+        kwargs.setdefault('length', LONGITUD_BLOB)
+        super().__init__(**kwargs)
+        self.dtype = dtype
+        # Mutable y compartido con las copias que SQLAlchemy hace por dialecto
+        self._estado = {'json_heredado': False}
+
+    @property
+    def json_heredado(self) -> bool:
+        return self._estado['json_heredado']
+
+    @json_heredado.setter
+    def json_heredado(self, valor: bool) -> None:
+        self._estado['json_heredado'] = valor
+
+    def _dtype_escritura(self) -> str:
+        if self.dtype:
+            return self.dtype
+        # Import diferido: la configuración puede cambiar el dtype por entorno
+        from app.core.config import settings
+        return settings.EMBEDDING_DTYPE
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        if isinstance(value, (bytes, bytearray, memoryview)):
+            return bytes(value)
+        return codificar_vector(value, self._dtype_escritura())
+
+    def bind_processor(self, dialect):
+        procesar_binario = super().bind_processor(dialect)
+
+        def procesar(value):
+            # Se consulta en cada escritura: detectar_columnas_json lo fija al conectar
+            if self.json_heredado and value is not None:
+                return _a_json(value)
+            return procesar_binario(value) if procesar_binario else value
+
+        return procesar
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        return decodificar_vector(value)
+
+
+def _a_json(value) -> str:
+    """Texto JSON para una columna aún no migrada"""
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        value = decodificar_vector(value)
+    return json.dumps(np.asarray(value, dtype=np.float32).ravel().tolist())
+
+
+def columnas_vectoriales(metadata: MetaData) -> Dict[Tuple[str, str], VectorBinario]:
+    """Columnas VectorBinario registradas en el metadata: {(tabla, columna): tipo}"""
+    return {
+        (tabla.name.lower(), columna.name.lower()): columna.type
+        for tabla in metadata.tables.values()
+        for columna in tabla.columns
+        if isinstance(columna.type, VectorBinario)
+    }
+
+
+def detectar_columnas_json(conexion_dbapi, metadata: MetaData) -> List[str]:
+    """
+    Revisa en MySQL el tipo real de las columnas VectorBinario
+
+    Las que siguen sin migrar (cualquier tipo que no sea BLOB) quedan con
+    json_heredado y se escriben como texto JSON. Devuelve "tabla.columna"
+    de cada una.
+    """
+    columnas = columnas_vectoriales(metadata)
+    if not columnas:
+        return []
+
+    cursor = conexion_dbapi.cursor()
+    try:
+        cursor.execute(
+            "SELECT TABLE_NAME, COLUMN_NAME, DATA_TYPE FROM information_schema.COLUMNS "
+            "WHERE TABLE_SCHEMA = DATABASE()"
+        )
+        filas = cursor.fetchall()
+    finally:
+        cursor.close()
+
+    heredadas = []
+    for fila in filas:
+        # information_schema puede llegar como bytes según la versión del driver
+        tabla, columna, tipo_dato = (
+            v.decode('utf-8') if isinstance(v, (bytes, bytearray)) else v for v in fila
+        )
+        tipo = columnas.get((tabla.lower(), columna.lower()))
+        if tipo is None:
+            continue
+        tipo.json_heredado = 'blob' not in tipo_dato.lower()
+        if tipo.json_heredado:
+            heredadas.append(f"{tabla}.{columna}")
+    return heredadas
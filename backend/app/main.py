@@ -11,7 +11,21 @@ from fastapi.staticfiles import StaticFiles
 
 from app.core.config import settings
 from app.api.v1.api import api_router
-from app.db.session import init_db
+from app.db.session import init_db, SessionLocal
+from app.services.especialidad_index import especialidad_index
+from app.services.vector_index import actividad_vector_index
+from app.services.embedding_cache import embedding_cache
+from app.services.chat_retrieval import indice_catalogo_chat
+from app.services.recomendacion_service import vectorizar_catalogo_en_segundo_plano
+from app.services.explicacion_worker import cola_explicaciones
+from app.services.chat_write_behind import escritor_mensajes
+from app.services.chat_retencion import programador_retencion_chat
+from app.services.gemini_async_client import cliente_gemini
+from app.services.chat_prompt_budget import presupuesto_prompt
+from app.services.gemini_chat_service import gemini_chat_service
+from app.services.chat_participantes import cache_participantes
+from app.services.pubsub import bus_eventos
+from app.services.ws_supervisor import supervisor_ws
 
 # ==================================================
 # CONFIGURACIÓN LOGGING
@@ -60,6 +74,95 @@ def on_startup():
     logging.info("✓ Base de datos inicializada")
     logging.info("✓ Directorios de uploads verificados")
 
+    # Caché de embeddings de versiones previas: fuera de lo que se sirve en /archivos
+    embedding_cache.retirar_directorio_anterior(settings.UPLOADS_DIR / "embeddings_cache")
+
+    # Índice de especialidades terapeuta ↔ terapia
+    db = SessionLocal()
+    try:
+        especialidad_index.construir(db)
+        logging.info("✓ Índice de especialidades construido")
+    except Exception as e:
+        logging.warning(f"Índice de especialidades se construirá en el primer uso: {e}")
+
+    # Índice vectorial de actividades (carga el .npy con mmap o reconstruye)
+    try:
+        actividad_vector_index.asegurar(db)
+        logging.info(f"✓ Índice vectorial de actividades listo ({len(actividad_vector_index)} vectores)")
+    except Exception as e:
+        logging.warning(f"Índice vectorial se construirá en el primer uso: {e}")
+
+    # Fragmentos del catálogo del centro para el chatbot
+    try:
+        indice_catalogo_chat.construir(db)
+        logging.info(f"✓ Catálogo del chatbot indexado ({len(indice_catalogo_chat)} fragmentos)")
+    except Exception as e:
+        logging.warning(f"Catálogo del chatbot se indexará en el primer uso: {e}")
+    finally:
+        db.close()
+
+    # Vectorizar actividades nuevas o editadas sin bloquear el arranque
+    vectorizar_catalogo_en_segundo_plano()
+    logging.info("✓ Vectorización de catálogo lanzada en segundo plano")
+
+    # Retención periódica de sesiones de chat inactivas
+    programador_retencion_chat.iniciar(
+        settings.CHAT_RETENCION_INTERVALO_HORAS,
+        dias=settings.CHAT_RETENCION_DIAS,
+        tamano_bloque=settings.CHAT_RETENCION_BLOQUE,
+        pausa_segundos=settings.CHAT_RETENCION_PAUSA_MS / 1000
+    )
+
+    # Conversaciones activas del worker anterior
+    if settings.CHAT_SESIONES_SNAPSHOT:
+        restauradas = gemini_chat_service.cargar_sesiones(settings.DATA_DIR / "sesiones_chat")
+        logging.info(f"✓ Sesiones de chat restauradas: {restauradas}")
+
+# ==================================================
+# SHUTDOWN
+# ==================================================
+@app.on_event("shutdown")
+def on_shutdown():
+    # Detener el pool de explicaciones Gemini en segundo plano
+    cola_explicaciones.cerrar()
+    logging.info("✓ Cola de explicaciones detenida")
+
+    # Detener la retención (se reanuda en el siguiente arranque) y
+    # escribir los mensajes de chat que sigan en cola
+    programador_retencion_chat.detener()
+    escritor_mensajes.cerrar()
+    logging.info("✓ Mensajes de chat pendientes guardados")
+
+    # Guardar las conversaciones activas para el siguiente arranque
+    if settings.CHAT_SESIONES_SNAPSHOT:
+        guardadas = gemini_chat_service.guardar_sesiones(settings.DATA_DIR / "sesiones_chat")
+        logging.info(f"✓ Sesiones de chat guardadas: {guardadas}")
+
+    # Altas incrementales del índice vectorial aún sin escribir a disco
+    actividad_vector_index.guardar_pendiente()
+
+    # Cerrar el pool de resúmenes del chat y el de conexiones del cliente Gemini
+    presupuesto_prompt.cerrar()
+    cliente_gemini.cerrar()
+
+# ==================================================
+# TIEMPO REAL: BUS DE EVENTOS Y SUPERVISOR DE WEBSOCKETS
+# ==================================================
+@app.on_event("startup")
+async def iniciar_bus_eventos():
+    # Se inicia en el event loop: con PUBSUB_BACKEND=unix conecta este
+    # worker con el broker (o lo hospeda si es el primero)
+    await bus_eventos.iniciar()
+    # Invalidaciones de la caché de participantes hechas en otros workers
+    cache_participantes.escuchar_bus(bus_eventos)
+    logging.info(f"✓ Bus de eventos '{bus_eventos.nombre}' iniciado")
+
+
+@app.on_event("shutdown")
+async def cerrar_bus_eventos():
+    await supervisor_ws.cerrar()
+    await bus_eventos.cerrar()
+
 # ==================================================
 # MANEJO GLOBAL DE ERRORES DE VALIDACIÓN
 # ==================================================
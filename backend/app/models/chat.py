@@ -1,7 +1,7 @@
 """
 Modelos para Chat - Persistencia de conversaciones
 """
-from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, Boolean
+from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, Boolean, Index
 from sqlalchemy.sql import func
 from app.db.base import Base
 
@@ -13,7 +13,7 @@ class ChatSession(Base):
     session_id = Column(String(32), unique=True, index=True, nullable=False)
     nino_id = Column(Integer, nullable=True, index=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
-    last_seen_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+    last_seen_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now(), index=True)
     active = Column(Boolean, default=True)
 
 class ChatMessage(Base):
@@ -25,3 +25,8 @@ class ChatMessage(Base):
     role = Column(String(16), nullable=False)  # "usuario" | "asistente"
     content = Column(Text, nullable=False)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    __table_args__ = (
+        # Historial: WHERE session_id = ? ORDER BY created_at DESC LIMIT N
+        Index('ix_chat_messages_session_created', 'session_id', 'created_at'),
+    )
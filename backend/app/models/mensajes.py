@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Text, DateTime, Boolean, ForeignKey, Enum as SQLEnum, UniqueConstraint
+from sqlalchemy import Column, Integer, String, Text, DateTime, Boolean, ForeignKey, Enum as SQLEnum, UniqueConstraint, Index
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from app.db.base_class import Base
@@ -35,6 +35,8 @@ class ConversacionParticipante(Base):
     
     __table_args__ = (
         UniqueConstraint('conversacion_id', 'usuario_id', name='uq_conv_usuario'),
+        # Lista de chats: conversaciones activas de un usuario
+        Index('ix_conv_part_usuario_activo', 'usuario_id', 'activo', 'conversacion_id'),
     )
 
 
@@ -53,6 +55,11 @@ class Mensaje(Base):
     emisor = relationship("Usuario")
     archivos = relationship("MensajeArchivo", back_populates="mensaje")
     vistos = relationship("MensajeVisto", back_populates="mensaje")
+    
+    __table_args__ = (
+        # Lista de chats: último mensaje no eliminado por conversación
+        Index('ix_mensajes_conv_eliminado_created', 'conversacion_id', 'eliminado', 'created_at', 'id'),
+    )
 
 
 class MensajeArchivo(Base):
@@ -83,4 +90,6 @@ class MensajeVisto(Base):
     
     __table_args__ = (
         UniqueConstraint('mensaje_id', 'usuario_id', name='uq_msg_usuario'),
+        # Lista de chats: no leídos de un usuario (cubre el COUNT agrupado)
+        Index('ix_mensajes_vistos_usuario_visto', 'usuario_id', 'visto', 'mensaje_id'),
     )
\ No newline at end of file
@@ -3,6 +3,7 @@ from datetime import datetime
 from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Text, JSON, Float
 from sqlalchemy.orm import relationship
 from app.db.base_class import Base
+from app.db.tipos import VectorBinario
 
 
 class PerfilNinoVectorizado(Base):
@@ -16,7 +17,10 @@ class PerfilNinoVectorizado(Base):
     nino_id = Column(Integer, ForeignKey("ninos.id", ondelete="CASCADE"), unique=True, nullable=False)
     
     # Vector de embeddings generado por Gemini
-    embedding = Column(JSON, nullable=False)  # Array de floats
+    embedding = Column(VectorBinario(), nullable=False)  # BLOB -> np.ndarray
+    # Backend que generó el vector (EmbeddingBackend.nombre): solo se comparan
+    # vectores del mismo modelo
+    modelo_embedding = Column(String(100))
     
     # Metadatos para contexto
     edad = Column(Integer)
@@ -45,7 +49,8 @@ class PerfilActividadVectorizada(Base):
     actividad_id = Column(Integer, ForeignKey("actividades.id", ondelete="CASCADE"), unique=True, nullable=False)
     
     # Vector de embeddings generado por Gemini
-    embedding = Column(JSON, nullable=False)
+    embedding = Column(VectorBinario(), nullable=False)
+    modelo_embedding = Column(String(100))  # EmbeddingBackend.nombre
     
     # Metadatos
     areas_desarrollo = Column(JSON)  # ['cognitivo', 'motor']
@@ -82,7 +87,7 @@ class HistorialProgreso(Base):
     duracion_minutos = Column(Integer)
     
     # Embedding de notas para análisis de similitud
-    embedding_notas = Column(JSON)
+    embedding_notas = Column(VectorBinario())
     
     fecha_registro = Column(DateTime, default=datetime.utcnow)
     
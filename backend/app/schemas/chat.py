@@ -2,7 +2,7 @@
 Esquemas Pydantic para Chat
 """
 from pydantic import BaseModel, Field
-from typing import Optional
+from typing import Any, Dict, Optional
 
 class ChatbotRequest(BaseModel):
     """Request para el chatbot"""
@@ -27,3 +27,9 @@ class EstadoResponse(BaseModel):
     """Response del estado de IA"""
     configurado: bool
     model: Optional[str] = None
+    cache_respuestas: Optional[Dict[str, Any]] = None
+    cliente_gemini: Optional[Dict[str, Any]] = None
+    tokens_prompt: Optional[Dict[str, Any]] = None
+    sesiones_memoria: Optional[Dict[str, Any]] = None
+    catalogo: Optional[Dict[str, Any]] = None
+    websockets: Optional[Dict[str, Any]] = None
@@ -90,6 +90,8 @@ class RecomendacionActividadesResponse(BaseModel):
     nino_id: int
     recomendaciones: List[RecomendacionActividad]
     explicacion: str | None = None
+    explicacion_id: int | None = Field(None, description="ID para consultar la explicación en segundo plano")
+    explicacion_estado: str | None = Field(None, description="pendiente | en_proceso | lista | error | descartada")
     fecha_generacion: str
 
 
@@ -112,6 +114,8 @@ class SeleccionTerapeutaResponse(BaseModel):
     terapeuta_seleccionado: TerapeutaRecomendado
     ranking_completo: List[TerapeutaRecomendado]
     explicacion: str | None = None
+    explicacion_id: int | None = Field(None, description="ID para consultar la explicación en segundo plano")
+    explicacion_estado: str | None = Field(None, description="pendiente | en_proceso | lista | error | descartada")
     criterios_usados: dict
 
 
@@ -123,6 +127,21 @@ class RecomendacionCompletaResponse(BaseModel):
     fecha_generacion: str
 
 
+class RecomendacionLoteRequest(BaseModel):
+    """Request para recomendaciones de muchos niños (respuesta NDJSON)"""
+    nino_ids: List[int] | None = Field(None, description="IDs de niños; None = todos los activos")
+    top_n: int = Field(5, ge=1, le=50, description="Recomendaciones por niño")
+
+
+class ExplicacionEstadoResponse(BaseModel):
+    """Estado de una explicación generada en segundo plano"""
+    tipo: str
+    explicacion_id: int
+    estado: str = Field(..., description="pendiente | en_proceso | lista | error | descartada | no_disponible")
+    explicacion: str | None = None
+    error: str | None = None
+
+
 class GenerarPerfilRequest(BaseModel):
     """Request para generar o actualizar perfil vectorizado"""
     nino_id: int
@@ -4,7 +4,7 @@ Schemas Pydantic para el módulo TOPSIS de Selección de Terapeutas
 Implementa validaciones robustas y tipos estrictos
 """
 from pydantic import BaseModel, Field, field_validator, model_validator
-from typing import Optional, Dict
+from typing import Optional, Dict, List
 from decimal import Decimal
 
 
@@ -98,6 +98,36 @@ class TopsisEvaluacionRequest(BaseModel):
         }
 
 
+class TopsisEvaluacionMultipleRequest(BaseModel):
+    """Request para rankear terapeutas para varias terapias en una sola llamada"""
+    terapia_ids: Optional[List[int]] = Field(
+        default=None,
+        description="IDs de terapias a evaluar (por defecto todas las activas)"
+    )
+    pesos: PesosCriterios = Field(
+        default_factory=PesosCriterios,
+        description="Pesos para cada criterio TOPSIS"
+    )
+    incluir_inactivos: bool = Field(
+        default=False,
+        description="Incluir terapeutas con estado laboral inactivo"
+    )
+    
+    class Config:
+        json_schema_extra = {
+            "example": {
+                "terapia_ids": [1, 2, 3],
+                "pesos": {
+                    "carga_laboral": 0.30,
+                    "sesiones_completadas": 0.25,
+                    "rating": 0.30,
+                    "especialidad": 0.15
+                },
+                "incluir_inactivos": False
+            }
+        }
+
+
 class MetricasTerapeuta(BaseModel):
     """Métricas calculadas para un terapeuta"""
     carga_laboral: int = Field(description="Número de citas activas")
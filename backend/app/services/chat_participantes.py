@@ -0,0 +1,143 @@
+# app/services/chat_participantes.py
+"""
+Participantes de conversaciones en caché y registros de "visto" en bloque
+
+Enviar un mensaje consultaba los participantes de la conversación y
+añadía un MensajeVisto (un INSERT) por destinatario. Aquí:
+
+- Caché por conversación {usuario_id: rol_id}, LRU acotada y con TTL.
+  Se invalida con eventos ORM de ConversacionParticipante (altas, bajas y
+  cambios de rol/estado) y, entre workers, publicando la invalidación en
+  el bus de eventos; el TTL acota cualquier cambio hecho por otra vía.
+- insertar_vistos: un solo INSERT multi-fila para todos los destinatarios.
+"""
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+from sqlalchemy import event, insert, inspect
+from sqlalchemy.orm import Session, object_session
+
+from app.models.mensajes import ConversacionParticipante, MensajeVisto
+
+# Canal del bus para invalidar entre workers
+CANAL_INVALIDACION = "chat:participantes"
+
+# Atributos que cambian la membresía (last_seen_at, por ejemplo, no)
+_ATRIBUTOS_MEMBRESIA = ('conversacion_id', 'usuario_id', 'rol_id', 'activo')
+
+
+class CacheParticipantes:
+    """conversacion_id -> {usuario_id: rol_id}"""
+
+    def __init__(self, max_conversaciones: int = 5000, ttl_segundos: float = 300):
+        self.max_conversaciones = max_conversaciones
+        self.ttl_segundos = ttl_segundos
+        self._lock = threading.Lock()
+        self._entradas: "OrderedDict[int, Tuple[float, Dict[int, int]]]" = OrderedDict()
+        self._bus = None
+        self.aciertos = 0
+        self.fallos = 0
+        self.invalidaciones = 0
+
+    def obtener(self, db: Session, conversacion_id: int) -> Dict[int, int]:
+        """Participantes de la conversación (una consulta solo si no está en caché)"""
+        ahora = time.monotonic()
+        with self._lock:
+            entrada = self._entradas.get(conversacion_id)
+            if entrada is not None and entrada[0] > ahora:
+                self._entradas.move_to_end(conversacion_id)
+                self.aciertos += 1
+                return entrada[1]
+            self.fallos += 1
+
+        participantes = dict(
+            db.query(ConversacionParticipante.usuario_id, ConversacionParticipante.rol_id)
+            .filter(ConversacionParticipante.conversacion_id == conversacion_id)
+            .all()
+        )
+        with self._lock:
+            self._entradas[conversacion_id] = (ahora + self.ttl_segundos, participantes)
+            self._entradas.move_to_end(conversacion_id)
+            while len(self._entradas) > self.max_conversaciones:
+                self._entradas.popitem(last=False)
+        return participantes
+
+    def invalidar(self, conversacion_id: Optional[int], propagar: bool = True) -> None:
+        if conversacion_id is None:
+            return
+        with self._lock:
+            self._entradas.pop(conversacion_id, None)
+            self.invalidaciones += 1
+        if propagar and self._bus is not None:
+            self._bus.publicar(CANAL_INVALIDACION, str(conversacion_id))
+
+    def escuchar_bus(self, bus) -> None:
+        """Recibe las invalidaciones de otros workers (llamar desde el event loop)"""
+        self._bus = bus
+        bus.suscribir(CANAL_INVALIDACION, lambda texto, _excluir: self.invalidar(int(texto), propagar=False))
+
+    def estadisticas(self) -> Dict[str, Any]:
+        with self._lock:
+            consultas = self.aciertos + self.fallos
+            return {
+                'conversaciones': len(self._entradas),
+                'aciertos': self.aciertos,
+                'fallos': self.fallos,
+                'tasa_aciertos': round(self.aciertos / consultas, 3) if consultas else 0.0,
+                'invalidaciones': self.invalidaciones,
+            }
+
+
+def insertar_vistos(db: Session, mensaje_id: int, usuario_ids: Iterable[int]) -> int:
+    """Registros de "no visto" para los destinatarios en un solo INSERT; no hace commit"""
+    ahora = datetime.now()
+    filas = [
+        {"mensaje_id": mensaje_id, "usuario_id": usuario_id, "visto": False, "visto_at": ahora}
+        for usuario_id in usuario_ids
+    ]
+    if filas:
+        db.execute(insert(MensajeVisto).values(filas))
+    return len(filas)
+
+
+# Instancia global (WebSocket de conversaciones y endpoints REST de mensajes)
+cache_participantes = CacheParticipantes()
+
+
+def _invalidar(objetivo, conversacion_id: Optional[int]) -> None:
+    # Ahora y otra vez tras el commit: una lectura concurrente entre el
+    # flush y el commit podría haber guardado la lista anterior
+    cache_participantes.invalidar(conversacion_id)
+    sesion = object_session(objetivo)
+    if sesion is not None and conversacion_id is not None:
+        sesion.info.setdefault('participantes_invalidar', set()).add(conversacion_id)
+
+
+def _al_cambiar(_mapper, _conexion, objetivo):
+    _invalidar(objetivo, objetivo.conversacion_id)
+
+
+def _al_actualizar(_mapper, _conexion, objetivo):
+    estado = inspect(objetivo)
+    for atributo in _ATRIBUTOS_MEMBRESIA:
+        historial = estado.attrs[atributo].history
+        if historial.has_changes():
+            # Si cambió de conversación, invalidar también la anterior
+            for anterior in historial.deleted if atributo == 'conversacion_id' else ():
+                _invalidar(objetivo, anterior)
+            _invalidar(objetivo, objetivo.conversacion_id)
+            return
+
+
+def _tras_commit(sesion: Session):
+    for conversacion_id in sesion.info.pop('participantes_invalidar', ()):
+        cache_participantes.invalidar(conversacion_id)
+
+
+event.listen(ConversacionParticipante, 'after_insert', _al_cambiar)
+event.listen(ConversacionParticipante, 'after_delete', _al_cambiar)
+event.listen(ConversacionParticipante, 'after_update', _al_actualizar)
+event.listen(Session, 'after_commit', _tras_commit)
@@ -0,0 +1,290 @@
+# app/services/chat_prompt_budget.py
+"""
+Presupuesto de tokens del prompt del chat con resumen acumulado
+
+En vez de reenviar el historial completo en cada turno, el prompt se arma
+con un tamaño fijo:
+
+    reglas + contexto + [resumen de lo anterior] + turnos recientes + pregunta
+
+- Los tokens se estiman localmente (~4 caracteres por token) para no
+  añadir una llamada de red por turno.
+- Los turnos recientes entran del más nuevo al más viejo mientras quepan
+  en lo que queda del presupuesto.
+- Los turnos que ya no caben, y los que están por salir de la ventana
+  de historial (últimos N mensajes), se pliegan en un resumen acumulado por
+  sesión. El resumen se calcula fuera del camino de la petición (pool de
+  fondo): la petición usa el último resumen disponible y el siguiente
+  turno ya incluye el actualizado. Sin Gemini (o con el circuito abierto)
+  el resumen es extractivo y local.
+
+Cada petición registra su desglose de tokens; los agregados se exponen en
+GET /chat/estado.
+"""
+import math
+import threading
+import zlib
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from app.core.config import settings
+
+# Tokens extra por turno (etiqueta de rol y separadores)
+TOKENS_POR_TURNO = 4
+
+# Caracteres por turno en el resumen extractivo local
+CARACTERES_TURNO_RESUMEN = 160
+
+# Turnos de margen antes del borde de la ventana de historial: los que
+# saldrán de ella en los próximos intercambios se pliegan por adelantado
+MARGEN_VENTANA = 4
+
+Turno = Dict[str, str]
+
+
+def estimar_tokens(texto: Optional[str]) -> int:
+    """Estimación local de tokens (~4 caracteres por token)"""
+    if not texto:
+        return 0
+    return math.ceil(len(texto) / 4)
+
+
+def _huella_turno(turno: Turno) -> int:
+    return zlib.crc32(f"{turno.get('role')}\x00{turno.get('text')}".encode('utf-8'))
+
+
+def _etiqueta(rol: str) -> str:
+    return "Usuario" if rol in ('usuario', 'user') else "Asistente"
+
+
+def recortar_a_tokens(texto: str, tokens: int, desde_el_final: bool = False) -> str:
+    """Recorta un texto a ~`tokens` tokens"""
+    limite = tokens * 4
+    if len(texto) <= limite:
+        return texto
+    return "…" + texto[-limite:] if desde_el_final else texto[:limite] + "…"
+
+
+def resumen_extractivo(previo: Optional[str], turnos: Sequence[Turno], tokens: int) -> str:
+    """Resumen local: resumen previo + inicio de cada turno, conservando lo más reciente"""
+    lineas = [previo] if previo else []
+    for turno in turnos:
+        texto = " ".join(turno.get("text", "").split())
+        if len(texto) > CARACTERES_TURNO_RESUMEN:
+            texto = texto[:CARACTERES_TURNO_RESUMEN] + "…"
+        lineas.append(f"{_etiqueta(turno.get('role', ''))}: {texto}")
+    return recortar_a_tokens("\n".join(lineas), tokens, desde_el_final=True)
+
+
+def resumen_gemini(previo: Optional[str], turnos: Sequence[Turno], tokens: int) -> str:
+    """Resumen abstractivo con Gemini; si no está disponible, extractivo"""
+    from app.services.gemini_async_client import cliente_gemini
+
+    if not cliente_gemini.configurado:
+        return resumen_extractivo(previo, turnos, tokens)
+    conversacion = "\n".join(f"{_etiqueta(t.get('role', ''))}: {t.get('text', '')}" for t in turnos)
+    prompt = (
+        f"Actualiza el resumen de una conversación entre un cuidador y un asistente "
+        f"especializado en autismo. Conserva datos del niño, objetivos, estrategias ya "
+        f"sugeridas y preguntas pendientes. Máximo {int(tokens * 0.7)} palabras, sin saludo.\n\n"
+        f"Resumen actual:\n{previo or '(vacío)'}\n\nTurnos nuevos:\n{conversacion}"
+    )
+    try:
+        return recortar_a_tokens(cliente_gemini.generar_sync(prompt, deadline=20).strip(), tokens)
+    except Exception as e:
+        print(f"[WARN] Resumen de conversación con Gemini falló, se usa el extractivo: {e}")
+        return resumen_extractivo(previo, turnos, tokens)
+
+
+class _Resumen:
+    __slots__ = ('texto', 'hasta')
+
+    def __init__(self, texto: str, hasta: int):
+        self.texto = texto
+        # Huella del último turno plegado en el resumen
+        self.hasta = hasta
+
+
+class PresupuestoPrompt:
+    """Recorte del historial a un presupuesto de tokens + resúmenes acumulados por sesión"""
+
+    def __init__(
+        self,
+        tokens_max: int = 3000,
+        tokens_resumen: int = 300,
+        max_sesiones: int = 2000,
+        resumidor: Callable[[Optional[str], Sequence[Turno], int], str] = resumen_gemini,
+        max_pendientes: int = 100,
+        muestras: int = 1000
+    ):
+        self.tokens_max = tokens_max
+        self.tokens_resumen = tokens_resumen
+        self.max_sesiones = max_sesiones
+        self.resumidor = resumidor
+        self.max_pendientes = max_pendientes
+        self._lock = threading.Lock()
+        self._resumenes: "OrderedDict[str, _Resumen]" = OrderedDict()
+        self._en_curso: set = set()
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+        # Métricas
+        self._totales: deque = deque(maxlen=muestras)
+        self.peticiones = 0
+        self.tokens_acumulados = 0
+        self.turnos_omitidos = 0
+        self.resumenes_generados = 0
+        self.resumenes_descartados = 0
+        self.ultima: Optional[Dict[str, int]] = None
+
+    def _pool(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="chat-resumen")
+        return self._executor
+
+    # --------------------------------------------------------
+    # Recorte
+    # --------------------------------------------------------
+
+    def disponible(self, *fijos: str) -> int:
+        """Tokens que quedan para el historial tras las partes fijas y el resumen"""
+        return max(0, self.tokens_max - self.tokens_resumen - sum(estimar_tokens(p) for p in fijos))
+
+    def recortar(
+        self,
+        clave: Optional[str],
+        turnos: Sequence[Turno],
+        presupuesto: int,
+        ventana: Optional[int] = None
+    ) -> Tuple[Optional[str], List[Turno]]:
+        """
+        Turnos recientes que caben en `presupuesto` tokens y resumen de los anteriores
+
+        Args:
+            clave: sesión dueña del resumen (None = sin resumen, solo recorte)
+            turnos: historial en orden cronológico [{"role", "text"}]
+            presupuesto: tokens disponibles para los turnos
+            ventana: máximo de mensajes con que se leyó el historial (None =
+                completo). Los más viejos se pliegan antes de salir de la
+                ventana aunque todavía quepan en el presupuesto
+
+        Returns:
+            (resumen o None, turnos recientes en orden cronológico)
+        """
+        restante = presupuesto
+        inicio = len(turnos)
+        while inicio > 0:
+            costo = estimar_tokens(turnos[inicio - 1].get("text")) + TOKENS_POR_TURNO
+            if costo > restante:
+                break
+            restante -= costo
+            inicio -= 1
+        recientes = list(turnos[inicio:])
+        if clave is None:
+            return None, recientes
+
+        with self._lock:
+            resumen = self._resumenes.get(clave)
+            if resumen is not None:
+                self._resumenes.move_to_end(clave)
+        corte = inicio
+        if ventana:
+            corte = max(corte, len(turnos) - max(0, ventana - MARGEN_VENTANA))
+        if corte:
+            self._programar_plegado(clave, resumen, turnos, corte)
+        return (resumen.texto if resumen else None), recientes
+
+    def _programar_plegado(
+        self,
+        clave: str,
+        resumen: Optional[_Resumen],
+        turnos: Sequence[Turno],
+        corte: int
+    ) -> None:
+        """Pliega en segundo plano los turnos [:corte] que el resumen aún no cubre"""
+        pendientes = list(turnos[:corte])
+        if resumen is not None:
+            huellas = [_huella_turno(t) for t in turnos]
+            if resumen.hasta in huellas:
+                posicion = len(huellas) - 1 - huellas[::-1].index(resumen.hasta)
+                pendientes = list(turnos[posicion + 1:corte])
+        if not pendientes:
+            return
+
+        with self._lock:
+            if clave in self._en_curso:
+                return
+            if len(self._en_curso) >= self.max_pendientes:
+                self.resumenes_descartados += 1
+                return
+            self._en_curso.add(clave)
+        self._pool().submit(self._plegar, clave, resumen.texto if resumen else None, pendientes)
+
+    def _plegar(self, clave: str, previo: Optional[str], turnos: List[Turno]) -> None:
+        try:
+            texto = self.resumidor(previo, turnos, self.tokens_resumen)
+            with self._lock:
+                self._resumenes[clave] = _Resumen(texto, _huella_turno(turnos[-1]))
+                self._resumenes.move_to_end(clave)
+                while len(self._resumenes) > self.max_sesiones:
+                    self._resumenes.popitem(last=False)
+                self.resumenes_generados += 1
+        except Exception as e:
+            print(f"[WARN] Error resumiendo la sesión de chat {clave}: {e}")
+        finally:
+            with self._lock:
+                self._en_curso.discard(clave)
+
+    def resumen(self, clave: str) -> Optional[str]:
+        with self._lock:
+            resumen = self._resumenes.get(clave)
+            return resumen.texto if resumen else None
+
+    def olvidar(self, claves) -> None:
+        with self._lock:
+            for clave in claves:
+                self._resumenes.pop(clave, None)
+
+    # --------------------------------------------------------
+    # Métricas por petición
+    # --------------------------------------------------------
+
+    def registrar(self, desglose: Dict[str, int]) -> None:
+        """Registra el desglose de tokens de una petición (debe incluir 'total')"""
+        with self._lock:
+            self.peticiones += 1
+            self.tokens_acumulados += desglose["total"]
+            self.turnos_omitidos += desglose.get("turnos_omitidos", 0)
+            self._totales.append(desglose["total"])
+            self.ultima = dict(desglose)
+
+    def estadisticas(self) -> Dict[str, Any]:
+        with self._lock:
+            totales = sorted(self._totales)
+            return {
+                'presupuesto_tokens': self.tokens_max,
+                'peticiones': self.peticiones,
+                'tokens_promedio': round(self.tokens_acumulados / self.peticiones, 1) if self.peticiones else 0.0,
+                'tokens_p95': totales[min(len(totales) - 1, int(len(totales) * 0.95))] if totales else 0,
+                'tokens_max': totales[-1] if totales else 0,
+                'turnos_omitidos': self.turnos_omitidos,
+                'ultima': self.ultima,
+                'resumenes': len(self._resumenes),
+                'resumenes_en_curso': len(self._en_curso),
+                'resumenes_generados': self.resumenes_generados,
+                'resumenes_descartados': self.resumenes_descartados,
+            }
+
+    def cerrar(self) -> None:
+        """Detiene el pool de resúmenes (el que esté en curso termina)"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+# Instancia global compartida por el chatbot y GeminiChatService
+presupuesto_prompt = PresupuestoPrompt(
+    tokens_max=settings.CHAT_PROMPT_TOKENS_MAX,
+    tokens_resumen=settings.CHAT_PROMPT_TOKENS_RESUMEN,
+    max_sesiones=settings.CHAT_HISTORIAL_SESIONES
+)
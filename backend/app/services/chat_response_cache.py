@@ -0,0 +1,250 @@
+# app/services/chat_response_cache.py
+"""
+Caché de respuestas del chatbot público
+
+Las preguntas frecuentes sin contexto ("cómo manejar rabietas", "qué es
+ABA") se repiten mucho; reutilizar la respuesta ahorra la llamada al LLM.
+
+Dos niveles:
+- Exacto: sha256 del mensaje normalizado (minúsculas, sin acentos ni
+  signos) + rol del usuario + huella del contexto (reglas del sistema y
+  modelo, así un cambio de prompt invalida todo)
+- Semántico: si no hay coincidencia exacta, se compara el embedding de la
+  pregunta con los de las preguntas en caché (mismo rol y huella) y se
+  reutiliza la respuesta si el coseno supera el umbral. Los embeddings son
+  locales (feature hashing, ~0.2 ms) para no añadir latencia de red.
+  Como son léxicos, "rabietas a los 3 años" y "a los 13 años" o "qué es
+  ABA" y "qué no es ABA" se parecen mucho; por eso el nivel semántico
+  además exige la misma firma crítica: los números (en cifra o en letra)
+  y las negaciones de ambas preguntas deben coincidir en orden.
+
+Las entradas caducan por TTL y se desalojan por LRU. Nunca se consulta ni
+se guarda nada cuando hay contexto de un niño: esas respuestas son
+personales y no se comparten.
+"""
+import hashlib
+import re
+import threading
+import time
+import unicodedata
+import zlib
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+import numpy as np
+
+from app.core.config import settings
+from app.services.embedding_backends import EmbeddingBackend, LocalHashingBackend
+
+_NO_ALFANUMERICO_RE = re.compile(r'[^a-z0-9ñ]+')
+
+# Palabras que cambian el sentido clínico de una pregunta aunque el resto
+# sea idéntico (ya normalizadas: minúsculas y sin acentos)
+_NEGACIONES = frozenset({
+    'no', 'ni', 'nunca', 'jamas', 'tampoco', 'sin', 'nada', 'nadie',
+    'ningun', 'ninguna', 'ninguno',
+})
+_NUMEROS_EN_LETRA = frozenset({
+    'cero', 'un', 'uno', 'una', 'dos', 'tres', 'cuatro', 'cinco', 'seis', 'siete',
+    'ocho', 'nueve', 'diez', 'once', 'doce', 'trece', 'catorce', 'quince',
+    'dieciseis', 'diecisiete', 'dieciocho', 'diecinueve', 'veinte', 'treinta',
+    'cuarenta', 'cincuenta', 'sesenta', 'setenta', 'ochenta', 'noventa',
+    'cien', 'ciento', 'mil', 'medio', 'media',
+})
+
+
+def normalizar_pregunta(texto: str) -> str:
+    """Minúsculas, sin acentos (conserva la ñ), sin signos y espacios simples"""
+    descompuesto = unicodedata.normalize('NFKD', texto.lower().replace('ñ', '\0'))
+    sin_acentos = ''.join(c for c in descompuesto if not unicodedata.combining(c)).replace('\0', 'ñ')
+    return _NO_ALFANUMERICO_RE.sub(' ', sin_acentos).strip()
+
+
+def firma_critica(pregunta: str) -> int:
+    """
+    Números y negaciones de una pregunta normalizada, en orden
+
+    Dos preguntas solo comparten respuesta por similitud si su firma es
+    la misma ("3 años" != "13 años", "qué es" != "qué no es").
+    """
+    criticas = [
+        palabra for palabra in pregunta.split()
+        if palabra.isdigit() or palabra in _NEGACIONES or palabra in _NUMEROS_EN_LETRA
+    ]
+    return zlib.crc32(' '.join(criticas).encode('utf-8'))
+
+
+def huella_contexto(*partes: Any) -> str:
+    """Huella corta de lo que condiciona la respuesta además de la pregunta"""
+    h = hashlib.sha256()
+    for parte in partes:
+        h.update(repr(parte).encode('utf-8'))
+        h.update(b'\0')
+    return h.hexdigest()[:16]
+
+
+class CacheRespuestasChat:
+    """Caché LRU + TTL de respuestas con búsqueda exacta y semántica"""
+
+    def __init__(
+        self,
+        capacidad: int = 1000,
+        ttl_segundos: float = 86400,
+        umbral_semantico: float = 0.85,
+        embedder: Optional[EmbeddingBackend] = None
+    ):
+        self.capacidad = capacidad
+        self.ttl_segundos = ttl_segundos
+        self.umbral_semantico = umbral_semantico
+        self.embedder = embedder or LocalHashingBackend()
+        self._lock = threading.Lock()
+        # clave -> {respuesta, fila, expira}; el orden es el de uso (LRU)
+        self._entradas: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        # Embeddings de las preguntas: una fila por entrada
+        self._matriz = np.zeros((capacidad, self.embedder.dimension), dtype=np.float32)
+        self._grupos = np.zeros(capacidad, dtype=np.int64)
+        self._firmas = np.zeros(capacidad, dtype=np.int64)
+        self._expiraciones = np.zeros(capacidad, dtype=np.float64)  # 0 = fila libre
+        self._claves_fila: list = [None] * capacidad
+        self._filas_libres = list(range(capacidad - 1, -1, -1))
+        self.aciertos_exactos = 0
+        self.aciertos_semanticos = 0
+        self.fallos = 0
+        self.omitidas = 0
+
+    def __len__(self) -> int:
+        return len(self._entradas)
+
+    @staticmethod
+    def _clave(pregunta: str, rol: str, huella: str) -> str:
+        return hashlib.sha256(f"{huella}\0{rol}\0{pregunta}".encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def _grupo(rol: str, huella: str) -> int:
+        return zlib.crc32(f"{huella}\0{rol}".encode('utf-8'))
+
+    def _vector(self, pregunta: str) -> np.ndarray:
+        return self.embedder.embed_lote([pregunta])[0]
+
+    def _quitar(self, clave: str) -> None:
+        """Elimina una entrada (con el lock tomado)"""
+        entrada = self._entradas.pop(clave)
+        fila = entrada['fila']
+        self._expiraciones[fila] = 0.0
+        self._claves_fila[fila] = None
+        self._filas_libres.append(fila)
+
+    # --------------------------------------------------------
+    # API
+    # --------------------------------------------------------
+
+    def obtener(
+        self,
+        mensaje: str,
+        rol: str,
+        huella: str,
+        contexto: Optional[Dict] = None
+    ) -> Tuple[Optional[str], Optional[str]]:
+        """
+        Busca una respuesta reutilizable
+
+        Returns:
+            (respuesta, nivel) con nivel 'exacto' o 'semantico'; (None, None) si no hay
+        """
+        if contexto:
+            self.omitidas += 1
+            return None, None
+
+        pregunta = normalizar_pregunta(mensaje)
+        if not pregunta:
+            return None, None
+        clave = self._clave(pregunta, rol, huella)
+        ahora = time.monotonic()
+
+        with self._lock:
+            entrada = self._entradas.get(clave)
+            if entrada is not None:
+                if entrada['expira'] > ahora:
+                    self._entradas.move_to_end(clave)
+                    self.aciertos_exactos += 1
+                    return entrada['respuesta'], 'exacto'
+                self._quitar(clave)
+
+        vector = self._vector(pregunta)
+        grupo = self._grupo(rol, huella)
+        firma = firma_critica(pregunta)
+        with self._lock:
+            if self._entradas:
+                similitudes = self._matriz @ vector
+                validas = (self._grupos == grupo) & (self._firmas == firma) & (self._expiraciones > ahora)
+                similitudes[~validas] = -np.inf
+                fila = int(np.argmax(similitudes))
+                if similitudes[fila] >= self.umbral_semantico:
+                    clave_similar = self._claves_fila[fila]
+                    self._entradas.move_to_end(clave_similar)
+                    self.aciertos_semanticos += 1
+                    return self._entradas[clave_similar]['respuesta'], 'semantico'
+            self.fallos += 1
+        return None, None
+
+    def guardar(
+        self,
+        mensaje: str,
+        rol: str,
+        huella: str,
+        respuesta: str,
+        contexto: Optional[Dict] = None
+    ) -> bool:
+        """Guarda una respuesta; devuelve False si no es cacheable"""
+        pregunta = normalizar_pregunta(mensaje)
+        if contexto or not pregunta or not respuesta or self.capacidad <= 0:
+            return False
+
+        clave = self._clave(pregunta, rol, huella)
+        vector = self._vector(pregunta)
+        ahora = time.monotonic()
+        with self._lock:
+            if clave in self._entradas:
+                self._quitar(clave)
+            # Primero las caducadas, luego las menos usadas
+            if not self._filas_libres:
+                for clave_vieja in [c for c, e in self._entradas.items() if e['expira'] <= ahora]:
+                    self._quitar(clave_vieja)
+            while not self._filas_libres:
+                self._quitar(next(iter(self._entradas)))
+
+            fila = self._filas_libres.pop()
+            expira = ahora + self.ttl_segundos
+            self._matriz[fila] = vector
+            self._grupos[fila] = self._grupo(rol, huella)
+            self._firmas[fila] = firma_critica(pregunta)
+            self._expiraciones[fila] = expira
+            self._claves_fila[fila] = clave
+            self._entradas[clave] = {'respuesta': respuesta, 'fila': fila, 'expira': expira}
+        return True
+
+    def limpiar(self) -> None:
+        with self._lock:
+            for clave in list(self._entradas):
+                self._quitar(clave)
+
+    def estadisticas(self) -> Dict[str, Any]:
+        aciertos = self.aciertos_exactos + self.aciertos_semanticos
+        total = aciertos + self.fallos
+        return {
+            'entradas': len(self._entradas),
+            'capacidad': self.capacidad,
+            'aciertos_exactos': self.aciertos_exactos,
+            'aciertos_semanticos': self.aciertos_semanticos,
+            'fallos': self.fallos,
+            'omitidas_por_contexto': self.omitidas,
+            'tasa_aciertos': round(aciertos / total, 4) if total else 0.0,
+        }
+
+
+# Instancia global de la caché
+cache_respuestas_chat = CacheRespuestasChat(
+    capacidad=settings.CHAT_CACHE_SIZE,
+    ttl_segundos=settings.CHAT_CACHE_TTL_SEGUNDOS,
+    umbral_semantico=settings.CHAT_CACHE_UMBRAL_SEMANTICO
+)
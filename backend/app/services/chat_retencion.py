@@ -0,0 +1,250 @@
+# app/services/chat_retencion.py
+"""
+Retención de sesiones de chat por bloques
+
+Borra las sesiones inactivas (last_seen_at < corte) y sus mensajes en
+bloques acotados por clave primaria, con DELETE por conjuntos:
+
+    DELETE FROM chat_messages WHERE session_id IN (SELECT session_id FROM chat_sessions WHERE id IN (...) AND last_seen_at < :corte)
+    DELETE FROM chat_sessions WHERE id IN (...) AND last_seen_at < :corte
+
+Cada bloque es una transacción corta (commit por bloque) y entre bloques se
+puede pausar para no saturar la BD. El avance (corte + último id) se guarda
+en DATA_DIR/retencion_chat.json (no en uploads/, que se sirve en
+/archivos): si el proceso se interrumpe, la siguiente
+ejecución continúa desde ahí con el mismo corte. Los borrados son
+idempotentes, así que repetir un bloque no tiene efecto.
+
+ProgramadorRetencion lo ejecuta periódicamente en un hilo de fondo.
+"""
+import json
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional
+
+from sqlalchemy import select
+
+from app.core.config import settings
+from app.db.session import SessionLocal
+from app.models.chat import ChatSession, ChatMessage
+
+
+class TrabajoRetencionChat:
+    """Borrado por bloques, con pausa entre bloques y punto de reanudación"""
+
+    def __init__(
+        self,
+        session_factory: Callable = SessionLocal,
+        ruta_avance: Optional[Path] = None,
+        al_borrar: Optional[Callable] = None,
+        ruta_anterior: Optional[Path] = None
+    ):
+        self.session_factory = session_factory
+        self.ruta_avance = Path(ruta_avance) if ruta_avance else settings.DATA_DIR / "retencion_chat.json"
+        # Ubicación de versiones previas: su avance se retoma y se mueve
+        self.ruta_anterior = Path(ruta_anterior) if ruta_anterior else settings.UPLOADS_DIR / "retencion_chat.json"
+        # Recibe los session_id borrados (para limpiar estado en memoria)
+        self.al_borrar = al_borrar
+        self._lock = threading.Lock()
+        self.ultimo_reporte: Optional[Dict[str, Any]] = None
+
+    # --------------------------------------------------------
+    # Punto de reanudación
+    # --------------------------------------------------------
+
+    def _leer_avance(self) -> Optional[Dict[str, Any]]:
+        if not self.ruta_avance.exists() and self.ruta_anterior.exists():
+            try:
+                self.ruta_avance.parent.mkdir(parents=True, exist_ok=True)
+                os.replace(self.ruta_anterior, self.ruta_avance)
+            except OSError as e:
+                print(f"[WARN] No se pudo mover el avance de retención anterior: {e}")
+        try:
+            datos = json.loads(self.ruta_avance.read_text(encoding='utf-8'))
+            return {"corte": datetime.fromisoformat(datos["corte"]), "ultimo_id": int(datos["ultimo_id"])}
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError) as e:
+            print(f"[WARN] Avance de retención ilegible, se empieza de cero: {e}")
+            return None
+
+    def _guardar_avance(self, corte: datetime, ultimo_id: int) -> None:
+        try:
+            self.ruta_avance.parent.mkdir(parents=True, exist_ok=True)
+            temporal = self.ruta_avance.with_suffix(f".{os.getpid()}.tmp")
+            temporal.write_text(json.dumps({"corte": corte.isoformat(), "ultimo_id": ultimo_id}), encoding='utf-8')
+            os.replace(temporal, self.ruta_avance)
+        except OSError as e:
+            print(f"[WARN] No se pudo guardar el avance de retención: {e}")
+
+    def _borrar_avance(self) -> None:
+        try:
+            self.ruta_avance.unlink()
+        except FileNotFoundError:
+            pass
+
+    # --------------------------------------------------------
+    # Ejecución
+    # --------------------------------------------------------
+
+    def _borrar_bloque(self, db, corte: datetime, ultimo_id: int, tamano_bloque: int):
+        """Borra un bloque; devuelve (último id visto, session_ids, mensajes borrados, sesiones borradas)"""
+        filas = (db.query(ChatSession.id, ChatSession.session_id)
+                 .filter(ChatSession.last_seen_at < corte, ChatSession.id > ultimo_id)
+                 .order_by(ChatSession.id)
+                 .limit(tamano_bloque)
+                 .all())
+        if not filas:
+            return None, [], 0, 0
+
+        ids = [fila.id for fila in filas]
+        # Se repite la condición de corte: una sesión reactivada mientras
+        # tanto no se borra
+        expiradas = select(ChatSession.session_id).where(
+            ChatSession.id.in_(ids), ChatSession.last_seen_at < corte
+        )
+        mensajes = db.query(ChatMessage).filter(
+            ChatMessage.session_id.in_(expiradas)
+        ).delete(synchronize_session=False)
+        sesiones = db.query(ChatSession).filter(
+            ChatSession.id.in_(ids), ChatSession.last_seen_at < corte
+        ).delete(synchronize_session=False)
+        db.commit()
+        return ids[-1], [fila.session_id for fila in filas], mensajes, sesiones
+
+    def ejecutar(
+        self,
+        dias: int = 7,
+        tamano_bloque: int = 500,
+        pausa_segundos: float = 0.1,
+        max_bloques: Optional[int] = None,
+        detener: Optional[threading.Event] = None,
+        db=None
+    ) -> Dict[str, Any]:
+        """
+        Borra sesiones inactivas hace más de `dias` días y sus mensajes
+
+        Args:
+            tamano_bloque: sesiones por transacción
+            pausa_segundos: espera entre bloques (throttling)
+            max_bloques: detenerse tras N bloques (se reanuda en la siguiente ejecución)
+            detener: evento para interrumpir entre bloques (apagado)
+            db: sesión a usar (por defecto una propia)
+
+        Returns:
+            Reporte con sesiones/mensajes borrados, bloques, segundos y filas por segundo
+        """
+        if not self._lock.acquire(blocking=False):
+            raise ValueError("La retención de chat ya se está ejecutando")
+        try:
+            avance = self._leer_avance()
+            if avance:
+                corte, ultimo_id = avance["corte"], avance["ultimo_id"]
+                print(f"[ChatRetencion] Reanudando desde id {ultimo_id} (corte {corte.isoformat()})")
+            else:
+                corte, ultimo_id = datetime.utcnow() - timedelta(days=dias), 0
+
+            inicio = time.perf_counter()
+            total_sesiones = total_mensajes = bloques = 0
+            completo = False
+            propia = db is None
+            if propia:
+                db = self.session_factory()
+            try:
+                while max_bloques is None or bloques < max_bloques:
+                    if detener is not None and detener.is_set():
+                        break
+                    siguiente, session_ids, mensajes, sesiones = self._borrar_bloque(
+                        db, corte, ultimo_id, tamano_bloque
+                    )
+                    if siguiente is None:
+                        completo = True
+                        break
+                    ultimo_id = siguiente
+                    bloques += 1
+                    total_mensajes += mensajes
+                    total_sesiones += sesiones
+                    self._guardar_avance(corte, ultimo_id)
+                    if self.al_borrar:
+                        self.al_borrar(session_ids)
+                    if pausa_segundos > 0:
+                        if detener is not None:
+                            detener.wait(pausa_segundos)
+                        else:
+                            time.sleep(pausa_segundos)
+            except Exception:
+                db.rollback()
+                raise
+            finally:
+                if propia:
+                    db.close()
+
+            if completo:
+                self._borrar_avance()
+
+            segundos = time.perf_counter() - inicio
+            filas = total_sesiones + total_mensajes
+            reporte = {
+                "corte": corte.isoformat(),
+                "sesiones_eliminadas": total_sesiones,
+                "mensajes_eliminados": total_mensajes,
+                "bloques": bloques,
+                "completo": completo,
+                "segundos": round(segundos, 3),
+                "filas_por_segundo": round(filas / segundos, 1) if segundos > 0 else 0.0,
+            }
+            self.ultimo_reporte = reporte
+            print(
+                f"[ChatRetencion] {total_sesiones} sesiones y {total_mensajes} mensajes en "
+                f"{bloques} bloques ({reporte['filas_por_segundo']} filas/s)"
+                + ("" if completo else " - pendiente, se reanudará")
+            )
+            return reporte
+        finally:
+            self._lock.release()
+
+
+class ProgramadorRetencion:
+    """Ejecuta la retención cada N horas en un hilo de fondo"""
+
+    def __init__(self, trabajo: TrabajoRetencionChat):
+        self.trabajo = trabajo
+        self._detener = threading.Event()
+        self._hilo: Optional[threading.Thread] = None
+
+    def iniciar(self, intervalo_horas: float, **parametros) -> None:
+        """Primera ejecución tras un intervalo corto; intervalo_horas <= 0 lo desactiva"""
+        if intervalo_horas <= 0 or (self._hilo is not None and self._hilo.is_alive()):
+            return
+        self._detener.clear()
+        self._hilo = threading.Thread(
+            target=self._bucle,
+            args=(intervalo_horas * 3600, parametros),
+            name="chat-retencion",
+            daemon=True
+        )
+        self._hilo.start()
+
+    def _bucle(self, intervalo: float, parametros: Dict[str, Any]) -> None:
+        # No competir con el arranque de la aplicación
+        espera = min(60.0, intervalo)
+        while not self._detener.wait(espera):
+            try:
+                self.trabajo.ejecutar(detener=self._detener, **parametros)
+            except Exception as e:
+                print(f"[WARN] Retención de chat falló: {e}")
+            espera = intervalo
+
+    def detener(self) -> None:
+        self._detener.set()
+        if self._hilo is not None:
+            self._hilo.join(timeout=5)
+            self._hilo = None
+
+
+# Instancias globales
+retencion_chat = TrabajoRetencionChat()
+programador_retencion_chat = ProgramadorRetencion(retencion_chat)
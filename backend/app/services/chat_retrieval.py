@@ -0,0 +1,310 @@
+# app/services/chat_retrieval.py
+"""
+Recuperación de contenido del centro para el chatbot
+
+Las actividades, recursos y terapias de la BD se parten en fragmentos
+cortos (ventanas de palabras con solapamiento, precedidas por el título)
+y se vectorizan en un VectorIndex en memoria. Por cada pregunta se
+recuperan los top-k fragmentos más parecidos (uno por elemento) y
+build_prompt los inyecta como "Recursos del centro relacionados".
+
+- Embeddings locales (LocalHashingBackend): la consulta se vectoriza sin
+  red, así la búsqueda completa cuesta menos de un milisegundo.
+- Refresco incremental: eventos ORM marcan las filas insertadas,
+  editadas o borradas y `sincronizar` solo re-fragmenta esas filas.
+- Cada fragmento tiene un id entero: tipo << 40 | fila_id << 8 | número.
+"""
+import threading
+import time
+from typing import Any, Dict, List, Optional, Sequence, Set, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from app.models.actividad import Actividad
+from app.models.recurso import Recurso
+from app.models.terapia import Terapia
+from app.services.embedding_backends import EmbeddingBackend, LocalHashingBackend
+from app.services.vector_index import VectorIndex
+
+TIPO_ACTIVIDAD = 'actividad'
+TIPO_RECURSO = 'recurso'
+TIPO_TERAPIA = 'terapia'
+
+_CODIGOS = {TIPO_ACTIVIDAD: 1, TIPO_RECURSO: 2, TIPO_TERAPIA: 3}
+_TIPOS = {codigo: tipo for tipo, codigo in _CODIGOS.items()}
+_ETIQUETAS = {TIPO_ACTIVIDAD: "Actividad", TIPO_RECURSO: "Recurso", TIPO_TERAPIA: "Terapia"}
+
+# Fragmentos como máximo por fila (el id reserva 8 bits)
+MAX_FRAGMENTOS_FILA = 255
+
+
+def id_fragmento(tipo: str, fila_id: int, numero: int) -> int:
+    return (_CODIGOS[tipo] << 40) | (int(fila_id) << 8) | numero
+
+
+def fila_de_fragmento(fragmento_id: int) -> Tuple[str, int]:
+    return _TIPOS[fragmento_id >> 40], (fragmento_id >> 8) & ((1 << 32) - 1)
+
+
+def _valor(valor: Any) -> str:
+    if valor is None:
+        return ''
+    if isinstance(valor, (list, tuple)):
+        return ', '.join(str(v) for v in valor)
+    return str(getattr(valor, 'value', valor))
+
+
+def fragmentar(titulo: str, campos: Sequence[Any], palabras: int = 60, solapamiento: int = 15) -> List[str]:
+    """
+    Ventanas de `palabras` palabras con `solapamiento`, cada una con el título
+
+    Returns:
+        Fragmentos de texto (al menos uno: el título)
+    """
+    cuerpo = " ".join(t for t in (_valor(c).strip() for c in campos) if t).split()
+    if not cuerpo:
+        return [titulo]
+    paso = max(1, palabras - solapamiento)
+    fragmentos = []
+    for inicio in range(0, len(cuerpo), paso):
+        fragmentos.append(f"{titulo}: {' '.join(cuerpo[inicio:inicio + palabras])}")
+        if inicio + palabras >= len(cuerpo) or len(fragmentos) == MAX_FRAGMENTOS_FILA:
+            break
+    return fragmentos
+
+
+class _Fragmento:
+    __slots__ = ('tipo', 'fila_id', 'titulo', 'texto')
+
+    def __init__(self, tipo: str, fila_id: int, titulo: str, texto: str):
+        self.tipo = tipo
+        self.fila_id = fila_id
+        self.titulo = titulo
+        self.texto = texto
+
+
+class IndiceCatalogoChat:
+    """Índice de fragmentos del catálogo del centro para el chatbot"""
+
+    def __init__(
+        self,
+        backend: Optional[EmbeddingBackend] = None,
+        palabras_fragmento: int = 60,
+        solapamiento: int = 15
+    ):
+        self.backend = backend or LocalHashingBackend()
+        self.palabras_fragmento = palabras_fragmento
+        self.solapamiento = solapamiento
+        self.indice = VectorIndex("catalogo_chat")
+        self._lock = threading.RLock()
+        self._fragmentos: Dict[int, _Fragmento] = {}
+        # (tipo, fila_id) -> ids de sus fragmentos
+        self._por_fila: Dict[Tuple[str, int], List[int]] = {}
+        self._pendientes: Set[Tuple[str, int]] = set()
+        self.construido = False
+        # Cambia con cada modificación (forma parte de la huella de la caché de respuestas)
+        self.version = 0
+
+        self.busquedas = 0
+        self.segundos_busqueda = 0.0
+        self.filas_sincronizadas = 0
+
+    def __len__(self) -> int:
+        return len(self._fragmentos)
+
+    # --------------------------------------------------------
+    # Lectura de la BD
+    # --------------------------------------------------------
+
+    @staticmethod
+    def _filas(db: Session, tipo: str, ids: Optional[Sequence[int]] = None) -> List[Tuple[int, str, list]]:
+        """(id, título, campos) de las filas indexables de un tipo"""
+        if tipo == TIPO_ACTIVIDAD:
+            consulta = db.query(
+                Actividad.id, Actividad.nombre, Actividad.area_desarrollo, Actividad.descripcion,
+                Actividad.objetivo, Actividad.materiales, Actividad.tags
+            ).filter(Actividad.activo == 1)
+            modelo = Actividad
+        elif tipo == TIPO_RECURSO:
+            consulta = db.query(
+                Recurso.id, Recurso.titulo, Recurso.categoria_recurso, Recurso.nivel_recurso,
+                Recurso.tipo_recurso, Recurso.descripcion, Recurso.objetivo_terapeutico
+            )
+            modelo = Recurso
+        else:
+            consulta = db.query(
+                Terapia.id, Terapia.nombre, Terapia.categoria, Terapia.descripcion, Terapia.objetivo_general
+            ).filter(Terapia.activo == 1)
+            modelo = Terapia
+        if ids is not None:
+            consulta = consulta.filter(modelo.id.in_(ids))
+        return [(fila[0], fila[1] or '', list(fila[2:])) for fila in consulta.all()]
+
+    def _vectorizar(self, tipo: str, filas) -> Tuple[List[int], List[_Fragmento], Any]:
+        ids, fragmentos = [], []
+        for fila_id, titulo, campos in filas:
+            for numero, texto in enumerate(
+                fragmentar(titulo, campos, self.palabras_fragmento, self.solapamiento)
+            ):
+                ids.append(id_fragmento(tipo, fila_id, numero))
+                fragmentos.append(_Fragmento(tipo, fila_id, titulo, texto))
+        vectores = self.backend.embed_lote([f.texto for f in fragmentos]) if fragmentos else []
+        return ids, fragmentos, vectores
+
+    # --------------------------------------------------------
+    # Construcción y refresco incremental
+    # --------------------------------------------------------
+
+    def construir(self, db: Session) -> None:
+        """Fragmenta y vectoriza todo el catálogo (una consulta por tipo)"""
+        with self._lock:
+            self._pendientes.clear()
+        ids, fragmentos, vectores = [], [], []
+        for tipo in _CODIGOS:
+            ids_tipo, fragmentos_tipo, vectores_tipo = self._vectorizar(tipo, self._filas(db, tipo))
+            ids += ids_tipo
+            fragmentos += fragmentos_tipo
+            vectores += list(vectores_tipo)
+
+        self.indice.cargar_vectores(
+            ids=ids,
+            vectores=vectores,
+            areas=[f.tipo for f in fragmentos],
+            dificultades=[None] * len(fragmentos),
+            usar_ivf=False
+        )
+        with self._lock:
+            self._fragmentos = dict(zip(ids, fragmentos))
+            self._por_fila = {}
+            for fragmento_id, fragmento in self._fragmentos.items():
+                self._por_fila.setdefault((fragmento.tipo, fragmento.fila_id), []).append(fragmento_id)
+            self.construido = True
+            self.version += 1
+
+    def marcar(self, tipo: str, fila_id: Optional[int]) -> None:
+        """Marca una fila para re-fragmentar en la próxima sincronización"""
+        if fila_id is not None:
+            with self._lock:
+                self._pendientes.add((tipo, int(fila_id)))
+
+    def sincronizar(self, db: Session) -> int:
+        """
+        Re-fragmenta solo las filas marcadas (o construye si aún no existe)
+
+        Returns:
+            Filas actualizadas
+        """
+        if not self.construido:
+            self.construir(db)
+            return len(self._por_fila)
+        with self._lock:
+            if not self._pendientes:
+                return 0
+            pendientes, self._pendientes = self._pendientes, set()
+
+        por_tipo: Dict[str, List[int]] = {}
+        for tipo, fila_id in pendientes:
+            por_tipo.setdefault(tipo, []).append(fila_id)
+
+        with self._lock:
+            for tipo, filas_ids in por_tipo.items():
+                for fila_id in filas_ids:
+                    for fragmento_id in self._por_fila.pop((tipo, fila_id), []):
+                        self.indice.eliminar(fragmento_id)
+                        self._fragmentos.pop(fragmento_id, None)
+                # Filas borradas o desactivadas no vuelven
+                ids, fragmentos, vectores = self._vectorizar(tipo, self._filas(db, tipo, filas_ids))
+                for fragmento_id, fragmento, vector in zip(ids, fragmentos, vectores):
+                    self.indice.agregar(fragmento_id, vector, area=tipo)
+                    self._fragmentos[fragmento_id] = fragmento
+                    self._por_fila.setdefault((tipo, fragmento.fila_id), []).append(fragmento_id)
+            self.version += 1
+            self.filas_sincronizadas += len(pendientes)
+        return len(pendientes)
+
+    # --------------------------------------------------------
+    # Búsqueda
+    # --------------------------------------------------------
+
+    def buscar(
+        self,
+        pregunta: str,
+        top_k: int = 3,
+        score_minimo: float = 0.0,
+        tipo: Optional[str] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Fragmentos más parecidos a la pregunta, a lo sumo uno por elemento
+
+        Returns:
+            [{"tipo", "id", "titulo", "texto", "score"}] de mayor a menor score
+        """
+        if not self._fragmentos or top_k <= 0:
+            return []
+        inicio = time.perf_counter()
+        vector = self.backend.embed_lote([pregunta])[0]
+        candidatos = self.indice.buscar(vector, top_k=top_k * 3, area=tipo)
+
+        resultados, vistos = [], set()
+        for fragmento_id, score in candidatos:
+            fragmento = self._fragmentos.get(fragmento_id)
+            if fragmento is None or score < score_minimo:
+                continue
+            clave = (fragmento.tipo, fragmento.fila_id)
+            if clave in vistos:
+                continue
+            vistos.add(clave)
+            resultados.append({
+                "tipo": fragmento.tipo,
+                "id": fragmento.fila_id,
+                "titulo": fragmento.titulo,
+                "texto": fragmento.texto,
+                "score": round(score, 4),
+            })
+            if len(resultados) == top_k:
+                break
+
+        self.busquedas += 1
+        self.segundos_busqueda += time.perf_counter() - inicio
+        return resultados
+
+    def estadisticas(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'construido': self.construido,
+                'fragmentos': len(self._fragmentos),
+                'elementos': len(self._por_fila),
+                'pendientes': len(self._pendientes),
+                'filas_sincronizadas': self.filas_sincronizadas,
+                'busquedas': self.busquedas,
+                'busqueda_promedio_ms': round(self.segundos_busqueda * 1000 / self.busquedas, 3) if self.busquedas else 0.0,
+            }
+
+
+def formatear_fragmentos(fragmentos: Sequence[Dict[str, Any]], tokens_fragmento: int = 60) -> str:
+    """Bloque compacto de fragmentos para el prompt"""
+    limite = tokens_fragmento * 4
+    lineas = []
+    for f in fragmentos:
+        texto = f["texto"]
+        if len(texto) > limite:
+            texto = texto[:limite].rsplit(' ', 1)[0] + "…"
+        lineas.append(f"- [{_ETIQUETAS[f['tipo']]}] {texto}")
+    return "\n".join(lineas)
+
+
+# Instancia global
+indice_catalogo_chat = IndiceCatalogoChat()
+
+
+def _escuchar(modelo, tipo: str) -> None:
+    def marcar(_mapper, _conexion, objetivo):
+        indice_catalogo_chat.marcar(tipo, objetivo.id)
+    for _evento in ('after_insert', 'after_update', 'after_delete'):
+        event.listen(modelo, _evento, marcar)
+
+
+_escuchar(Actividad, TIPO_ACTIVIDAD)
+_escuchar(Recurso, TIPO_RECURSO)
+_escuchar(Terapia, TIPO_TERAPIA)
@@ -1,9 +1,16 @@
 """
 Lógica de chat - Construcción de prompts y consulta a Gemini
 """
-from typing import Dict, Optional, List
+import asyncio
+import threading
+from typing import AsyncIterator, Dict, Iterator, Optional, List
 from app.services.gemini_service import gemini_chat_service
+from app.services.gemini_chat_service import respuesta_fallback
 from app.services.safety import medical_disclaimer
+from app.services.chat_response_cache import cache_respuestas_chat, huella_contexto
+from app.services.chat_prompt_budget import estimar_tokens, presupuesto_prompt
+from app.services.chat_retrieval import formatear_fragmentos, indice_catalogo_chat
+from app.core.config import settings
 
 SYSTEM_RULES = """
 Eres un asistente especializado en autismo (TEA) y terapias infantiles.
@@ -30,56 +37,218 @@ Eres un asistente especializado en autismo (TEA) y terapias infantiles.
 **Tono:** Español neutro, profesional pero amable. Evita jerga técnica innecesaria.
 """
 
-def build_prompt(mensaje: str, contexto: Optional[Dict], historial: Optional[List[Dict]]) -> str:
+def build_prompt(
+    mensaje: str,
+    contexto: Optional[Dict],
+    historial: Optional[List[Dict]],
+    rol_usuario: Optional[str] = None,
+    session_id: Optional[str] = None
+) -> str:
     """
     Construye el prompt para Gemini incluyendo contexto e historial
+
+    Incluye los fragmentos del catálogo del centro más parecidos a la
+    pregunta (actividades, recursos y terapias) para que la respuesta
+    remita a lo que el centro ofrece.
+
+    El prompt no pasa de CHAT_PROMPT_TOKENS_MAX tokens (estimados): del
+    historial entran los turnos más recientes que quepan y, si la sesión
+    ya tiene un resumen acumulado de los anteriores, va en su lugar.
+    El desglose de tokens queda en las métricas de presupuesto_prompt.
     """
-    prompt = SYSTEM_RULES.strip() + "\n\n"
+    cabecera = SYSTEM_RULES.strip() + "\n\n"
+    if rol_usuario:
+        cabecera += f"**Quien pregunta es:** {rol_usuario}\n\n"
 
-    # Agregar contexto del niño si existe
+    # Contexto del niño si existe
+    bloque_contexto = ""
     if contexto:
-        prompt += "**Contexto del niño (si aplica):**\n"
-        prompt += f"- Nombre: {contexto.get('nombre','N/A')}\n"
-        prompt += f"- Edad: {contexto.get('edad','N/A')}\n"
-        prompt += f"- Diagnóstico: {contexto.get('diagnostico','N/A')}\n"
-        prompt += f"- Nivel de TEA: {contexto.get('nivel_autismo','N/A')}\n\n"
-
-    # Agregar historial si existe
-    if historial and len(historial) > 0:
-        prompt += "**Historial reciente de la conversación:**\n"
-        for h in historial:
+        bloque_contexto += "**Contexto del niño (si aplica):**\n"
+        bloque_contexto += f"- Nombre: {contexto.get('nombre','N/A')}\n"
+        bloque_contexto += f"- Edad: {contexto.get('edad','N/A')}\n"
+        bloque_contexto += f"- Diagnóstico: {contexto.get('diagnostico','N/A')}\n"
+        bloque_contexto += f"- Nivel de TEA: {contexto.get('nivel_autismo','N/A')}\n\n"
+
+    # Contenido del centro relacionado con la pregunta
+    bloque_catalogo = ""
+    fragmentos = indice_catalogo_chat.buscar(
+        mensaje,
+        top_k=settings.CHAT_CATALOGO_TOP_K,
+        score_minimo=settings.CHAT_CATALOGO_SCORE_MINIMO
+    )
+    if fragmentos:
+        bloque_catalogo = "**Recursos del centro relacionados:**\n"
+        bloque_catalogo += formatear_fragmentos(fragmentos, settings.CHAT_CATALOGO_TOKENS_FRAGMENTO)
+        bloque_catalogo += "\n\n"
+
+    # Pregunta actual e instrucciones finales
+    pregunta = f"**Pregunta actual:**\n👤 Usuario: {mensaje}\n\n"
+    cierre = "Responde con recomendaciones prácticas y seguras. Máximo 300 palabras.\n"
+    if fragmentos:
+        cierre += "Si alguno de los recursos del centro aplica, recomiéndalo por su nombre.\n"
+    cierre += medical_disclaimer()
+
+    # Historial recortado al presupuesto restante
+    historial = historial or []
+    resumen, recientes = presupuesto_prompt.recortar(
+        session_id,
+        historial,
+        presupuesto_prompt.disponible(cabecera, bloque_contexto, bloque_catalogo, pregunta, cierre),
+        ventana=settings.CHAT_PROMPT_HISTORIAL_MENSAJES
+    )
+    bloque_resumen = ""
+    if resumen:
+        bloque_resumen = f"**Resumen de la conversación anterior:**\n{resumen}\n\n"
+    bloque_historial = ""
+    if recientes:
+        bloque_historial = "**Historial reciente de la conversación:**\n"
+        for h in recientes:
             rol_label = "👤 Usuario" if h['role'] == 'usuario' else "🤖 Asistente"
-            prompt += f"{rol_label}: {h['text']}\n"
-        prompt += "\n"
+            bloque_historial += f"{rol_label}: {h['text']}\n"
+        bloque_historial += "\n"
 
-    # Agregar pregunta actual
-    prompt += f"**Pregunta actual:**\n👤 Usuario: {mensaje}\n\n"
-    
-    # Instrucciones finales
-    prompt += "Responde con recomendaciones prácticas y seguras. Máximo 300 palabras.\n"
-    prompt += medical_disclaimer()
-    
-    return prompt
+    presupuesto_prompt.registrar({
+        "sistema": estimar_tokens(cabecera) + estimar_tokens(cierre),
+        "contexto": estimar_tokens(bloque_contexto),
+        "catalogo": estimar_tokens(bloque_catalogo),
+        "resumen": estimar_tokens(bloque_resumen),
+        "historial": estimar_tokens(bloque_historial),
+        "pregunta": estimar_tokens(pregunta),
+        "total": estimar_tokens(
+            cabecera + bloque_contexto + bloque_catalogo + bloque_resumen + bloque_historial + pregunta + cierre
+        ),
+        "turnos_incluidos": len(recientes),
+        "turnos_omitidos": len(historial) - len(recientes),
+    })
+    return cabecera + bloque_contexto + bloque_catalogo + bloque_resumen + bloque_historial + pregunta + cierre
+
+def huella_prompt() -> str:
+    """Huella de las reglas, el modelo y el catálogo: si cambian, la caché deja de coincidir"""
+    return huella_contexto(
+        SYSTEM_RULES,
+        medical_disclaimer(),
+        getattr(gemini_chat_service, "model_id", None),
+        indice_catalogo_chat.version
+    )
 
 def ask_gemini(
     mensaje: str, 
     contexto: Optional[Dict], 
     historial: Optional[List[Dict]],
-    rol_usuario: str = "padre"
+    rol_usuario: str = "padre",
+    session_id: Optional[str] = None
 ) -> str:
     """
     Consulta a Gemini usando Gemini 2.0 Flash (cliente google-genai)
+
+    Las preguntas sin contexto del niño pasan antes por la caché de
+    respuestas (exacta y semántica). Solo se consultan y guardan las
+    respuestas del primer turno (sin historial), que no dependen de la
+    conversación, y nunca la respuesta de respaldo (circuito de Gemini
+    abierto).
     
     Args:
         mensaje: Pregunta del usuario
         contexto: Contexto del niño
         historial: Historial de conversación
         rol_usuario: "padre", "terapeuta" o "educador"
+        session_id: Sesión del chat (dueña del resumen acumulado)
     """
+    huella = huella_prompt()
+    if not historial:
+        respuesta, _nivel = cache_respuestas_chat.obtener(mensaje, rol_usuario, huella, contexto)
+        if respuesta is not None:
+            return respuesta
+
     result = gemini_chat_service.chat(
         mensaje,
         contexto_nino=contexto,
-        rol_usuario=rol_usuario
+        rol_usuario=rol_usuario,
+        prompt=build_prompt(mensaje, contexto, historial, rol_usuario, session_id)
     )
     # El servicio retorna un dict, extraemos la respuesta
-    return result.get("respuesta", "No se pudo generar una respuesta.")
+    respuesta = result.get("respuesta")
+    if not respuesta:
+        return "No se pudo generar una respuesta."
+
+    if not historial and not result.get("fallback"):
+        cache_respuestas_chat.guardar(mensaje, rol_usuario, huella, respuesta, contexto)
+    return respuesta
+
+def ask_gemini_stream(
+    mensaje: str,
+    contexto: Optional[Dict],
+    historial: Optional[List[Dict]],
+    rol_usuario: str = "padre",
+    session_id: Optional[str] = None
+) -> Iterator[str]:
+    """
+    Versión en streaming de ask_gemini: entrega la respuesta por fragmentos
+
+    Un acierto de caché (solo en el primer turno) se entrega en un solo
+    fragmento. La respuesta se guarda en caché solo si el stream terminó
+    completo.
+    """
+    huella = huella_prompt()
+    if not historial:
+        respuesta, _nivel = cache_respuestas_chat.obtener(mensaje, rol_usuario, huella, contexto)
+        if respuesta is not None:
+            yield respuesta
+            return
+
+    partes: List[str] = []
+    for trozo in gemini_chat_service.chat_stream(
+        build_prompt(mensaje, contexto, historial, rol_usuario, session_id)
+    ):
+        partes.append(trozo)
+        yield trozo
+
+    respuesta = "".join(partes)
+    if respuesta and not historial and respuesta != respuesta_fallback(mensaje):
+        cache_respuestas_chat.guardar(mensaje, rol_usuario, huella, respuesta, contexto)
+
+async def iterar_en_hilo(fuente: Iterator[str], cancelado: threading.Event) -> AsyncIterator[str]:
+    """
+    Consume un iterador bloqueante en un hilo y entrega sus elementos al
+    event loop conforme llegan
+
+    Si el consumidor deja de iterar (cliente desconectado) o se activa
+    `cancelado`, el hilo cierra la fuente en el siguiente fragmento y
+    libera el worker; no se siguen leyendo tokens de Gemini.
+    """
+    loop = asyncio.get_running_loop()
+    cola: asyncio.Queue = asyncio.Queue()
+    fin = object()
+
+    def publicar(item) -> None:
+        try:
+            loop.call_soon_threadsafe(cola.put_nowait, item)
+        except RuntimeError:
+            # El event loop ya se cerró
+            cancelado.set()
+
+    def producir() -> None:
+        try:
+            for trozo in fuente:
+                if cancelado.is_set():
+                    break
+                publicar(trozo)
+        except Exception as e:
+            publicar(e)
+        finally:
+            cerrar = getattr(fuente, "close", None)
+            if cerrar:
+                cerrar()
+            publicar(fin)
+
+    loop.run_in_executor(None, producir)
+    try:
+        while True:
+            item = await cola.get()
+            if item is fin:
+                break
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        cancelado.set()
@@ -1,14 +1,146 @@
 """
 Almacenamiento de sesiones de chat y historial en BD
+
+El historial reciente de cada sesión se mantiene en un buffer circular en
+memoria (write-through): append escribe en BD y en el buffer, y history
+se sirve del buffer sin tocar la BD. Solo la primera lectura de una sesión
+(o tras expirar el buffer) consulta los últimos N mensajes con un ORDER BY
+descendente + LIMIT sobre el índice (session_id, created_at).
+
+El buffer es por proceso; con varios workers una sesión puede recibir
+mensajes de otro proceso, por eso cada buffer caduca a los
+CHAT_HISTORIAL_TTL_SEGUNDOS y se vuelve a hidratar desde BD.
+
+last_seen_at se actualiza como mucho una vez cada
+CHAT_LAST_SEEN_INTERVALO_SEGUNDOS por sesión, con un UPDATE directo.
+
+Los mensajes se insertan de forma diferida y por lotes
+(app.services.chat_write_behind); ver CHAT_PERSISTENCIA.
 """
 import os
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Deque, Dict, List, Optional
+
 from sqlalchemy.orm import Session
+from app.core.config import settings
 from app.models.chat import ChatSession, ChatMessage
-from datetime import datetime, timedelta
+from app.services.chat_write_behind import EscritorMensajes, escritor_mensajes
+from app.services.chat_retencion import TrabajoRetencionChat, retencion_chat
+from app.services.chat_prompt_budget import presupuesto_prompt
+from datetime import datetime
+
+
+class _BufferSesion:
+    """Últimos mensajes de una sesión"""
+
+    __slots__ = ('mensajes', 'hidratado_en')
+
+    def __init__(self, capacidad: int, mensajes: Optional[List[Dict[str, str]]] = None):
+        self.mensajes: Deque[Dict[str, str]] = deque(mensajes or (), maxlen=capacidad)
+        self.hidratado_en = time.monotonic()
+
+
+class HistorialReciente:
+    """Buffers circulares por sesión, con LRU sobre las sesiones y TTL"""
+
+    def __init__(self, capacidad: int = 32, max_sesiones: int = 2000, ttl_segundos: float = 300):
+        self.capacidad = capacidad
+        self.max_sesiones = max_sesiones
+        self.ttl_segundos = ttl_segundos
+        self._lock = threading.Lock()
+        self._sesiones: "OrderedDict[str, _BufferSesion]" = OrderedDict()
+        self.aciertos = 0
+        self.fallos = 0
+
+    def obtener(self, session_id: str, limit: int) -> Optional[List[Dict[str, str]]]:
+        """Últimos `limit` mensajes, o None si hay que ir a BD"""
+        if limit > self.capacidad:
+            return None
+        with self._lock:
+            buffer = self._sesiones.get(session_id)
+            if buffer is None or time.monotonic() - buffer.hidratado_en > self.ttl_segundos:
+                self.fallos += 1
+                return None
+            self._sesiones.move_to_end(session_id)
+            self.aciertos += 1
+            mensajes = list(buffer.mensajes)
+        return mensajes[-limit:] if limit > 0 else []
+
+    def hidratar(self, session_id: str, mensajes: List[Dict[str, str]]) -> None:
+        """Reemplaza el buffer con mensajes leídos de BD (orden cronológico)"""
+        with self._lock:
+            self._sesiones[session_id] = _BufferSesion(self.capacidad, mensajes)
+            self._sesiones.move_to_end(session_id)
+            while len(self._sesiones) > self.max_sesiones:
+                self._sesiones.popitem(last=False)
+
+    def agregar(self, session_id: str, role: str, text: str) -> None:
+        """Write-through: solo si la sesión ya está en memoria"""
+        with self._lock:
+            buffer = self._sesiones.get(session_id)
+            if buffer is not None:
+                buffer.mensajes.append({"role": role, "text": text})
+
+    def descartar(self, session_ids) -> None:
+        with self._lock:
+            for session_id in session_ids:
+                self._sesiones.pop(session_id, None)
+
+    def estadisticas(self) -> Dict[str, int]:
+        return {
+            'sesiones': len(self._sesiones),
+            'capacidad_por_sesion': self.capacidad,
+            'aciertos': self.aciertos,
+            'fallos': self.fallos,
+        }
+
 
 class ChatStore:
     """Almacena y recupera sesiones y mensajes de chat desde BD"""
-    
+
+    def __init__(
+        self,
+        capacidad_historial: int = 32,
+        max_sesiones: int = 2000,
+        ttl_historial: float = 300,
+        intervalo_last_seen: float = 60,
+        escritor: Optional[EscritorMensajes] = None,
+        retencion: Optional[TrabajoRetencionChat] = None
+    ):
+        self.recientes = HistorialReciente(capacidad_historial, max_sesiones, ttl_historial)
+        # None = cada append hace su propio commit
+        self.escritor = escritor
+        self.retencion = retencion or TrabajoRetencionChat()
+        self.retencion.al_borrar = self.olvidar
+        self.intervalo_last_seen = intervalo_last_seen
+        # session_id -> momento (monotónico) del último last_seen_at escrito
+        self._ultimo_visto: "OrderedDict[str, float]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _marcar_visto(self, session_id: str) -> bool:
+        """True si toca escribir last_seen_at (y lo registra)"""
+        ahora = time.monotonic()
+        with self._lock:
+            ultimo = self._ultimo_visto.get(session_id)
+            if ultimo is not None and ahora - ultimo < self.intervalo_last_seen:
+                return False
+            self._ultimo_visto[session_id] = ahora
+            self._ultimo_visto.move_to_end(session_id)
+            while len(self._ultimo_visto) > self.recientes.max_sesiones:
+                self._ultimo_visto.popitem(last=False)
+            return True
+
+    def _conocida(self, session_id: str) -> bool:
+        """
+        La sesión se creó o recibió mensajes en este proceso hace poco
+        (la limpieza solo borra sesiones inactivas durante días)
+        """
+        with self._lock:
+            ultimo = self._ultimo_visto.get(session_id)
+        return ultimo is not None and time.monotonic() - ultimo < self.recientes.ttl_segundos
+
     def new_session(self, db: Session, nino_id: int | None = None) -> str:
         """
         Crea una nueva sesión de chat
@@ -21,6 +153,9 @@ class ChatStore:
         except Exception:
             db.rollback()
             raise
+        # Sesión nueva: su historial está vacío, no hace falta leerlo de BD
+        self.recientes.hidratar(sid, [])
+        self._marcar_visto(sid)
         print(f"[ChatStore] Nueva sesión: {sid}")
         return sid
 
@@ -28,16 +163,21 @@ class ChatStore:
         """
         Asegura que la sesión existe; si no, la crea
         """
-        s = db.query(ChatSession).filter(ChatSession.session_id == session_id).first()
+        if self._conocida(session_id):
+            return session_id
+
+        s = db.query(ChatSession.id).filter(ChatSession.session_id == session_id).first()
         if s:
             return session_id
-        
+
         try:
             db.add(ChatSession(session_id=session_id, nino_id=nino_id))
             db.commit()
         except Exception:
             db.rollback()
             raise
+        self.recientes.hidratar(session_id, [])
+        self._marcar_visto(session_id)
         print(f"[ChatStore] Sesión creada (ensure): {session_id}")
         return session_id
 
@@ -48,55 +188,79 @@ class ChatStore:
         if role not in ("usuario", "asistente"):
             raise ValueError("Rol inválido en chat: debe ser 'usuario' o 'asistente'")
 
+        if self.escritor is not None:
+            # Escritura diferida: el lote incluye el UPDATE de last_seen_at
+            self.escritor.encolar(session_id, role, content, tocar_sesion=self._marcar_visto(session_id))
+            self.recientes.agregar(session_id, role, content)
+            return
+
         try:
-            msg = ChatMessage(session_id=session_id, role=role, content=content)
-            db.add(msg)
-            
-            # Actualizar last_seen_at
-            session = db.query(ChatSession).filter(ChatSession.session_id == session_id).first()
-            if session:
-                session.last_seen_at = datetime.utcnow()
-            
+            db.add(ChatMessage(session_id=session_id, role=role, content=content))
+
+            # Actualizar last_seen_at (agrupado: como mucho una vez por intervalo)
+            if self._marcar_visto(session_id):
+                db.query(ChatSession).filter(ChatSession.session_id == session_id).update(
+                    {ChatSession.last_seen_at: datetime.utcnow()}, synchronize_session=False
+                )
+
             db.commit()
         except Exception:
             db.rollback()
+            with self._lock:
+                self._ultimo_visto.pop(session_id, None)
             raise
+        self.recientes.agregar(session_id, role, content)
+
+    def _leer_ultimos(self, db: Session, session_id: str, limit: int) -> List[Dict[str, str]]:
+        """Últimos `limit` mensajes desde BD en orden cronológico"""
+        rows = (db.query(ChatMessage.role, ChatMessage.content)
+                .filter(ChatMessage.session_id == session_id)
+                .order_by(ChatMessage.created_at.desc(), ChatMessage.id.desc())
+                .limit(limit)
+                .all())
+        return [{"role": role, "text": content} for role, content in reversed(rows)]
 
     def history(self, db: Session, session_id: str, limit: int = 8):
         """
         Recupera historial de una sesión (últimos N mensajes)
         """
-        rows = (db.query(ChatMessage)
-                .filter(ChatMessage.session_id == session_id)
-                .order_by(ChatMessage.created_at.asc())
-                .all())
-        
-        # Retorna los últimos 'limit' mensajes
-        rows = rows[-limit:] if rows else []
-        return [{"role": r.role, "text": r.content} for r in rows]
-    
-    def cleanup_old_sessions(self, db: Session, days: int = 7):
+        mensajes = self.recientes.obtener(session_id, limit)
+        if mensajes is not None:
+            return mensajes
+
+        # Leer lo propio: los mensajes aún en cola deben estar en BD antes de leer
+        if self.escritor is not None and self.escritor.pendientes(session_id):
+            self.escritor.vaciar()
+
+        if limit > self.recientes.capacidad:
+            return self._leer_ultimos(db, session_id, limit)
+
+        # Hidratar el buffer completo para que las siguientes lecturas no usen SQL
+        mensajes = self._leer_ultimos(db, session_id, self.recientes.capacidad)
+        self.recientes.hidratar(session_id, mensajes)
+        return mensajes[-limit:] if limit > 0 else []
+
+    def olvidar(self, session_ids: List[str]) -> None:
+        """Descarta el estado en memoria de sesiones eliminadas"""
+        self.recientes.descartar(session_ids)
+        presupuesto_prompt.olvidar(session_ids)
+        with self._lock:
+            for session_id in session_ids:
+                self._ultimo_visto.pop(session_id, None)
+
+    def cleanup_old_sessions(self, db: Session, days: int = 7, **parametros):
         """
         Limpia sesiones inactivas más viejas que N días
+        (por bloques, ver app.services.chat_retencion)
         """
-        cutoff = datetime.utcnow() - timedelta(days=days)
-        old_sessions = db.query(ChatSession).filter(
-            ChatSession.last_seen_at < cutoff
-        ).all()
-        
-        try:
-            for session in old_sessions:
-                # Eliminar mensajes asociados
-                db.query(ChatMessage).filter(
-                    ChatMessage.session_id == session.session_id
-                ).delete()
-                db.delete(session)
-            
-            db.commit()
-        except Exception:
-            db.rollback()
-            raise
-        print(f"[ChatStore] Limpieza: eliminadas {len(old_sessions)} sesiones antiguas")
+        return self.retencion.ejecutar(dias=days, db=db, **parametros)
 
 # Instancia global
-chat_store = ChatStore()
+chat_store = ChatStore(
+    capacidad_historial=settings.CHAT_HISTORIAL_BUFFER,
+    max_sesiones=settings.CHAT_HISTORIAL_SESIONES,
+    ttl_historial=settings.CHAT_HISTORIAL_TTL_SEGUNDOS,
+    intervalo_last_seen=settings.CHAT_LAST_SEEN_INTERVALO_SEGUNDOS,
+    escritor=escritor_mensajes,
+    retencion=retencion_chat
+)
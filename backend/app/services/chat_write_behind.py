@@ -0,0 +1,326 @@
+# app/services/chat_write_behind.py
+"""
+Escritura diferida (write-behind) de mensajes del chat
+
+ChatStore.append encola el mensaje y regresa; un hilo de fondo inserta los
+pendientes en lotes (bulk insert + un solo UPDATE de last_seen_at para las
+sesiones tocadas) cuando se juntan CHAT_ESCRITURA_LOTE mensajes o pasan
+CHAT_ESCRITURA_INTERVALO_MS desde el primero pendiente.
+
+Modos (CHAT_PERSISTENCIA):
+- 'diferida': lo anterior
+- 'sincrona': cada append vacía la cola antes de regresar (durable al
+  responder, pero sigue agrupando lo que haya pendiente). Si el lote falla
+  se reintenta en línea hasta que la fila se escribe o se descarta; la
+  excepción solo sale con la fila fuera de la cola (reintentar no duplica)
+
+Fallos al escribir:
+- De conexión u operativos (BD caída, pool agotado, deadlock): el lote
+  vuelve a la cola y el hilo espera con backoff exponencial (hasta
+  MAX_ESPERA_REINTENTO) sin descartar nada. Con la cola en max_pendientes
+  mientras la BD no responde, encolar rechaza los mensajes nuevos con
+  ColaLlena en lugar de tirar los que ya esperan.
+- Cualquier otro (integridad, datos): tras MAX_INTENTOS_LOTE intentos el
+  lote se inserta fila por fila y solo se descartan las filas que fallan.
+
+created_at se fija al encolar, así el orden del historial no depende de
+cuándo se insertó el lote. Al apagar la aplicación se vacía la cola.
+"""
+import threading
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+from sqlalchemy.exc import (
+    DBAPIError,
+    DisconnectionError,
+    InterfaceError,
+    OperationalError,
+    TimeoutError as TimeoutPool,
+)
+
+from app.core.config import settings
+from app.db.session import SessionLocal
+from app.models.chat import ChatSession, ChatMessage
+
+MODO_DIFERIDO = 'diferida'
+MODO_SINCRONO = 'sincrona'
+
+# Intentos de un lote antes de insertarlo fila por fila
+MAX_INTENTOS_LOTE = 3
+
+# Tope del backoff mientras la BD no responde (segundos)
+MAX_ESPERA_REINTENTO = 30.0
+
+
+class ColaLlena(RuntimeError):
+    """La cola llegó a max_pendientes y la BD sigue sin responder"""
+
+
+def es_error_de_conexion(error: Exception) -> bool:
+    """Fallo de la BD y no de las filas: se reintenta el lote completo más tarde"""
+    if isinstance(error, (OperationalError, InterfaceError, DisconnectionError, TimeoutPool)):
+        return True
+    return isinstance(error, DBAPIError) and error.connection_invalidated
+
+
+class EscritorMensajes:
+    """Cola de mensajes pendientes con vaciado por tamaño o por tiempo"""
+
+    def __init__(
+        self,
+        modo: str = MODO_DIFERIDO,
+        tamano_lote: int = 200,
+        intervalo_segundos: float = 0.25,
+        max_pendientes: int = 5000,
+        session_factory: Callable = SessionLocal
+    ):
+        if modo not in (MODO_DIFERIDO, MODO_SINCRONO):
+            raise ValueError(f"Modo de persistencia de chat desconocido: {modo}")
+        self.modo = modo
+        self.tamano_lote = tamano_lote
+        self.intervalo_segundos = intervalo_segundos
+        self.max_pendientes = max_pendientes
+        self.session_factory = session_factory
+
+        self._cond = threading.Condition()
+        self._vaciado = threading.Lock()
+        self._pendientes: List[Dict[str, Any]] = []
+        self._sesiones_tocadas: Set[str] = set()
+        self._primero_en: Optional[float] = None
+        self._intentos = 0
+        # Backoff mientras la BD no responde
+        self._fallos_conexion = 0
+        self._reintentar_en: Optional[float] = None
+        self._hilo: Optional[threading.Thread] = None
+        self._detener = False
+
+        self.mensajes_escritos = 0
+        self.lotes_escritos = 0
+        self.mensajes_descartados = 0
+        self.mensajes_rechazados = 0
+
+    # --------------------------------------------------------
+    # Encolado
+    # --------------------------------------------------------
+
+    def _arrancar(self) -> None:
+        if self._hilo is None or not self._hilo.is_alive():
+            self._detener = False
+            self._hilo = threading.Thread(target=self._bucle, name="chat-write-behind", daemon=True)
+            self._hilo.start()
+
+    def encolar(self, session_id: str, role: str, content: str, tocar_sesion: bool = True) -> None:
+        """
+        Agrega un mensaje a la cola
+
+        Args:
+            tocar_sesion: actualizar chat_sessions.last_seen_at en el vaciado
+        """
+        fila = {
+            "session_id": session_id,
+            "role": role,
+            "content": content,
+            "created_at": datetime.utcnow(),
+        }
+        with self._cond:
+            if (
+                self.modo == MODO_DIFERIDO
+                and len(self._pendientes) >= self.max_pendientes
+                and self._en_espera()
+            ):
+                self.mensajes_rechazados += 1
+                raise ColaLlena("Cola de mensajes de chat llena: la base de datos no responde")
+            self._pendientes.append(fila)
+            if tocar_sesion:
+                self._sesiones_tocadas.add(session_id)
+            # El primero pendiente arranca el plazo del hilo (que puede estar
+            # esperando sin límite) y un lote lleno lo despierta antes
+            primero = self._primero_en is None
+            if primero:
+                self._primero_en = time.monotonic()
+            lleno = len(self._pendientes) >= self.tamano_lote
+            saturado = len(self._pendientes) >= self.max_pendientes
+            if primero or lleno:
+                self._cond.notify()
+
+        if self.modo == MODO_SINCRONO:
+            # Tras MAX_INTENTOS_LOTE vaciados el lote se inserta fila por
+            # fila: la nuestra queda escrita o descartada
+            for _ in range(MAX_INTENTOS_LOTE):
+                self.vaciar()
+                with self._cond:
+                    sigue_pendiente = any(f is fila for f in self._pendientes)
+                if not sigue_pendiente:
+                    break
+            else:
+                with self._cond:
+                    self._pendientes = [f for f in self._pendientes if f is not fila]
+                raise RuntimeError("No se pudo guardar el mensaje de chat")
+            if fila.get("descartado"):
+                raise RuntimeError("No se pudo guardar el mensaje de chat")
+        elif saturado:
+            # Contrapresión: el hilo no da abasto, escribe quien encola
+            self.vaciar()
+        else:
+            self._arrancar()
+
+    def _en_espera(self) -> bool:
+        """Hay un backoff de conexión en curso (llamar con _cond tomado)"""
+        return self._reintentar_en is not None and time.monotonic() < self._reintentar_en
+
+    def pendientes(self, session_id: Optional[str] = None) -> int:
+        with self._cond:
+            if session_id is None:
+                return len(self._pendientes)
+            return sum(1 for fila in self._pendientes if fila["session_id"] == session_id)
+
+    # --------------------------------------------------------
+    # Vaciado
+    # --------------------------------------------------------
+
+    def _bucle(self) -> None:
+        while True:
+            with self._cond:
+                while not self._detener:
+                    if self._en_espera():
+                        self._cond.wait(self._reintentar_en - time.monotonic())
+                    elif self._primero_en is not None:
+                        espera = self._primero_en + self.intervalo_segundos - time.monotonic()
+                        if len(self._pendientes) >= self.tamano_lote or espera <= 0:
+                            break
+                        self._cond.wait(espera)
+                    else:
+                        self._cond.wait()
+                if self._detener:
+                    return
+            self.vaciar()
+
+    def vaciar(self) -> int:
+        """Inserta todo lo pendiente (en lotes de tamano_lote); devuelve filas escritas"""
+        escritas = 0
+        with self._vaciado:
+            while True:
+                with self._cond:
+                    if not self._pendientes:
+                        self._primero_en = None
+                        return escritas
+                    lote = self._pendientes[:self.tamano_lote]
+                    del self._pendientes[:self.tamano_lote]
+                    sesiones = {fila["session_id"] for fila in lote} & self._sesiones_tocadas
+                    self._sesiones_tocadas -= sesiones
+                    self._primero_en = time.monotonic() if self._pendientes else None
+
+                try:
+                    self._insertar(lote, sesiones)
+                    self._intentos = 0
+                    self._conexion_recuperada()
+                    escritas += len(lote)
+                except Exception as e:
+                    if es_error_de_conexion(e):
+                        self._devolver(lote, sesiones)
+                        self._esperar_conexion(e, len(lote))
+                        return escritas
+                    self._intentos += 1
+                    print(f"[WARN] Error escribiendo lote de chat ({len(lote)} mensajes, intento {self._intentos}): {e}")
+                    if self._intentos < MAX_INTENTOS_LOTE:
+                        self._devolver(lote, sesiones)
+                        return escritas
+                    self._intentos = 0
+                    individuales, completo = self._insertar_individual(lote, sesiones)
+                    escritas += individuales
+                    if not completo:
+                        return escritas
+
+    def _devolver(self, lote: List[Dict[str, Any]], sesiones: Set[str]) -> None:
+        """Regresa el lote al frente de la cola para el siguiente vaciado"""
+        with self._cond:
+            self._pendientes[:0] = lote
+            self._sesiones_tocadas |= sesiones
+            self._primero_en = time.monotonic()
+
+    def _esperar_conexion(self, error: Exception, filas: int) -> None:
+        with self._cond:
+            self._fallos_conexion += 1
+            espera = min(MAX_ESPERA_REINTENTO, self.intervalo_segundos * 2 ** self._fallos_conexion)
+            self._reintentar_en = time.monotonic() + espera
+        print(
+            f"[WARN] BD no disponible para el chat ({filas} mensajes en cola, "
+            f"reintento en {espera:.1f}s): {error}"
+        )
+
+    def _conexion_recuperada(self) -> None:
+        if self._reintentar_en is not None:
+            with self._cond:
+                self._fallos_conexion = 0
+                self._reintentar_en = None
+
+    def _insertar(self, lote: List[Dict[str, Any]], sesiones: Set[str]) -> None:
+        db = self.session_factory()
+        try:
+            db.bulk_insert_mappings(ChatMessage, lote)
+            if sesiones:
+                db.query(ChatSession).filter(ChatSession.session_id.in_(sesiones)).update(
+                    {ChatSession.last_seen_at: datetime.utcnow()}, synchronize_session=False
+                )
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+        self.mensajes_escritos += len(lote)
+        self.lotes_escritos += 1
+
+    def _insertar_individual(self, lote: List[Dict[str, Any]], sesiones: Set[str]) -> Tuple[int, bool]:
+        """
+        Último recurso: aísla las filas que fallan (p. ej. sesión ya eliminada)
+
+        Si la BD deja de responder a la mitad, el resto del lote vuelve a la
+        cola sin descartar nada. Devuelve (filas escritas, lote completo).
+        """
+        escritas = 0
+        for i, fila in enumerate(lote):
+            try:
+                self._insertar([fila], sesiones & {fila["session_id"]})
+                escritas += 1
+            except Exception as e:
+                if es_error_de_conexion(e):
+                    resto = lote[i:]
+                    self._devolver(resto, sesiones & {f["session_id"] for f in resto})
+                    self._esperar_conexion(e, len(resto))
+                    return escritas, False
+                fila["descartado"] = True
+                self.mensajes_descartados += 1
+                print(f"[WARN] Mensaje de chat descartado (sesión {fila['session_id']}): {e}")
+        return escritas, True
+
+    def cerrar(self) -> None:
+        """Detiene el hilo y escribe lo pendiente"""
+        with self._cond:
+            self._detener = True
+            self._cond.notify_all()
+        if self._hilo is not None:
+            self._hilo.join(timeout=10)
+            self._hilo = None
+        self.vaciar()
+
+    def estadisticas(self) -> Dict[str, Any]:
+        return {
+            'modo': self.modo,
+            'pendientes': self.pendientes(),
+            'mensajes_escritos': self.mensajes_escritos,
+            'lotes_escritos': self.lotes_escritos,
+            'mensajes_descartados': self.mensajes_descartados,
+            'mensajes_rechazados': self.mensajes_rechazados,
+            'esperando_bd': self._reintentar_en is not None,
+        }
+
+
+# Instancia global del escritor
+escritor_mensajes = EscritorMensajes(
+    modo=settings.CHAT_PERSISTENCIA,
+    tamano_lote=settings.CHAT_ESCRITURA_LOTE,
+    intervalo_segundos=settings.CHAT_ESCRITURA_INTERVALO_MS / 1000,
+    max_pendientes=settings.CHAT_ESCRITURA_MAX_PENDIENTES
+)
@@ -1,54 +1,62 @@
 # app/services/conversation_store.py
+import sys
 import time
 from collections import deque
 from typing import Dict, List
 from uuid import uuid4
 
+from app.services.session_state import AlmacenSesiones
+
+
+class _Mensaje:
+    __slots__ = ('role', 'text', 'timestamp')
+
+    def __init__(self, role: str, text: str, timestamp: float):
+        self.role = role
+        self.text = text
+        self.timestamp = timestamp
+
+
+def _tamano(mensajes: deque) -> int:
+    return sys.getsizeof(mensajes) + sum(sys.getsizeof(m.text) + 80 for m in mensajes)
+
 
 class ConversationStore:
     """
     Historial en memoria con TTL.
     No sustituye BD, solo ayuda al contexto del prompt.
+
+    Sesiones acotadas (LRU) y con caducidad por inactividad; la limpieza
+    solo toca las sesiones vencidas (ver AlmacenSesiones).
     """
 
-    def __init__(self, ttl_seconds: int = 1800):
+    def __init__(self, ttl_seconds: int = 1800, max_sesiones: int = 2000, max_mensajes: int = 10):
         self.ttl = ttl_seconds
-        self.sessions: Dict[str, Dict] = {}
-
-    def _cleanup(self):
-        """Elimina sesiones expiradas."""
-        now = time.time()
-        expired = [
-            sid for sid, data in self.sessions.items()
-            if now - data.get("updated_at", now) > self.ttl
-        ]
-        for sid in expired:
-            self.sessions.pop(sid, None)
+        self.max_mensajes = max_mensajes
+        self.sessions: AlmacenSesiones[deque] = AlmacenSesiones(
+            max_sesiones=max_sesiones,
+            ttl_segundos=ttl_seconds,
+            nombre="conversaciones",
+            medir=_tamano
+        )
 
     def new_session(self) -> str:
         """Crea nueva sesión de conversación."""
-        self._cleanup()
         sid = uuid4().hex
-        self.sessions[sid] = {
-            "messages": deque(maxlen=10),
-            "updated_at": time.time(),
-        }
+        self.sessions.poner(sid, deque(maxlen=self.max_mensajes))
         return sid
 
     def append(self, session_id: str, role: str, text: str):
         """Agrega mensaje al historial de la sesión."""
-        if session_id not in self.sessions:
-            self.sessions[session_id] = {
-                "messages": deque(maxlen=10),
-                "updated_at": time.time(),
-            }
-        self.sessions[session_id]["messages"].append(
-            {"role": role, "text": text}
-        )
-        self.sessions[session_id]["updated_at"] = time.time()
-        self._cleanup()
+        mensajes = self.sessions.obtener_o_crear(session_id, lambda: deque(maxlen=self.max_mensajes))
+        mensajes.append(_Mensaje(role, text, time.time()))
 
     def history(self, session_id: str) -> List[Dict[str, str]]:
         """Obtiene historial de la sesión."""
-        self._cleanup()
-        return list(self.sessions.get(session_id, {}).get("messages", []))
+        mensajes = self.sessions.obtener(session_id)
+        if mensajes is None:
+            return []
+        return [{"role": m.role, "text": m.text} for m in mensajes]
+
+    def estadisticas(self) -> Dict:
+        return self.sessions.estadisticas()
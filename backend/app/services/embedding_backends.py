@@ -0,0 +1,148 @@
+# app/services/embedding_backends.py
+"""
+Backends intercambiables de generación de embeddings
+
+Todos exponen la misma interfaz:
+- nombre: identifica al modelo (forma parte de la clave de caché)
+- dimension: tamaño de los vectores
+- embed_lote(textos) -> np.ndarray (n, dimension) float32
+
+Backends disponibles:
+- GeminiEmbeddingBackend: API remota de Gemini
+- LocalHashingBackend: 100% local y sin red. Vectoriza con feature hashing
+  de palabras y n-gramas de caracteres, así textos que comparten
+  vocabulario (o raíces: "lenguaje"/"lenguajes") quedan cerca.
+"""
+import math
+import re
+from abc import ABC, abstractmethod
+import unicodedata
+import zlib
+from functools import lru_cache
+from typing import List, Sequence, Tuple
+
+import numpy as np
+
+DIMENSION_EMBEDDING = 768
+
+_PALABRA_RE = re.compile(r'[a-z0-9]+')
+
+
+class EmbeddingBackend(ABC):
+    """Interfaz común de los backends de embeddings"""
+
+    nombre: str = ''
+    dimension: int = DIMENSION_EMBEDDING
+    # Llamadas simultáneas que tiene sentido lanzar (1 = CPU local)
+    concurrencia_maxima: int = 1
+
+    @abstractmethod
+    def embed_lote(self, textos: Sequence[str]) -> np.ndarray:
+        """Vectores (n, dimension) float32 en el orden de `textos`"""
+
+
+class GeminiEmbeddingBackend(EmbeddingBackend):
+    """
+    Embeddings remotos con la API de Gemini (un lote por llamada)
+
+    Usa el cliente compartido: si el circuito está abierto la llamada falla
+    al instante y el servicio de embeddings pasa al backend local.
+    """
+
+    concurrencia_maxima = 8
+
+    def __init__(self, modelo: str = "models/embedding-001", cliente=None):
+        self.nombre = modelo
+        if cliente is None:
+            from app.services.gemini_async_client import cliente_gemini as cliente
+        self.cliente = cliente
+        self.concurrencia_maxima = cliente.max_concurrencia
+
+    def embed_lote(self, textos: Sequence[str]) -> np.ndarray:
+        vectores = np.asarray(self.cliente.embed_lote_sync(list(textos), self.nombre), dtype=np.float32)
+        return vectores.reshape(len(textos), -1)
+
+
+def _normalizar(texto: str) -> str:
+    """Minúsculas y sin acentos"""
+    descompuesto = unicodedata.normalize('NFKD', texto.lower())
+    return ''.join(c for c in descompuesto if not unicodedata.combining(c))
+
+
+@lru_cache(maxsize=200000)
+def _hash_caracteristica(caracteristica: str, dimension: int) -> Tuple[int, float]:
+    """Índice y signo de una característica (crc32 estable entre procesos)"""
+    h = zlib.crc32(caracteristica.encode('utf-8'))
+    return h % dimension, (1.0 if (h >> 31) & 1 else -1.0)
+
+
+@lru_cache(maxsize=50000)
+def _caracteristicas_palabra(palabra: str, minimo: int, maximo: int) -> Tuple[str, ...]:
+    """Palabra completa + n-gramas de caracteres con bordes ('<len', 'je>')"""
+    marcada = f"<{palabra}>"
+    ngramas = [
+        marcada[i:i + n]
+        for n in range(minimo, maximo + 1)
+        for i in range(len(marcada) - n + 1)
+    ]
+    return (f"w:{palabra}", *ngramas)
+
+
+class LocalHashingBackend(EmbeddingBackend):
+    """
+    Embeddings locales por feature hashing (sin estado, thread-safe)
+
+    Características por texto:
+    - Palabras completas (peso PESO_PALABRA)
+    - N-gramas de caracteres de cada palabra con bordes ('<len', 'gua', 'je>')
+    Las frecuencias usan tf sublineal (1 + log tf), se proyectan con signo
+    a `dimension` cubetas y cada vector se normaliza a norma L2 = 1.
+    """
+
+    PESO_PALABRA = 2.0
+
+    def __init__(
+        self,
+        dimension: int = DIMENSION_EMBEDDING,
+        ngramas: Tuple[int, int] = (3, 5)
+    ):
+        self.dimension = dimension
+        self.ngramas = ngramas
+        self.nombre = f"local-hash-ngramas-{ngramas[0]}{ngramas[1]}-{dimension}-v1"
+
+    def caracteristicas(self, texto: str) -> dict:
+        """Conteos de palabras y n-gramas de caracteres de un texto"""
+        conteos: dict = {}
+        for palabra in _PALABRA_RE.findall(_normalizar(texto)):
+            for caracteristica in _caracteristicas_palabra(palabra, *self.ngramas):
+                conteos[caracteristica] = conteos.get(caracteristica, 0) + 1
+        return conteos
+
+    def _dispersa(self, textos: Sequence[str]) -> Tuple[List[int], List[int], List[float]]:
+        """Coordenadas (fila, columna, valor) de la matriz dispersa del lote"""
+        filas: List[int] = []
+        columnas: List[int] = []
+        valores: List[float] = []
+        for fila, texto in enumerate(textos):
+            for caracteristica, tf in self.caracteristicas(texto).items():
+                indice, signo = _hash_caracteristica(caracteristica, self.dimension)
+                peso = 1.0 + math.log(tf)
+                if caracteristica.startswith('w:'):
+                    peso *= self.PESO_PALABRA
+                filas.append(fila)
+                columnas.append(indice)
+                valores.append(signo * peso)
+        return filas, columnas, valores
+
+    def embed_lote(self, textos: Sequence[str]) -> np.ndarray:
+        matriz = np.zeros((len(textos), self.dimension), dtype=np.float32)
+        if not len(textos):
+            return matriz
+
+        filas, columnas, valores = self._dispersa(textos)
+        # Acumula solo los valores no nulos (colisiones de hash se suman)
+        np.add.at(matriz, (np.asarray(filas, dtype=np.intp), np.asarray(columnas, dtype=np.intp)), valores)
+
+        normas = np.linalg.norm(matriz, axis=1, keepdims=True)
+        normas[normas == 0] = 1.0
+        return matriz / normas
@@ -0,0 +1,272 @@
+# app/services/embedding_cache.py
+"""
+Caché de embeddings direccionada por contenido
+
+La clave es sha256(modelo + texto): el mismo texto con el mismo modelo
+nunca se vuelve a vectorizar, aunque cambie la fila que lo originó.
+
+Dos niveles:
+- Memoria: LRU acotada (OrderedDict) con vectores float32 inmutables
+- Disco: un archivo por clave en DATA_DIR/embeddings_cache/<2 hex>/<clave>.bin
+  con el mismo formato binario que las columnas de BD (app.db.tipos),
+  escrito de forma atómica (tmp + os.replace). Fuera de uploads/: son
+  vectores de textos de perfiles de niños y uploads/ se sirve en /archivos.
+  Cada PODA_CADA_ESCRITURAS escrituras un hilo de fondo borra los archivos
+  sin uso en max_dias y, si el total pasa de max_bytes, los menos usados
+  (la fecha de modificación se renueva en cada acierto de disco).
+"""
+import hashlib
+import os
+import shutil
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Iterable, Optional, Sequence
+
+import numpy as np
+
+from app.core.config import settings
+from app.db.tipos import codificar_vector, decodificar_vector
+
+
+# Escrituras entre podas del nivel en disco
+PODA_CADA_ESCRITURAS = 1000
+# Al podar por tamaño se baja hasta esta fracción del tope
+FRACCION_TRAS_PODA = 0.9
+
+
+def clave_embedding(modelo: str, texto: str) -> str:
+    """Clave de caché para un texto vectorizado con un modelo"""
+    h = hashlib.sha256()
+    h.update(modelo.encode('utf-8'))
+    h.update(b'\0')
+    h.update(texto.encode('utf-8'))
+    return h.hexdigest()
+
+
+class EmbeddingCache:
+    """Caché LRU en memoria con persistencia opcional en disco"""
+
+    def __init__(
+        self,
+        capacidad: int = 10000,
+        directorio: Optional[Path] = None,
+        persistir: bool = True,
+        max_bytes: Optional[int] = None,
+        max_dias: Optional[float] = None
+    ):
+        self.capacidad = capacidad
+        self.directorio = Path(directorio) if directorio else settings.DATA_DIR / "embeddings_cache"
+        self.persistir = persistir
+        self.max_bytes = max_bytes
+        self.max_dias = max_dias
+        self._lock = threading.Lock()
+        # La primera escritura del proceso dispara una poda
+        self._escrituras_desde_poda = PODA_CADA_ESCRITURAS
+        self._podando = False
+        self.archivos_podados = 0
+        self._memoria: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self.aciertos_memoria = 0
+        self.aciertos_disco = 0
+        self.fallos = 0
+
+    def __len__(self) -> int:
+        return len(self._memoria)
+
+    # --------------------------------------------------------
+    # Disco
+    # --------------------------------------------------------
+
+    def _ruta(self, clave: str) -> Path:
+        return self.directorio / clave[:2] / f"{clave}.bin"
+
+    def _leer_disco(self, clave: str) -> Optional[np.ndarray]:
+        if not self.persistir:
+            return None
+        ruta = self._ruta(clave)
+        try:
+            vector = decodificar_vector(ruta.read_bytes())
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            print(f"[WARN] Embedding en caché ilegible ({clave[:12]}): {e}")
+            return None
+        try:
+            # Marca de uso para la poda (los menos usados salen primero)
+            os.utime(ruta)
+        except OSError:
+            pass
+        return vector
+
+    def _escribir_disco(self, clave: str, vector: np.ndarray) -> None:
+        if not self.persistir:
+            return
+        ruta = self._ruta(clave)
+        try:
+            ruta.parent.mkdir(parents=True, exist_ok=True)
+            temporal = ruta.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+            temporal.write_bytes(codificar_vector(vector))
+            os.replace(temporal, ruta)
+        except OSError as e:
+            print(f"[WARN] No se pudo persistir embedding en caché: {e}")
+            return
+        with self._lock:
+            self._escrituras_desde_poda += 1
+            lanzar = self._escrituras_desde_poda >= PODA_CADA_ESCRITURAS and not self._podando
+            if lanzar:
+                self._escrituras_desde_poda = 0
+                self._podando = True
+        if lanzar:
+            threading.Thread(target=self._podar_en_fondo, name="embedding-cache-poda", daemon=True).start()
+
+    def retirar_directorio_anterior(self, anterior: Path) -> None:
+        """
+        Saca de `anterior` (p. ej. uploads/, servido públicamente) la caché
+        de versiones previas: la mueve al directorio actual o la borra
+        """
+        anterior = Path(anterior)
+        if not anterior.is_dir() or anterior.resolve() == self.directorio.resolve():
+            return
+        try:
+            if self.directorio.exists():
+                shutil.rmtree(anterior)
+            else:
+                self.directorio.parent.mkdir(parents=True, exist_ok=True)
+                shutil.move(str(anterior), str(self.directorio))
+        except OSError as e:
+            print(f"[WARN] No se pudo retirar la caché de embeddings de {anterior}: {e}")
+
+    def _podar_en_fondo(self) -> None:
+        try:
+            self.podar()
+        except Exception as e:
+            print(f"[WARN] Error podando la caché de embeddings: {e}")
+        finally:
+            with self._lock:
+                self._podando = False
+
+    def podar(self) -> int:
+        """
+        Borra del disco los archivos sin uso en max_dias y, si el total
+        supera max_bytes, los de uso más antiguo. Devuelve archivos borrados.
+        """
+        if not self.directorio.is_dir() or (self.max_bytes is None and self.max_dias is None):
+            return 0
+        archivos = []
+        for subdirectorio in os.scandir(self.directorio):
+            if not subdirectorio.is_dir():
+                continue
+            for entrada in os.scandir(subdirectorio.path):
+                if entrada.name.endswith('.bin'):
+                    try:
+                        info = entrada.stat()
+                    except OSError:
+                        continue
+                    archivos.append((info.st_mtime, info.st_size, entrada.path))
+
+        borrar = []
+        if self.max_dias is not None:
+            limite = time.time() - self.max_dias * 86400
+            borrar = [a for a in archivos if a[0] < limite]
+            archivos = [a for a in archivos if a[0] >= limite]
+        if self.max_bytes is not None:
+            total = sum(tamano for _, tamano, _ in archivos)
+            if total > self.max_bytes:
+                archivos.sort()
+                objetivo = self.max_bytes * FRACCION_TRAS_PODA
+                for archivo in archivos:
+                    if total <= objetivo:
+                        break
+                    borrar.append(archivo)
+                    total -= archivo[1]
+
+        borrados = 0
+        for _, _, ruta in borrar:
+            try:
+                os.remove(ruta)
+                borrados += 1
+            except OSError:
+                pass
+        with self._lock:
+            self.archivos_podados += borrados
+        return borrados
+
+    # --------------------------------------------------------
+    # Memoria
+    # --------------------------------------------------------
+
+    def _recordar(self, clave: str, vector: np.ndarray) -> None:
+        with self._lock:
+            self._memoria[clave] = vector
+            self._memoria.move_to_end(clave)
+            while len(self._memoria) > self.capacidad:
+                self._memoria.popitem(last=False)
+
+    # --------------------------------------------------------
+    # API
+    # --------------------------------------------------------
+
+    def obtener(self, modelo: str, texto: str) -> Optional[np.ndarray]:
+        """Vector en caché (memoria o disco) o None"""
+        clave = clave_embedding(modelo, texto)
+        with self._lock:
+            vector = self._memoria.get(clave)
+            if vector is not None:
+                self._memoria.move_to_end(clave)
+                self.aciertos_memoria += 1
+                return vector
+
+        vector = self._leer_disco(clave)
+        with self._lock:
+            if vector is None:
+                self.fallos += 1
+                return None
+            self.aciertos_disco += 1
+        self._recordar(clave, vector)
+        return vector
+
+    def obtener_varios(self, modelo: str, textos: Iterable[str]) -> Dict[str, np.ndarray]:
+        """Vectores en caché para los textos dados (solo los encontrados)"""
+        encontrados = {}
+        for texto in textos:
+            vector = self.obtener(modelo, texto)
+            if vector is not None:
+                encontrados[texto] = vector
+        return encontrados
+
+    def guardar(self, modelo: str, texto: str, vector: Sequence[float]) -> np.ndarray:
+        """Guarda un vector y devuelve la copia inmutable almacenada"""
+        arreglo = np.array(vector, dtype=np.float32).ravel()
+        arreglo.setflags(write=False)
+        clave = clave_embedding(modelo, texto)
+        self._recordar(clave, arreglo)
+        self._escribir_disco(clave, arreglo)
+        return arreglo
+
+    def limpiar_memoria(self) -> None:
+        with self._lock:
+            self._memoria.clear()
+
+    def estadisticas(self) -> Dict[str, int]:
+        with self._lock:
+            en_memoria = len(self._memoria)
+            aciertos_memoria, aciertos_disco, fallos = self.aciertos_memoria, self.aciertos_disco, self.fallos
+        total = aciertos_memoria + aciertos_disco + fallos
+        return {
+            'en_memoria': en_memoria,
+            'capacidad': self.capacidad,
+            'aciertos_memoria': aciertos_memoria,
+            'aciertos_disco': aciertos_disco,
+            'fallos': fallos,
+            'tasa_aciertos': round((aciertos_memoria + aciertos_disco) / total, 4) if total else 0.0,
+            'archivos_podados': self.archivos_podados,
+        }
+
+
+# Instancia global de la caché
+embedding_cache = EmbeddingCache(
+    capacidad=settings.EMBEDDING_CACHE_SIZE,
+    max_bytes=settings.EMBEDDING_CACHE_DISCO_MAX_MB * 1024 * 1024,
+    max_dias=settings.EMBEDDING_CACHE_DISCO_MAX_DIAS
+)
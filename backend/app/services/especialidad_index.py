@@ -0,0 +1,214 @@
+# app/services/especialidad_index.py
+"""
+Índice precompilado de coincidencia terapeuta ↔ terapia
+
+Se construye una vez (al arrancar o en el primer uso) con:
+- Tokens sin acentos y en minúsculas de las especialidades de cada terapeuta
+- Palabras clave por terapia (mapeo de especialidades + palabras del nombre)
+- Conjunto de terapeutas que coinciden con cada terapia
+
+Responder "qué terapeutas dominan la terapia X" es una búsqueda en un dict
+y la matriz completa terapeutas × terapias sale en una sola llamada.
+El índice se marca como sucio cuando cambian filas de Personal o Terapia
+(eventos ORM) y se reconstruye en el siguiente uso.
+"""
+import re
+import threading
+import unicodedata
+from typing import Dict, FrozenSet, Iterable, List, Optional, Set
+
+import numpy as np
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from app.models.personal import Personal
+from app.models.terapia import Terapia
+
+
+# Mapeo de fragmentos del nombre de la terapia a palabras clave de especialidad
+# (ya sin acentos; una palabra clave coincide si algún token del terapeuta empieza con ella)
+MAPEO_ESPECIALIDADES: Dict[str, tuple] = {
+    'terapia de lenguaje': ('lenguaje', 'comunicacion', 'habla'),
+    'lenguaje': ('lenguaje', 'comunicacion', 'habla'),
+    'ocupacional': ('ocupacional', 'ocupacion'),
+    'psicologia': ('psicologia', 'psicolog', 'psico'),
+    'conductual': ('conductual', 'aba', 'conducta'),
+    'aba': ('aba', 'conductual', 'conducta'),
+    'musica': ('musica', 'musicoterapia', 'musico'),
+    'fisica': ('fisica', 'fisico', 'motor'),
+    'sensorial': ('sensorial', 'integracion'),
+    'pedagog': ('pedagog', 'educacion'),
+}
+
+# Palabras del nombre de la terapia demasiado genéricas para decidir coincidencia
+PALABRAS_GENERICAS = frozenset({'terapia', 'terapias'})
+
+LONGITUD_MINIMA_PALABRA = 5
+
+_TOKEN_RE = re.compile(r'[a-z0-9]+')
+
+
+def normalizar_texto(texto: Optional[str]) -> str:
+    """Minúsculas y sin acentos ('Psicología' -> 'psicologia')"""
+    if not texto:
+        return ''
+    descompuesto = unicodedata.normalize('NFKD', texto.lower())
+    return ''.join(c for c in descompuesto if not unicodedata.combining(c)).strip()
+
+
+def tokenizar(texto: Optional[str]) -> FrozenSet[str]:
+    """Tokens alfanuméricos normalizados de un texto"""
+    return frozenset(_TOKEN_RE.findall(normalizar_texto(texto)))
+
+
+def palabras_clave_terapia(nombre: Optional[str]) -> FrozenSet[str]:
+    """
+    Palabras clave que identifican a una terapia: las del mapeo cuyos
+    fragmentos aparecen en el nombre y las palabras significativas del nombre
+    """
+    nombre_norm = normalizar_texto(nombre)
+    claves: Set[str] = set()
+    for fragmento, keywords in MAPEO_ESPECIALIDADES.items():
+        if fragmento in nombre_norm:
+            claves.update(keywords)
+    for palabra in _TOKEN_RE.findall(nombre_norm):
+        if len(palabra) >= LONGITUD_MINIMA_PALABRA and palabra not in PALABRAS_GENERICAS:
+            claves.add(palabra)
+    return frozenset(claves)
+
+
+def coincide(tokens_terapeuta: Iterable[str], claves_terapia: Iterable[str]) -> bool:
+    """True si alguna palabra clave es prefijo de algún token del terapeuta"""
+    tokens = tuple(tokens_terapeuta)
+    return any(token.startswith(clave) for clave in claves_terapia for token in tokens)
+
+
+class EspecialidadIndex:
+    """Índice en memoria de coincidencias terapeuta ↔ terapia"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = 0
+        self._version_construida = -1
+        self.tokens_terapeuta: Dict[int, FrozenSet[str]] = {}
+        self.claves_terapia: Dict[int, FrozenSet[str]] = {}
+        self.terapeutas_por_terapia: Dict[int, FrozenSet[int]] = {}
+        self.terapeuta_ids: List[int] = []
+        self.terapia_ids: List[int] = []
+        self._matriz = np.zeros((0, 0), dtype=bool)
+
+    # --------------------------------------------------------
+    # Construcción e invalidación
+    # --------------------------------------------------------
+
+    def invalidar(self, *args) -> None:
+        """Marca el índice para reconstrucción (firma compatible con eventos ORM)"""
+        self._version += 1
+
+    @property
+    def sucio(self) -> bool:
+        return self._version_construida != self._version
+
+    def construir(self, db: Session) -> None:
+        """Reconstruye el índice con 2 consultas (personal y terapias)"""
+        version = self._version
+        personal = db.query(
+            Personal.id,
+            Personal.especialidad_principal,
+            Personal.especialidades
+        ).order_by(Personal.id).all()
+        terapias = db.query(Terapia.id, Terapia.nombre).order_by(Terapia.id).all()
+
+        tokens_terapeuta = {
+            p.id: tokenizar(f"{p.especialidad_principal or ''} {p.especialidades or ''}")
+            for p in personal
+        }
+        claves_terapia = {t.id: palabras_clave_terapia(t.nombre) for t in terapias}
+
+        # Índice invertido palabra clave -> terapeutas (una pasada por clave distinta)
+        todas_claves = set().union(*claves_terapia.values()) if claves_terapia else set()
+        terapeutas_por_clave = {
+            clave: frozenset(
+                tid for tid, tokens in tokens_terapeuta.items()
+                if coincide(tokens, (clave,))
+            )
+            for clave in todas_claves
+        }
+        terapeutas_por_terapia = {
+            terapia_id: frozenset().union(*(terapeutas_por_clave[c] for c in claves))
+            for terapia_id, claves in claves_terapia.items()
+        }
+
+        terapeuta_ids = list(tokens_terapeuta)
+        terapia_ids = list(claves_terapia)
+        fila = {tid: i for i, tid in enumerate(terapeuta_ids)}
+        matriz = np.zeros((len(terapeuta_ids), len(terapia_ids)), dtype=bool)
+        for j, terapia_id in enumerate(terapia_ids):
+            filas = [fila[tid] for tid in terapeutas_por_terapia[terapia_id]]
+            matriz[filas, j] = True
+
+        with self._lock:
+            self.tokens_terapeuta = tokens_terapeuta
+            self.claves_terapia = claves_terapia
+            self.terapeutas_por_terapia = terapeutas_por_terapia
+            self.terapeuta_ids = terapeuta_ids
+            self.terapia_ids = terapia_ids
+            self._matriz = matriz
+            # Si hubo una invalidación durante la construcción, sigue sucio
+            self._version_construida = version
+
+    def asegurar(self, db: Session) -> None:
+        """Reconstruye el índice solo si fue invalidado"""
+        if self.sucio:
+            self.construir(db)
+
+    # --------------------------------------------------------
+    # Consultas
+    # --------------------------------------------------------
+
+    def terapeutas_para_terapia(self, db: Session, terapia_id: int) -> FrozenSet[int]:
+        """IDs de terapeutas cuya especialidad coincide con la terapia"""
+        self.asegurar(db)
+        return self.terapeutas_por_terapia.get(terapia_id, frozenset())
+
+    def coincide_terapeuta(self, db: Session, terapeuta_id: int, terapia_id: int) -> bool:
+        """¿El terapeuta domina la terapia?"""
+        return terapeuta_id in self.terapeutas_para_terapia(db, terapia_id)
+
+    def matriz_coincidencias(
+        self,
+        db: Session,
+        terapeuta_ids: Optional[List[int]] = None,
+        terapia_ids: Optional[List[int]] = None
+    ) -> np.ndarray:
+        """
+        Matriz booleana terapeutas × terapias en el orden solicitado
+        (por defecto todos los terapeutas y todas las terapias indexadas).
+        IDs desconocidos producen filas/columnas en False.
+        """
+        self.asegurar(db)
+        with self._lock:
+            matriz = self._matriz
+            fila = {tid: i for i, tid in enumerate(self.terapeuta_ids)}
+            columna = {tid: j for j, tid in enumerate(self.terapia_ids)}
+
+        if terapeuta_ids is None and terapia_ids is None:
+            return matriz.copy()
+
+        filas = terapeuta_ids if terapeuta_ids is not None else list(fila)
+        columnas = terapia_ids if terapia_ids is not None else list(columna)
+
+        # Índice extra en False para IDs que no están en el índice
+        extendida = np.zeros((matriz.shape[0] + 1, matriz.shape[1] + 1), dtype=bool)
+        extendida[:-1, :-1] = matriz
+        idx_filas = np.array([fila.get(t, -1) for t in filas], dtype=int)
+        idx_columnas = np.array([columna.get(t, -1) for t in columnas], dtype=int)
+        return extendida[np.ix_(idx_filas, idx_columnas)]
+
+
+# Instancia global del índice
+especialidad_index = EspecialidadIndex()
+
+for _modelo in (Personal, Terapia):
+    for _evento in ('after_insert', 'after_update', 'after_delete'):
+        event.listen(_modelo, _evento, especialidad_index.invalidar)
@@ -0,0 +1,191 @@
+# app/services/explicacion_worker.py
+"""
+Cola de explicaciones Gemini en segundo plano
+
+El ranking (similitud / TOPSIS) se devuelve de inmediato y la explicación
+en lenguaje natural se genera aparte, en un pool de hilos con concurrencia
+acotada. Al terminar se escribe en la fila correspondiente:
+
+- 'actividades' -> RecomendacionActividad.explicacion_humana
+- 'terapeuta'   -> AsignacionTerapeutaTOPSIS.explicacion_seleccion
+
+El id de la explicación es el id de esa fila. Los clientes consultan el
+estado (con espera opcional) en GET /recomendaciones/explicaciones/{tipo}/{id}.
+
+El estado vive en memoria del proceso que encoló. Sin él (otro worker o
+reinicio) se deduce de la fila: con texto está lista; sin texto y pasado el
+plazo máximo (espera en cola + generación) ya nadie la va a escribir y
+queda 'no_disponible' en lugar de pendiente para siempre.
+"""
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Optional, Tuple
+
+from app.core.config import settings
+from app.db.session import SessionLocal
+from app.models.recomendacion import RecomendacionActividad, AsignacionTerapeutaTOPSIS
+
+TIPO_ACTIVIDADES = 'actividades'
+TIPO_TERAPEUTA = 'terapeuta'
+
+# Tipo de explicación -> (modelo, columna donde se guarda, columna de creación)
+DESTINOS = {
+    TIPO_ACTIVIDADES: (RecomendacionActividad, 'explicacion_humana', 'fecha_generacion'),
+    TIPO_TERAPEUTA: (AsignacionTerapeutaTOPSIS, 'explicacion_seleccion', 'fecha_calculo'),
+}
+
+ESTADO_PENDIENTE = 'pendiente'
+ESTADO_EN_PROCESO = 'en_proceso'
+ESTADO_LISTA = 'lista'
+ESTADO_ERROR = 'error'
+ESTADO_DESCARTADA = 'descartada'
+# Sin estado en memoria, sin texto y fuera de plazo (error, descarte o reinicio)
+ESTADO_NO_DISPONIBLE = 'no_disponible'
+
+# Estados recientes que se conservan en memoria para consulta
+MAX_ESTADOS = 2000
+
+
+class ColaExplicaciones:
+    """Pool acotado que genera explicaciones y las guarda en BD"""
+
+    def __init__(
+        self,
+        max_concurrencia: int = 2,
+        max_pendientes: int = 200,
+        max_espera_segundos: float = 300,
+        max_generacion_segundos: float = 60
+    ):
+        self.max_concurrencia = max_concurrencia
+        self.max_pendientes = max_pendientes
+        self.max_espera_segundos = max_espera_segundos
+        self.max_generacion_segundos = max_generacion_segundos
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+        self._pendientes = 0
+        self._estados: "OrderedDict[Tuple[str, int], Dict]" = OrderedDict()
+
+    def _pool(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.max_concurrencia,
+                thread_name_prefix="explicaciones"
+            )
+        return self._executor
+
+    def _registrar(self, clave: Tuple[str, int], **valores) -> None:
+        with self._lock:
+            estado = self._estados.setdefault(clave, {})
+            estado.update(valores)
+            self._estados.move_to_end(clave)
+            while len(self._estados) > MAX_ESTADOS:
+                self._estados.popitem(last=False)
+
+    def encolar(self, tipo: str, registro_id: int, generar: Callable[[], str]) -> str:
+        """
+        Programa la generación de una explicación
+
+        Args:
+            tipo: 'actividades' o 'terapeuta'
+            registro_id: id de la fila donde se guardará
+            generar: función sin argumentos que devuelve el texto
+
+        Returns:
+            Estado inicial ('pendiente', o 'descartada' si la cola está llena)
+        """
+        if tipo not in DESTINOS:
+            raise ValueError(f"Tipo de explicación desconocido: {tipo}")
+        clave = (tipo, registro_id)
+
+        with self._lock:
+            llena = self._pendientes >= self.max_pendientes
+            if not llena:
+                self._pendientes += 1
+        if llena:
+            self._registrar(clave, estado=ESTADO_DESCARTADA, texto=None, error="Cola de explicaciones llena", future=None)
+            return ESTADO_DESCARTADA
+
+        self._registrar(clave, estado=ESTADO_PENDIENTE, texto=None, error=None, future=None)
+        future = self._pool().submit(self._ejecutar, clave, generar, time.monotonic())
+        self._registrar(clave, future=future)
+        return ESTADO_PENDIENTE
+
+    def _ejecutar(self, clave: Tuple[str, int], generar: Callable[[], str], encolada: float) -> Optional[str]:
+        tipo, registro_id = clave
+        if time.monotonic() - encolada > self.max_espera_segundos:
+            # Pasado el plazo los demás procesos ya la reportan no disponible
+            self._registrar(clave, estado=ESTADO_DESCARTADA, error="Tiempo de espera en cola agotado")
+            with self._lock:
+                self._pendientes -= 1
+            return None
+        self._registrar(clave, estado=ESTADO_EN_PROCESO)
+        try:
+            texto = generar()
+            self._guardar(tipo, registro_id, texto)
+            self._registrar(clave, estado=ESTADO_LISTA, texto=texto)
+            return texto
+        except Exception as e:
+            print(f"[WARN] Error generando explicación {tipo}/{registro_id}: {e}")
+            self._registrar(clave, estado=ESTADO_ERROR, error=str(e))
+            return None
+        finally:
+            with self._lock:
+                self._pendientes -= 1
+
+    @staticmethod
+    def _guardar(tipo: str, registro_id: int, texto: str) -> None:
+        modelo, columna, _ = DESTINOS[tipo]
+        db = SessionLocal()
+        try:
+            db.query(modelo).filter(modelo.id == registro_id).update(
+                {columna: texto}, synchronize_session=False
+            )
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def estado(self, tipo: str, registro_id: int) -> Optional[Dict]:
+        """Estado en memoria (None si no se encoló en este proceso o ya expiró)"""
+        with self._lock:
+            estado = self._estados.get((tipo, registro_id))
+            return dict(estado) if estado else None
+
+    def estado_sin_memoria(self, texto: Optional[str], creada: Optional[datetime]) -> str:
+        """
+        Estado deducido de la fila cuando no hay estado en memoria
+
+        Sin texto y con más antigüedad que la espera máxima en cola más la
+        generación, ningún proceso la va a escribir ya.
+        """
+        if texto:
+            return ESTADO_LISTA
+        plazo = timedelta(seconds=self.max_espera_segundos + self.max_generacion_segundos)
+        if creada is None or datetime.utcnow() - creada > plazo:
+            return ESTADO_NO_DISPONIBLE
+        return ESTADO_PENDIENTE
+
+    def future(self, tipo: str, registro_id: int) -> Optional[Future]:
+        estado = self.estado(tipo, registro_id)
+        return estado.get('future') if estado else None
+
+    def cerrar(self) -> None:
+        """Detiene el pool (las explicaciones ya en curso terminan)"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+# Instancia global de la cola
+cola_explicaciones = ColaExplicaciones(
+    max_concurrencia=settings.EXPLICACIONES_CONCURRENCIA,
+    max_pendientes=settings.EXPLICACIONES_MAX_PENDIENTES,
+    max_espera_segundos=settings.EXPLICACIONES_MAX_ESPERA_SEGUNDOS,
+    # Margen sobre el deadline del cliente Gemini (reintentos incluidos)
+    max_generacion_segundos=2 * settings.GEMINI_TIMEOUT_SEGUNDOS
+)
@@ -0,0 +1,565 @@
+# app/services/gemini_async_client.py
+"""
+Cliente asíncrono compartido para la API REST de Gemini
+
+Todas las llamadas a Gemini (chat, explicaciones, embeddings) pasan por
+una sola instancia (`cliente_gemini`) que aporta:
+
+- Pool de conexiones: un httpx.AsyncClient reutilizado (keep-alive)
+- Deadline por llamada: tiempo total máximo, reintentos incluidos (en
+  streaming, hasta recibir la respuesta; luego timeout por lectura)
+- Concurrencia acotada: semáforo de GEMINI_MAX_CONCURRENCIA llamadas
+- Reintentos con backoff exponencial y jitter completo para errores
+  reintentables (timeouts, conexión, HTTP 429/500/502/503/504)
+- Circuit breaker: si la tasa de errores de la ventana supera el umbral,
+  las llamadas fallan al instante con GeminiNoDisponible durante el
+  enfriamiento y los servicios usan sus fallbacks (respuesta clínica
+  segura, embeddings locales). Luego deja pasar una llamada de prueba.
+
+El cliente vive en un event loop propio (hilo de fondo), así lo pueden
+usar tanto handlers sync (generar_sync, desde el threadpool) como async
+(await generar) sin bloquear el loop de FastAPI.
+
+La URL base es configurable (GEMINI_API_BASE_URL) para probar contra un
+servidor falso local (ver scripts/servidor_gemini_falso.py).
+"""
+import asyncio
+import json
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Sequence, Union
+
+import httpx
+
+from app.core.config import settings
+
+ESTADOS_REINTENTABLES = {429, 500, 502, 503, 504}
+
+Contenido = Union[str, List[Dict[str, Any]]]
+
+
+class ErrorGemini(Exception):
+    """Error de la API de Gemini (no reintentable o reintentos agotados)"""
+
+    def __init__(self, mensaje: str, status_code: Optional[int] = None):
+        super().__init__(mensaje)
+        self.status_code = status_code
+
+
+class GeminiNoDisponible(ErrorGemini):
+    """Circuito abierto o deadline agotado: usar el fallback"""
+
+
+class CircuitBreaker:
+    """
+    Circuito cerrado -> abierto -> semiabierto sobre una ventana deslizante
+
+    Se abre cuando en los últimos `ventana_segundos` hubo al menos
+    `min_llamadas` y la fracción de errores es >= `umbral_errores`.
+
+    Toda llamada admitida por `permitir` debe terminar en `registrar` o,
+    si acaba sin resultado (cancelada, respuesta ilegible), en `liberar`:
+    si no, la prueba del semiabierto quedaría en curso para siempre. Por
+    si acaso, una prueba sin cerrar tras `timeout_prueba_segundos` se
+    descarta y se admite otra.
+    """
+
+    CERRADO = 'cerrado'
+    ABIERTO = 'abierto'
+    SEMIABIERTO = 'semiabierto'
+
+    def __init__(
+        self,
+        umbral_errores: float = 0.5,
+        min_llamadas: int = 10,
+        ventana_segundos: float = 30,
+        enfriamiento_segundos: float = 30,
+        timeout_prueba_segundos: float = 60
+    ):
+        self.umbral_errores = umbral_errores
+        self.min_llamadas = min_llamadas
+        self.ventana_segundos = ventana_segundos
+        self.enfriamiento_segundos = enfriamiento_segundos
+        self.timeout_prueba_segundos = timeout_prueba_segundos
+        self._lock = threading.Lock()
+        self._resultados: deque = deque()  # (momento, ok)
+        self._estado = self.CERRADO
+        self._abierto_en = 0.0
+        self._prueba_en_curso = False
+        self._prueba_desde = 0.0
+        self.aperturas = 0
+
+    @property
+    def estado(self) -> str:
+        with self._lock:
+            self._actualizar(time.monotonic())
+            return self._estado
+
+    def _actualizar(self, ahora: float) -> None:
+        if self._estado == self.ABIERTO and ahora - self._abierto_en >= self.enfriamiento_segundos:
+            self._estado = self.SEMIABIERTO
+            self._prueba_en_curso = False
+        elif (
+            self._estado == self.SEMIABIERTO and self._prueba_en_curso
+            and ahora - self._prueba_desde >= self.timeout_prueba_segundos
+        ):
+            self._prueba_en_curso = False
+        while self._resultados and ahora - self._resultados[0][0] > self.ventana_segundos:
+            self._resultados.popleft()
+
+    def permitir(self) -> bool:
+        """True si la llamada puede salir (en semiabierto, solo una de prueba)"""
+        ahora = time.monotonic()
+        with self._lock:
+            self._actualizar(ahora)
+            if self._estado == self.CERRADO:
+                return True
+            if self._estado == self.SEMIABIERTO and not self._prueba_en_curso:
+                self._prueba_en_curso = True
+                self._prueba_desde = ahora
+                return True
+            return False
+
+    def liberar(self) -> None:
+        """Llamada admitida que terminó sin resultado: en semiabierto se admite otra prueba"""
+        with self._lock:
+            if self._estado == self.SEMIABIERTO:
+                self._prueba_en_curso = False
+
+    def registrar(self, ok: bool) -> None:
+        ahora = time.monotonic()
+        with self._lock:
+            self._actualizar(ahora)
+            if self._estado == self.SEMIABIERTO:
+                self._prueba_en_curso = False
+                if ok:
+                    self._estado = self.CERRADO
+                    self._resultados.clear()
+                else:
+                    self._abrir(ahora)
+                return
+            self._resultados.append((ahora, ok))
+            errores = sum(1 for _, resultado in self._resultados if not resultado)
+            total = len(self._resultados)
+            if total >= self.min_llamadas and errores / total >= self.umbral_errores:
+                self._abrir(ahora)
+
+    def _abrir(self, ahora: float) -> None:
+        self._estado = self.ABIERTO
+        self._abierto_en = ahora
+        self._resultados.clear()
+        self.aperturas += 1
+        print(f"[WARN] Circuito de Gemini abierto por {self.enfriamiento_segundos:.0f}s")
+
+
+def _contenidos(contenido: Contenido) -> List[Dict[str, Any]]:
+    """Texto simple o lista de turnos {"role", "parts"} al formato de la API"""
+    if isinstance(contenido, str):
+        return [{"role": "user", "parts": [{"text": contenido}]}]
+    return contenido
+
+
+def _cuerpo(contenido: Contenido, sistema: Optional[str]) -> Dict[str, Any]:
+    cuerpo: Dict[str, Any] = {"contents": _contenidos(contenido)}
+    if sistema:
+        cuerpo["systemInstruction"] = {"parts": [{"text": sistema}]}
+    return cuerpo
+
+
+def _texto_respuesta(datos: Dict[str, Any]) -> str:
+    partes = []
+    for candidato in datos.get("candidates") or []:
+        for parte in (candidato.get("content") or {}).get("parts") or []:
+            if parte.get("text"):
+                partes.append(parte["text"])
+        break
+    return "".join(partes)
+
+
+class ClienteGemini:
+    """Cliente REST de Gemini con deadline, semáforo, reintentos y circuit breaker"""
+
+    def __init__(
+        self,
+        api_key: str = "",
+        modelo: str = "gemini-2.5-flash",
+        base_url: str = "https://generativelanguage.googleapis.com",
+        max_concurrencia: int = 8,
+        timeout_segundos: float = 30,
+        max_reintentos: int = 3,
+        backoff_base_segundos: float = 0.5,
+        backoff_max_segundos: float = 8,
+        breaker: Optional[CircuitBreaker] = None
+    ):
+        self.api_key = api_key
+        self.modelo = modelo
+        self.base_url = base_url.rstrip('/')
+        self.max_concurrencia = max_concurrencia
+        self.timeout_segundos = timeout_segundos
+        self.max_reintentos = max_reintentos
+        self.backoff_base_segundos = backoff_base_segundos
+        self.backoff_max_segundos = backoff_max_segundos
+        self.breaker = breaker or CircuitBreaker()
+
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._hilo: Optional[threading.Thread] = None
+        self._http: Optional[httpx.AsyncClient] = None
+        self._semaforo: Optional[asyncio.Semaphore] = None
+
+        self.llamadas = 0
+        self.reintentos = 0
+        self.errores = 0
+        # Tokens reportados por la API (usageMetadata)
+        self.tokens_entrada = 0
+        self.tokens_salida = 0
+        self.rechazadas_por_circuito = 0
+
+    @property
+    def configurado(self) -> bool:
+        return bool(self.api_key)
+
+    # --------------------------------------------------------
+    # Event loop propio
+    # --------------------------------------------------------
+
+    def _asegurar_loop(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is None or self._loop.is_closed():
+                loop = asyncio.new_event_loop()
+                listo = threading.Event()
+
+                def correr():
+                    asyncio.set_event_loop(loop)
+                    self._semaforo = asyncio.Semaphore(self.max_concurrencia)
+                    self._http = httpx.AsyncClient(
+                        base_url=self.base_url,
+                        timeout=httpx.Timeout(self.timeout_segundos, connect=5.0),
+                        limits=httpx.Limits(
+                            max_connections=self.max_concurrencia,
+                            max_keepalive_connections=self.max_concurrencia
+                        ),
+                        headers={"x-goog-api-key": self.api_key},
+                    )
+                    listo.set()
+                    loop.run_forever()
+
+                self._hilo = threading.Thread(target=correr, name="gemini-client", daemon=True)
+                self._hilo.start()
+                listo.wait()
+                self._loop = loop
+            return self._loop
+
+    def _programar(self, coro) -> Future:
+        return asyncio.run_coroutine_threadsafe(coro, self._asegurar_loop())
+
+    async def _en_loop_propio(self, coro):
+        """Ejecuta la corrutina en el loop del cliente desde cualquier otro loop"""
+        loop = self._asegurar_loop()
+        if asyncio.get_running_loop() is loop:
+            return await coro
+        return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coro, loop))
+
+    def cerrar(self) -> None:
+        """Cierra el pool de conexiones y detiene el loop"""
+        with self._lock:
+            loop, http = self._loop, self._http
+            self._loop = None
+        if loop is None:
+            return
+        if http is not None:
+            try:
+                asyncio.run_coroutine_threadsafe(http.aclose(), loop).result(timeout=5)
+            except Exception:
+                pass
+        loop.call_soon_threadsafe(loop.stop)
+        if self._hilo is not None:
+            self._hilo.join(timeout=5)
+        loop.close()
+
+    # --------------------------------------------------------
+    # Núcleo: una petición con deadline, reintentos y breaker
+    # --------------------------------------------------------
+
+    def _espera_backoff(self, intento: int, respuesta: Optional[httpx.Response]) -> float:
+        if respuesta is not None:
+            retry_after = respuesta.headers.get("Retry-After")
+            if retry_after and retry_after.replace('.', '', 1).isdigit():
+                return min(float(retry_after), self.backoff_max_segundos)
+        # Jitter completo: uniforme en [0, base * 2^intento]
+        return random.uniform(0, min(self.backoff_max_segundos, self.backoff_base_segundos * 2 ** intento))
+
+    async def _post(self, ruta: str, cuerpo: Dict[str, Any], deadline: Optional[float]) -> Dict[str, Any]:
+        if not self.configurado:
+            raise ValueError("Servicio Gemini no configurado")
+        limite = time.monotonic() + (deadline or self.timeout_segundos)
+
+        for intento in range(self.max_reintentos + 1):
+            if not self.breaker.permitir():
+                self.rechazadas_por_circuito += 1
+                raise GeminiNoDisponible("Circuito de Gemini abierto")
+            restante = limite - time.monotonic()
+            if restante <= 0:
+                raise GeminiNoDisponible("Deadline de Gemini agotado")
+
+            respuesta = None
+            error: Optional[Exception] = None
+            self.llamadas += 1
+            try:
+                async with self._semaforo:
+                    respuesta = await asyncio.wait_for(
+                        self._http.post(ruta, json=cuerpo, timeout=min(restante, self.timeout_segundos)),
+                        timeout=restante
+                    )
+            except (httpx.TimeoutException, httpx.TransportError, asyncio.TimeoutError) as e:
+                error = e
+            except BaseException:
+                # Cancelada u otro error inesperado: sin resultado para el circuito
+                self.breaker.liberar()
+                raise
+
+            if respuesta is not None and respuesta.status_code < 400:
+                self.breaker.registrar(True)
+                return respuesta.json()
+
+            reintentable = error is not None or respuesta.status_code in ESTADOS_REINTENTABLES
+            if not reintentable:
+                # Error del cliente (400, 403...): Gemini responde, cuenta como éxito del circuito
+                self.breaker.registrar(True)
+                self.errores += 1
+                raise ErrorGemini(
+                    f"Gemini respondió {respuesta.status_code}: {respuesta.text[:200]}",
+                    status_code=respuesta.status_code
+                )
+
+            self.breaker.registrar(False)
+            descripcion = str(error) if error is not None else f"HTTP {respuesta.status_code}"
+            espera = self._espera_backoff(intento, respuesta)
+            if intento == self.max_reintentos or time.monotonic() + espera >= limite:
+                self.errores += 1
+                raise GeminiNoDisponible(f"Gemini no disponible tras {intento + 1} intentos: {descripcion}")
+            self.reintentos += 1
+            await asyncio.sleep(espera)
+
+        raise GeminiNoDisponible("Gemini no disponible")
+
+    def _registrar_uso(self, datos: Dict[str, Any]) -> None:
+        uso = datos.get("usageMetadata") or {}
+        self.tokens_entrada += uso.get("promptTokenCount", 0)
+        self.tokens_salida += uso.get("candidatesTokenCount", 0)
+
+    async def _generar(
+        self, contenido: Contenido, modelo: Optional[str], deadline: Optional[float], sistema: Optional[str] = None
+    ) -> str:
+        datos = await self._post(
+            f"/v1beta/models/{modelo or self.modelo}:generateContent",
+            _cuerpo(contenido, sistema),
+            deadline
+        )
+        self._registrar_uso(datos)
+        return _texto_respuesta(datos)
+
+    async def _embed_lote(self, textos: Sequence[str], modelo: str, deadline: Optional[float]) -> List[List[float]]:
+        modelo = modelo if modelo.startswith("models/") else f"models/{modelo}"
+        datos = await self._post(
+            f"/v1beta/{modelo}:batchEmbedContents",
+            {"requests": [
+                {"model": modelo, "content": {"parts": [{"text": texto}]}, "taskType": "RETRIEVAL_DOCUMENT"}
+                for texto in textos
+            ]},
+            deadline
+        )
+        return [e["values"] for e in datos.get("embeddings", [])]
+
+    async def _stream(
+        self, contenido: Contenido, modelo: Optional[str], deadline: Optional[float], sistema: Optional[str] = None
+    ) -> AsyncIterator[str]:
+        """
+        Fragmentos de texto (SSE)
+
+        Antes del primer fragmento los errores reintentables (conexión,
+        timeouts, HTTP 429/5xx con su Retry-After) se reintentan como en
+        _post. Después de emitir texto un fallo termina el stream con
+        GeminiNoDisponible: reintentar duplicaría lo ya entregado.
+
+        El deadline acota la espera de la respuesta (cabeceras), reintentos
+        incluidos; una vez que el stream fluye cada lectura tiene
+        timeout_segundos, así una respuesta larga no se corta por el deadline.
+        """
+        if not self.configurado:
+            raise ValueError("Servicio Gemini no configurado")
+        ruta = f"/v1beta/models/{modelo or self.modelo}:streamGenerateContent"
+        cuerpo = _cuerpo(contenido, sistema)
+        limite = time.monotonic() + (deadline or self.timeout_segundos)
+
+        for intento in range(self.max_reintentos + 1):
+            if not self.breaker.permitir():
+                self.rechazadas_por_circuito += 1
+                raise GeminiNoDisponible("Circuito de Gemini abierto")
+            restante = limite - time.monotonic()
+            if restante <= 0:
+                self.breaker.liberar()
+                raise GeminiNoDisponible("Deadline de Gemini agotado")
+
+            respuesta = None
+            error: Optional[Exception] = None
+            emitido = False
+            registrada = False
+            self.llamadas += 1
+            try:
+                async with self._semaforo:
+                    try:
+                        peticion = self._http.build_request(
+                            "POST", ruta, params={"alt": "sse"}, json=cuerpo, timeout=self.timeout_segundos
+                        )
+                        respuesta = await asyncio.wait_for(self._http.send(peticion, stream=True), timeout=restante)
+                        try:
+                            if respuesta.status_code < 400:
+                                async for linea in respuesta.aiter_lines():
+                                    if not linea.startswith("data:"):
+                                        continue
+                                    datos = json.loads(linea[5:])
+                                    # El último fragmento trae el uso total
+                                    if datos.get("usageMetadata", {}).get("candidatesTokenCount"):
+                                        self._registrar_uso(datos)
+                                    texto = _texto_respuesta(datos)
+                                    if texto:
+                                        emitido = True
+                                        yield texto
+                                self.breaker.registrar(True)
+                                registrada = True
+                                return
+                            await respuesta.aread()
+                        finally:
+                            await respuesta.aclose()
+                    except (httpx.TimeoutException, httpx.TransportError, asyncio.TimeoutError) as e:
+                        if emitido:
+                            self.breaker.registrar(False)
+                            registrada = True
+                            self.errores += 1
+                            raise GeminiNoDisponible(f"Gemini no disponible: {e}")
+                        respuesta = None
+                        error = e
+            except BaseException:
+                # Cliente desconectado (GeneratorExit/CancelledError) o fragmento
+                # ilegible: la llamada no dio resultado, no debe retener la prueba
+                if not registrada:
+                    self.breaker.liberar()
+                raise
+
+            reintentable = error is not None or respuesta.status_code in ESTADOS_REINTENTABLES
+            if not reintentable:
+                # Error del cliente (400, 403...): Gemini responde, cuenta como éxito del circuito
+                self.breaker.registrar(True)
+                self.errores += 1
+                raise ErrorGemini(
+                    f"Gemini respondió {respuesta.status_code}: {respuesta.text[:200]}",
+                    status_code=respuesta.status_code
+                )
+
+            self.breaker.registrar(False)
+            descripcion = str(error) if error is not None else f"HTTP {respuesta.status_code}"
+            espera = self._espera_backoff(intento, respuesta)
+            if intento == self.max_reintentos or time.monotonic() + espera >= limite:
+                self.errores += 1
+                raise GeminiNoDisponible(f"Gemini no disponible tras {intento + 1} intentos: {descripcion}")
+            self.reintentos += 1
+            await asyncio.sleep(espera)
+
+        raise GeminiNoDisponible("Gemini no disponible")
+
+    # --------------------------------------------------------
+    # API async (desde handlers async)
+    # --------------------------------------------------------
+
+    async def generar(
+        self,
+        contenido: Contenido,
+        modelo: Optional[str] = None,
+        deadline: Optional[float] = None,
+        sistema: Optional[str] = None
+    ) -> str:
+        """Texto generado para un prompt o una lista de turnos (con instrucción de sistema opcional)"""
+        return await self._en_loop_propio(self._generar(contenido, modelo, deadline, sistema))
+
+    async def embed_lote(self, textos: Sequence[str], modelo: str, deadline: Optional[float] = None) -> List[List[float]]:
+        return await self._en_loop_propio(self._embed_lote(textos, modelo, deadline))
+
+    # --------------------------------------------------------
+    # API sync (desde servicios que corren en el threadpool)
+    # --------------------------------------------------------
+
+    def generar_sync(
+        self,
+        contenido: Contenido,
+        modelo: Optional[str] = None,
+        deadline: Optional[float] = None,
+        sistema: Optional[str] = None
+    ) -> str:
+        return self._programar(self._generar(contenido, modelo, deadline, sistema)).result()
+
+    def embed_lote_sync(self, textos: Sequence[str], modelo: str, deadline: Optional[float] = None) -> List[List[float]]:
+        return self._programar(self._embed_lote(textos, modelo, deadline)).result()
+
+    def stream_sync(
+        self,
+        contenido: Contenido,
+        modelo: Optional[str] = None,
+        deadline: Optional[float] = None,
+        sistema: Optional[str] = None
+    ) -> Iterator[str]:
+        """
+        Iterador bloqueante sobre el stream. Si quien consume lo cierra
+        (generator.close()), se cancela la petición HTTP en curso.
+        """
+        loop = self._asegurar_loop()
+        agen = self._stream(contenido, modelo, deadline, sistema)
+        pendiente: Optional[Future] = None
+        try:
+            while True:
+                pendiente = asyncio.run_coroutine_threadsafe(agen.__anext__(), loop)
+                try:
+                    trozo = pendiente.result()
+                except StopAsyncIteration:
+                    return
+                pendiente = None
+                yield trozo
+        finally:
+            if pendiente is not None:
+                pendiente.cancel()
+            asyncio.run_coroutine_threadsafe(agen.aclose(), loop)
+
+    def estadisticas(self) -> Dict[str, Any]:
+        return {
+            'configurado': self.configurado,
+            'circuito': self.breaker.estado,
+            'aperturas_circuito': self.breaker.aperturas,
+            'llamadas': self.llamadas,
+            'reintentos': self.reintentos,
+            'errores': self.errores,
+            'tokens_entrada': self.tokens_entrada,
+            'tokens_salida': self.tokens_salida,
+            'rechazadas_por_circuito': self.rechazadas_por_circuito,
+        }
+
+
+# Instancia global compartida por todos los servicios Gemini
+cliente_gemini = ClienteGemini(
+    api_key=settings.GEMINI_API_KEY,
+    modelo=settings.GEMINI_MODEL,
+    base_url=settings.GEMINI_API_BASE_URL,
+    max_concurrencia=settings.GEMINI_MAX_CONCURRENCIA,
+    timeout_segundos=settings.GEMINI_TIMEOUT_SEGUNDOS,
+    max_reintentos=settings.GEMINI_MAX_REINTENTOS,
+    breaker=CircuitBreaker(
+        umbral_errores=settings.GEMINI_CIRCUITO_UMBRAL_ERRORES,
+        min_llamadas=settings.GEMINI_CIRCUITO_MIN_LLAMADAS,
+        ventana_segundos=settings.GEMINI_CIRCUITO_VENTANA_SEGUNDOS,
+        enfriamiento_segundos=settings.GEMINI_CIRCUITO_ENFRIAMIENTO_SEGUNDOS,
+        # Una prueba no puede durar más que una llamada completa con reintentos
+        timeout_prueba_segundos=2 * settings.GEMINI_TIMEOUT_SEGUNDOS
+    )
+)
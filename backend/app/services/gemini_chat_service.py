@@ -2,65 +2,127 @@
 from __future__ import annotations
 
 import os
+import sys
 import json
-from typing import Optional, List, Dict, Any
+from collections import deque
+from typing import Optional, List, Dict, Any, Iterator, Tuple
 from datetime import datetime
-import google.generativeai as genai
-from pydantic import BaseModel, Field
 
 from app.core.config import settings
+from app.services.session_state import AlmacenSesiones
+from app.services.gemini_async_client import ClienteGemini, GeminiNoDisponible, cliente_gemini
+from app.services.chat_prompt_budget import TOKENS_POR_TURNO, estimar_tokens, presupuesto_prompt
 
 
-class ChatMessage(BaseModel):
-    role: str = Field(..., description="Rol: 'user' o 'assistant'")
-    content: str = Field(..., description="Contenido del mensaje")
-    timestamp: datetime = Field(default_factory=datetime.utcnow)
-    
-    class Config:
-        arbitrary_types_allowed = True
+def respuesta_fallback(mensaje: str = "") -> str:
+    """Respuesta clínica segura cuando Gemini no está disponible"""
+    return (
+        "Puedo darte orientación general basada en buenas prácticas:\n\n"
+        "• Mantén rutinas predecibles y anticipa cambios.\n"
+        "• Usa apoyos visuales y lenguaje claro.\n"
+        "• Refuerza positivamente conductas adecuadas.\n"
+        "• Divide actividades en pasos pequeños.\n"
+        "• Ante rabietas: mantén la calma, valida la emoción y ofrece espacio tranquilo.\n\n"
+        "Si deseas recomendaciones más específicas, indica edad, nivel de apoyo y objetivo terapéutico."
+    )
 
 
-class ChatSession(BaseModel):
-    session_id: str
-    nino_id: int
-    usuario_id: int
-    messages: List[ChatMessage] = []
-    created_at: datetime = Field(default_factory=datetime.utcnow)
-    updated_at: datetime = Field(default_factory=datetime.utcnow)
-    
-    class Config:
-        arbitrary_types_allowed = True
+class ChatMessage:
+    """Mensaje de una sesión en memoria (role: 'user' o 'assistant')"""
+
+    __slots__ = ('role', 'content', 'timestamp')
+
+    def __init__(self, role: str, content: str, timestamp: Optional[datetime] = None):
+        self.role = role
+        self.content = content
+        self.timestamp = timestamp or datetime.utcnow()
+
+
+class ChatSession:
+    """
+    Sesión de chat en memoria
+
+    Conserva los últimos `max_mensajes` mensajes; los anteriores ya están
+    plegados en el resumen acumulado del presupuesto de tokens.
+    """
+
+    __slots__ = ('session_id', 'nino_id', 'usuario_id', 'messages', 'created_at', 'updated_at')
+
+    def __init__(
+        self,
+        session_id: str,
+        nino_id: int,
+        usuario_id: int,
+        max_mensajes: int = 100,
+        created_at: Optional[datetime] = None,
+        updated_at: Optional[datetime] = None
+    ):
+        ahora = datetime.utcnow()
+        self.session_id = session_id
+        self.nino_id = nino_id
+        self.usuario_id = usuario_id
+        self.messages: deque = deque(maxlen=max_mensajes)
+        self.created_at = created_at or ahora
+        self.updated_at = updated_at or ahora
+
+    def tamano_bytes(self) -> int:
+        """Bytes aproximados que ocupa la sesión"""
+        return sys.getsizeof(self.messages) + sum(
+            sys.getsizeof(m.content) + 120 for m in self.messages
+        )
+
+    def a_dict(self) -> Dict[str, Any]:
+        return {
+            "session_id": self.session_id,
+            "nino_id": self.nino_id,
+            "usuario_id": self.usuario_id,
+            "created_at": self.created_at.isoformat(),
+            "updated_at": self.updated_at.isoformat(),
+            "messages": [[m.role, m.content, m.timestamp.isoformat()] for m in self.messages],
+        }
+
+    @classmethod
+    def desde_dict(cls, datos: Dict[str, Any], max_mensajes: int = 100) -> "ChatSession":
+        session = cls(
+            datos["session_id"],
+            datos["nino_id"],
+            datos["usuario_id"],
+            max_mensajes=max_mensajes,
+            created_at=datetime.fromisoformat(datos["created_at"]),
+            updated_at=datetime.fromisoformat(datos["updated_at"])
+        )
+        session.messages.extend(
+            ChatMessage(role, content, datetime.fromisoformat(timestamp))
+            for role, content, timestamp in datos["messages"]
+        )
+        return session
 
 
 class GeminiChatService:
     """Servicio de chat integrado con Google Gemini AI"""
     
-    def __init__(self):
+    def __init__(self, cliente: ClienteGemini = cliente_gemini):
         """Inicializa el servicio de chat con Gemini"""
-        self.is_configured = False
+        # Cliente compartido (pool, deadline, reintentos y circuit breaker)
+        self.cliente = cliente
+        self.model_name = cliente.modelo
+        self.is_configured = cliente.configurado
+        
+        # Sesiones de chat en memoria: acotadas (LRU) y con caducidad por inactividad
+        self.max_mensajes = settings.CHAT_SESION_MAX_MENSAJES
+        self.chat_sessions: AlmacenSesiones[ChatSession] = AlmacenSesiones(
+            max_sesiones=settings.CHAT_SESIONES_MEMORIA_MAX,
+            ttl_segundos=settings.CHAT_SESIONES_TTL_SEGUNDOS,
+            nombre="sesiones de chat Gemini",
+            medir=ChatSession.tamano_bytes
+        )
         
         # Validar que la API key esté configurada
-        if not settings.GEMINI_API_KEY:
+        if not self.is_configured:
             print("⚠ ADVERTENCIA: GEMINI_API_KEY no está configurada.")
-            return
-        
-        try:
-            # Configurar la API de Google Generative AI
-            genai.configure(api_key=settings.GEMINI_API_KEY)
-            
-            # Usar GEMINI_MODEL (no GEMINI_MODEL_ID)
-            self.model_name = settings.GEMINI_MODEL
-            self.model = genai.GenerativeModel(self.model_name)
-            
-            self.is_configured = True
+        else:
             print(f"✓ Servicio Gemini inicializado con modelo: {self.model_name}")
-        except Exception as e:
-            print(f"⚠ Error al inicializar Gemini: {str(e)}")
-            return
-        
-        # Almacenar sesiones de chat en memoria (usar Redis en producción)
-        self.chat_sessions: Dict[str, ChatSession] = {}
-        
+
         # Sistema de prompt para el asistente
         self.system_prompt = """Eres un asistente especializado en apoyo educativo y emocional para niños con autismo.
 
@@ -81,38 +143,108 @@ Considera siempre:
 
 Responde siempre de manera amigable, positiva y motivadora."""
 
+    @property
+    def configured(self) -> bool:
+        """Alias usado por los endpoints de chat"""
+        return self.is_configured
+
+    @property
+    def model_id(self) -> Optional[str]:
+        return self.model_name if self.is_configured else None
+
+    def chat(
+        self,
+        mensaje: str,
+        contexto_nino: Optional[Dict[str, Any]] = None,
+        rol_usuario: str = "padre",
+        prompt: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """
+        Respuesta de un solo turno para el chatbot público
+
+        Args:
+            mensaje: Pregunta del usuario (ya sanitizada)
+            contexto_nino: Datos del niño (opcional)
+            rol_usuario: "padre", "terapeuta" o "educador"
+            prompt: Prompt completo ya construido (si None se arma uno básico)
+
+        Returns:
+            {"respuesta", "modelo"}; con el circuito abierto (o el deadline
+            agotado) la respuesta es la de respaldo y se añade "fallback": True
+        """
+        if not self.is_configured:
+            raise ValueError("Servicio Gemini no configurado")
+
+        if prompt is None:
+            prompt = f"{self.system_prompt}\n\nRol de quien pregunta: {rol_usuario}\n"
+            if contexto_nino:
+                prompt += "Contexto del niño: " + json.dumps(contexto_nino, ensure_ascii=False, default=str) + "\n"
+            prompt += f"\nPregunta: {mensaje}"
+
+        try:
+            return {"respuesta": self.cliente.generar_sync(prompt), "modelo": self.model_name}
+        except GeminiNoDisponible as e:
+            print(f"[WARN] Gemini no disponible, respuesta de respaldo: {e}")
+            return {"respuesta": respuesta_fallback(mensaje), "modelo": None, "fallback": True}
+        except Exception as e:
+            raise Exception(f"Error al obtener respuesta de Gemini: {str(e)}")
+
+    def chat_stream(self, prompt: str) -> Iterator[str]:
+        """
+        Igual que chat() pero entrega el texto por fragmentos conforme llega
+
+        Si quien consume deja de iterar (generator.close()), se deja de leer
+        el stream y la respuesta de Gemini se descarta.
+
+        Si Gemini no está disponible antes del primer fragmento se entrega
+        la respuesta de respaldo; a mitad de stream se propaga el error.
+        """
+        if not self.is_configured:
+            raise ValueError("Servicio Gemini no configurado")
+
+        yield from self._stream(self.cliente.stream_sync(prompt))
+
+    @staticmethod
+    def _stream(fuente: Iterator[str], mensaje: str = "") -> Iterator[str]:
+        entregados = False
+        try:
+            for texto in fuente:
+                entregados = True
+                yield texto
+        except GeneratorExit:
+            raise
+        except GeminiNoDisponible as e:
+            if entregados:
+                raise Exception(f"Error al obtener respuesta de Gemini: {str(e)}")
+            print(f"[WARN] Gemini no disponible, respuesta de respaldo: {e}")
+            yield respuesta_fallback(mensaje)
+        except Exception as e:
+            raise Exception(f"Error al obtener respuesta de Gemini: {str(e)}")
+        finally:
+            fuente.close()
+
     def create_chat_session(self, session_id: str, nino_id: int, usuario_id: int) -> ChatSession:
         """Crea una nueva sesión de chat"""
         if not self.is_configured:
             raise ValueError("Servicio Gemini no configurado")
             
-        session = ChatSession(
-            session_id=session_id,
-            nino_id=nino_id,
-            usuario_id=usuario_id,
-            created_at=datetime.utcnow(),
-            updated_at=datetime.utcnow()
-        )
-        self.chat_sessions[session_id] = session
-        return session
+        session = ChatSession(session_id, nino_id, usuario_id, max_mensajes=self.max_mensajes)
+        return self.chat_sessions.poner(session_id, session)
 
     def add_message_to_session(self, session_id: str, role: str, content: str) -> Optional[ChatMessage]:
         """Añade un mensaje a una sesión existente"""
-        if session_id not in self.chat_sessions:
+        session = self.chat_sessions.obtener(session_id)
+        if session is None:
             raise ValueError(f"Sesión {session_id} no encontrada")
         
-        message = ChatMessage(
-            role=role,
-            content=content,
-            timestamp=datetime.utcnow()
-        )
-        self.chat_sessions[session_id].messages.append(message)
-        self.chat_sessions[session_id].updated_at = datetime.utcnow()
+        message = ChatMessage(role, content)
+        session.messages.append(message)
+        session.updated_at = message.timestamp
         return message
 
     def get_session(self, session_id: str) -> Optional[ChatSession]:
         """Obtiene una sesión existente"""
-        return self.chat_sessions.get(session_id)
+        return self.chat_sessions.obtener(session_id)
 
     def get_chat_history(self, session_id: str) -> List[Dict[str, str]]:
         """Obtiene el historial de chat formateado para Gemini"""
@@ -123,63 +255,105 @@ Responde siempre de manera amigable, positiva y motivadora."""
         history = []
         for msg in session.messages:
             history.append({
-                "role": msg.role,
+                # La API solo admite los roles "user" y "model"
+                "role": "model" if msg.role == "assistant" else msg.role,
                 "parts": [{"text": msg.content}]
             })
         return history
 
-    def get_response(self, session_id: str, user_message: str) -> str:
-        """Obtiene una respuesta de Gemini basada en el historial de chat"""
+    def _iniciar_chat(self, session_id: str, user_message: str) -> Tuple[str, List[Dict[str, Any]]]:
+        """
+        Instrucción de sistema y turnos para Gemini dentro del presupuesto de tokens
+
+        El prompt de sistema va como systemInstruction (no como intercambio
+        falso); del historial entran los turnos recientes que quepan y el
+        resumen acumulado de los anteriores se añade a la instrucción.
+        """
         if not self.is_configured:
             raise ValueError("Servicio Gemini no configurado")
             
         session = self.get_session(session_id)
         if not session:
             raise ValueError(f"Sesión {session_id} no encontrada")
-        
+
+        turnos = [{"role": msg.role, "text": msg.content} for msg in session.messages]
+        resumen, recientes = presupuesto_prompt.recortar(
+            session_id,
+            turnos,
+            presupuesto_prompt.disponible(self.system_prompt, user_message),
+            ventana=self.max_mensajes
+        )
+        sistema = self.system_prompt
+        if resumen:
+            sistema += f"\n\nResumen de la conversación anterior:\n{resumen}"
+
+        contenidos = [
+            # La API solo admite los roles "user" y "model"
+            {"role": "model" if t["role"] == "assistant" else t["role"], "parts": [{"text": t["text"]}]}
+            for t in recientes
+        ]
+        contenidos.append({"role": "user", "parts": [{"text": user_message}]})
+
+        historial = sum(estimar_tokens(t["text"]) + TOKENS_POR_TURNO for t in recientes)
+        presupuesto_prompt.registrar({
+            "sistema": estimar_tokens(self.system_prompt),
+            "contexto": 0,
+            "resumen": estimar_tokens(resumen),
+            "historial": historial,
+            "pregunta": estimar_tokens(user_message),
+            "total": estimar_tokens(sistema) + historial + estimar_tokens(user_message),
+            "turnos_incluidos": len(recientes),
+            "turnos_omitidos": len(turnos) - len(recientes),
+        })
+        return sistema, contenidos
+
+    def get_response(self, session_id: str, user_message: str) -> str:
+        """Obtiene una respuesta de Gemini basada en el historial de chat"""
+        sistema, contenidos = self._iniciar_chat(session_id, user_message)
         try:
-            # Obtener historial de chat
-            history = self.get_chat_history(session_id)
-            
-            # Crear contexto con el sistema prompt
-            context_message = {
-                "role": "user",
-                "parts": [{"text": self.system_prompt}]
-            }
-            system_response = {
-                "role": "model",
-                "parts": [{"text": "Entendido. Seré un asistente especializado en apoyo para niños con autismo."}]
-            }
-            
-            # Combinar historial completo
-            full_history = [context_message, system_response] + history
-            
-            # Iniciar chat con Gemini
-            chat = self.model.start_chat(history=full_history)
-            response = chat.send_message(user_message)
-            
-            return response.text
-            
+            return self.cliente.generar_sync(contenidos, sistema=sistema)
+        except GeminiNoDisponible as e:
+            print(f"[WARN] Gemini no disponible, respuesta de respaldo: {e}")
+            return respuesta_fallback(user_message)
         except Exception as e:
             raise Exception(f"Error al obtener respuesta de Gemini: {str(e)}")
 
+    def get_response_stream(self, session_id: str, user_message: str) -> Iterator[str]:
+        """get_response() entregando el texto por fragmentos conforme llega"""
+        sistema, contenidos = self._iniciar_chat(session_id, user_message)
+        yield from self._stream(self.cliente.stream_sync(contenidos, sistema=sistema), user_message)
+
     def delete_session(self, session_id: str) -> bool:
         """Elimina una sesión de chat"""
-        if session_id in self.chat_sessions:
-            del self.chat_sessions[session_id]
-            return True
-        return False
+        return self.chat_sessions.descartar(session_id)
 
     def list_sessions(self, usuario_id: int) -> List[ChatSession]:
         """Lista todas las sesiones de un usuario"""
         return [
-            session for session in self.chat_sessions.values()
+            session for session in self.chat_sessions.valores()
             if session.usuario_id == usuario_id
         ]
 
     def clear_all_sessions(self):
         """Limpia todas las sesiones (usar con cuidado)"""
-        self.chat_sessions.clear()
+        self.chat_sessions.limpiar()
+
+    # --------------------------------------------------------
+    # Snapshot (reinicio del worker sin perder conversaciones)
+    # --------------------------------------------------------
+
+    def guardar_sesiones(self, directorio) -> int:
+        """Snapshot de las sesiones de este worker (directorio no servido, 0600)"""
+        return self.chat_sessions.guardar_snapshot_worker(directorio, "sesiones_chat", ChatSession.a_dict)
+
+    def cargar_sesiones(self, directorio) -> int:
+        """Restaura el snapshot de un worker anterior (cada uno se carga una sola vez)"""
+        return self.chat_sessions.reclamar_snapshot(
+            directorio, "sesiones_chat", lambda datos: ChatSession.desde_dict(datos, self.max_mensajes)
+        )
+
+    def estadisticas_sesiones(self) -> Dict[str, Any]:
+        return self.chat_sessions.estadisticas()
 
 
 # Inicializar el servicio de forma segura
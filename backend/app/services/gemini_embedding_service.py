@@ -1,32 +1,47 @@
 # app/services/gemini_embedding_service.py
 import numpy as np
-import google.generativeai as genai
-from typing import List
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Sequence, Tuple
 
 from app.core.config import settings
+from app.services.embedding_cache import embedding_cache
+from app.services.embedding_backends import (
+    EmbeddingBackend,
+    GeminiEmbeddingBackend,
+    LocalHashingBackend,
+)
 
 
 class GeminiEmbeddingService:
     """
     Servicio de embeddings para similitud de contenidos.
     Usado en TOPSIS, recomendaciones y búsqueda semántica.
+    
+    El backend se elige con EMBEDDING_BACKEND ("auto", "gemini", "local").
+    En "auto" se usa Gemini si hay API key y el backend local si no.
+    El backend local es además el fallback cuando Gemini falla; cada
+    vector se guarda con el nombre del backend que lo generó.
     """
 
     def __init__(self):
         api_key = settings.GEMINI_API_KEY
         self.configured = False
+        self.model = "models/embedding-001"
+        self.cache = embedding_cache
+        self.local: EmbeddingBackend = LocalHashingBackend()
+        self.backend: EmbeddingBackend = self.local
+
+        if settings.EMBEDDING_BACKEND == "local":
+            print("[OK] Embeddings locales (sin red)")
+            return
 
         if not api_key:
-            print("[WARN] Embeddings Gemini no configurados.")
+            print("[WARN] Embeddings Gemini no configurados, usando backend local.")
             return
 
-        try:
-            genai.configure(api_key=api_key)
-            self.model = "models/embedding-001"
-            self.configured = True
-            print("[OK] Gemini Embeddings listo")
-        except Exception as e:
-            print(f"[WARN] Error configurando embeddings: {e}")
+        self.backend = GeminiEmbeddingBackend(self.model)
+        self.configured = True
+        print("[OK] Gemini Embeddings listo")
 
     def embed(self, text: str) -> List[float]:
         """
@@ -38,19 +53,103 @@ class GeminiEmbeddingService:
         Returns:
             Vector de 768 dimensiones
         """
-        if not self.configured:
-            return self._hash_embedding(text)
+        return self.embed_lote([text])[0]
+
+    @property
+    def modelo(self) -> str:
+        """Nombre del backend principal (el que deben tener los vectores indexados)"""
+        return self.backend.nombre
+
+    def embed_lote(
+        self,
+        textos: Sequence[str],
+        max_concurrencia: Optional[int] = None,
+        tamano_lote: Optional[int] = None
+    ) -> List[List[float]]:
+        """
+        Genera embeddings para muchos textos.
+        
+        Returns:
+            Vectores en el mismo orden que `textos` (ver embed_lote_con_modelo)
+        """
+        return self.embed_lote_con_modelo(textos, max_concurrencia, tamano_lote)[0]
 
+    def embed_lote_con_modelo(
+        self,
+        textos: Sequence[str],
+        max_concurrencia: Optional[int] = None,
+        tamano_lote: Optional[int] = None
+    ) -> Tuple[List[List[float]], str]:
+        """
+        Genera embeddings para muchos textos e informa qué backend los generó.
+        
+        Los textos repetidos o ya cacheados no se envían; el resto se manda
+        al backend en lotes de `tamano_lote` textos por llamada, con a lo
+        sumo `max_concurrencia` llamadas simultáneas.
+        
+        Todos los vectores de una llamada salen del mismo backend: si falla
+        un lote de Gemini, la llamada completa se resuelve con el local.
+        Ambos tienen 768 dimensiones pero espacios distintos, así que no se
+        deben comparar entre sí.
+        
+        Args:
+            textos: Textos a vectorizar
+            max_concurrencia: Llamadas simultáneas al backend
+            tamano_lote: Textos por llamada
+            
+        Returns:
+            (vectores en el mismo orden que `textos`, nombre del backend)
+        """
+        backend = self.backend
         try:
-            res = genai.embed_content(
-                model=self.model,
-                content=text,
-                task_type="retrieval_document",
-            )
-            return res["embedding"]
+            return self._embed_con(backend, textos, max_concurrencia, tamano_lote), backend.nombre
         except Exception as e:
-            print(f"[WARN] Error generando embedding: {e}")
-            return self._hash_embedding(text)
+            if backend is self.local:
+                raise
+            print(f"[WARN] Error generando {len(textos)} embeddings, se usa el backend local: {e}")
+            return self._embed_con(self.local, textos, max_concurrencia, tamano_lote), self.local.nombre
+
+    def _embed_con(
+        self,
+        backend: EmbeddingBackend,
+        textos: Sequence[str],
+        max_concurrencia: Optional[int],
+        tamano_lote: Optional[int]
+    ) -> List[List[float]]:
+        """Vectores de un solo backend, pasando por la caché"""
+        max_concurrencia = min(
+            max_concurrencia or settings.EMBEDDING_CONCURRENCIA,
+            backend.concurrencia_maxima
+        )
+        tamano_lote = tamano_lote or settings.EMBEDDING_LOTE
+
+        unicos = list(dict.fromkeys(textos))
+        vectores = self.cache.obtener_varios(backend.nombre, unicos)
+        pendientes = [t for t in unicos if t not in vectores]
+
+        if pendientes:
+            lotes = [
+                pendientes[i:i + tamano_lote]
+                for i in range(0, len(pendientes), tamano_lote)
+            ]
+            embed = lambda lote: self._embed_backend_lote(backend, lote)
+            if max_concurrencia <= 1 or len(lotes) == 1:
+                resultados = map(embed, lotes)
+            else:
+                with ThreadPoolExecutor(max_workers=min(max_concurrencia, len(lotes))) as pool:
+                    resultados = list(pool.map(embed, lotes))
+            for lote, resultado in zip(lotes, resultados):
+                vectores.update(zip(lote, resultado))
+
+        return [vectores[t].tolist() for t in textos]
+
+    def _embed_backend_lote(self, backend: EmbeddingBackend, lote: List[str]) -> List[np.ndarray]:
+        """Una llamada al backend para varios textos (guardados en caché)"""
+        matriz = backend.embed_lote(lote)
+        return [
+            self.cache.guardar(backend.nombre, texto, vector)
+            for texto, vector in zip(lote, matriz)
+        ]
 
     def embed_perfil_nino(self, datos_nino: dict) -> tuple[List[float], str]:
         """
@@ -62,17 +161,7 @@ class GeminiEmbeddingService:
         Returns:
             Tupla (embedding, texto_perfil)
         """
-        texto = f"""
-Perfil del niño: {datos_nino.get('nombre', '')}
-Edad: {datos_nino.get('edad', '')} años
-Diagnósticos: {', '.join(datos_nino.get('diagnosticos', []))}
-Dificultades: {', '.join(datos_nino.get('dificultades', []))}
-Fortalezas: {', '.join(datos_nino.get('fortalezas', []))}
-Notas clínicas: {datos_nino.get('notas_clinicas', '')}
-Sensibilidades: {', '.join(datos_nino.get('sensibilidades', []))}
-Áreas prioritarias: {', '.join(datos_nino.get('areas_prioritarias', []))}
-        """.strip()
-        
+        texto = self.texto_perfil_nino(datos_nino)
         embedding = self.embed(texto)
         return embedding, texto
 
@@ -86,7 +175,28 @@ Sensibilidades: {', '.join(datos_nino.get('sensibilidades', []))}
         Returns:
             Tupla (embedding, texto_actividad)
         """
-        texto = f"""
+        texto = self.texto_actividad(datos_actividad)
+        embedding = self.embed(texto)
+        return embedding, texto
+
+    @staticmethod
+    def texto_perfil_nino(datos_nino: dict) -> str:
+        """Texto que se vectoriza para el perfil de un niño"""
+        return f"""
+Perfil del niño: {datos_nino.get('nombre', '')}
+Edad: {datos_nino.get('edad', '')} años
+Diagnósticos: {', '.join(datos_nino.get('diagnosticos', []))}
+Dificultades: {', '.join(datos_nino.get('dificultades', []))}
+Fortalezas: {', '.join(datos_nino.get('fortalezas', []))}
+Notas clínicas: {datos_nino.get('notas_clinicas', '')}
+Sensibilidades: {', '.join(datos_nino.get('sensibilidades', []))}
+Áreas prioritarias: {', '.join(datos_nino.get('areas_prioritarias', []))}
+        """.strip()
+
+    @staticmethod
+    def texto_actividad(datos_actividad: dict) -> str:
+        """Texto que se vectoriza para una actividad"""
+        return f"""
 Actividad: {datos_actividad.get('nombre', '')}
 Descripción: {datos_actividad.get('descripcion', '')}
 Objetivo: {datos_actividad.get('objetivo', '')}
@@ -95,9 +205,6 @@ Tags: {', '.join(datos_actividad.get('tags', []))}
 Nivel de dificultad: {datos_actividad.get('dificultad', '')}
 Materiales: {datos_actividad.get('materiales', '')}
         """.strip()
-        
-        embedding = self.embed(texto)
-        return embedding, texto
 
     def similitud_coseno(
         self, vector1: List[float], vector2: List[float]
@@ -128,18 +235,6 @@ Materiales: {datos_actividad.get('materiales', '')}
             print(f"❌ Error en similitud: {e}")
             return 0.0
 
-    @staticmethod
-    def _hash_embedding(text: str) -> List[float]:
-        """
-        Fallback: genera embedding determinista basado en hash.
-        Útil cuando Gemini API no está disponible.
-        """
-        import hashlib
-
-        h = int(hashlib.md5(text.encode()).hexdigest(), 16)
-        np.random.seed(h % (2**32))
-        return np.random.rand(768).tolist()
-
 
 # Singleton
 gemini_embedding_service = GeminiEmbeddingService()
@@ -8,10 +8,10 @@ Para nuevo código, usa:
 from __future__ import annotations
 
 from typing import List, Dict, Optional
-import google.generativeai as genai
 
-from app.core.config import settings
-from app.services.gemini_chat_service import gemini_chat_service
+from app.services.gemini_async_client import GeminiNoDisponible, cliente_gemini
+from app.services.gemini_chat_service import gemini_chat_service, respuesta_fallback
+from app.services.gemini_embedding_service import gemini_embedding_service
 
 
 # =====================================================
@@ -27,19 +27,16 @@ class GeminiService:
     """
 
     def __init__(self):
-        self.is_configured = False
+        # Servicios delegados (disponibles aun sin API key: tienen fallback)
+        self.chat_service = gemini_chat_service
+        self.embedding_service = gemini_embedding_service
+        # Cliente compartido con el chat y los embeddings
+        self.cliente = cliente_gemini
+        self.model_name = cliente_gemini.modelo
+        self.is_configured = cliente_gemini.configurado
         
-        if not settings.GEMINI_API_KEY:
+        if not self.is_configured:
             print("⚠ ADVERTENCIA: GEMINI_API_KEY no está configurada")
-            return
-        
-        try:
-            genai.configure(api_key=settings.GEMINI_API_KEY)
-            self.model_name = settings.GEMINI_MODEL
-            self.model = genai.GenerativeModel(self.model_name)
-            self.is_configured = True
-        except Exception as e:
-            print(f"⚠ Error al configurar Gemini: {str(e)}")
     
     # ----- Chatbot (delegado) -----
     def chat(
@@ -91,19 +88,86 @@ class GeminiService:
         """
         return self.embedding_service.similitud_coseno(vector1, vector2)
 
+    # ----- Explicaciones de recomendaciones -----
+    def explicar_recomendacion_actividades(
+        self,
+        nombre_nino: str,
+        perfil_nino: Optional[str],
+        actividades_recomendadas: List[Dict],
+    ) -> str:
+        """
+        Explica en lenguaje claro por qué se recomiendan las actividades.
+        Sin Gemini (o si falla) devuelve una explicación de plantilla.
+        """
+        lista = "\n".join(
+            f"- {a.get('nombre')} (área: {a.get('area_desarrollo') or 'general'}, "
+            f"afinidad: {a.get('score', 0):.0%})"
+            for a in actividades_recomendadas
+        )
+        if self.is_configured:
+            prompt = f"""
+Eres un coordinador clínico de un centro de atención a niños con autismo.
+Explica de forma breve y clara (máximo 150 palabras) a terapeutas y padres por qué
+estas actividades son adecuadas para {nombre_nino}.
+
+Perfil del niño:
+{perfil_nino or 'No disponible'}
+
+Actividades recomendadas:
+{lista}
+            """
+            try:
+                return self.cliente.generar_sync(prompt)
+            except Exception as e:
+                print(f"[WARN] Error generando explicación de actividades: {e}")
+
+        return (
+            f"Las siguientes actividades se seleccionaron para {nombre_nino} por su "
+            f"afinidad con su perfil clínico:\n{lista}"
+        )
+
+    def explicar_seleccion_terapeuta(
+        self,
+        nombre_nino: str,
+        terapia_tipo: str,
+        terapeuta_seleccionado: Dict,
+        criterios_topsis: Dict,
+        ranking_top3: List[Dict],
+    ) -> str:
+        """
+        Explica por qué el terapeuta seleccionado por TOPSIS es la mejor opción.
+        Sin Gemini (o si falla) devuelve una explicación de plantilla.
+        """
+        ranking = "\n".join(
+            f"{i}. {t.get('nombre')} (score: {t.get('score', 0):.3f})"
+            for i, t in enumerate(ranking_top3, start=1)
+        )
+        if self.is_configured:
+            prompt = f"""
+Eres un coordinador clínico. Explica de forma breve (máximo 120 palabras) por qué
+{terapeuta_seleccionado.get('nombre')} es el terapeuta más adecuado de {terapia_tipo}
+para {nombre_nino}, según el método TOPSIS.
+
+Criterios y pesos: {criterios_topsis}
+
+Top 3 del ranking:
+{ranking}
+            """
+            try:
+                return self.cliente.generar_sync(prompt)
+            except Exception as e:
+                print(f"[WARN] Error generando explicación de terapeuta: {e}")
+
+        return (
+            f"{terapeuta_seleccionado.get('nombre')} obtuvo el mejor score TOPSIS para "
+            f"{terapia_tipo} considerando los criterios evaluados.\nRanking:\n{ranking}"
+        )
+
     # ----- Fallbacks clínicos -----
     @staticmethod
     def _fallback_response(mensaje: str) -> str:
         """Respuesta clínica segura."""
-        return (
-            "Puedo darte orientación general basada en buenas prácticas:\n\n"
-            "• Mantén rutinas predecibles y anticipa cambios.\n"
-            "• Usa apoyos visuales y lenguaje claro.\n"
-            "• Refuerza positivamente conductas adecuadas.\n"
-            "• Divide actividades en pasos pequeños.\n"
-            "• Ante rabietas: mantén la calma, valida la emoción y ofrece espacio tranquilo.\n\n"
-            "Si deseas recomendaciones más específicas, indica edad, nivel de apoyo y objetivo terapéutico."
-        )
+        return respuesta_fallback(mensaje)
 
     # ----- Plantillas por defecto -----
     @staticmethod
@@ -202,9 +266,9 @@ Por favor, proporciona:
 5. Próximos pasos sugeridos
             """
             
-            response = self.model.generate_content(prompt)
-            return response.text
-            
+            return await self.cliente.generar(prompt)
+        except GeminiNoDisponible:
+            return respuesta_fallback()
         except Exception as e:
             raise Exception(f"Error al generar recomendación: {str(e)}")
     
@@ -226,9 +290,9 @@ Por favor, proporciona:
 4. Cuándo buscar ayuda profesional
             """
             
-            response = self.model.generate_content(prompt)
-            return response.text
-            
+            return await self.cliente.generar(prompt)
+        except GeminiNoDisponible:
+            return respuesta_fallback()
         except Exception as e:
             raise Exception(f"Error al analizar comportamiento: {str(e)}")
     
@@ -238,8 +302,9 @@ Por favor, proporciona:
             raise ValueError("Servicio Gemini no está configurado")
             
         try:
-            response = self.model.generate_content(prompt)
-            return response.text
+            return await self.cliente.generar(prompt)
+        except GeminiNoDisponible:
+            return respuesta_fallback()
         except Exception as e:
             raise Exception(f"Error al generar contenido: {str(e)}")
 
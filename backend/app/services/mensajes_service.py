@@ -0,0 +1,115 @@
+# app/services/mensajes_service.py
+"""
+Consultas de la bandeja de chats entre usuarios
+
+listar_chats_usuario arma la lista de conversaciones en una sola sentencia
+(antes: 4 consultas por conversación): último mensaje por ROW_NUMBER(),
+no leídos agrupados por conversación y nombre del niño por JOIN. Requiere
+MySQL 8 (funciones de ventana); los índices que la respaldan están en
+app/models/mensajes.py y sql/mensajes_indices.sql.
+"""
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import and_, desc, func, select
+from sqlalchemy.orm import Session
+
+from app.models.mensajes import (
+    Conversacion, ConversacionParticipante, Mensaje, MensajeArchivo, MensajeVisto
+)
+from app.models.nino import Nino
+
+
+def listar_chats_usuario(db: Session, usuario_id: int, nino_id: Optional[int] = None) -> List[Dict[str, Any]]:
+    """Conversaciones activas del usuario, más recientes primero (una consulta)"""
+    # Último mensaje no eliminado de cada conversación del usuario
+    mis_conversaciones = select(ConversacionParticipante.conversacion_id).where(
+        ConversacionParticipante.usuario_id == usuario_id,
+        ConversacionParticipante.activo == True
+    )
+    ultimos = select(
+        Mensaje.id,
+        Mensaje.conversacion_id,
+        Mensaje.tipo,
+        Mensaje.contenido,
+        func.row_number().over(
+            partition_by=Mensaje.conversacion_id,
+            order_by=(desc(Mensaje.created_at), desc(Mensaje.id))
+        ).label("orden")
+    ).where(
+        Mensaje.conversacion_id.in_(mis_conversaciones),
+        Mensaje.eliminado == False
+    ).subquery("ultimos")
+    
+    # Nombre del primer archivo adjunto (solo se usa si el último mensaje es ARCHIVO)
+    archivo_nombre = select(MensajeArchivo.nombre_original).where(
+        MensajeArchivo.mensaje_id == ultimos.c.id
+    ).order_by(MensajeArchivo.id).limit(1).scalar_subquery()
+    
+    # No leídos del usuario por conversación
+    no_leidos = select(
+        Mensaje.conversacion_id,
+        func.count(MensajeVisto.id).label("total")
+    ).join(
+        Mensaje, Mensaje.id == MensajeVisto.mensaje_id
+    ).where(
+        MensajeVisto.usuario_id == usuario_id,
+        MensajeVisto.visto == False
+    ).group_by(Mensaje.conversacion_id).subquery("no_leidos")
+    
+    query = select(
+        Conversacion.id,
+        Conversacion.nino_id,
+        Conversacion.updated_at,
+        Nino.nombre.label("nino_nombre"),
+        ultimos.c.tipo,
+        ultimos.c.contenido,
+        archivo_nombre.label("archivo_nombre"),
+        func.coalesce(no_leidos.c.total, 0).label("no_leidos")
+    ).join(
+        ConversacionParticipante,
+        and_(
+            ConversacionParticipante.conversacion_id == Conversacion.id,
+            ConversacionParticipante.usuario_id == usuario_id,
+            ConversacionParticipante.activo == True
+        )
+    ).outerjoin(
+        Nino, Nino.id == Conversacion.nino_id
+    ).outerjoin(
+        ultimos, and_(ultimos.c.conversacion_id == Conversacion.id, ultimos.c.orden == 1)
+    ).outerjoin(
+        no_leidos, no_leidos.c.conversacion_id == Conversacion.id
+    ).where(
+        Conversacion.activa == True
+    )
+    
+    if nino_id:
+        query = query.where(Conversacion.nino_id == nino_id)
+    
+    filas = db.execute(query.order_by(desc(Conversacion.updated_at))).all()
+    
+    resultado = []
+    
+    for fila in filas:
+        ultimo_mensaje = ""
+        if fila.tipo == "TEXTO":
+            ultimo_mensaje = (fila.contenido or "")[:50]
+        elif fila.tipo == "AUDIO":
+            ultimo_mensaje = "🎤 Mensaje de audio"
+        elif fila.tipo == "ARCHIVO":
+            ultimo_mensaje = f"📎 {fila.archivo_nombre}" if fila.archivo_nombre else "📎 Archivo"
+        
+        # Construir título
+        if fila.nino_id:
+            titulo = f"Chat - {fila.nino_nombre or 'Niño'}"
+        else:
+            titulo = "Chat General"
+        
+        resultado.append({
+            "conversacionId": fila.id,
+            "titulo": titulo,
+            "ultimoMensaje": ultimo_mensaje,
+            "noLeidos": fila.no_leidos or 0,
+            "ultimaActualizacion": fila.updated_at.isoformat()
+        })
+    
+    return resultado
@@ -0,0 +1,410 @@
+# app/services/pubsub.py
+"""
+Bus de eventos pub/sub para el tiempo real (chat y notificaciones)
+
+Los WebSockets viven en el proceso que los aceptó; con varios workers de
+uvicorn un evento publicado en el worker A debe llegar a los sockets del
+worker B. Los managers publican aquí y se suscriben por canal
+("conversacion:12", "notificaciones:padre:5"), nunca a todo.
+
+- BusLocal: un solo proceso; entrega directa a los receptores.
+- BusUnix: varios procesos en la misma máquina. Un broker embebido
+  escucha en un socket Unix; cada worker se conecta, le indica los canales
+  que tiene abiertos (S/U) y publica (P). El broker solo reenvía cada
+  evento a los workers suscritos a ese canal y nunca de vuelta al emisor
+  (el emisor entrega localmente sin pasar por el socket). El broker lo
+  hospeda el primer worker que toma el lock del archivo; si ese worker
+  muere, los demás se reconectan y otro toma el relevo.
+
+Protocolo (una línea por trama, el texto es JSON compacto sin saltos):
+    S <canal> | U <canal> | P <canal> <excluir|-> <texto>  (worker -> broker)
+    M <canal> <excluir|-> <texto>                          (broker -> worker)
+
+`publicar` se puede llamar desde cualquier hilo (endpoints síncronos en el
+threadpool); suscribir y los receptores corren en el event loop.
+"""
+import asyncio
+import logging
+import os
+import socket
+import tempfile
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional, Set
+
+from app.core.config import settings
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# receptor(texto, excluir): excluir es la clave de conexión a omitir (o None)
+Receptor = Callable[[str, Optional[str]], None]
+
+# Tamaño máximo de una trama y del buffer de salida por conexión
+LIMITE_TRAMA = 1 << 20
+MAX_BUFFER_SALIDA = 8 << 20
+
+
+class BusEventos:
+    """Base: receptores locales por canal y entrega en el event loop"""
+
+    nombre = "local"
+
+    def __init__(self):
+        self._receptores: Dict[str, Set[Receptor]] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self.publicados = 0
+        self.entregas_locales = 0
+        self.errores_receptor = 0
+
+    async def iniciar(self) -> None:
+        self._loop = asyncio.get_running_loop()
+
+    async def cerrar(self) -> None:
+        self._receptores.clear()
+
+    # --------------------------------------------------------
+    # Suscripción (desde el event loop)
+    # --------------------------------------------------------
+
+    def suscribir(self, canal: str, receptor: Receptor) -> None:
+        if self._loop is None:
+            self._loop = asyncio.get_running_loop()
+        receptores = self._receptores.setdefault(canal, set())
+        primero = not receptores
+        receptores.add(receptor)
+        if primero:
+            self._canal_abierto(canal)
+
+    def desuscribir(self, canal: str, receptor: Receptor) -> None:
+        receptores = self._receptores.get(canal)
+        if not receptores or receptor not in receptores:
+            return
+        receptores.discard(receptor)
+        if not receptores:
+            del self._receptores[canal]
+            self._canal_cerrado(canal)
+
+    def canales(self) -> Set[str]:
+        return set(self._receptores)
+
+    # --------------------------------------------------------
+    # Publicación (desde cualquier hilo)
+    # --------------------------------------------------------
+
+    def publicar(self, canal: str, texto: str, excluir: Optional[str] = None) -> None:
+        """Publica un evento ya serializado; no espera ningún envío"""
+        self.publicados += 1
+        try:
+            en_loop = asyncio.get_running_loop() is self._loop
+        except RuntimeError:
+            en_loop = False
+        if en_loop:
+            self._publicar_en_loop(canal, texto, excluir)
+        elif self._loop is not None and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._publicar_en_loop, canal, texto, excluir)
+
+    def _publicar_en_loop(self, canal: str, texto: str, excluir: Optional[str]) -> None:
+        self._entregar(canal, texto, excluir)
+        self._reenviar(canal, texto, excluir)
+
+    def _entregar(self, canal: str, texto: str, excluir: Optional[str]) -> None:
+        for receptor in list(self._receptores.get(canal, ())):
+            try:
+                receptor(texto, excluir)
+                self.entregas_locales += 1
+            except Exception as e:
+                self.errores_receptor += 1
+                logger.error(f"[pubsub] Error en receptor de {canal}: {e!r}")
+
+    # Puntos de extensión de los buses entre procesos
+    def _canal_abierto(self, canal: str) -> None:
+        pass
+
+    def _canal_cerrado(self, canal: str) -> None:
+        pass
+
+    def _reenviar(self, canal: str, texto: str, excluir: Optional[str]) -> None:
+        pass
+
+    def estadisticas(self) -> Dict[str, Any]:
+        return {
+            'backend': self.nombre,
+            'canales': len(self._receptores),
+            'publicados': self.publicados,
+            'entregas_locales': self.entregas_locales,
+            'errores_receptor': self.errores_receptor,
+        }
+
+
+class BusLocal(BusEventos):
+    """Bus de un solo proceso"""
+
+
+# ============================================================
+# Broker embebido sobre socket Unix
+# ============================================================
+
+class _BrokerUnix:
+    """Enruta tramas P a los workers suscritos al canal"""
+
+    def __init__(self, max_buffer: int = MAX_BUFFER_SALIDA):
+        self.max_buffer = max_buffer
+        self._suscriptores: Dict[str, Set[asyncio.StreamWriter]] = {}
+        self._clientes: Set[asyncio.StreamWriter] = set()
+        self.servidor: Optional[asyncio.AbstractServer] = None
+        self.enrutados = 0
+        self.descartados = 0
+
+    async def iniciar(self, ruta: str) -> None:
+        self.servidor = await asyncio.start_unix_server(self._atender, path=ruta, limit=LIMITE_TRAMA)
+
+    async def cerrar(self) -> None:
+        if self.servidor is not None:
+            self.servidor.close()
+            for escritor in list(self._clientes):
+                escritor.close()
+            self._suscriptores.clear()
+            self.servidor = None
+
+    async def _atender(self, lector: asyncio.StreamReader, escritor: asyncio.StreamWriter) -> None:
+        self._clientes.add(escritor)
+        canales: Set[str] = set()
+        try:
+            while True:
+                linea = await lector.readline()
+                if not linea:
+                    break
+                operacion, canal = linea[:1], linea[2:].split(b' ', 1)[0].rstrip(b'\n').decode()
+                if operacion == b'P':
+                    self._enrutar(canal, b'M' + linea[1:], escritor)
+                elif operacion == b'S':
+                    canales.add(canal)
+                    self._suscriptores.setdefault(canal, set()).add(escritor)
+                elif operacion == b'U':
+                    canales.discard(canal)
+                    self._quitar(canal, escritor)
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        except asyncio.CancelledError:
+            # Al apagar el loop: terminar sin propagar (evita ruido de asyncio)
+            pass
+        finally:
+            self._clientes.discard(escritor)
+            for canal in canales:
+                self._quitar(canal, escritor)
+            escritor.close()
+
+    def _quitar(self, canal: str, escritor: asyncio.StreamWriter) -> None:
+        escritores = self._suscriptores.get(canal)
+        if escritores is not None:
+            escritores.discard(escritor)
+            if not escritores:
+                del self._suscriptores[canal]
+
+    def _enrutar(self, canal: str, trama: bytes, origen: asyncio.StreamWriter) -> None:
+        for escritor in self._suscriptores.get(canal, ()):
+            if escritor is origen:
+                continue
+            # Worker que no lee: se descarta para no crecer sin límite
+            if escritor.transport.get_write_buffer_size() > self.max_buffer:
+                self.descartados += 1
+                continue
+            escritor.write(trama)
+            self.enrutados += 1
+
+
+class BusUnix(BusEventos):
+    """Bus entre procesos de la misma máquina vía broker en socket Unix"""
+
+    nombre = "unix"
+
+    def __init__(self, ruta: str, reintento_segundos: float = 0.5):
+        super().__init__()
+        self.ruta = ruta
+        self.reintento_segundos = reintento_segundos
+        self._escritor: Optional[asyncio.StreamWriter] = None
+        self._tarea: Optional[asyncio.Task] = None
+        self._broker: Optional[_BrokerUnix] = None
+        self._lock_fd: Optional[int] = None
+        self.reenviados = 0
+        self.recibidos = 0
+        self.perdidos = 0
+        self.reconexiones = 0
+
+    async def iniciar(self) -> None:
+        await super().iniciar()
+        if self._tarea is None:
+            self._tarea = self._loop.create_task(self._mantener_conexion(), name="pubsub-unix")
+            # Esperar brevemente la primera conexión para no perder publicaciones del arranque
+            for _ in range(40):
+                if self._escritor is not None:
+                    break
+                await asyncio.sleep(0.025)
+
+    def suscribir(self, canal: str, receptor: Receptor) -> None:
+        super().suscribir(canal, receptor)
+        if self._tarea is None:
+            self._tarea = self._loop.create_task(self._mantener_conexion(), name="pubsub-unix")
+
+    async def cerrar(self) -> None:
+        if self._tarea is not None:
+            self._tarea.cancel()
+            await asyncio.gather(self._tarea, return_exceptions=True)
+            self._tarea = None
+        if self._escritor is not None:
+            self._escritor.close()
+            self._escritor = None
+        if self._broker is not None:
+            await self._broker.cerrar()
+            self._broker = None
+            try:
+                os.unlink(self.ruta)
+            except OSError:
+                pass
+        if self._lock_fd is not None:
+            os.close(self._lock_fd)
+            self._lock_fd = None
+        await super().cerrar()
+
+    # --------------------------------------------------------
+    # Conexión con el broker (y elección del broker)
+    # --------------------------------------------------------
+
+    async def _mantener_conexion(self) -> None:
+        while True:
+            try:
+                lector, escritor = await self._conectar()
+                self._escritor = escritor
+                for canal in list(self._receptores):
+                    self._escribir(b'S ' + canal.encode() + b'\n')
+                await self._leer(lector)
+            except asyncio.CancelledError:
+                raise
+            except (OSError, ConnectionError, asyncio.IncompleteReadError, ValueError) as e:
+                logger.warning(f"[pubsub] Conexión con el broker perdida: {e!r}")
+            finally:
+                if self._escritor is not None:
+                    self._escritor.close()
+                    self._escritor = None
+            self.reconexiones += 1
+            await asyncio.sleep(self.reintento_segundos)
+
+    async def _conectar(self):
+        try:
+            return await asyncio.open_unix_connection(self.ruta, limit=LIMITE_TRAMA)
+        except (FileNotFoundError, ConnectionRefusedError):
+            await self._tomar_broker()
+            return await asyncio.open_unix_connection(self.ruta, limit=LIMITE_TRAMA)
+
+    async def _tomar_broker(self) -> None:
+        """Hospeda el broker si ningún otro proceso tiene el lock"""
+        if self._broker is not None:
+            return
+        fd = os.open(self.ruta + ".lock", os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            # Otro worker es el broker (quizá aún arrancando)
+            os.close(fd)
+            await asyncio.sleep(0.05)
+            return
+        try:
+            # Socket huérfano de un broker que murió
+            os.unlink(self.ruta)
+        except FileNotFoundError:
+            pass
+        broker = _BrokerUnix()
+        try:
+            await broker.iniciar(self.ruta)
+        except OSError:
+            os.close(fd)
+            raise
+        self._broker, self._lock_fd = broker, fd
+        logger.info(f"[pubsub] Broker de eventos escuchando en {self.ruta} (pid {os.getpid()})")
+
+    async def _leer(self, lector: asyncio.StreamReader) -> None:
+        while True:
+            linea = await lector.readline()
+            if not linea:
+                raise ConnectionError("el broker cerró la conexión")
+            partes = linea[2:].rstrip(b'\n').split(b' ', 2)
+            if linea[:1] != b'M' or len(partes) != 3:
+                continue
+            canal, excluir, texto = partes
+            self.recibidos += 1
+            self._entregar(
+                canal.decode(),
+                texto.decode('utf-8'),
+                None if excluir == b'-' else excluir.decode()
+            )
+
+    def _escribir(self, trama: bytes) -> bool:
+        escritor = self._escritor
+        if escritor is None or escritor.transport.get_write_buffer_size() > MAX_BUFFER_SALIDA:
+            return False
+        escritor.write(trama)
+        return True
+
+    # --------------------------------------------------------
+    # Extensiones de BusEventos
+    # --------------------------------------------------------
+
+    def _canal_abierto(self, canal: str) -> None:
+        self._escribir(b'S ' + canal.encode() + b'\n')
+
+    def _canal_cerrado(self, canal: str) -> None:
+        self._escribir(b'U ' + canal.encode() + b'\n')
+
+    def _reenviar(self, canal: str, texto: str, excluir: Optional[str]) -> None:
+        trama = f"P {canal} {excluir or '-'} {texto}\n".encode('utf-8')
+        if self._escribir(trama):
+            self.reenviados += 1
+        else:
+            self.perdidos += 1
+
+    def estadisticas(self) -> Dict[str, Any]:
+        datos = super().estadisticas()
+        datos.update({
+            'conectado': self._escritor is not None,
+            'es_broker': self._broker is not None,
+            'reenviados': self.reenviados,
+            'recibidos': self.recibidos,
+            'perdidos': self.perdidos,
+            'reconexiones': self.reconexiones,
+        })
+        if self._broker is not None:
+            datos['broker'] = {
+                'workers': len(self._broker._clientes),
+                'canales': len(self._broker._suscriptores),
+                'enrutados': self._broker.enrutados,
+                'descartados': self._broker.descartados,
+            }
+        return datos
+
+
+def ruta_socket_por_defecto(nombre_proyecto: str) -> str:
+    """Ruta corta en el directorio temporal (los sockets Unix admiten ~100 caracteres)"""
+    nombre = "".join(c if c.isalnum() else "_" for c in nombre_proyecto.lower())
+    return str(Path(tempfile.gettempdir()) / f"{nombre}_pubsub.sock")
+
+
+def crear_bus(backend: str, ruta: str = "") -> BusEventos:
+    """Bus según configuración ("local" o "unix"); sin sockets Unix se usa el local"""
+    if backend == "unix":
+        if hasattr(socket, "AF_UNIX") and fcntl is not None:
+            return BusUnix(ruta)
+        print("[WARN] PUBSUB_BACKEND=unix no está disponible en esta plataforma, se usa el bus local")
+    elif backend != "local":
+        print(f"[WARN] PUBSUB_BACKEND desconocido '{backend}', se usa el bus local")
+    return BusLocal()
+
+
+# Instancia global compartida por el chat y las notificaciones
+bus_eventos = crear_bus(
+    settings.PUBSUB_BACKEND,
+    settings.PUBSUB_SOCKET or ruta_socket_por_defecto(settings.PROJECT_NAME)
+)
@@ -22,6 +22,7 @@ from app.schemas.recomendacion_actividades import (
     RecomendacionResponse,
     PerfilNinoResponse
 )
+from app.services.vector_index import actividad_vector_index
 
 
 class RecomendacionActividadesService:
@@ -123,13 +124,21 @@ class RecomendacionActividadesService:
         
         nombre_nino = f"{nino.nombre} {nino.apellido_paterno} {nino.apellido_materno or ''}".strip()
         
-        # 3. Obtener actividades vectorizadas
-        actividades_vectorizadas = self.obtener_actividades_vectorizadas(
-            filtrar_por_area=filtrar_por_area,
-            nivel_dificultad_max=nivel_dificultad_max
+        # 3-6. Top N con el índice vectorial (pre-filtros de área y dificultad)
+        if perfil_nino.modelo_embedding != actividad_vector_index.modelo:
+            raise ValueError(
+                f"El perfil del niño {nino_id} se generó con otro modelo de embeddings. "
+                "Debe regenerarse con POST /api/v1/recomendaciones/perfil"
+            )
+        actividad_vector_index.asegurar(self.db)
+        top_scores = actividad_vector_index.buscar(
+            perfil_nino.embedding,
+            top_k=top_n,
+            area=filtrar_por_area,
+            dificultad_max=nivel_dificultad_max
         )
         
-        if not actividades_vectorizadas:
+        if not top_scores:
             return RecomendacionResponse(
                 nino_id=nino_id,
                 nombre_nino=nombre_nino,
@@ -139,34 +148,31 @@ class RecomendacionActividadesService:
                 recomendaciones=[]
             )
         
-        # 4. Calcular similitudes
-        embedding_nino = perfil_nino.embedding
-        scores_actividades = []
-        
-        for act_vec in actividades_vectorizadas:
-            similitud = self.calcular_similitud_coseno(
-                embedding_nino,
-                act_vec.embedding
-            )
-            
-            # Obtener detalles de la actividad
-            actividad = self.db.query(Actividad).filter(
-                Actividad.id == act_vec.actividad_id
-            ).first()
-            
-            if actividad:
-                scores_actividades.append({
-                    'actividad': actividad,
-                    'score': similitud,
-                    'tags': act_vec.tags or [],
-                    'areas': act_vec.areas_desarrollo or []
-                })
-        
-        # 5. Ordenar por score descendente
-        scores_actividades.sort(key=lambda x: x['score'], reverse=True)
+        # Detalles de las actividades seleccionadas en una sola consulta
+        detalles = {
+            fila.Actividad.id: fila
+            for fila in self.db.query(
+                Actividad,
+                PerfilActividadVectorizada.tags,
+                PerfilActividadVectorizada.areas_desarrollo
+            ).join(
+                PerfilActividadVectorizada,
+                PerfilActividadVectorizada.actividad_id == Actividad.id
+            ).filter(
+                Actividad.id.in_([actividad_id for actividad_id, _ in top_scores])
+            ).all()
+        }
         
-        # 6. Tomar top N
-        top_actividades = scores_actividades[:top_n]
+        top_actividades = [
+            {
+                'actividad': detalles[actividad_id].Actividad,
+                'score': score,
+                'tags': detalles[actividad_id].tags or [],
+                'areas': detalles[actividad_id].areas_desarrollo or []
+            }
+            for actividad_id, score in top_scores
+            if actividad_id in detalles
+        ]
         
         # 7. Crear objetos de respuesta
         recomendaciones = []
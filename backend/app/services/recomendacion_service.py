@@ -3,10 +3,11 @@
 Servicio de recomendación basado en contenido
 Integra similitud vectorial con TOPSIS y Gemini
 """
-from typing import List, Dict, Optional
+from typing import Iterator, List, Dict, Optional
 from sqlalchemy.orm import Session
 from sqlalchemy import desc
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, date
+import threading
 import numpy as np
 
 from app.models.recomendacion import (
@@ -21,6 +22,13 @@ from app.models.actividad import Actividad
 from app.models.personal import Personal
 from app.services.gemini_service import gemini_service
 from app.services import topsis_service
+from app.services.vector_index import actividad_vector_index
+from app.db.session import SessionLocal
+from app.services.explicacion_worker import (
+    cola_explicaciones,
+    TIPO_ACTIVIDADES,
+    TIPO_TERAPEUTA
+)
 
 
 class RecomendacionService:
@@ -42,30 +50,19 @@ class RecomendacionService:
         if not nino:
             raise ValueError(f"Niño {nino_id} no encontrado")
         
-        # Calcular edad
-        from datetime import date
-        hoy = date.today()
-        edad = hoy.year - nino.fecha_nacimiento.year
-        
         # Obtener diagnóstico
         diagnostico = self.db.query(NinoDiagnostico).filter(
             NinoDiagnostico.nino_id == nino_id
         ).first()
         
         # Preparar datos para embedding
-        datos_nino = {
-            'nombre': f"{nino.nombre} {nino.apellido_paterno}",
-            'edad': edad,
-            'diagnosticos': diagnostico.tipo_autismo.split(',') if diagnostico and diagnostico.tipo_autismo else [],
-            'dificultades': diagnostico.sensibilidades.split(',') if diagnostico and diagnostico.sensibilidades else [],
-            'fortalezas': [],  # Extraer de notas si están disponibles
-            'notas_clinicas': diagnostico.notas if diagnostico else '',
-            'sensibilidades': [],
-            'areas_prioritarias': []
-        }
+        datos_nino = self._datos_perfil_nino(nino, diagnostico)
+        edad = datos_nino['edad']
         
-        # Generar embedding con Gemini
-        embedding, texto_perfil = self.gemini.generar_embedding_perfil_nino(datos_nino)
+        # Generar embedding (Gemini o, si falla, el backend local)
+        embedding_service = self.gemini.embedding_service
+        texto_perfil = embedding_service.texto_perfil_nino(datos_nino)
+        (embedding,), modelo = embedding_service.embed_lote_con_modelo([texto_perfil])
         
         # Verificar si ya existe perfil
         perfil_existente = self.db.query(PerfilNinoVectorizado).filter(
@@ -75,6 +72,7 @@ class RecomendacionService:
         if perfil_existente:
             # Actualizar
             perfil_existente.embedding = embedding
+            perfil_existente.modelo_embedding = modelo
             perfil_existente.edad = edad
             perfil_existente.diagnosticos = datos_nino['diagnosticos']
             perfil_existente.dificultades = datos_nino['dificultades']
@@ -87,6 +85,7 @@ class RecomendacionService:
             perfil = PerfilNinoVectorizado(
                 nino_id=nino_id,
                 embedding=embedding,
+                modelo_embedding=modelo,
                 edad=edad,
                 diagnosticos=datos_nino['diagnosticos'],
                 dificultades=datos_nino['dificultades'],
@@ -99,6 +98,84 @@ class RecomendacionService:
         self.db.refresh(perfil)
         return perfil
     
+    @staticmethod
+    def _datos_perfil_nino(nino: Nino, diagnostico: Optional[NinoDiagnostico]) -> Dict:
+        """Datos del niño que alimentan el texto a vectorizar"""
+        hoy = date.today()
+        return {
+            'nombre': f"{nino.nombre} {nino.apellido_paterno}",
+            'edad': hoy.year - nino.fecha_nacimiento.year,
+            'diagnosticos': diagnostico.tipo_autismo.split(',') if diagnostico and diagnostico.tipo_autismo else [],
+            'dificultades': diagnostico.sensibilidades.split(',') if diagnostico and diagnostico.sensibilidades else [],
+            'fortalezas': [],  # Extraer de notas si están disponibles
+            'notas_clinicas': diagnostico.notas if diagnostico else '',
+            'sensibilidades': [],
+            'areas_prioritarias': []
+        }
+    
+    def crear_perfiles_ninos(self, nino_ids: List[int]) -> Dict[int, np.ndarray]:
+        """
+        Crea en lote los perfiles vectorizados que falten
+        
+        Usa 3 consultas (perfiles, niños, diagnósticos), una llamada a
+        embed_lote y un solo commit, en lugar de crear_perfil_nino por niño.
+        Los perfiles generados con otro modelo que el del índice de
+        actividades se regeneran.
+        
+        Returns:
+            Embedding de cada niño (existentes y nuevos) por nino_id, solo
+            los del modelo del índice de actividades
+        """
+        if not nino_ids:
+            return {}
+        modelo_indice = actividad_vector_index.modelo
+        perfiles = {
+            perfil.nino_id: perfil
+            for perfil in self.db.query(PerfilNinoVectorizado).filter(
+                PerfilNinoVectorizado.nino_id.in_(nino_ids)
+            ).all()
+        }
+        embeddings = {
+            nino_id: perfil.embedding
+            for nino_id, perfil in perfiles.items()
+            if perfil.modelo_embedding == modelo_indice
+        }
+        faltantes = [nino_id for nino_id in nino_ids if nino_id not in embeddings]
+        if not faltantes:
+            return embeddings
+        
+        ninos = self.db.query(Nino).filter(Nino.id.in_(faltantes)).all()
+        if not ninos:
+            return embeddings
+        diagnosticos = {}
+        for diagnostico in self.db.query(NinoDiagnostico).filter(
+            NinoDiagnostico.nino_id.in_(faltantes)
+        ).order_by(NinoDiagnostico.id).all():
+            diagnosticos.setdefault(diagnostico.nino_id, diagnostico)
+        
+        embedding_service = self.gemini.embedding_service
+        datos = [self._datos_perfil_nino(n, diagnosticos.get(n.id)) for n in ninos]
+        textos = [embedding_service.texto_perfil_nino(d) for d in datos]
+        vectores, modelo = embedding_service.embed_lote_con_modelo(textos)
+        
+        for nino, datos_nino, texto, embedding in zip(ninos, datos, textos, vectores):
+            perfil = perfiles.get(nino.id)
+            if perfil is None:
+                perfil = PerfilNinoVectorizado(nino_id=nino.id)
+                self.db.add(perfil)
+            perfil.embedding = embedding
+            perfil.modelo_embedding = modelo
+            perfil.edad = datos_nino['edad']
+            perfil.diagnosticos = datos_nino['diagnosticos']
+            perfil.dificultades = datos_nino['dificultades']
+            perfil.fortalezas = datos_nino['fortalezas']
+            perfil.texto_perfil = texto
+            perfil.fecha_actualizacion = datetime.utcnow()
+            if modelo == modelo_indice:
+                embeddings[nino.id] = np.asarray(embedding, dtype=np.float32)
+        self.db.commit()
+        return embeddings
+    
     def crear_perfil_actividad(self, actividad_id: int) -> PerfilActividadVectorizada:
         """
         Crea o actualiza el perfil vectorizado de una actividad
@@ -107,19 +184,10 @@ class RecomendacionService:
         if not actividad:
             raise ValueError(f"Actividad {actividad_id} no encontrada")
         
-        # Preparar datos
-        datos_actividad = {
-            'nombre': actividad.nombre,
-            'descripcion': actividad.descripcion or '',
-            'objetivo': actividad.objetivo or '',
-            'area_desarrollo': actividad.area_desarrollo or '',
-            'tags': actividad.tags or [],
-            'dificultad': actividad.dificultad or 1,
-            'materiales': actividad.materiales or ''
-        }
-        
         # Generar embedding
-        embedding, texto_descripcion = self.gemini.generar_embedding_actividad(datos_actividad)
+        embedding_service = self.gemini.embedding_service
+        texto_descripcion = embedding_service.texto_actividad(self._datos_actividad(actividad))
+        (embedding,), modelo = embedding_service.embed_lote_con_modelo([texto_descripcion])
         
         # Verificar si existe
         perfil_existente = self.db.query(PerfilActividadVectorizada).filter(
@@ -128,6 +196,7 @@ class RecomendacionService:
         
         if perfil_existente:
             perfil_existente.embedding = embedding
+            perfil_existente.modelo_embedding = modelo
             perfil_existente.areas_desarrollo = [actividad.area_desarrollo] if actividad.area_desarrollo else []
             perfil_existente.tags = actividad.tags or []
             perfil_existente.nivel_dificultad = actividad.dificultad or 1
@@ -138,6 +207,7 @@ class RecomendacionService:
             perfil = PerfilActividadVectorizada(
                 actividad_id=actividad_id,
                 embedding=embedding,
+                modelo_embedding=modelo,
                 areas_desarrollo=[actividad.area_desarrollo] if actividad.area_desarrollo else [],
                 tags=actividad.tags or [],
                 nivel_dificultad=actividad.dificultad or 1,
@@ -147,13 +217,114 @@ class RecomendacionService:
         
         self.db.commit()
         self.db.refresh(perfil)
+        
+        # Alta/baja incremental en el índice vectorial
+        actividad_vector_index.sincronizar_actividad(self.db, actividad, embedding, modelo)
         return perfil
     
+    @staticmethod
+    def _datos_actividad(actividad: Actividad) -> Dict:
+        """Datos de la actividad que alimentan el texto a vectorizar"""
+        return {
+            'nombre': actividad.nombre,
+            'descripcion': actividad.descripcion or '',
+            'objetivo': actividad.objetivo or '',
+            'area_desarrollo': actividad.area_desarrollo or '',
+            'tags': actividad.tags or [],
+            'dificultad': actividad.dificultad or 1,
+            'materiales': actividad.materiales or ''
+        }
+    
+    def vectorizar_actividades(
+        self,
+        actividad_ids: Optional[List[int]] = None,
+        solo_cambios: bool = True
+    ) -> Dict:
+        """
+        Vectoriza actividades activas en lote
+        
+        Se omiten las actividades cuyo texto no cambió desde la última
+        vectorización con el modelo actual; el resto se envía en lotes con concurrencia acotada
+        (ver GeminiEmbeddingService.embed_lote) y se guarda en un solo commit.
+        
+        Args:
+            actividad_ids: Limitar a estas actividades (None = todas las activas)
+            solo_cambios: Si False, re-vectoriza aunque el texto no haya cambiado
+            
+        Returns:
+            Diccionario con totales (total, vectorizadas, sin_cambios)
+        """
+        query = self.db.query(Actividad).filter(Actividad.activo == 1)
+        if actividad_ids is not None:
+            query = query.filter(Actividad.id.in_(actividad_ids))
+        actividades = query.all()
+        
+        perfiles = {
+            p.actividad_id: p
+            for p in self.db.query(PerfilActividadVectorizada).filter(
+                PerfilActividadVectorizada.actividad_id.in_([a.id for a in actividades])
+            ).all()
+        } if actividades else {}
+        
+        embedding_service = self.gemini.embedding_service
+        pendientes = []
+        for actividad in actividades:
+            texto = embedding_service.texto_actividad(self._datos_actividad(actividad))
+            perfil = perfiles.get(actividad.id)
+            if (
+                solo_cambios and perfil is not None and perfil.texto_descripcion == texto
+                and perfil.modelo_embedding == embedding_service.modelo
+            ):
+                continue
+            pendientes.append((actividad, perfil, texto))
+        
+        if pendientes:
+            embeddings, modelo = embedding_service.embed_lote_con_modelo([texto for _, _, texto in pendientes])
+            for (actividad, perfil, texto), embedding in zip(pendientes, embeddings):
+                areas = [actividad.area_desarrollo] if actividad.area_desarrollo else []
+                if perfil is None:
+                    perfil = PerfilActividadVectorizada(actividad_id=actividad.id)
+                    self.db.add(perfil)
+                perfil.embedding = embedding
+                perfil.modelo_embedding = modelo
+                perfil.areas_desarrollo = areas
+                perfil.tags = actividad.tags or []
+                perfil.nivel_dificultad = actividad.dificultad or 1
+                perfil.texto_descripcion = texto
+                perfil.fecha_actualizacion = datetime.utcnow()
+            self.db.commit()
+            actividad_vector_index.construir(self.db)
+        
+        return {
+            'total': len(actividades),
+            'vectorizadas': len(pendientes),
+            'sin_cambios': len(actividades) - len(pendientes)
+        }
+    
+    def _asegurar_indice_actividades(self) -> None:
+        """
+        Índice vectorial listo; si está vacío vectoriza el catálogo
+
+        La vectorización pasa por _vectorizacion_lock: si la de arranque
+        (vectorizar_catalogo_en_segundo_plano) está en curso se espera a que
+        termine en vez de insertar los mismos actividad_id en paralelo.
+        """
+        actividad_vector_index.asegurar(self.db)
+        if len(actividad_vector_index):
+            return
+        with _vectorizacion_lock:
+            # Cerrar la transacción para ver lo que confirmó el otro hilo
+            self.db.commit()
+            actividad_vector_index.asegurar(self.db)
+            if len(actividad_vector_index) == 0:
+                self.vectorizar_actividades()
+    
     def recomendar_actividades(
         self,
         nino_id: int,
         top_n: int = 5,
-        incluir_explicacion: bool = True
+        incluir_explicacion: bool = True,
+        explicacion_async: bool = True
     ) -> Dict:
         """
         Recomienda actividades para un niño usando similitud de contenido
@@ -162,6 +333,8 @@ class RecomendacionService:
             nino_id: ID del niño
             top_n: Número de actividades a recomendar
             incluir_explicacion: Si se debe generar explicación con Gemini
+            explicacion_async: Si la explicación se genera en segundo plano
+                (se devuelve explicacion_id para consultarla después)
             
         Returns:
             Diccionario con actividades recomendadas y explicación
@@ -171,43 +344,37 @@ class RecomendacionService:
             PerfilNinoVectorizado.nino_id == nino_id
         ).first()
         
-        if not perfil_nino:
+        # Sin perfil o generado con otro modelo que el índice: regenerarlo
+        if not perfil_nino or perfil_nino.modelo_embedding != actividad_vector_index.modelo:
             perfil_nino = self.crear_perfil_nino(nino_id)
         
-        # Obtener todas las actividades vectorizadas activas
-        actividades_vectorizadas = self.db.query(
-            PerfilActividadVectorizada
-        ).join(
-            Actividad, PerfilActividadVectorizada.actividad_id == Actividad.id
-        ).filter(
-            Actividad.activo == 1
-        ).all()
-        
-        # Si no hay actividades vectorizadas, vectorizar todas
-        if not actividades_vectorizadas:
-            actividades = self.db.query(Actividad).filter(Actividad.activo == 1).all()
-            for act in actividades:
-                self.crear_perfil_actividad(act.id)
-            # Volver a consultar
-            actividades_vectorizadas = self.db.query(PerfilActividadVectorizada).all()
-        
-        # Calcular similitud con cada actividad
-        recomendaciones = []
-        embedding_nino = perfil_nino.embedding
-        
-        for act_vec in actividades_vectorizadas:
-            similitud = self.gemini.calcular_similitud_coseno(
-                embedding_nino,
-                act_vec.embedding
-            )
-            
-            # Obtener datos de la actividad
-            actividad = self.db.query(Actividad).filter(
-                Actividad.id == act_vec.actividad_id
-            ).first()
-            
+        # Índice vectorial de actividades activas (mmap en disco o BD);
+        # si no hay actividades vectorizadas, vectorizar todas en lote
+        self._asegurar_indice_actividades()
+        
+        # Top-N con un solo producto matriz-vector (un perfil de otro modelo,
+        # p. ej. del fallback local, no se puede comparar: sin recomendaciones)
+        top_scores = []
+        if (
+            perfil_nino.modelo_embedding == actividad_vector_index.modelo
+            and perfil_nino.embedding is not None
+            and len(perfil_nino.embedding) == actividad_vector_index.dimension
+        ):
+            top_scores = actividad_vector_index.buscar(perfil_nino.embedding, top_k=top_n)
+        
+        # Datos de las actividades seleccionadas en una sola consulta
+        actividades_por_id = {
+            act.id: act
+            for act in self.db.query(Actividad).filter(
+                Actividad.id.in_([actividad_id for actividad_id, _ in top_scores])
+            ).all()
+        } if top_scores else {}
+        
+        top_recomendaciones = []
+        for actividad_id, similitud in top_scores:
+            actividad = actividades_por_id.get(actividad_id)
             if actividad:
-                recomendaciones.append({
+                top_recomendaciones.append({
                     'actividad_id': actividad.id,
                     'nombre': actividad.nombre,
                     'descripcion': actividad.descripcion,
@@ -218,44 +385,178 @@ class RecomendacionService:
                     'tags': actividad.tags or []
                 })
         
-        # Ordenar por similitud descendente
-        recomendaciones.sort(key=lambda x: x['score'], reverse=True)
-        top_recomendaciones = recomendaciones[:top_n]
+        # Guardar recomendación en BD (la explicación se completa después)
+        recomendacion_registro = RecomendacionActividad(
+            nino_id=nino_id,
+            actividades_recomendadas=top_recomendaciones,
+            metodo='contenido'
+        )
+        self.db.add(recomendacion_registro)
+        self.db.commit()
         
-        # Generar explicación con Gemini si se solicita
+        # Explicación con Gemini si se solicita
         explicacion = None
+        explicacion_estado = None
         if incluir_explicacion and top_recomendaciones:
             nino = self.db.query(Nino).filter(Nino.id == nino_id).first()
             nombre_nino = f"{nino.nombre} {nino.apellido_paterno}" if nino else "el niño"
-            
-            explicacion = self.gemini.explicar_recomendacion_actividades(
+            # Valores ya cargados: la función corre en otro hilo sin esta sesión
+            texto_perfil = perfil_nino.texto_perfil
+            generar = lambda: self.gemini.explicar_recomendacion_actividades(
                 nombre_nino=nombre_nino,
-                perfil_nino=perfil_nino.texto_perfil,
+                perfil_nino=texto_perfil,
                 actividades_recomendadas=top_recomendaciones
             )
-        
-        # Guardar recomendación en BD
-        recomendacion_registro = RecomendacionActividad(
-            nino_id=nino_id,
-            actividades_recomendadas=top_recomendaciones,
-            explicacion_humana=explicacion,
-            metodo='contenido'
-        )
-        self.db.add(recomendacion_registro)
-        self.db.commit()
+            
+            if explicacion_async:
+                explicacion_estado = cola_explicaciones.encolar(
+                    TIPO_ACTIVIDADES, recomendacion_registro.id, generar
+                )
+            else:
+                explicacion = generar()
+                recomendacion_registro.explicacion_humana = explicacion
+                self.db.commit()
+                explicacion_estado = 'lista'
         
         return {
             'nino_id': nino_id,
             'recomendaciones': top_recomendaciones,
             'explicacion': explicacion,
+            'explicacion_id': recomendacion_registro.id if explicacion_estado else None,
+            'explicacion_estado': explicacion_estado,
             'fecha_generacion': datetime.utcnow().isoformat()
         }
     
+    def recomendar_actividades_lote(
+        self,
+        nino_ids: Optional[List[int]] = None,
+        top_n: int = 5,
+        guardar: bool = True,
+        tamano_insercion: int = 200
+    ) -> Iterator[Dict]:
+        """
+        Recomienda actividades para muchos niños a la vez
+        
+        El catálogo se carga una vez, los perfiles de los niños se apilan en
+        una matriz y todas las similitudes salen de un solo producto de
+        matrices. Los resultados se generan niño por niño (para streaming) y
+        los registros RecomendacionActividad se insertan en bloque.
+        La explicación de Gemini no se genera en este modo.
+        
+        Args:
+            nino_ids: IDs de niños (None = todos los activos)
+            top_n: Actividades por niño
+            guardar: Si se registran las recomendaciones en BD
+            tamano_insercion: Filas por inserción en bloque
+            
+        Yields:
+            Un diccionario por niño con el mismo formato que recomendar_actividades
+        """
+        if nino_ids is None:
+            nino_ids = [
+                fila.id for fila in self.db.query(Nino.id).filter(
+                    Nino.estado == "ACTIVO"
+                ).order_by(Nino.id).all()
+            ]
+        nino_ids = list(dict.fromkeys(nino_ids))
+        if not nino_ids:
+            return
+        
+        # Índice primero: los perfiles se comparan con su modelo
+        self._asegurar_indice_actividades()
+        
+        embeddings = self.crear_perfiles_ninos(nino_ids)
+        
+        # Sin embedding puede ser un niño inexistente o un perfil de otro
+        # modelo (p. ej. fallback local con el índice de Gemini)
+        sin_embedding = [nino_id for nino_id in nino_ids if nino_id not in embeddings]
+        existentes = {
+            fila.id for fila in self.db.query(Nino.id).filter(Nino.id.in_(sin_embedding)).all()
+        } if sin_embedding else set()
+        
+        # Solo perfiles con la misma dimensión que el índice
+        con_perfil = [
+            nino_id for nino_id in nino_ids
+            if nino_id in embeddings and len(embeddings[nino_id]) == actividad_vector_index.dimension
+        ]
+        resultados = actividad_vector_index.buscar_lote(
+            [embeddings[nino_id] for nino_id in con_perfil],
+            top_k=top_n
+        )
+        top_por_nino = dict(zip(con_perfil, resultados))
+        
+        # Datos de todas las actividades seleccionadas en una sola consulta
+        seleccionadas = {actividad_id for top in resultados for actividad_id, _ in top}
+        actividades_por_id = {
+            act.id: act
+            for act in self.db.query(Actividad).filter(
+                Actividad.id.in_(seleccionadas)
+            ).all()
+        } if seleccionadas else {}
+        
+        fecha = datetime.utcnow()
+        pendientes = []
+        for nino_id in nino_ids:
+            top_recomendaciones = []
+            for actividad_id, similitud in top_por_nino.get(nino_id, []):
+                actividad = actividades_por_id.get(actividad_id)
+                if actividad:
+                    top_recomendaciones.append({
+                        'actividad_id': actividad.id,
+                        'nombre': actividad.nombre,
+                        'descripcion': actividad.descripcion,
+                        'objetivo': actividad.objetivo,
+                        'area_desarrollo': actividad.area_desarrollo,
+                        'dificultad': actividad.dificultad,
+                        'score': similitud,
+                        'tags': actividad.tags or []
+                    })
+            
+            if guardar and nino_id in top_por_nino:
+                pendientes.append({
+                    'nino_id': nino_id,
+                    'actividades_recomendadas': top_recomendaciones,
+                    'explicacion_humana': None,
+                    'metodo': 'contenido',
+                    'fecha_generacion': fecha
+                })
+                if len(pendientes) >= tamano_insercion:
+                    self.db.bulk_insert_mappings(RecomendacionActividad, pendientes)
+                    pendientes = []
+            
+            yield {
+                'nino_id': nino_id,
+                'recomendaciones': top_recomendaciones,
+                'explicacion': None,
+                'fecha_generacion': fecha.isoformat(),
+                'error': None if nino_id in top_por_nino else self._error_lote(
+                    nino_id, nino_id in embeddings, nino_id in existentes
+                )
+            }
+        
+        if pendientes:
+            self.db.bulk_insert_mappings(RecomendacionActividad, pendientes)
+        if guardar:
+            self.db.commit()
+    
+    @staticmethod
+    def _error_lote(nino_id: int, con_embedding: bool, existe: bool) -> str:
+        """Motivo por el que un niño del lote quedó sin recomendaciones"""
+        if con_embedding:
+            return f"Perfil del niño {nino_id} con dimensión incompatible"
+        if not existe:
+            return f"Niño {nino_id} no encontrado"
+        return (
+            f"Perfil del niño {nino_id} generado con otro modelo de embeddings "
+            f"que el índice de actividades ({actividad_vector_index.modelo})"
+        )
+    
     def seleccionar_terapeuta_optimo(
         self,
         nino_id: int,
         terapia_tipo: str,
-        criterios_pesos: Optional[Dict[str, float]] = None
+        criterios_pesos: Optional[Dict[str, float]] = None,
+        explicacion_async: bool = True
     ) -> Dict:
         """
         Selecciona el terapeuta óptimo usando TOPSIS
@@ -264,6 +565,7 @@ class RecomendacionService:
             nino_id: ID del niño
             terapia_tipo: Tipo de terapia ('lenguaje', 'conductual', etc.)
             criterios_pesos: Pesos para cada criterio (opcional)
+            explicacion_async: Si la explicación se genera en segundo plano
             
         Returns:
             Diccionario con terapeuta seleccionado y ranking
@@ -295,36 +597,45 @@ class RecomendacionService:
         # Obtener el mejor terapeuta
         mejor_terapeuta = resultado_topsis['ranking'][0]
         
-        # Generar explicación con Gemini
-        nino = self.db.query(Nino).filter(Nino.id == nino_id).first()
-        nombre_nino = f"{nino.nombre} {nino.apellido_paterno}" if nino else "el niño"
-        
-        explicacion = self.gemini.explicar_seleccion_terapeuta(
-            nombre_nino=nombre_nino,
-            terapia_tipo=terapia_tipo,
-            terapeuta_seleccionado=mejor_terapeuta,
-            criterios_topsis=resultado_topsis['criterios_usados'],
-            ranking_top3=resultado_topsis['ranking'][:3]
-        )
-        
-        # Guardar en BD
+        # Guardar en BD (la explicación se completa después)
         asignacion = AsignacionTerapeutaTOPSIS(
             nino_id=nino_id,
             terapia_tipo=terapia_tipo,
             ranking_terapeutas=resultado_topsis['ranking'],
             terapeuta_seleccionado_id=mejor_terapeuta['id'],
-            explicacion_seleccion=explicacion,
             criterios_usados=resultado_topsis['criterios_usados']
         )
         self.db.add(asignacion)
         self.db.commit()
         
+        # Explicación con Gemini
+        nino = self.db.query(Nino).filter(Nino.id == nino_id).first()
+        nombre_nino = f"{nino.nombre} {nino.apellido_paterno}" if nino else "el niño"
+        generar = lambda: self.gemini.explicar_seleccion_terapeuta(
+            nombre_nino=nombre_nino,
+            terapia_tipo=terapia_tipo,
+            terapeuta_seleccionado=mejor_terapeuta,
+            criterios_topsis=resultado_topsis['criterios_usados'],
+            ranking_top3=resultado_topsis['ranking'][:3]
+        )
+        
+        explicacion = None
+        if explicacion_async:
+            explicacion_estado = cola_explicaciones.encolar(TIPO_TERAPEUTA, asignacion.id, generar)
+        else:
+            explicacion = generar()
+            asignacion.explicacion_seleccion = explicacion
+            self.db.commit()
+            explicacion_estado = 'lista'
+        
         return {
             'nino_id': nino_id,
             'terapia_tipo': terapia_tipo,
             'terapeuta_seleccionado': mejor_terapeuta,
             'ranking_completo': resultado_topsis['ranking'],
             'explicacion': explicacion,
+            'explicacion_id': asignacion.id,
+            'explicacion_estado': explicacion_estado,
             'criterios_usados': resultado_topsis['criterios_usados']
         }
     
@@ -367,3 +678,56 @@ class RecomendacionService:
 def get_recomendacion_service(db: Session) -> RecomendacionService:
     """Factory para crear instancia del servicio"""
     return RecomendacionService(db)
+
+
+# ============================================================
+# VECTORIZACIÓN MASIVA EN SEGUNDO PLANO
+# ============================================================
+
+_vectorizacion_lock = threading.Lock()
+estado_vectorizacion: Dict = {
+    'en_curso': False,
+    'ultimo_resultado': None,
+    'ultimo_error': None,
+    'fecha_fin': None
+}
+
+
+def _ejecutar_vectorizacion(solo_cambios: bool) -> None:
+    db = SessionLocal()
+    try:
+        resultado = RecomendacionService(db).vectorizar_actividades(solo_cambios=solo_cambios)
+        estado_vectorizacion['ultimo_resultado'] = resultado
+        estado_vectorizacion['ultimo_error'] = None
+        print(
+            f"[OK] Vectorización de catálogo: {resultado['vectorizadas']} nuevas/cambiadas, "
+            f"{resultado['sin_cambios']} sin cambios"
+        )
+    except Exception as e:
+        db.rollback()
+        estado_vectorizacion['ultimo_error'] = str(e)
+        print(f"[WARN] Error en vectorización de catálogo: {e}")
+    finally:
+        db.close()
+        estado_vectorizacion['en_curso'] = False
+        estado_vectorizacion['fecha_fin'] = datetime.utcnow().isoformat()
+        _vectorizacion_lock.release()
+
+
+def vectorizar_catalogo_en_segundo_plano(solo_cambios: bool = True) -> bool:
+    """
+    Lanza la vectorización de todas las actividades en un hilo aparte
+    
+    Returns:
+        False si ya había una vectorización en curso
+    """
+    if not _vectorizacion_lock.acquire(blocking=False):
+        return False
+    estado_vectorizacion['en_curso'] = True
+    threading.Thread(
+        target=_ejecutar_vectorizacion,
+        args=(solo_cambios,),
+        name="vectorizacion-catalogo",
+        daemon=True
+    ).start()
+    return True
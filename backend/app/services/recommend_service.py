@@ -2,9 +2,19 @@
 """
 Servicio para recomendaciones basadas en contenido
 Utiliza similitud de coseno entre perfiles de niños y actividades/terapias
+
+Los catálogos de actividades y terapias se vectorizan una sola vez: se
+mantiene un TfidfVectorizer ajustado y la matriz dispersa de documentos,
+con los tags ya parseados. Un cambio en filas de Actividad o Terapia
+(eventos ORM) incrementa la versión del catálogo y se reconstruye en el
+siguiente uso. Cada petición solo transforma el texto del niño.
 """
-import json
-from typing import List, Dict
+import threading
+from abc import ABC, abstractmethod
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import event
 from sqlalchemy.orm import Session
 
 from app.models.nino import Nino, NinoDiagnostico, NinoInfoEmocional
@@ -15,191 +25,301 @@ from app.services.vectorizer import (
     build_profile_text,
     build_actividad_text,
     build_terapia_text,
-    calcular_similitud
+    parsear_tags,
+    ModeloTfidf
 )
 
 
-def recomendar_actividades_para_nino(
-    db: Session, 
-    nino_id: int,
-    top_n: int = 10
-) -> List[RecomendacionActividad]:
+class CatalogoTfidf(ABC):
+    """Catálogo vectorizado con TF-IDF, reconstruido solo al cambiar de versión"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = 0
+        self._version_construida = -1
+        self.items: List[Dict[str, Any]] = []
+        self.modelo = ModeloTfidf([])
+
+    def invalidar(self, *args) -> None:
+        """Marca el catálogo para reconstrucción (firma compatible con eventos ORM)"""
+        self._version += 1
+
+    @property
+    def sucio(self) -> bool:
+        return self._version_construida != self._version
+
+    @abstractmethod
+    def cargar(self, db: Session) -> Tuple[List[Dict[str, Any]], List[str]]:
+        """Datos de cada documento y su texto (implementado por cada catálogo)"""
+
+    def construir(self, db: Session) -> None:
+        version = self._version
+        items, textos = self.cargar(db)
+        modelo = ModeloTfidf(textos)
+        with self._lock:
+            self.items = items
+            self.modelo = modelo
+            # Si hubo una invalidación durante la construcción, sigue sucio
+            self._version_construida = version
+
+    def asegurar(self, db: Session) -> None:
+        """Reconstruye el catálogo solo si fue invalidado"""
+        if self.sucio:
+            self.construir(db)
+
+    def top(self, db: Session, texto_referencia: str, top_n: int) -> List[Tuple[Dict[str, Any], float]]:
+        """Los top_n documentos más similares al texto (orden estable ante empates)"""
+        self.asegurar(db)
+        with self._lock:
+            items, modelo = self.items, self.modelo
+        if not items:
+            return []
+        scores = modelo.similitudes(texto_referencia)
+        orden = np.argsort(-scores, kind='stable')[:top_n]
+        return [(items[i], float(scores[i])) for i in orden]
+
+    def top_lote(
+        self,
+        db: Session,
+        textos_referencia: List[str],
+        top_n: int
+    ) -> List[List[Tuple[Dict[str, Any], float]]]:
+        """top() para muchos textos con una sola multiplicación de matrices"""
+        self.asegurar(db)
+        with self._lock:
+            items, modelo = self.items, self.modelo
+        if not items:
+            return [[] for _ in textos_referencia]
+        scores = modelo.similitudes_lote(textos_referencia)
+        orden = np.argsort(-scores, axis=1, kind='stable')[:, :top_n]
+        return [
+            [(items[i], float(fila_scores[i])) for i in fila_orden]
+            for fila_orden, fila_scores in zip(orden, scores)
+        ]
+
+
+class CatalogoActividades(CatalogoTfidf):
+
+    def cargar(self, db: Session) -> Tuple[List[Dict[str, Any]], List[str]]:
+        actividades = db.query(Actividad).filter(Actividad.activo == 1).all()
+        items, textos = [], []
+        for act in actividades:
+            textos.append(build_actividad_text({
+                "nombre": act.nombre,
+                "descripcion": act.descripcion,
+                "objetivo": act.objetivo,
+                "area_desarrollo": act.area_desarrollo,
+                "tags": act.tags
+            }))
+            items.append({
+                "actividad_id": act.id,
+                "nombre": act.nombre,
+                "descripcion": act.descripcion,
+                "tags": parsear_tags(act.tags),
+                "dificultad": act.dificultad,
+                "area_desarrollo": act.area_desarrollo
+            })
+        return items, textos
+
+
+class CatalogoTerapias(CatalogoTfidf):
+
+    def cargar(self, db: Session) -> Tuple[List[Dict[str, Any]], List[str]]:
+        terapias = db.query(Terapia).filter(Terapia.activo == 1).all()
+        items, textos = [], []
+        for ter in terapias:
+            textos.append(build_terapia_text({
+                "nombre": ter.nombre,
+                "descripcion": ter.descripcion,
+                "objetivo_general": ter.objetivo_general,
+                "categoria": ter.categoria,
+                "tags": ter.tags
+            }))
+            items.append({
+                "terapia_id": ter.id,
+                "nombre": ter.nombre,
+                "descripcion": ter.descripcion,
+                "categoria": ter.categoria,
+                "tags": parsear_tags(ter.tags)
+            })
+        return items, textos
+
+
+# Instancias globales de los catálogos
+catalogo_actividades = CatalogoActividades()
+catalogo_terapias = CatalogoTerapias()
+
+for _modelo, _catalogo in ((Actividad, catalogo_actividades), (Terapia, catalogo_terapias)):
+    for _evento in ('after_insert', 'after_update', 'after_delete'):
+        event.listen(_modelo, _evento, _catalogo.invalidar)
+
+
+def _datos_nino(
+    nino: Nino,
+    diagnostico: Optional[NinoDiagnostico],
+    info_emocional: Optional[NinoInfoEmocional]
+) -> Dict[str, Any]:
+    return {
+        "perfil_contenido": nino.perfil_contenido or {},
+        "diagnostico_principal": diagnostico.diagnostico_principal if diagnostico else None,
+        "diagnostico_resumen": diagnostico.diagnostico_resumen if diagnostico else None,
+        "preferencias": info_emocional.preferencias if info_emocional else None,
+        "palabras_clave": info_emocional.palabras_clave if info_emocional else None,
+    }
+
+
+def texto_perfil_nino(db: Session, nino_id: int) -> str:
     """
-    Recomienda actividades para un niño basado en su perfil
-    
-    Args:
-        db: Sesión de base de datos
-        nino_id: ID del niño
-        top_n: Número máximo de recomendaciones a retornar
-    
-    Returns:
-        Lista de RecomendacionActividad ordenada por score descendente
+    Construye el texto del perfil del niño (perfil de contenido,
+    diagnóstico e info emocional)
     """
     # Obtener niño con sus relaciones
     nino = db.query(Nino).filter(Nino.id == nino_id).first()
     if not nino:
         raise ValueError(f"Niño con ID {nino_id} no encontrado")
-    
+
     # Obtener diagnóstico e info emocional
     diagnostico = db.query(NinoDiagnostico).filter(
         NinoDiagnostico.nino_id == nino_id
     ).first()
-    
+
     info_emocional = db.query(NinoInfoEmocional).filter(
         NinoInfoEmocional.nino_id == nino_id
     ).first()
-    
-    # Construir datos del niño
-    nino_data = {
-        "perfil_contenido": nino.perfil_contenido or {},
-        "diagnostico_principal": diagnostico.diagnostico_principal if diagnostico else None,
-        "diagnostico_resumen": diagnostico.diagnostico_resumen if diagnostico else None,
-        "preferencias": info_emocional.preferencias if info_emocional else None,
-        "palabras_clave": info_emocional.palabras_clave if info_emocional else None,
+
+    return build_profile_text(_datos_nino(nino, diagnostico, info_emocional))
+
+
+def textos_perfiles_ninos(db: Session, nino_ids: Optional[List[int]] = None) -> Dict[int, str]:
+    """
+    Textos de perfil de muchos niños con 3 consultas en total
+
+    Args:
+        nino_ids: IDs de niños (None = todos los activos)
+
+    Returns:
+        Texto por nino_id (los IDs inexistentes no aparecen)
+    """
+    query = db.query(Nino)
+    if nino_ids is None:
+        query = query.filter(Nino.estado == "ACTIVO")
+    else:
+        query = query.filter(Nino.id.in_(nino_ids))
+    ninos = query.order_by(Nino.id).all()
+    ids = [n.id for n in ninos]
+    if not ids:
+        return {}
+
+    diagnosticos: Dict[int, NinoDiagnostico] = {}
+    for diagnostico in db.query(NinoDiagnostico).filter(
+        NinoDiagnostico.nino_id.in_(ids)
+    ).order_by(NinoDiagnostico.id).all():
+        diagnosticos.setdefault(diagnostico.nino_id, diagnostico)
+
+    infos: Dict[int, NinoInfoEmocional] = {}
+    for info in db.query(NinoInfoEmocional).filter(
+        NinoInfoEmocional.nino_id.in_(ids)
+    ).order_by(NinoInfoEmocional.id).all():
+        infos.setdefault(info.nino_id, info)
+
+    return {
+        n.id: build_profile_text(_datos_nino(n, diagnosticos.get(n.id), infos.get(n.id)))
+        for n in ninos
     }
-    
-    # Construir texto del perfil del niño
-    texto_nino = build_profile_text(nino_data)
-    
-    # Obtener todas las actividades activas
-    actividades = db.query(Actividad).filter(Actividad.activo == 1).all()
-    
-    if not actividades:
-        return []
-    
-    # Construir textos de actividades
-    textos_actividades = []
-    for act in actividades:
-        act_data = {
-            "nombre": act.nombre,
-            "descripcion": act.descripcion,
-            "objetivo": act.objetivo,
-            "area_desarrollo": act.area_desarrollo,
-            "tags": act.tags
-        }
-        textos_actividades.append(build_actividad_text(act_data))
-    
-    # Calcular similitudes
-    scores = calcular_similitud(texto_nino, textos_actividades)
-    
-    # Crear recomendaciones
-    recomendaciones = []
-    for idx, act in enumerate(actividades):
-        tags = act.tags if isinstance(act.tags, list) else []
-        if isinstance(act.tags, str):
-            try:
-                tags = json.loads(act.tags)
-            except:
-                tags = []
-        
-        recomendaciones.append(
-            RecomendacionActividad(
-                actividad_id=act.id,
-                nombre=act.nombre,
-                descripcion=act.descripcion,
-                score=float(scores[idx]),
-                tags=tags,
-                dificultad=act.dificultad,
-                area_desarrollo=act.area_desarrollo
-            )
-        )
-    
-    # Ordenar por score descendente
-    recomendaciones.sort(key=lambda x: x.score, reverse=True)
-    
-    # Retornar top N
-    return recomendaciones[:top_n]
+
+
+def recomendar_actividades_para_nino(
+    db: Session,
+    nino_id: int,
+    top_n: int = 10
+) -> List[RecomendacionActividad]:
+    """
+    Recomienda actividades para un niño basado en su perfil
+
+    Args:
+        db: Sesión de base de datos
+        nino_id: ID del niño
+        top_n: Número máximo de recomendaciones a retornar
+
+    Returns:
+        Lista de RecomendacionActividad ordenada por score descendente
+    """
+    texto_nino = texto_perfil_nino(db, nino_id)
+
+    return [
+        RecomendacionActividad(**item, score=score)
+        for item, score in catalogo_actividades.top(db, texto_nino, top_n)
+    ]
 
 
 def recomendar_terapias_para_nino(
-    db: Session, 
+    db: Session,
     nino_id: int,
     top_n: int = 10
 ) -> List[RecomendacionTerapia]:
     """
     Recomienda terapias para un niño basado en su perfil
-    
+
     Args:
         db: Sesión de base de datos
         nino_id: ID del niño
         top_n: Número máximo de recomendaciones a retornar
-    
+
     Returns:
         Lista de RecomendacionTerapia ordenada por score descendente
     """
-    # Obtener niño con sus relaciones
-    nino = db.query(Nino).filter(Nino.id == nino_id).first()
-    if not nino:
-        raise ValueError(f"Niño con ID {nino_id} no encontrado")
-    
-    # Obtener diagnóstico e info emocional
-    diagnostico = db.query(NinoDiagnostico).filter(
-        NinoDiagnostico.nino_id == nino_id
-    ).first()
-    
-    info_emocional = db.query(NinoInfoEmocional).filter(
-        NinoInfoEmocional.nino_id == nino_id
-    ).first()
-    
-    # Construir datos del niño
-    nino_data = {
-        "perfil_contenido": nino.perfil_contenido or {},
-        "diagnostico_principal": diagnostico.diagnostico_principal if diagnostico else None,
-        "diagnostico_resumen": diagnostico.diagnostico_resumen if diagnostico else None,
-        "preferencias": info_emocional.preferencias if info_emocional else None,
-        "palabras_clave": info_emocional.palabras_clave if info_emocional else None,
-    }
-    
-    # Construir texto del perfil del niño
-    texto_nino = build_profile_text(nino_data)
-    
-    # Obtener todas las terapias activas
-    terapias = db.query(Terapia).filter(Terapia.activo == 1).all()
-    
-    if not terapias:
-        return []
-    
-    # Construir textos de terapias
-    textos_terapias = []
-    for ter in terapias:
-        ter_data = {
-            "nombre": ter.nombre,
-            "descripcion": ter.descripcion,
-            "objetivo_general": ter.objetivo_general,
-            "categoria": ter.categoria,
-            "tags": ter.tags
-        }
-        textos_terapias.append(build_terapia_text(ter_data))
-    
-    # Calcular similitudes
-    scores = calcular_similitud(texto_nino, textos_terapias)
-    
-    # Crear recomendaciones
-    recomendaciones = []
-    for idx, ter in enumerate(terapias):
-        tags = []
-        if ter.tags:
-            if isinstance(ter.tags, list):
-                tags = ter.tags
-            elif isinstance(ter.tags, str):
-                try:
-                    tags = json.loads(ter.tags)
-                except:
-                    tags = []
-        
-        recomendaciones.append(
-            RecomendacionTerapia(
-                terapia_id=ter.id,
-                nombre=ter.nombre,
-                descripcion=ter.descripcion,
-                score=float(scores[idx]),
-                categoria=ter.categoria,
-                tags=tags
-            )
+    texto_nino = texto_perfil_nino(db, nino_id)
+
+    return [
+        RecomendacionTerapia(**item, score=score)
+        for item, score in catalogo_terapias.top(db, texto_nino, top_n)
+    ]
+
+
+def _recomendar_lote(
+    db: Session,
+    catalogo: CatalogoTfidf,
+    esquema,
+    nino_ids: Optional[List[int]],
+    top_n: int
+) -> Iterator[Tuple[int, Optional[List[Any]]]]:
+    textos = textos_perfiles_ninos(db, nino_ids)
+    ids = list(textos) if nino_ids is None else list(dict.fromkeys(nino_ids))
+    encontrados = [nino_id for nino_id in ids if nino_id in textos]
+    resultados = dict(zip(
+        encontrados,
+        catalogo.top_lote(db, [textos[nino_id] for nino_id in encontrados], top_n)
+    ))
+    for nino_id in ids:
+        top = resultados.get(nino_id)
+        yield nino_id, (
+            [esquema(**item, score=score) for item, score in top]
+            if top is not None else None
         )
-    
-    # Ordenar por score descendente
-    recomendaciones.sort(key=lambda x: x.score, reverse=True)
-    
-    # Retornar top N
-    return recomendaciones[:top_n]
+
+
+def recomendar_actividades_lote(
+    db: Session,
+    nino_ids: Optional[List[int]] = None,
+    top_n: int = 10
+) -> Iterator[Tuple[int, Optional[List[RecomendacionActividad]]]]:
+    """
+    Recomienda actividades para muchos niños (catálogo y perfiles se cargan
+    una vez; todas las similitudes salen de un solo producto disperso)
+
+    Args:
+        nino_ids: IDs de niños (None = todos los activos)
+
+    Yields:
+        (nino_id, recomendaciones) en orden; recomendaciones es None si el niño no existe
+    """
+    return _recomendar_lote(db, catalogo_actividades, RecomendacionActividad, nino_ids, top_n)
+
+
+def recomendar_terapias_lote(
+    db: Session,
+    nino_ids: Optional[List[int]] = None,
+    top_n: int = 10
+) -> Iterator[Tuple[int, Optional[List[RecomendacionTerapia]]]]:
+    """Versión para terapias de recomendar_actividades_lote"""
+    return _recomendar_lote(db, catalogo_terapias, RecomendacionTerapia, nino_ids, top_n)
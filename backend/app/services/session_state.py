@@ -0,0 +1,277 @@
+# app/services/session_state.py
+"""
+Contenedor de estado de sesiones en memoria: acotado y con caducidad
+
+Lo comparten GeminiChatService y ConversationStore:
+
+- Capacidad máxima con desalojo LRU (OrderedDict por último acceso)
+- TTL por inactividad con un min-heap de vencimientos: purgar cuesta
+  O(k log n) para k sesiones vencidas, sin recorrer todas. Cada acceso
+  empuja un vencimiento nuevo y los viejos se descartan al salir del heap
+  (borrado perezoso); el heap se compacta si acumula demasiados.
+- Snapshot opcional a disco (JSON, escritura atómica, permisos 0600) para
+  que un worker reiniciado recupere las conversaciones activas. Cada
+  worker escribe su propio archivo y al arrancar reclama uno solo, así
+  ninguna sesión se restaura en dos workers. Los snapshots contienen
+  conversaciones completas: van en un directorio que no se sirve
+  (settings.DATA_DIR), nunca en uploads/
+- Estadísticas de memoria (sesiones, entradas del heap, bytes estimados)
+"""
+import heapq
+import itertools
+import json
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Callable, Dict, Generic, Iterator, List, Optional, Tuple, TypeVar
+
+V = TypeVar('V')
+
+
+class _Entrada:
+    __slots__ = ('valor', 'expira')
+
+    def __init__(self, valor, expira: float):
+        self.valor = valor
+        self.expira = expira
+
+
+class AlmacenSesiones(Generic[V]):
+    """Mapa session_id -> estado con LRU, TTL por inactividad y snapshot"""
+
+    # El heap se reconstruye si tiene más de FACTOR_COMPACTAR entradas por sesión viva
+    FACTOR_COMPACTAR = 4
+
+    def __init__(
+        self,
+        max_sesiones: int = 1000,
+        ttl_segundos: float = 1800,
+        nombre: str = "sesiones",
+        medir: Optional[Callable[[V], int]] = None
+    ):
+        self.max_sesiones = max_sesiones
+        self.ttl_segundos = ttl_segundos
+        self.nombre = nombre
+        # Bytes aproximados de un valor (para estadísticas)
+        self.medir = medir or sys.getsizeof
+        self._lock = threading.RLock()
+        self._entradas: "OrderedDict[str, _Entrada]" = OrderedDict()
+        self._vencimientos: List[Tuple[float, int, str]] = []
+        self._contador = itertools.count()
+        self.expiradas = 0
+        self.desalojadas = 0
+
+    def __len__(self) -> int:
+        return len(self._entradas)
+
+    def __contains__(self, clave: str) -> bool:
+        return self.obtener(clave, tocar=False) is not None
+
+    # --------------------------------------------------------
+    # Vencimientos
+    # --------------------------------------------------------
+
+    def _programar(self, clave: str, entrada: _Entrada, ahora: float) -> None:
+        entrada.expira = ahora + self.ttl_segundos
+        heapq.heappush(self._vencimientos, (entrada.expira, next(self._contador), clave))
+        if len(self._vencimientos) > self.FACTOR_COMPACTAR * len(self._entradas) + 64:
+            self._vencimientos = [
+                (e.expira, next(self._contador), c) for c, e in self._entradas.items()
+            ]
+            heapq.heapify(self._vencimientos)
+
+    def _purgar(self, ahora: float) -> int:
+        vencidas = 0
+        while self._vencimientos and self._vencimientos[0][0] <= ahora:
+            expira, _, clave = heapq.heappop(self._vencimientos)
+            entrada = self._entradas.get(clave)
+            # Vencimiento viejo de una sesión que se volvió a usar
+            if entrada is None or entrada.expira != expira:
+                continue
+            del self._entradas[clave]
+            vencidas += 1
+        self.expiradas += vencidas
+        return vencidas
+
+    def purgar(self) -> int:
+        """Elimina las sesiones vencidas; devuelve cuántas"""
+        with self._lock:
+            return self._purgar(time.monotonic())
+
+    # --------------------------------------------------------
+    # Acceso
+    # --------------------------------------------------------
+
+    def obtener(self, clave: str, tocar: bool = True) -> Optional[V]:
+        """Estado de la sesión (None si no existe o venció); tocar renueva el TTL"""
+        ahora = time.monotonic()
+        with self._lock:
+            self._purgar(ahora)
+            entrada = self._entradas.get(clave)
+            if entrada is None:
+                return None
+            if tocar:
+                self._entradas.move_to_end(clave)
+                self._programar(clave, entrada, ahora)
+            return entrada.valor
+
+    def poner(self, clave: str, valor: V) -> V:
+        """Crea o reemplaza una sesión (desaloja la menos usada si está lleno)"""
+        ahora = time.monotonic()
+        with self._lock:
+            self._purgar(ahora)
+            entrada = self._entradas.get(clave)
+            if entrada is None:
+                entrada = self._entradas[clave] = _Entrada(valor, ahora)
+            else:
+                entrada.valor = valor
+            self._entradas.move_to_end(clave)
+            self._programar(clave, entrada, ahora)
+            while len(self._entradas) > self.max_sesiones:
+                self._entradas.popitem(last=False)
+                self.desalojadas += 1
+            return valor
+
+    def obtener_o_crear(self, clave: str, fabrica: Callable[[], V]) -> V:
+        with self._lock:
+            valor = self.obtener(clave)
+            if valor is None:
+                valor = self.poner(clave, fabrica())
+            return valor
+
+    def descartar(self, clave: str) -> bool:
+        with self._lock:
+            return self._entradas.pop(clave, None) is not None
+
+    def limpiar(self) -> None:
+        with self._lock:
+            self._entradas.clear()
+            self._vencimientos.clear()
+
+    def valores(self) -> List[V]:
+        """Copia de los estados vivos (del menos al más reciente)"""
+        with self._lock:
+            self._purgar(time.monotonic())
+            return [entrada.valor for entrada in self._entradas.values()]
+
+    def __iter__(self) -> Iterator[str]:
+        with self._lock:
+            return iter(list(self._entradas))
+
+    # --------------------------------------------------------
+    # Snapshot a disco
+    # --------------------------------------------------------
+
+    def guardar_snapshot(self, ruta: Path, serializar: Callable[[V], Any]) -> int:
+        """
+        Escribe las sesiones vivas en `ruta` (JSON, escritura atómica)
+
+        El vencimiento se guarda en tiempo de pared para que sobreviva al
+        reinicio del proceso. Devuelve cuántas sesiones se guardaron.
+        """
+        ruta = Path(ruta)
+        with self._lock:
+            ahora_mono, ahora = time.monotonic(), time.time()
+            self._purgar(ahora_mono)
+            datos = [
+                {"clave": clave, "expira": ahora + (entrada.expira - ahora_mono), "valor": serializar(entrada.valor)}
+                for clave, entrada in self._entradas.items()
+            ]
+        try:
+            ruta.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+            temporal = ruta.with_suffix(f".{os.getpid()}.tmp")
+            # Solo el usuario del proceso puede leerlo (conversaciones de cuidadores)
+            descriptor = os.open(temporal, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(descriptor, 'w', encoding='utf-8') as archivo:
+                json.dump(datos, archivo, ensure_ascii=False, default=str)
+            os.replace(temporal, ruta)
+        except OSError as e:
+            print(f"[WARN] No se pudo guardar el snapshot de {self.nombre}: {e}")
+            return 0
+        return len(datos)
+
+    def cargar_snapshot(self, ruta: Path, deserializar: Callable[[Any], V]) -> int:
+        """Restaura las sesiones no vencidas de un snapshot; devuelve cuántas"""
+        try:
+            datos = json.loads(Path(ruta).read_text(encoding='utf-8'))
+        except FileNotFoundError:
+            return 0
+        except (OSError, ValueError) as e:
+            print(f"[WARN] Snapshot de {self.nombre} ilegible, se ignora: {e}")
+            return 0
+
+        ahora_mono, ahora = time.monotonic(), time.time()
+        cargadas = 0
+        with self._lock:
+            # En orden de uso: las más recientes quedan al final del LRU
+            for registro in datos:
+                restante = registro["expira"] - ahora
+                if restante <= 0:
+                    continue
+                try:
+                    valor = deserializar(registro["valor"])
+                except (KeyError, TypeError, ValueError) as e:
+                    print(f"[WARN] Sesión {registro.get('clave')} del snapshot ignorada: {e}")
+                    continue
+                entrada = _Entrada(valor, ahora_mono + restante)
+                self._entradas[registro["clave"]] = entrada
+                self._entradas.move_to_end(registro["clave"])
+                heapq.heappush(self._vencimientos, (entrada.expira, next(self._contador), registro["clave"]))
+                cargadas += 1
+            while len(self._entradas) > self.max_sesiones:
+                self._entradas.popitem(last=False)
+                self.desalojadas += 1
+        return cargadas
+
+    def guardar_snapshot_worker(self, directorio: Path, prefijo: str, serializar: Callable[[V], Any]) -> int:
+        """Snapshot de este worker: `<prefijo>.<pid>.json` en `directorio`"""
+        return self.guardar_snapshot(Path(directorio) / f"{prefijo}.{os.getpid()}.json", serializar)
+
+    def reclamar_snapshot(self, directorio: Path, prefijo: str, deserializar: Callable[[Any], V]) -> int:
+        """
+        Restaura UN snapshot de un worker anterior
+
+        El archivo se reclama renombrándolo (atómico: si dos workers lo
+        intentan solo uno lo consigue) y se borra tras cargarlo. Los
+        snapshots más viejos que el TTL ya no tienen sesiones vivas y se
+        eliminan (quedan si hay menos workers que antes).
+        """
+        directorio = Path(directorio)
+        if not directorio.is_dir():
+            return 0
+        ahora = time.time()
+        for ruta in sorted(directorio.glob(f"{prefijo}.*.json")):
+            reclamada = ruta.with_name(f"{ruta.name}.{os.getpid()}.cargando")
+            try:
+                viejo = ahora - ruta.stat().st_mtime > self.ttl_segundos
+                os.rename(ruta, reclamada)
+            except FileNotFoundError:
+                continue  # lo reclamó otro worker
+            except OSError as e:
+                print(f"[WARN] No se pudo reclamar el snapshot {ruta.name}: {e}")
+                continue
+            try:
+                if not viejo:
+                    return self.cargar_snapshot(reclamada, deserializar)
+            finally:
+                try:
+                    reclamada.unlink()
+                except OSError:
+                    pass
+        return 0
+
+    def estadisticas(self) -> Dict[str, Any]:
+        with self._lock:
+            self._purgar(time.monotonic())
+            return {
+                'sesiones': len(self._entradas),
+                'capacidad': self.max_sesiones,
+                'ttl_segundos': self.ttl_segundos,
+                'entradas_heap': len(self._vencimientos),
+                'expiradas': self.expiradas,
+                'desalojadas': self.desalojadas,
+                'bytes_estimados': sum(self.medir(e.valor) for e in self._entradas.values()),
+            }
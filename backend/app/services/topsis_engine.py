@@ -0,0 +1,161 @@
+# app/services/topsis_engine.py
+"""
+Motor TOPSIS vectorizado compartido por todos los rankeadores
+
+Evalúa en una sola pasada de NumPy una pila 3-D de matrices de decisión
+(escenarios × alternativas × criterios). Cada escenario puede tener sus
+propios pesos y su propia máscara beneficio/costo, de modo que rankear
+terapeutas para cada tipo de terapia o probar varios juegos de pesos
+es una sola llamada.
+
+Reglas comunes para todos los llamadores:
+- Columnas en cero: el denominador de normalización se toma como 1,
+  la columna no aporta distancia.
+- Filas con NaN: se excluyen de la normalización y de los ideales y
+  reciben score 0.0 (quedan al final del ranking). También sirven como
+  relleno para apilar escenarios con distinto número de alternativas.
+- Empates: filas idénticas obtienen scores idénticos; si D+ + D- = 0
+  (la alternativa es a la vez ideal y anti-ideal) el score es 0.5.
+  El orden del ranking es estable: a igual score gana el índice menor.
+"""
+import numpy as np
+from typing import List, Sequence, Union
+
+TIPO_BENEFICIO = 'beneficio'
+TIPO_COSTO = 'costo'
+
+SCORE_EMPATE = 0.5
+SCORE_INVALIDO = 0.0
+
+
+def tipos_a_mascara(tipos: Sequence[str]) -> np.ndarray:
+    """
+    Convierte una lista de tipos ('beneficio' / 'costo') en máscara booleana
+    True = beneficio (mayor es mejor), False = costo (menor es mejor)
+    """
+    return np.array([tipo == TIPO_BENEFICIO for tipo in tipos], dtype=bool)
+
+
+def apilar_matrices(matrices: Sequence[Sequence[Sequence[float]]]) -> np.ndarray:
+    """
+    Apila matrices con distinto número de alternativas en un arreglo 3-D
+    rellenando con filas NaN (que el motor ignora)
+    """
+    if not matrices:
+        raise ValueError("Se requiere al menos una matriz de decisión")
+
+    arreglos = [np.asarray(m, dtype=float) for m in matrices]
+    num_criterios = {a.shape[1] for a in arreglos if a.ndim == 2 and a.size}
+    if len(num_criterios) > 1:
+        raise ValueError("Todas las matrices deben tener el mismo número de criterios")
+    columnas = num_criterios.pop() if num_criterios else 0
+
+    max_filas = max(a.shape[0] for a in arreglos)
+    pila = np.full((len(arreglos), max_filas, columnas), np.nan)
+    for i, arreglo in enumerate(arreglos):
+        if arreglo.size:
+            pila[i, :arreglo.shape[0], :] = arreglo
+    return pila
+
+
+def topsis_lote(
+    matrices: Union[np.ndarray, Sequence],
+    pesos: Union[np.ndarray, Sequence],
+    beneficio: Union[np.ndarray, Sequence]
+) -> np.ndarray:
+    """
+    Calcula scores TOPSIS para una pila de matrices de decisión
+
+    Args:
+        matrices: Arreglo (S, N, C) o una sola matriz (N, C)
+        pesos: Pesos (C,) comunes o (S, C) por escenario
+        beneficio: Máscara booleana (C,) o (S, C); True = beneficio
+
+    Returns:
+        Scores (S, N) entre 0 y 1, o (N,) si se recibió una sola matriz
+    """
+    matriz_np = np.asarray(matrices, dtype=float)
+    una_sola = matriz_np.ndim == 2
+    if una_sola:
+        matriz_np = matriz_np[np.newaxis]
+    if matriz_np.ndim != 3:
+        raise ValueError("La matriz de decisión debe ser 2-D o 3-D")
+
+    num_escenarios, num_alternativas, num_criterios = matriz_np.shape
+
+    pesos_np = np.asarray(pesos, dtype=float)
+    beneficio_np = np.asarray(beneficio, dtype=bool)
+    try:
+        pesos_np = np.broadcast_to(pesos_np, (num_escenarios, num_criterios))
+        beneficio_np = np.broadcast_to(beneficio_np, (num_escenarios, num_criterios))
+    except ValueError:
+        raise ValueError(
+            f"Pesos y tipos deben tener {num_criterios} criterios "
+            f"(uno por columna de la matriz)"
+        )
+
+    if num_alternativas == 0:
+        vacio = np.zeros((num_escenarios, 0))
+        return vacio[0] if una_sola else vacio
+
+    # Filas válidas: sin ningún NaN
+    validas = ~np.isnan(matriz_np).any(axis=2)
+    datos = np.where(validas[..., np.newaxis], matriz_np, 0.0)
+
+    # Paso 1: Normalización vectorial por columna (columnas en cero -> 1)
+    denominador = np.sqrt((datos ** 2).sum(axis=1, keepdims=True))
+    denominador[denominador == 0] = 1.0
+
+    # Paso 2: Aplicar pesos
+    ponderada = datos / denominador * pesos_np[:, np.newaxis, :]
+
+    # Paso 3: Ideales sobre filas válidas, sin bucle por criterio
+    mascara = validas[..., np.newaxis]
+    maximos = np.where(mascara, ponderada, -np.inf).max(axis=1)
+    minimos = np.where(mascara, ponderada, np.inf).min(axis=1)
+    maximos[~np.isfinite(maximos)] = 0.0
+    minimos[~np.isfinite(minimos)] = 0.0
+
+    ideal_positivo = np.where(beneficio_np, maximos, minimos)
+    ideal_negativo = np.where(beneficio_np, minimos, maximos)
+
+    # Paso 4: Distancias euclidianas
+    dist_positivas = np.sqrt(
+        ((ponderada - ideal_positivo[:, np.newaxis, :]) ** 2).sum(axis=2)
+    )
+    dist_negativas = np.sqrt(
+        ((ponderada - ideal_negativo[:, np.newaxis, :]) ** 2).sum(axis=2)
+    )
+
+    # Paso 5: Coeficiente de proximidad relativa
+    total = dist_positivas + dist_negativas
+    scores = np.full_like(total, SCORE_EMPATE)
+    np.divide(dist_negativas, total, out=scores, where=total > 0)
+    scores[~validas] = SCORE_INVALIDO
+
+    return scores[0] if una_sola else scores
+
+
+def topsis(
+    matriz: Union[np.ndarray, Sequence],
+    pesos: Union[np.ndarray, Sequence],
+    tipos: Sequence[str]
+) -> np.ndarray:
+    """Atajo para una sola matriz con tipos como texto ('beneficio'/'costo')"""
+    return topsis_lote(np.asarray(matriz, dtype=float), pesos, tipos_a_mascara(tipos))
+
+
+def orden_ranking(scores: np.ndarray) -> np.ndarray:
+    """
+    Índices que ordenan los scores de mayor a menor (último eje)
+    Orden estable: ante empate conserva el orden original
+    """
+    return np.argsort(-np.asarray(scores, dtype=float), axis=-1, kind='stable')
+
+
+def posiciones_ranking(scores: np.ndarray) -> List[int]:
+    """Posición (1 = mejor) de cada alternativa de un vector de scores"""
+    orden = orden_ranking(scores)
+    posiciones = np.empty(len(orden), dtype=int)
+    posiciones[orden] = np.arange(1, len(orden) + 1)
+    return posiciones.tolist()
@@ -3,12 +3,12 @@
 Servicio para cálculo de prioridad usando el método TOPSIS
 (Technique for Order of Preference by Similarity to Ideal Solution)
 """
-import numpy as np
 from typing import List, Tuple, Dict
 from sqlalchemy.orm import Session
 
 from app.models.criterio_topsis import CriterioTopsis
 from app.schemas.topsis import TopsisInput, TopsisResultado
+from app.services import topsis_engine
 
 
 def aplicar_topsis(
@@ -27,36 +27,8 @@ def aplicar_topsis(
     Returns:
         Lista de scores TOPSIS normalizados entre 0 y 1 para cada alternativa
     """
-    # Convertir a numpy array
-    matriz_np = np.array(matriz, dtype=float)
-    pesos_np = np.array(pesos, dtype=float)
-    
-    # Paso 1: Normalizar la matriz (normalización vectorial)
-    # Cada columna se divide por la raíz cuadrada de la suma de los cuadrados
-    norm_matriz = matriz_np / np.sqrt((matriz_np ** 2).sum(axis=0))
-    
-    # Paso 2: Aplicar pesos
-    matriz_ponderada = norm_matriz * pesos_np
-    
-    # Paso 3: Determinar ideal positivo y negativo
-    ideal_positivo = np.zeros(len(tipos))
-    ideal_negativo = np.zeros(len(tipos))
-    
-    for i, tipo in enumerate(tipos):
-        if tipo == 'beneficio':
-            ideal_positivo[i] = matriz_ponderada[:, i].max()
-            ideal_negativo[i] = matriz_ponderada[:, i].min()
-        else:  # tipo == 'costo'
-            ideal_positivo[i] = matriz_ponderada[:, i].min()
-            ideal_negativo[i] = matriz_ponderada[:, i].max()
-    
-    # Paso 4: Calcular distancias euclidianas
-    distancias_positivo = np.sqrt(((matriz_ponderada - ideal_positivo) ** 2).sum(axis=1))
-    distancias_negativo = np.sqrt(((matriz_ponderada - ideal_negativo) ** 2).sum(axis=1))
-    
-    # Paso 5: Calcular scores (similitud con ideal positivo)
-    # Score = D- / (D+ + D-)
-    scores = distancias_negativo / (distancias_positivo + distancias_negativo + 1e-10)
+    # Motor vectorizado compartido (maneja columnas en cero, NaN y empates)
+    scores = topsis_engine.topsis(matriz, pesos, tipos)
     
     return scores.tolist()
 
@@ -106,23 +78,15 @@ def calcular_prioridad_ninos(
     # Aplicar TOPSIS
     scores = aplicar_topsis(input_data.matriz, pesos, tipos)
     
-    # Crear resultados con ranking
-    resultados = [
-        {"nino_id": nino_id, "score": score}
-        for nino_id, score in zip(input_data.ids, scores)
-    ]
-    
-    # Ordenar por score descendente
-    resultados.sort(key=lambda x: x["score"], reverse=True)
-    
-    # Asignar ranking
+    # Ordenar por score descendente (orden estable ante empates) y asignar ranking
+    orden = topsis_engine.orden_ranking(scores)
     resultados_finales = [
         TopsisResultado(
-            nino_id=r["nino_id"],
-            score=r["score"],
+            nino_id=input_data.ids[i],
+            score=scores[i],
             ranking=idx + 1
         )
-        for idx, r in enumerate(resultados)
+        for idx, i in enumerate(orden)
     ]
     
     return resultados_finales
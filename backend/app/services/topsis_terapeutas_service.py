@@ -12,7 +12,7 @@ Implementa Clean Architecture con separación de responsabilidades:
 import numpy as np
 from sqlalchemy.orm import Session
 from sqlalchemy import func, and_, or_
-from typing import List, Tuple, Dict, Optional
+from typing import List, Optional, FrozenSet
 from datetime import datetime, timedelta
 
 from app.models.personal import Personal, EstadoLaboral
@@ -20,197 +20,89 @@ from app.models.cita import Cita
 from app.models.terapia import Terapia, TerapiaPersonal, Sesion
 from app.schemas.topsis_terapeutas import (
     TopsisEvaluacionRequest,
+    TopsisEvaluacionMultipleRequest,
     TerapeutaRanking,
     MetricasTerapeuta,
     TopsisResultado,
     PesosCriterios
 )
+from app.services import topsis_engine
+from app.services.especialidad_index import (
+    especialidad_index,
+    coincide,
+    tokenizar,
+    palabras_clave_terapia
+)
 
 
 class TopsisCalculator:
     """
     Clase para cálculos TOPSIS puros (sin dependencias de BD)
-    Implementa el algoritmo TOPSIS estándar
+    Delega en el motor vectorizado compartido (topsis_engine)
     """
     
     @staticmethod
-    def normalizar_matriz(matriz: np.ndarray) -> np.ndarray:
-        """
-        Normalización vectorial de la matriz de decisión
-        Cada elemento se divide por la raíz cuadrada de la suma de cuadrados de su columna
-        """
-        denominador = np.sqrt((matriz ** 2).sum(axis=0))
-        # Evitar división por cero
-        denominador[denominador == 0] = 1
-        return matriz / denominador
-    
-    @staticmethod
-    def aplicar_pesos(matriz_normalizada: np.ndarray, pesos: np.ndarray) -> np.ndarray:
-        """Multiplica cada columna por su peso correspondiente"""
-        return matriz_normalizada * pesos
-    
-    @staticmethod
-    def calcular_ideales(
-        matriz_ponderada: np.ndarray,
+    def evaluar(
+        matriz: np.ndarray,
+        pesos: np.ndarray,
         tipos_criterios: List[str]
-    ) -> Tuple[np.ndarray, np.ndarray]:
-        """
-        Calcula la solución ideal positiva (A+) y negativa (A-)
-        
-        Args:
-            matriz_ponderada: Matriz con pesos aplicados
-            tipos_criterios: Lista con 'beneficio' o 'costo' para cada criterio
-            
-        Returns:
-            Tupla (ideal_positivo, ideal_negativo)
-        """
-        ideal_positivo = np.zeros(matriz_ponderada.shape[1])
-        ideal_negativo = np.zeros(matriz_ponderada.shape[1])
-        
-        for i, tipo in enumerate(tipos_criterios):
-            if tipo == 'beneficio':
-                # Para criterios de beneficio: max es mejor
-                ideal_positivo[i] = matriz_ponderada[:, i].max()
-                ideal_negativo[i] = matriz_ponderada[:, i].min()
-            else:  # tipo == 'costo'
-                # Para criterios de costo: min es mejor
-                ideal_positivo[i] = matriz_ponderada[:, i].min()
-                ideal_negativo[i] = matriz_ponderada[:, i].max()
-        
-        return ideal_positivo, ideal_negativo
-    
-    @staticmethod
-    def calcular_distancias(
-        matriz_ponderada: np.ndarray,
-        ideal_positivo: np.ndarray,
-        ideal_negativo: np.ndarray
-    ) -> Tuple[np.ndarray, np.ndarray]:
-        """
-        Calcula distancias euclidianas a las soluciones ideales
-        
-        Returns:
-            Tupla (distancias_positivas, distancias_negativas)
-        """
-        dist_positivas = np.sqrt(
-            ((matriz_ponderada - ideal_positivo) ** 2).sum(axis=1)
-        )
-        dist_negativas = np.sqrt(
-            ((matriz_ponderada - ideal_negativo) ** 2).sum(axis=1)
-        )
-        return dist_positivas, dist_negativas
-    
-    @staticmethod
-    def calcular_scores(
-        dist_positivas: np.ndarray,
-        dist_negativas: np.ndarray
     ) -> np.ndarray:
         """
-        Calcula el coeficiente de proximidad relativa (score TOPSIS)
-        Score = D- / (D+ + D-)
-        Valores cercanos a 1 indican mejor alternativa
+        Ejecuta los 5 pasos de TOPSIS con el motor vectorizado compartido
+        Acepta una matriz (N, C) o una pila de escenarios (S, N, C)
         """
-        denominador = dist_positivas + dist_negativas
-        # Evitar división por cero (aunque no debería ocurrir)
-        denominador[denominador == 0] = 1e-10
-        return dist_negativas / denominador
+        return topsis_engine.topsis_lote(
+            matriz, pesos, topsis_engine.tipos_a_mascara(tipos_criterios)
+        )
 
 
 class MetricasService:
     """Servicio para calcular métricas de terapeutas desde la base de datos"""
     
     @staticmethod
-    def obtener_carga_laboral(db: Session, terapeuta_id: int) -> int:
-        """
-        Obtiene las sesiones semanales del terapeuta desde la tabla personal.
-        Esto representa su carga laboral actual.
-        Retorna el número de sesiones por semana que tiene asignadas.
-        """
-        terapeuta = db.query(Personal).filter(Personal.id == terapeuta_id).first()
-        if terapeuta and terapeuta.sesiones_semana:
-            return int(terapeuta.sesiones_semana)
-        return 0
-    
-    @staticmethod
-    def obtener_sesiones_completadas(db: Session, terapeuta_id: int) -> int:
-        """
-        Obtiene el total de pacientes del terapeuta desde la tabla personal.
-        Representa su experiencia práctica y volumen de trabajo histórico.
-        """
-        terapeuta = db.query(Personal).filter(Personal.id == terapeuta_id).first()
-        if terapeuta and terapeuta.total_pacientes:
-            return int(terapeuta.total_pacientes)
-        return 0
-    
-    @staticmethod
-    def obtener_rating_promedio(db: Session, terapeuta_id: int) -> float:
+    def coincide_especialidad(
+        terapia_nombre: str,
+        especialidad_principal: Optional[str],
+        especialidades: Optional[str]
+    ) -> bool:
         """
-        Obtiene el rating del terapeuta directamente desde la tabla personal.
-        Este rating es la calificación promedio histórica del terapeuta.
-        Retorna un valor entre 0 y 5.0
+        Compara el nombre de una terapia contra el texto de especialidades
+        de un terapeuta (mismas reglas que el índice). No consulta la BD.
         """
-        terapeuta = db.query(Personal).filter(Personal.id == terapeuta_id).first()
-        if terapeuta and terapeuta.rating is not None:
-            return float(terapeuta.rating)
-        return 3.0  # Valor neutral si no tiene rating
+        return coincide(
+            tokenizar(f"{especialidad_principal or ''} {especialidades or ''}"),
+            palabras_clave_terapia(terapia_nombre)
+        )
     
     @staticmethod
-    def verifica_especialidad_match(
+    def cargar_metricas_lote(
         db: Session,
-        terapeuta_id: int,
-        terapia_id: Optional[int]
-    ) -> bool:
-        """
-        Verifica si la especialidad del terapeuta coincide con la terapia solicitada.
-        Busca por nombre de la terapia en la especialidad_principal y especialidades.
-        Si no se especifica terapia_id, retorna True.
+        incluir_inactivos: bool = False
+    ) -> list:
         """
-        if terapia_id is None:
-            return True
-        
-        # Obtener el terapeuta
-        terapeuta = db.query(Personal).filter(Personal.id == terapeuta_id).first()
-        if not terapeuta:
-            return False
+        Obtiene en UNA consulta las métricas de todos los terapeutas
+        (nunca una consulta por terapeuta). Valores por defecto: carga y
+        pacientes 0 si son nulos, rating 3.0 (neutral) si es nulo.
         
-        # Obtener la terapia
-        terapia = db.query(Terapia).filter(Terapia.id == terapia_id).first()
-        if not terapia:
-            return False
-        
-        # Normalizar nombres para comparación (sin acentos, minúsculas)
-        terapia_nombre = terapia.nombre.lower().strip()
-        especialidad_principal = (terapeuta.especialidad_principal or '').lower().strip()
-        especialidades = (terapeuta.especialidades or '').lower().strip()
-        
-        # Mapeo de terapias a palabras clave de especialidades
-        mapeo_especialidades = {
-            'terapia de lenguaje': ['lenguaje', 'comunicación', 'habla'],
-            'lenguaje': ['lenguaje', 'comunicación', 'habla'],
-            'ocupacional': ['ocupacional', 'ocupación'],
-            'psicología': ['psicología', 'psicolog', 'psico'],
-            'conductual': ['conductual', 'aba', 'conducta'],
-            'aba': ['aba', 'conductual', 'conducta'],
-            'música': ['música', 'musicoterapia', 'musico'],
-            'física': ['física', 'fisico', 'motor'],
-            'sensorial': ['sensorial', 'integración'],
-            'pedagog': ['pedagog', 'educación']
-        }
-        
-        # Buscar coincidencias
-        for terapia_key, keywords in mapeo_especialidades.items():
-            if terapia_key in terapia_nombre:
-                for keyword in keywords:
-                    if keyword in especialidad_principal or keyword in especialidades:
-                        return True
+        Returns:
+            Filas con id, nombre, especialidades y columnas de métricas
+        """
+        query = db.query(
+            Personal.id,
+            Personal.nombres,
+            Personal.apellido_paterno,
+            Personal.apellido_materno,
+            Personal.especialidad_principal,
+            Personal.especialidades,
+            func.coalesce(Personal.sesiones_semana, 0).label('carga_laboral'),
+            func.coalesce(Personal.total_pacientes, 0).label('sesiones_completadas'),
+            func.coalesce(Personal.rating, 3.0).label('rating'),
+        )
         
-        # Si no hay match en el mapeo, buscar coincidencia directa
-        palabras_terapia = terapia_nombre.split()
-        for palabra in palabras_terapia:
-            if len(palabra) > 4:  # Solo palabras significativas
-                if palabra in especialidad_principal or palabra in especialidades:
-                    return True
+        if not incluir_inactivos:
+            query = query.filter(Personal.estado_laboral == EstadoLaboral.ACTIVO)
         
-        return False
+        return query.order_by(Personal.id).all()
 
 
 class TopsisEvaluacionService:
@@ -224,62 +116,32 @@ class TopsisEvaluacionService:
         self.calculator = TopsisCalculator()
         self.metricas_service = MetricasService()
     
-    def obtener_terapeutas_activos(
+    def construir_matriz_desde_filas(
         self,
-        incluir_inactivos: bool = False
-    ) -> List[Personal]:
-        """Obtiene lista de terapeutas del sistema"""
-        query = self.db.query(Personal)
-        
-        if not incluir_inactivos:
-            query = query.filter(Personal.estado_laboral == EstadoLaboral.ACTIVO)
-        
-        return query.all()
-    
-    def calcular_metricas_terapeuta(
-        self,
-        terapeuta: Personal,
-        terapia_id: Optional[int]
-    ) -> MetricasTerapeuta:
-        """Calcula todas las métricas para un terapeuta"""
-        return MetricasTerapeuta(
-            carga_laboral=self.metricas_service.obtener_carga_laboral(
-                self.db, terapeuta.id
-            ),
-            sesiones_completadas=self.metricas_service.obtener_sesiones_completadas(
-                self.db, terapeuta.id
-            ),
-            rating=self.metricas_service.obtener_rating_promedio(
-                self.db, terapeuta.id
-            ),
-            especialidad_match=self.metricas_service.verifica_especialidad_match(
-                self.db, terapeuta.id, terapia_id
-            )
-        )
-    
-    def construir_matriz_decision(
-        self,
-        terapeutas: List[Personal],
-        metricas_dict: Dict[int, MetricasTerapeuta]
+        filas: list,
+        terapeutas_match: Optional[FrozenSet[int]]
     ) -> np.ndarray:
         """
-        Construye la matriz de decisión con las métricas de cada terapeuta
+        Construye la matriz de decisión directamente desde las columnas
+        devueltas por MetricasService.cargar_metricas_lote (sin consultas)
         
         Columnas: [carga_laboral, sesiones_completadas, rating, especialidad_match]
-        Filas: Un terapeuta por fila
+        terapeutas_match: IDs que dominan la terapia (None = sin filtro, todos 1)
         """
-        matriz = []
-        for terapeuta in terapeutas:
-            metricas = metricas_dict[terapeuta.id]
-            fila = [
-                float(metricas.carga_laboral),
-                float(metricas.sesiones_completadas),
-                float(metricas.rating),
-                1.0 if metricas.especialidad_match else 0.0  # Convertir bool a float
-            ]
-            matriz.append(fila)
+        if not filas:
+            return np.zeros((0, 4))
+        
+        matriz = np.empty((len(filas), 4), dtype=float)
+        matriz[:, 0] = [fila.carga_laboral for fila in filas]
+        matriz[:, 1] = [fila.sesiones_completadas for fila in filas]
+        matriz[:, 2] = [fila.rating for fila in filas]
+        
+        if terapeutas_match is None:
+            matriz[:, 3] = 1.0
+        else:
+            matriz[:, 3] = [fila.id in terapeutas_match for fila in filas]
         
-        return np.array(matriz, dtype=float)
+        return matriz
     
     def evaluar_terapeutas(
         self,
@@ -289,16 +151,25 @@ class TopsisEvaluacionService:
         Método principal: Evalúa terapeutas usando TOPSIS
         
         Flujo:
-        1. Obtener terapeutas
-        2. Calcular métricas para cada uno
+        1. Obtener terapeutas y sus métricas en una sola consulta
+        2. Coincidencia de especialidad (índice precompilado)
         3. Construir matriz de decisión
         4. Aplicar TOPSIS
         5. Generar ranking ordenado
         """
-        # 1. Obtener terapeutas
-        terapeutas = self.obtener_terapeutas_activos(request.incluir_inactivos)
+        # Obtener nombre de terapia si se especificó (1 consulta)
+        terapia_nombre = None
+        if request.terapia_id:
+            terapia_nombre = self.db.query(Terapia.nombre).filter(
+                Terapia.id == request.terapia_id
+            ).scalar()
         
-        if not terapeutas:
+        # 1. Obtener terapeutas con sus métricas (1 consulta para todos)
+        filas = self.metricas_service.cargar_metricas_lote(
+            self.db, request.incluir_inactivos
+        )
+        
+        if not filas:
             return TopsisResultado(
                 total_evaluados=0,
                 terapia_solicitada=None,
@@ -306,15 +177,13 @@ class TopsisEvaluacionService:
                 ranking=[]
             )
         
-        # 2. Calcular métricas para cada terapeuta
-        metricas_dict = {}
-        for terapeuta in terapeutas:
-            metricas_dict[terapeuta.id] = self.calcular_metricas_terapeuta(
-                terapeuta, request.terapia_id
+        # 2-3. Construir matriz de decisión desde las columnas del resultado
+        terapeutas_match = None
+        if request.terapia_id is not None:
+            terapeutas_match = especialidad_index.terapeutas_para_terapia(
+                self.db, request.terapia_id
             )
-        
-        # 3. Construir matriz de decisión
-        matriz = self.construir_matriz_decision(terapeutas, metricas_dict)
+        matriz = self.construir_matriz_desde_filas(filas, terapeutas_match)
         
         # 4. Aplicar TOPSIS
         # Definir pesos y tipos de criterios
@@ -328,63 +197,120 @@ class TopsisEvaluacionService:
         # Tipos: carga_laboral es 'costo' (menos es mejor), resto son 'beneficio'
         tipos = ['costo', 'beneficio', 'beneficio', 'beneficio']
         
-        # Normalizar
-        matriz_norm = self.calculator.normalizar_matriz(matriz)
-        
-        # Aplicar pesos
-        matriz_pond = self.calculator.aplicar_pesos(matriz_norm, pesos)
-        
-        # Calcular ideales
-        ideal_pos, ideal_neg = self.calculator.calcular_ideales(matriz_pond, tipos)
-        
-        # Calcular distancias
-        dist_pos, dist_neg = self.calculator.calcular_distancias(
-            matriz_pond, ideal_pos, ideal_neg
-        )
-        
-        # Calcular scores
-        scores = self.calculator.calcular_scores(dist_pos, dist_neg)
-        
-        # 5. Generar ranking
-        # Crear lista temporal con scores para ordenar
-        temp_ranking = []
-        for i, terapeuta in enumerate(terapeutas):
-            nombre_completo = f"{terapeuta.nombres} {terapeuta.apellido_paterno} {terapeuta.apellido_materno or ''}".strip()
-            temp_ranking.append({
-                'terapeuta_id': terapeuta.id,
-                'nombre': nombre_completo,
-                'especialidad_principal': terapeuta.especialidad_principal,
-                'score': float(scores[i]),
-                'metricas': metricas_dict[terapeuta.id]
-            })
+        # Normalizar, ponderar, ideales, distancias y scores en una pasada
+        scores = self.calculator.evaluar(matriz, pesos, tipos)
         
-        # Ordenar por score descendente
-        temp_ranking.sort(key=lambda x: x['score'], reverse=True)
+        # 5. Generar ranking ordenado por score descendente (estable ante empates)
+        orden = topsis_engine.orden_ranking(scores)
         
-        # Crear objetos TerapeutaRanking con ranking ya asignado
         ranking_list = []
-        for i, item in enumerate(temp_ranking, start=1):
+        for i, idx in enumerate(orden, start=1):
+            fila = filas[idx]
+            nombre_completo = f"{fila.nombres} {fila.apellido_paterno} {fila.apellido_materno or ''}".strip()
             ranking_list.append(
                 TerapeutaRanking(
-                    terapeuta_id=item['terapeuta_id'],
-                    nombre=item['nombre'],
-                    especialidad_principal=item['especialidad_principal'],
-                    score=item['score'],
+                    terapeuta_id=fila.id,
+                    nombre=nombre_completo,
+                    especialidad_principal=fila.especialidad_principal,
+                    score=float(scores[idx]),
                     ranking=i,
-                    metricas=item['metricas']
+                    metricas=MetricasTerapeuta(
+                        carga_laboral=int(matriz[idx, 0]),
+                        sesiones_completadas=int(matriz[idx, 1]),
+                        rating=float(matriz[idx, 2]),
+                        especialidad_match=bool(matriz[idx, 3])
+                    )
                 )
             )
         
-        # Obtener nombre de terapia si se especificó
-        terapia_nombre = None
-        if request.terapia_id:
-            terapia = self.db.query(Terapia).filter(Terapia.id == request.terapia_id).first()
-            if terapia:
-                terapia_nombre = terapia.nombre
-        
         return TopsisResultado(
-            total_evaluados=len(terapeutas),
+            total_evaluados=len(filas),
             terapia_solicitada=terapia_nombre,
             pesos_aplicados=request.pesos,
             ranking=ranking_list
         )
+    
+    def evaluar_por_terapias(
+        self,
+        request: TopsisEvaluacionMultipleRequest
+    ) -> List[TopsisResultado]:
+        """
+        Rankea terapeutas para varias terapias en una sola pasada TOPSIS
+        
+        Las métricas se cargan una vez; cada terapia es un escenario de la
+        pila 3-D que solo difiere en la columna de especialidad, tomada de la
+        matriz terapeutas × terapias del índice precompilado.
+        """
+        query = self.db.query(Terapia.id, Terapia.nombre)
+        if request.terapia_ids is not None:
+            query = query.filter(Terapia.id.in_(request.terapia_ids))
+        else:
+            query = query.filter(Terapia.activo == 1)
+        terapias = query.order_by(Terapia.id).all()
+        
+        filas = self.metricas_service.cargar_metricas_lote(
+            self.db, request.incluir_inactivos
+        )
+        
+        if not terapias or not filas:
+            return [
+                TopsisResultado(
+                    total_evaluados=0,
+                    terapia_solicitada=terapia.nombre,
+                    pesos_aplicados=request.pesos,
+                    ranking=[]
+                )
+                for terapia in terapias
+            ]
+        
+        # Matriz base sin filtro de especialidad, replicada por terapia
+        base = self.construir_matriz_desde_filas(filas, None)
+        coincidencias = especialidad_index.matriz_coincidencias(
+            self.db,
+            terapeuta_ids=[fila.id for fila in filas],
+            terapia_ids=[terapia.id for terapia in terapias]
+        )
+        pila = np.repeat(base[np.newaxis], len(terapias), axis=0)
+        pila[:, :, 3] = coincidencias.T
+        
+        pesos = np.array([
+            request.pesos.carga_laboral,
+            request.pesos.sesiones_completadas,
+            request.pesos.rating,
+            request.pesos.especialidad
+        ])
+        tipos = ['costo', 'beneficio', 'beneficio', 'beneficio']
+        scores = self.calculator.evaluar(pila, pesos, tipos)
+        ordenes = topsis_engine.orden_ranking(scores)
+        
+        resultados = []
+        for k, terapia in enumerate(terapias):
+            ranking_list = []
+            for i, idx in enumerate(ordenes[k], start=1):
+                fila = filas[idx]
+                nombre_completo = f"{fila.nombres} {fila.apellido_paterno} {fila.apellido_materno or ''}".strip()
+                ranking_list.append(
+                    TerapeutaRanking(
+                        terapeuta_id=fila.id,
+                        nombre=nombre_completo,
+                        especialidad_principal=fila.especialidad_principal,
+                        score=float(scores[k, idx]),
+                        ranking=i,
+                        metricas=MetricasTerapeuta(
+                            carga_laboral=int(pila[k, idx, 0]),
+                            sesiones_completadas=int(pila[k, idx, 1]),
+                            rating=float(pila[k, idx, 2]),
+                            especialidad_match=bool(pila[k, idx, 3])
+                        )
+                    )
+                )
+            resultados.append(
+                TopsisResultado(
+                    total_evaluados=len(filas),
+                    terapia_solicitada=terapia.nombre,
+                    pesos_aplicados=request.pesos,
+                    ranking=ranking_list
+                )
+            )
+        
+        return resultados
@@ -0,0 +1,555 @@
+# app/services/vector_index.py
+"""
+Índice vectorial en proceso para recomendación de actividades
+
+Mantiene los embeddings de actividades como una matriz float32 con filas
+normalizadas (norma 1) y un mapa actividad_id -> fila. Una recomendación
+es un solo producto matriz-vector en lugar de miles de similitudes escalares.
+
+- Pre-filtros por área de desarrollo y dificultad máxima (máscaras NumPy)
+- Particionado IVF opcional (k-means) para catálogos grandes
+- Persistencia en uploads/vectores/*.npy, cargable con mmap
+- Un índice solo contiene vectores de un modelo de embeddings (el backend
+  principal); los generados por el fallback local no se mezclan
+- Alta/baja incremental cuando se vectoriza una actividad (guardado en
+  disco diferido: varias altas seguidas se escriben una sola vez)
+"""
+import json
+import os
+import threading
+from collections import Counter
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from sqlalchemy import event, func
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.models.actividad import Actividad
+from app.models.recomendacion import PerfilActividadVectorizada
+from app.services.gemini_embedding_service import gemini_embedding_service
+
+
+# Tamaño de catálogo a partir del cual se entrena el particionado IVF
+IVF_MIN_VECTORES = 4096
+# Iteraciones de k-means al entrenar los centroides
+IVF_ITERACIONES = 10
+# Espera tras la última alta incremental antes de escribir el índice a disco
+GUARDADO_DIFERIDO_SEGUNDOS = 5.0
+# Capacidad mínima de los arreglos de reserva para altas incrementales
+CAPACIDAD_INICIAL = 64
+
+
+def normalizar_filas(matriz: np.ndarray) -> np.ndarray:
+    """Normaliza cada fila a norma 1 (filas en cero quedan en cero)"""
+    matriz = np.asarray(matriz, dtype=np.float32)
+    normas = np.linalg.norm(matriz, axis=-1, keepdims=True)
+    normas[normas == 0] = 1.0
+    return matriz / normas
+
+
+def _normalizar_area(area: Optional[str]) -> str:
+    return (area or '').strip().lower()
+
+
+class VectorIndex:
+    """
+    Índice vectorial de coseno con ids, metadatos de filtro e IVF opcional
+
+    Las búsquedas trabajan sobre una instantánea inmutable del estado,
+    las modificaciones se serializan con un lock y reemplazan los arreglos.
+    """
+
+    def __init__(self, nombre: str, directorio: Optional[Path] = None):
+        self.nombre = nombre
+        self.directorio = Path(directorio) if directorio else settings.UPLOADS_DIR / "vectores"
+        self._lock = threading.RLock()
+        self._version = 0
+        self._version_construida = -1
+        self._guardado: Optional[threading.Timer] = None
+        self._reiniciar(dimension=0)
+
+    def _reiniciar(self, dimension: int) -> None:
+        self.dimension = dimension
+        self.matriz = np.zeros((0, dimension), dtype=np.float32)
+        self.ids = np.zeros(0, dtype=np.int64)
+        self.areas = np.zeros(0, dtype=object)
+        self.dificultades = np.zeros(0, dtype=np.int16)
+        self.listas = np.zeros(0, dtype=np.int32)
+        self.centroides: Optional[np.ndarray] = None
+        self.firma = ''
+        self._posicion: Dict[int, int] = {}
+        # Arreglos con capacidad sobrante; matriz/ids/... son vistas [:n] de
+        # ellos mientras solo haya altas (None = sin reserva)
+        self._reserva: Optional[Tuple[np.ndarray, ...]] = None
+
+    # --------------------------------------------------------
+    # Estado
+    # --------------------------------------------------------
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __contains__(self, item_id: int) -> bool:
+        return item_id in self._posicion
+
+    def invalidar(self, *args) -> None:
+        """Marca el índice para reconstrucción (firma compatible con eventos ORM)"""
+        with self._lock:
+            self._version += 1
+
+    @property
+    def sucio(self) -> bool:
+        return self._version_construida != self._version
+
+    # --------------------------------------------------------
+    # Construcción
+    # --------------------------------------------------------
+
+    def cargar_vectores(
+        self,
+        ids: Sequence[int],
+        vectores: Sequence[Sequence[float]],
+        areas: Sequence[Optional[str]],
+        dificultades: Sequence[Optional[int]],
+        usar_ivf: Optional[bool] = None
+    ) -> None:
+        """
+        Reemplaza el contenido del índice
+
+        Args:
+            usar_ivf: None = automático según IVF_MIN_VECTORES
+        """
+        version = self._version
+        filas = [np.asarray(v, dtype=np.float32).ravel() for v in vectores]
+        dimensiones = Counter(fila.shape[0] for fila in filas if fila.shape[0])
+        dimension = dimensiones.most_common(1)[0][0] if dimensiones else 0
+
+        # Descartar vectores con dimensión distinta a la mayoritaria
+        validos = [i for i, fila in enumerate(filas) if fila.shape[0] == dimension and dimension]
+        if len(validos) != len(filas):
+            print(f"[WARN] Índice {self.nombre}: {len(filas) - len(validos)} vectores con dimensión inválida")
+
+        matriz = normalizar_filas(np.stack([filas[i] for i in validos])) if validos else np.zeros((0, dimension), dtype=np.float32)
+
+        with self._lock:
+            self._reiniciar(dimension)
+            self.matriz = matriz
+            self.ids = np.array([ids[i] for i in validos], dtype=np.int64)
+            self.areas = np.array([_normalizar_area(areas[i]) for i in validos], dtype=object)
+            self.dificultades = np.array([dificultades[i] or 1 for i in validos], dtype=np.int16)
+            self._posicion = {int(item_id): i for i, item_id in enumerate(self.ids)}
+
+            if usar_ivf is None:
+                usar_ivf = len(self.ids) >= IVF_MIN_VECTORES
+            if usar_ivf and len(self.ids):
+                self.entrenar_ivf()
+            else:
+                self.listas = np.zeros(len(self.ids), dtype=np.int32)
+
+            self._version_construida = version
+
+    def entrenar_ivf(self, num_listas: Optional[int] = None, semilla: int = 0) -> None:
+        """Particiona el índice con k-means esférico (centroides normalizados)"""
+        with self._lock:
+            n = len(self.ids)
+            if n == 0:
+                return
+            num_listas = num_listas or max(1, int(np.sqrt(n)))
+            num_listas = min(num_listas, n)
+
+            rng = np.random.default_rng(semilla)
+            centroides = self.matriz[rng.choice(n, size=num_listas, replace=False)].copy()
+            for _ in range(IVF_ITERACIONES):
+                asignacion = np.argmax(self.matriz @ centroides.T, axis=1)
+                sumas = np.zeros_like(centroides)
+                np.add.at(sumas, asignacion, self.matriz)
+                vacios = ~np.any(sumas, axis=1)
+                sumas[vacios] = centroides[vacios]
+                centroides = normalizar_filas(sumas)
+
+            self.centroides = centroides
+            self.listas = np.argmax(self.matriz @ centroides.T, axis=1).astype(np.int32)
+            self._reserva = None
+
+    # --------------------------------------------------------
+    # Altas y bajas incrementales
+    # --------------------------------------------------------
+
+    def agregar(
+        self,
+        item_id: int,
+        vector: Sequence[float],
+        area: Optional[str] = None,
+        dificultad: Optional[int] = None
+    ) -> None:
+        """Inserta o reemplaza un vector"""
+        fila = normalizar_filas(np.asarray(vector, dtype=np.float32).reshape(1, -1))
+        with self._lock:
+            if self.dimension == 0 and len(self.ids) == 0:
+                self._reiniciar(fila.shape[1])
+            if fila.shape[1] != self.dimension:
+                raise ValueError(
+                    f"Dimensión {fila.shape[1]} no coincide con el índice ({self.dimension})"
+                )
+
+            lista = 0
+            if self.centroides is not None:
+                lista = int(np.argmax(self.centroides @ fila[0]))
+
+            area = _normalizar_area(area)
+            dificultad = dificultad or 1
+            posicion = self._posicion.get(int(item_id))
+            if posicion is not None:
+                # Copia para no escribir sobre un arreglo mapeado en memoria
+                matriz = np.array(self.matriz)
+                matriz[posicion] = fila[0]
+                self.matriz = matriz
+                self.areas = self.areas.copy()
+                self.areas[posicion] = area
+                self.dificultades = self.dificultades.copy()
+                self.dificultades[posicion] = dificultad
+                self.listas = self.listas.copy()
+                self.listas[posicion] = lista
+                self._reserva = None
+            else:
+                self._anexar(fila[0], item_id, area, dificultad, lista)
+
+    def _anexar(self, fila: np.ndarray, item_id: int, area: str, dificultad: int, lista: int) -> None:
+        """
+        Añade una fila al final en O(1) amortizado
+
+        Escribe en la fila n de los arreglos de reserva (duplicando su
+        capacidad cuando se llenan) y publica vistas [:n + 1]. Las
+        instantáneas que ya tomó buscar() son vistas [:n] y no ven la escritura.
+        """
+        n = len(self.ids)
+        if self._reserva is None or n >= len(self._reserva[0]):
+            capacidad = max(CAPACIDAD_INICIAL, 2 * n)
+            matriz = np.zeros((capacidad, self.dimension), dtype=np.float32)
+            ids = np.zeros(capacidad, dtype=np.int64)
+            areas = np.zeros(capacidad, dtype=object)
+            dificultades = np.zeros(capacidad, dtype=np.int16)
+            listas = np.zeros(capacidad, dtype=np.int32)
+            matriz[:n] = self.matriz
+            ids[:n] = self.ids
+            areas[:n] = self.areas
+            dificultades[:n] = self.dificultades
+            listas[:n] = self.listas
+            self._reserva = (matriz, ids, areas, dificultades, listas)
+
+        matriz, ids, areas, dificultades, listas = self._reserva
+        matriz[n] = fila
+        ids[n] = item_id
+        areas[n] = area
+        dificultades[n] = dificultad
+        listas[n] = lista
+        self.matriz = matriz[:n + 1]
+        self.ids = ids[:n + 1]
+        self.areas = areas[:n + 1]
+        self.dificultades = dificultades[:n + 1]
+        self.listas = listas[:n + 1]
+        self._posicion[int(item_id)] = n
+
+    def eliminar(self, item_id: int) -> bool:
+        """Quita un vector del índice; retorna False si no existía"""
+        with self._lock:
+            posicion = self._posicion.get(int(item_id))
+            if posicion is None:
+                return False
+            conservar = np.ones(len(self.ids), dtype=bool)
+            conservar[posicion] = False
+            self.matriz = self.matriz[conservar]
+            self.ids = self.ids[conservar]
+            self.areas = self.areas[conservar]
+            self.dificultades = self.dificultades[conservar]
+            self.listas = self.listas[conservar]
+            self._posicion = {int(i): p for p, i in enumerate(self.ids)}
+            self._reserva = None
+            return True
+
+    # --------------------------------------------------------
+    # Búsqueda
+    # --------------------------------------------------------
+
+    def buscar(
+        self,
+        vector: Sequence[float],
+        top_k: int = 10,
+        area: Optional[str] = None,
+        dificultad_max: Optional[int] = None,
+        num_sondas: Optional[int] = None
+    ) -> List[Tuple[int, float]]:
+        """
+        Top-k por similitud coseno con pre-filtros
+
+        Returns:
+            Lista de (item_id, score) con score normalizado a [0, 1]
+            como (coseno + 1) / 2, ordenada de mayor a menor
+        """
+        with self._lock:
+            matriz, ids = self.matriz, self.ids
+            areas, dificultades = self.areas, self.dificultades
+            listas, centroides = self.listas, self.centroides
+
+        if len(ids) == 0 or top_k <= 0:
+            return []
+
+        consulta = normalizar_filas(np.asarray(vector, dtype=np.float32).reshape(1, -1))[0]
+        if consulta.shape[0] != matriz.shape[1]:
+            raise ValueError(
+                f"Dimensión de consulta {consulta.shape[0]} no coincide con el índice ({matriz.shape[1]})"
+            )
+
+        mascara = np.ones(len(ids), dtype=bool)
+        if area:
+            mascara &= areas == _normalizar_area(area)
+        if dificultad_max:
+            mascara &= dificultades <= dificultad_max
+        if centroides is not None:
+            num_sondas = num_sondas or max(1, len(centroides) // 4)
+            sondas = np.argsort(-(centroides @ consulta))[:num_sondas]
+            mascara &= np.isin(listas, sondas)
+
+        candidatos = np.flatnonzero(mascara)
+        if len(candidatos) == 0:
+            return []
+
+        if len(candidatos) == len(ids):
+            similitudes = matriz @ consulta
+        else:
+            similitudes = matriz[candidatos] @ consulta
+
+        k = min(top_k, len(candidatos))
+        mejores = np.argpartition(-similitudes, k - 1)[:k]
+        mejores = mejores[np.argsort(-similitudes[mejores], kind='stable')]
+
+        scores = np.clip((similitudes[mejores].astype(np.float64) + 1.0) / 2.0, 0.0, 1.0)
+        return [
+            (int(ids[candidatos[i]]), float(score))
+            for i, score in zip(mejores, scores)
+        ]
+
+    def buscar_lote(
+        self,
+        vectores: Sequence[Sequence[float]],
+        top_k: int = 10
+    ) -> List[List[Tuple[int, float]]]:
+        """
+        Top-k exacto para muchas consultas con un solo producto de matrices
+
+        Returns:
+            Una lista de (item_id, score) por consulta, en el mismo orden
+        """
+        with self._lock:
+            matriz, ids = self.matriz, self.ids
+
+        consultas = np.asarray(vectores, dtype=np.float32)
+        if len(consultas) == 0:
+            return []
+        if len(ids) == 0 or top_k <= 0:
+            return [[] for _ in range(len(consultas))]
+        if consultas.ndim != 2 or consultas.shape[1] != matriz.shape[1]:
+            raise ValueError(
+                f"Las consultas deben ser (n, {matriz.shape[1]}), se recibió {consultas.shape}"
+            )
+
+        similitudes = normalizar_filas(consultas) @ matriz.T
+        k = min(top_k, len(ids))
+        mejores = np.argpartition(-similitudes, k - 1, axis=1)[:, :k]
+        parciales = np.take_along_axis(similitudes, mejores, axis=1)
+        orden = np.argsort(-parciales, axis=1, kind='stable')
+        mejores = np.take_along_axis(mejores, orden, axis=1)
+        scores = np.clip(
+            (np.take_along_axis(similitudes, mejores, axis=1).astype(np.float64) + 1.0) / 2.0,
+            0.0, 1.0
+        )
+        return [
+            [(int(ids[i]), float(score)) for i, score in zip(fila_ids, fila_scores)]
+            for fila_ids, fila_scores in zip(mejores, scores)
+        ]
+
+    # --------------------------------------------------------
+    # Persistencia
+    # --------------------------------------------------------
+
+    @property
+    def ruta_matriz(self) -> Path:
+        return self.directorio / f"{self.nombre}.npy"
+
+    @property
+    def ruta_metadatos(self) -> Path:
+        return self.directorio / f"{self.nombre}_meta.npz"
+
+    def guardar(self) -> None:
+        """Escribe matriz y metadatos de forma atómica (archivo temporal + rename)"""
+        with self._lock:
+            self.directorio.mkdir(parents=True, exist_ok=True)
+            tmp_matriz = self.ruta_matriz.with_suffix('.tmp.npy')
+            tmp_meta = self.ruta_metadatos.with_suffix('.tmp.npz')
+            np.save(tmp_matriz, np.ascontiguousarray(self.matriz, dtype=np.float32))
+            np.savez(
+                tmp_meta,
+                ids=self.ids,
+                areas=np.array(json.dumps([str(a) for a in self.areas])),
+                dificultades=self.dificultades,
+                listas=self.listas,
+                centroides=self.centroides if self.centroides is not None else np.zeros((0, self.dimension), dtype=np.float32),
+                firma=np.array(self.firma),
+            )
+            os.replace(tmp_matriz, self.ruta_matriz)
+            os.replace(tmp_meta, self.ruta_metadatos)
+
+    def cargar(self, mmap: bool = True) -> bool:
+        """Carga el índice desde disco; retorna False si no hay archivos"""
+        if not self.ruta_matriz.exists() or not self.ruta_metadatos.exists():
+            return False
+        try:
+            matriz = np.load(self.ruta_matriz, mmap_mode='r' if mmap else None)
+            with np.load(self.ruta_metadatos) as meta:
+                ids = meta['ids'].astype(np.int64)
+                areas = np.array(json.loads(str(meta['areas'])), dtype=object)
+                dificultades = meta['dificultades'].astype(np.int16)
+                listas = meta['listas'].astype(np.int32)
+                centroides = meta['centroides']
+                firma = str(meta['firma']) if 'firma' in meta.files else ''
+        except Exception as e:
+            print(f"[WARN] No se pudo cargar el índice {self.nombre}: {e}")
+            return False
+
+        if len(matriz) != len(ids):
+            print(f"[WARN] Índice {self.nombre} inconsistente en disco, se reconstruirá")
+            return False
+
+        with self._lock:
+            self._reiniciar(matriz.shape[1] if matriz.ndim == 2 else 0)
+            self.matriz = matriz
+            self.ids = ids
+            self.areas = areas if len(areas) == len(ids) else np.array([''] * len(ids), dtype=object)
+            self.dificultades = dificultades
+            self.listas = listas
+            self.centroides = centroides if len(centroides) else None
+            self.firma = firma
+            self._posicion = {int(i): p for p, i in enumerate(ids)}
+        return True
+
+
+class ActividadVectorIndex(VectorIndex):
+    """
+    Índice de embeddings de actividades activas (PerfilActividadVectorizada)
+
+    Solo incluye los perfiles cuyo modelo_embedding es `modelo`; las
+    consultas deben venir del mismo modelo.
+    """
+
+    def __init__(self, directorio: Optional[Path] = None, modelo: Optional[str] = None):
+        super().__init__("actividades", directorio)
+        self.modelo = modelo or gemini_embedding_service.modelo
+
+    def calcular_firma(self, db: Session) -> str:
+        """Huella barata del contenido en BD (modelo + conteo + última actualización)"""
+        total, ultima = db.query(
+            func.count(PerfilActividadVectorizada.id),
+            func.max(PerfilActividadVectorizada.fecha_actualizacion)
+        ).filter(
+            PerfilActividadVectorizada.modelo_embedding == self.modelo
+        ).one()
+        return f"{self.modelo}|{total}|{ultima.isoformat() if ultima else ''}"
+
+    def construir(self, db: Session) -> None:
+        """Reconstruye desde la BD con una sola consulta y persiste en disco"""
+        version = self._version
+        firma = self.calcular_firma(db)
+        filas = db.query(
+            PerfilActividadVectorizada.actividad_id,
+            PerfilActividadVectorizada.embedding,
+            Actividad.area_desarrollo,
+            Actividad.dificultad
+        ).join(
+            Actividad, Actividad.id == PerfilActividadVectorizada.actividad_id
+        ).filter(
+            Actividad.activo == 1,
+            PerfilActividadVectorizada.modelo_embedding == self.modelo
+        ).all()
+
+        self.cargar_vectores(
+            ids=[f.actividad_id for f in filas],
+            vectores=[f.embedding if f.embedding is not None else [] for f in filas],
+            areas=[f.area_desarrollo for f in filas],
+            dificultades=[f.dificultad for f in filas]
+        )
+        with self._lock:
+            self.firma = firma
+            self._version_construida = version
+        try:
+            self.guardar()
+        except OSError as e:
+            print(f"[WARN] No se pudo persistir el índice {self.nombre}: {e}")
+
+    def asegurar(self, db: Session) -> None:
+        """
+        Garantiza un índice utilizable: primero intenta el archivo en disco
+        (mmap) y, si no existe o fue invalidado, reconstruye desde la BD
+        """
+        if not self.sucio:
+            return
+        primera_carga = self._version_construida == -1 and self._version == 0
+        if primera_carga and self.cargar() and self.firma == self.calcular_firma(db):
+            self._version_construida = 0
+            return
+        self.construir(db)
+
+    def sincronizar_actividad(
+        self,
+        db: Session,
+        actividad: Actividad,
+        embedding: Sequence[float],
+        modelo: str
+    ) -> None:
+        """
+        Alta/baja incremental tras vectorizar una actividad (ya confirmada en BD)
+
+        La huella se recalcula con la BD para que el archivo en disco siga
+        siendo válido al reiniciar. La escritura se difiere
+        GUARDADO_DIFERIDO_SEGUNDOS: una vectorización en bucle guarda una vez.
+        """
+        if self.sucio:
+            # Se reconstruirá completo en el próximo uso
+            return
+        firma = self.calcular_firma(db)
+        if actividad.activo == 1 and modelo == self.modelo and embedding is not None and len(embedding):
+            self.agregar(actividad.id, embedding, actividad.area_desarrollo, actividad.dificultad)
+        else:
+            self.eliminar(actividad.id)
+        with self._lock:
+            self.firma = firma
+            if self._guardado is not None:
+                self._guardado.cancel()
+            self._guardado = threading.Timer(GUARDADO_DIFERIDO_SEGUNDOS, self.guardar_pendiente)
+            self._guardado.daemon = True
+            self._guardado.start()
+
+    def guardar_pendiente(self) -> None:
+        """Escribe a disco las altas/bajas incrementales aún no guardadas"""
+        with self._lock:
+            if self._guardado is None:
+                return
+            self._guardado.cancel()
+            self._guardado = None
+            if self.sucio:
+                # Lo que hay en memoria ya no es lo que se reconstruirá
+                return
+            try:
+                self.guardar()
+            except OSError as e:
+                print(f"[WARN] No se pudo persistir el índice {self.nombre}: {e}")
+
+
+# Instancia global del índice de actividades
+actividad_vector_index = ActividadVectorIndex()
+
+# Cambios de área/dificultad/estado o bajas de actividades invalidan el índice
+for _evento in ('after_update', 'after_delete'):
+    event.listen(Actividad, _evento, actividad_vector_index.invalidar)
+event.listen(PerfilActividadVectorizada, 'after_delete', actividad_vector_index.invalidar)
@@ -4,12 +4,39 @@ Servicio para construir representaciones de texto para recomendación basada en
 Utiliza TF-IDF y similitud de coseno
 """
 import json
-from typing import List, Dict
+from typing import Any, List, Dict, Sequence
 from sklearn.feature_extraction.text import TfidfVectorizer
 from sklearn.metrics.pairwise import cosine_similarity
 import numpy as np
 
 
+# Parámetros comunes del vectorizador TF-IDF
+PARAMETROS_TFIDF = dict(
+    lowercase=True,
+    max_features=500,
+    ngram_range=(1, 2),  # Unigramas y bigramas
+    min_df=1
+)
+
+
+def parsear_tags(tags: Any) -> List[str]:
+    """
+    Normaliza tags guardados como lista o como string JSON
+    
+    Returns:
+        Lista de tags ([] si no hay o el JSON es inválido)
+    """
+    if isinstance(tags, list):
+        return tags
+    if isinstance(tags, str) and tags:
+        try:
+            valor = json.loads(tags)
+        except ValueError:
+            return []
+        return valor if isinstance(valor, list) else []
+    return []
+
+
 def build_profile_text(nino_data: Dict) -> str:
     """
     Construye un texto representativo del perfil del niño
@@ -146,12 +173,7 @@ def calcular_similitud(
         return np.zeros(len(textos_candidatos))
     
     # Crear vectorizador TF-IDF
-    vectorizer = TfidfVectorizer(
-        lowercase=True,
-        max_features=500,
-        ngram_range=(1, 2),  # Unigramas y bigramas
-        min_df=1
-    )
+    vectorizer = TfidfVectorizer(**PARAMETROS_TFIDF)
     
     # Combinar todos los textos
     todos_textos = [texto_referencia] + textos_candidatos
@@ -168,3 +190,47 @@ def calcular_similitud(
     except Exception as e:
         # Si hay error (ej: todos los textos vacíos), retornar ceros
         return np.zeros(len(textos_candidatos))
+
+
+class ModeloTfidf:
+    """
+    Vectorizador TF-IDF ajustado una sola vez sobre un catálogo
+    
+    Guarda la matriz dispersa de documentos (filas con norma L2 = 1), de modo
+    que cada consulta solo transforma el texto de referencia y hace un
+    producto disperso matriz-vector.
+    """
+
+    def __init__(self, textos_documentos: Sequence[str]):
+        self.num_documentos = len(textos_documentos)
+        self.vectorizer = TfidfVectorizer(**PARAMETROS_TFIDF)
+        try:
+            self.matriz = self.vectorizer.fit_transform(textos_documentos)
+        except ValueError:
+            # Catálogo vacío o sin vocabulario útil
+            self.vectorizer = None
+            self.matriz = None
+
+    def similitudes(self, texto_referencia: str) -> np.ndarray:
+        """
+        Similitud de coseno del texto de referencia contra cada documento
+        
+        Returns:
+            Array (num_documentos,) con scores entre 0 y 1
+        """
+        if not texto_referencia or self.vectorizer is None:
+            return np.zeros(self.num_documentos)
+        consulta = self.vectorizer.transform([texto_referencia])
+        return (self.matriz @ consulta.T).toarray().ravel()
+
+    def similitudes_lote(self, textos_referencia: Sequence[str]) -> np.ndarray:
+        """
+        Similitudes de varios textos de referencia con un solo producto disperso
+        
+        Returns:
+            Array (num_textos, num_documentos)
+        """
+        if self.vectorizer is None or not len(textos_referencia):
+            return np.zeros((len(textos_referencia), self.num_documentos))
+        consultas = self.vectorizer.transform([texto or '' for texto in textos_referencia])
+        return (consultas @ self.matriz.T).toarray()
@@ -0,0 +1,251 @@
+# app/services/ws_fanout.py
+"""
+Difusión de eventos a grupos de WebSockets con contrapresión
+
+Enviar con `await websocket.send_json(...)` a cada participante en serie
+hace que un cliente lento (móvil con mala red) retrase a todos los demás
+y serializa el mismo dict una vez por socket. Aquí:
+
+- Cada evento se serializa una sola vez (JSON compacto, como send_json)
+  y el mismo texto se encola para todas las conexiones del grupo.
+- Cada conexión tiene una cola de salida acotada y su propia tarea
+  escritora; publicar es un encolado sin esperas.
+- Si la cola de una conexión se llena, la conexión queda "rezagada": se
+  descartan sus eventos pendientes y recibe {"tipo": "rezagado"} para que
+  el cliente se resincronice por REST. Tras `max_rezagos` desbordes se
+  cierra (código 1013) y se retira del grupo.
+- Un envío que tarda más de `timeout_envio` también retira la conexión.
+
+Todo se usa desde el event loop (sin locks).
+"""
+import asyncio
+import json
+import logging
+from typing import Any, Dict, Hashable, List, Optional
+
+from fastapi import WebSocket
+
+logger = logging.getLogger(__name__)
+
+# Código de cierre "Try Again Later" para consumidores demasiado lentos
+CIERRE_CONSUMIDOR_LENTO = 1013
+
+
+def serializar(evento: Dict[str, Any]) -> str:
+    """JSON compacto, igual que WebSocket.send_json"""
+    return json.dumps(evento, separators=(",", ":"), ensure_ascii=False, default=str)
+
+
+class ConexionSalida:
+    """Conexión registrada: socket + cola de salida + tarea escritora"""
+
+    __slots__ = ('grupo', 'clave', 'websocket', 'cola', 'tarea', 'rezagos', 'enviados', 'descartados', 'cerrada')
+
+    def __init__(self, grupo: Hashable, clave: Hashable, websocket: WebSocket, max_cola: int):
+        self.grupo = grupo
+        self.clave = clave
+        self.websocket = websocket
+        self.cola: "asyncio.Queue[str]" = asyncio.Queue(maxsize=max_cola)
+        self.tarea: Optional[asyncio.Task] = None
+        self.rezagos = 0
+        self.enviados = 0
+        self.descartados = 0
+        self.cerrada = False
+
+    @property
+    def rezagada(self) -> bool:
+        return self.rezagos > 0
+
+
+class DifusorWebSocket:
+    """Grupos de conexiones {grupo: {clave: ConexionSalida}} con envío desacoplado"""
+
+    def __init__(
+        self,
+        nombre: str = "ws",
+        max_cola: int = 256,
+        timeout_envio: float = 10.0,
+        max_rezagos: int = 3
+    ):
+        self.nombre = nombre
+        self.max_cola = max_cola
+        self.timeout_envio = timeout_envio
+        self.max_rezagos = max_rezagos
+        self.grupos: Dict[Hashable, Dict[Hashable, ConexionSalida]] = {}
+
+        # Métricas
+        self.publicados = 0
+        self.encolados = 0
+        self.enviados = 0
+        self.descartados = 0
+        self.rezagos = 0
+        self.expulsadas = 0
+        self.errores_envio = 0
+
+    # --------------------------------------------------------
+    # Registro de conexiones
+    # --------------------------------------------------------
+
+    def registrar(self, grupo: Hashable, clave: Hashable, websocket: WebSocket) -> ConexionSalida:
+        """Registra una conexión ya aceptada (reemplaza la anterior de la misma clave)"""
+        anterior = self.grupos.get(grupo, {}).get(clave)
+        if anterior is not None:
+            self._detener(anterior)
+        conexion = ConexionSalida(grupo, clave, websocket, self.max_cola)
+        conexion.tarea = asyncio.get_running_loop().create_task(
+            self._escribir(conexion), name=f"{self.nombre}-escritor-{grupo}-{clave}"
+        )
+        self.grupos.setdefault(grupo, {})[clave] = conexion
+        return conexion
+
+    def retirar(self, grupo: Hashable, clave: Hashable, conexion: Optional[ConexionSalida] = None) -> bool:
+        """
+        Retira una conexión y detiene su escritor
+
+        Si se indica `conexion`, solo se retira si sigue siendo la registrada
+        (una reconexión posterior con la misma clave no se toca).
+        """
+        miembros = self.grupos.get(grupo)
+        if not miembros:
+            return False
+        actual = miembros.get(clave)
+        if actual is None or (conexion is not None and actual is not conexion):
+            return False
+        del miembros[clave]
+        if not miembros:
+            del self.grupos[grupo]
+        self._detener(actual)
+        return True
+
+    def _detener(self, conexion: ConexionSalida) -> None:
+        conexion.cerrada = True
+        if conexion.tarea is not None and conexion.tarea is not asyncio.current_task():
+            conexion.tarea.cancel()
+
+    def claves(self, grupo: Hashable) -> List[Hashable]:
+        return list(self.grupos.get(grupo, ()))
+
+    def conexion(self, grupo: Hashable, clave: Hashable) -> Optional[ConexionSalida]:
+        return self.grupos.get(grupo, {}).get(clave)
+
+    # --------------------------------------------------------
+    # Publicación
+    # --------------------------------------------------------
+
+    def publicar(self, grupo: Hashable, evento: Dict[str, Any], excluir: Optional[Hashable] = None) -> int:
+        """Serializa una vez y encola para el grupo; devuelve a cuántas conexiones"""
+        if not self.grupos.get(grupo):
+            return 0
+        return self.publicar_texto(grupo, serializar(evento), excluir)
+
+    def enviar_texto(self, grupo: Hashable, clave: Hashable, texto: str) -> bool:
+        """Encola un texto para una sola conexión del grupo"""
+        conexion = self.conexion(grupo, clave)
+        return conexion is not None and self._encolar(conexion, texto)
+
+    def encolar(self, conexion: ConexionSalida, texto: str) -> bool:
+        """Encola un texto para una conexión concreta; False si ya fue retirada"""
+        return self._encolar(conexion, texto)
+
+    def publicar_texto(self, grupo: Hashable, texto: str, excluir: Optional[Hashable] = None) -> int:
+        """Encola un evento ya serializado (no espera a ningún envío)"""
+        miembros = self.grupos.get(grupo)
+        if not miembros:
+            return 0
+        self.publicados += 1
+        encolados = 0
+        for clave, conexion in list(miembros.items()):
+            if excluir is not None and clave == excluir:
+                continue
+            if self._encolar(conexion, texto):
+                encolados += 1
+        self.encolados += encolados
+        return encolados
+
+    def _encolar(self, conexion: ConexionSalida, texto: str) -> bool:
+        if conexion.cerrada:
+            return False
+        try:
+            conexion.cola.put_nowait(texto)
+            return True
+        except asyncio.QueueFull:
+            pass
+
+        # Desborde: se descarta lo pendiente y se avisa al cliente
+        descartados = conexion.cola.qsize() + 1
+        while not conexion.cola.empty():
+            conexion.cola.get_nowait()
+        conexion.descartados += descartados
+        conexion.rezagos += 1
+        self.descartados += descartados
+        self.rezagos += 1
+
+        if conexion.rezagos > self.max_rezagos:
+            logger.warning(
+                f"[{self.nombre}] Conexión {conexion.clave} de {conexion.grupo} cerrada por lenta "
+                f"({conexion.rezagos} desbordes)"
+            )
+            self._expulsar(conexion)
+            return False
+
+        conexion.cola.put_nowait(serializar({"tipo": "rezagado", "descartados": descartados}))
+        return False
+
+    def _expulsar(self, conexion: ConexionSalida) -> None:
+        if self.retirar(conexion.grupo, conexion.clave, conexion):
+            self.expulsadas += 1
+            asyncio.get_running_loop().create_task(self._cerrar_socket(conexion.websocket))
+
+    @staticmethod
+    async def _cerrar_socket(websocket: WebSocket) -> None:
+        try:
+            await websocket.close(code=CIERRE_CONSUMIDOR_LENTO)
+        except Exception:
+            pass
+
+    # --------------------------------------------------------
+    # Escritor por conexión
+    # --------------------------------------------------------
+
+    async def _escribir(self, conexion: ConexionSalida) -> None:
+        try:
+            while True:
+                texto = await conexion.cola.get()
+                await asyncio.wait_for(conexion.websocket.send_text(texto), self.timeout_envio)
+                conexion.enviados += 1
+                self.enviados += 1
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.errores_envio += 1
+            logger.error(f"[{self.nombre}] Error enviando a {conexion.clave} en {conexion.grupo}: {e!r}")
+            if self.retirar(conexion.grupo, conexion.clave, conexion):
+                await self._cerrar_socket(conexion.websocket)
+
+    async def cerrar(self) -> None:
+        """Detiene todos los escritores (al apagar)"""
+        tareas = []
+        for miembros in list(self.grupos.values()):
+            for conexion in list(miembros.values()):
+                self._detener(conexion)
+                if conexion.tarea is not None:
+                    tareas.append(conexion.tarea)
+        self.grupos.clear()
+        await asyncio.gather(*tareas, return_exceptions=True)
+
+    def estadisticas(self) -> Dict[str, Any]:
+        conexiones = [c for miembros in self.grupos.values() for c in miembros.values()]
+        return {
+            'grupos': len(self.grupos),
+            'conexiones': len(conexiones),
+            'rezagadas': sum(1 for c in conexiones if c.rezagada),
+            'cola_max_actual': max((c.cola.qsize() for c in conexiones), default=0),
+            'capacidad_cola': self.max_cola,
+            'publicados': self.publicados,
+            'encolados': self.encolados,
+            'enviados': self.enviados,
+            'descartados': self.descartados,
+            'desbordes': self.rezagos,
+            'expulsadas': self.expulsadas,
+            'errores_envio': self.errores_envio,
+        }
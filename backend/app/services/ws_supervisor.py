@@ -0,0 +1,297 @@
+# app/services/ws_supervisor.py
+"""
+Supervisor de conexiones WebSocket (chat y notificaciones)
+
+Sin supervisión un socket muerto solo se detecta cuando falla un envío y
+una conexión inactiva vive para siempre (memoria y descriptores que no se
+liberan con redes móviles inestables). El supervisor:
+
+- Envía latidos (ping) cada `intervalo_ping` segundos sin tráfico del cliente.
+- Cierra la conexión si un cliente que ya respondió pongs deja de
+  hacerlo durante `timeout_pong` (los clientes que nunca responden solo
+  quedan sujetos a la inactividad y a los fallos de envío).
+- Cierra la conexión tras `timeout_inactividad` segundos sin mensajes de
+  la aplicación (salvo en canales solo de envío, como notificaciones,
+  donde el cliente escucha sin hablar: ahí solo cuentan latidos y envíos).
+- Agenda las revisiones en una rueda de temporizadores: programar,
+  cancelar y retirar una conexión cuestan O(1) y cada tick solo revisa las
+  conexiones cuya revisión vence en esa ranura.
+- Lleva indicadores en vivo (conexiones por tipo, máximo, cierres por motivo).
+
+Todo corre en el event loop (sin locks).
+"""
+import asyncio
+import itertools
+import logging
+import math
+import time
+from typing import Any, Callable, Dict, List, Optional, Set
+
+from fastapi import WebSocket
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Códigos de cierre de la aplicación
+CIERRE_SIN_LATIDO = 4001
+CIERRE_INACTIVIDAD = 4002
+CIERRE_ENVIO = 4003
+
+
+class ConexionVigilada:
+    """Estado de supervisión de un WebSocket"""
+
+    __slots__ = (
+        'id', 'tipo', 'websocket', 'enviar_ping', 'al_cerrar',
+        'ultimo_latido', 'ultimo_mensaje', 'ultimo_ping', 'ping_pendiente', 'responde_ping',
+        'con_inactividad', 'cerrada', 'tick', 'ranura'
+    )
+
+    def __init__(
+        self,
+        id_: int,
+        tipo: str,
+        websocket: WebSocket,
+        enviar_ping: Callable[[], bool],
+        al_cerrar: Optional[Callable[[], None]],
+        ahora: float,
+        con_inactividad: bool = True
+    ):
+        self.id = id_
+        self.tipo = tipo
+        self.websocket = websocket
+        self.enviar_ping = enviar_ping
+        self.al_cerrar = al_cerrar
+        # Cualquier trama del cliente / mensajes de la aplicación
+        self.ultimo_latido = ahora
+        self.ultimo_mensaje = ahora
+        self.ultimo_ping = ahora
+        self.ping_pendiente: Optional[float] = None
+        self.responde_ping = False
+        self.con_inactividad = con_inactividad
+        self.cerrada = False
+        # Posición en la rueda de temporizadores
+        self.tick = 0
+        self.ranura: Optional[int] = None
+
+
+class RuedaTemporizadores:
+    """
+    Rueda de temporizadores con hash
+
+    Cada elemento guarda su tick absoluto y su ranura; las vueltas
+    completas se resuelven comparando el tick al revisar la ranura.
+    """
+
+    def __init__(self, ranura_segundos: float = 1.0, ranuras: int = 64):
+        self.ranura_segundos = ranura_segundos
+        self._ranuras: List[Set[ConexionVigilada]] = [set() for _ in range(ranuras)]
+        self.tick = 0
+
+    def programar(self, elemento: ConexionVigilada, segundos: float) -> None:
+        self.cancelar(elemento)
+        elemento.tick = self.tick + max(1, math.ceil(segundos / self.ranura_segundos))
+        elemento.ranura = elemento.tick % len(self._ranuras)
+        self._ranuras[elemento.ranura].add(elemento)
+
+    def cancelar(self, elemento: ConexionVigilada) -> None:
+        if elemento.ranura is not None:
+            self._ranuras[elemento.ranura].discard(elemento)
+            elemento.ranura = None
+
+    def avanzar(self) -> List[ConexionVigilada]:
+        """Avanza un tick y devuelve los elementos vencidos (ya fuera de la rueda)"""
+        self.tick += 1
+        ranura = self._ranuras[self.tick % len(self._ranuras)]
+        vencidos = [e for e in ranura if e.tick <= self.tick]
+        for elemento in vencidos:
+            ranura.discard(elemento)
+            elemento.ranura = None
+        return vencidos
+
+    def __len__(self) -> int:
+        return sum(len(r) for r in self._ranuras)
+
+
+class SupervisorConexiones:
+    """Latidos, inactividad y cosecha de WebSockets muertos"""
+
+    def __init__(
+        self,
+        intervalo_ping: float = 25,
+        timeout_pong: float = 10,
+        timeout_inactividad: float = 1800,
+        ranura_segundos: float = 1.0,
+        ranuras: int = 64
+    ):
+        self.intervalo_ping = intervalo_ping
+        self.timeout_pong = timeout_pong
+        self.timeout_inactividad = timeout_inactividad
+        self.rueda = RuedaTemporizadores(ranura_segundos, ranuras)
+        self._conexiones: Dict[int, ConexionVigilada] = {}
+        self._ids = itertools.count(1)
+        self._tarea: Optional[asyncio.Task] = None
+
+        # Indicadores
+        self.por_tipo: Dict[str, int] = {}
+        self.max_conexiones = 0
+        self.abiertas = 0
+        self.pings = 0
+        self.pongs = 0
+        self.responden_ping = 0
+        self.cerradas: Dict[str, int] = {'sin_latido': 0, 'inactividad': 0, 'envio': 0}
+
+    def __len__(self) -> int:
+        return len(self._conexiones)
+
+    # --------------------------------------------------------
+    # Registro
+    # --------------------------------------------------------
+
+    def vigilar(
+        self,
+        tipo: str,
+        websocket: WebSocket,
+        enviar_ping: Callable[[], bool],
+        al_cerrar: Optional[Callable[[], None]] = None,
+        inactividad: bool = True
+    ) -> ConexionVigilada:
+        """
+        Empieza a supervisar un socket ya aceptado
+
+        Args:
+            tipo: etiqueta para los indicadores ("chat", "notificaciones")
+            enviar_ping: encola un ping; False si la conexión ya no acepta envíos
+            al_cerrar: limpieza inmediata al cosecharla (retirar del manager)
+            inactividad: False en canales solo de envío (el cliente no habla)
+        """
+        if self._tarea is None or self._tarea.done():
+            self._tarea = asyncio.get_running_loop().create_task(self._girar(), name="ws-supervisor")
+        vigilada = ConexionVigilada(
+            next(self._ids), tipo, websocket, enviar_ping, al_cerrar, time.monotonic(), inactividad
+        )
+        self._conexiones[vigilada.id] = vigilada
+        self.rueda.programar(vigilada, self.intervalo_ping)
+        self.por_tipo[tipo] = self.por_tipo.get(tipo, 0) + 1
+        self.abiertas += 1
+        self.max_conexiones = max(self.max_conexiones, len(self._conexiones))
+        return vigilada
+
+    def soltar(self, vigilada: ConexionVigilada) -> bool:
+        """Deja de supervisar (idempotente, O(1))"""
+        if self._conexiones.pop(vigilada.id, None) is None:
+            return False
+        vigilada.cerrada = True
+        self.rueda.cancelar(vigilada)
+        self.por_tipo[vigilada.tipo] -= 1
+        if vigilada.responde_ping:
+            self.responden_ping -= 1
+        return True
+
+    def recibido(self, vigilada: ConexionVigilada, pong: bool = False, actividad: bool = False) -> None:
+        """
+        Registra una trama del cliente (O(1), no reprograma: la próxima
+        revisión usa las marcas de tiempo actualizadas)
+        """
+        ahora = time.monotonic()
+        vigilada.ultimo_latido = ahora
+        vigilada.ping_pendiente = None
+        if pong:
+            if not vigilada.responde_ping and not vigilada.cerrada:
+                vigilada.responde_ping = True
+                self.responden_ping += 1
+            self.pongs += 1
+        if actividad:
+            vigilada.ultimo_mensaje = ahora
+
+    # --------------------------------------------------------
+    # Revisión periódica
+    # --------------------------------------------------------
+
+    async def _girar(self) -> None:
+        while True:
+            await asyncio.sleep(self.rueda.ranura_segundos)
+            ahora = time.monotonic()
+            for vigilada in self.rueda.avanzar():
+                try:
+                    self._revisar(vigilada, ahora)
+                except Exception as e:
+                    logger.error(f"[ws-supervisor] Error revisando conexión {vigilada.id}: {e!r}")
+
+    def _revisar(self, vigilada: ConexionVigilada, ahora: float) -> None:
+        if vigilada.cerrada:
+            return
+        if vigilada.con_inactividad and ahora - vigilada.ultimo_mensaje >= self.timeout_inactividad:
+            self._cosechar(vigilada, CIERRE_INACTIVIDAD, 'inactividad')
+            return
+
+        if vigilada.ping_pendiente is not None and ahora - vigilada.ping_pendiente >= self.timeout_pong:
+            if vigilada.responde_ping:
+                self._cosechar(vigilada, CIERRE_SIN_LATIDO, 'sin_latido')
+                return
+            # Cliente que no responde pings: no se le exige pong
+            vigilada.ping_pendiente = None
+
+        if vigilada.ping_pendiente is None and ahora - max(vigilada.ultimo_latido, vigilada.ultimo_ping) >= self.intervalo_ping:
+            if not vigilada.enviar_ping():
+                self._cosechar(vigilada, CIERRE_ENVIO, 'envio')
+                return
+            vigilada.ultimo_ping = vigilada.ping_pendiente = ahora
+            self.pings += 1
+
+        vence = [vigilada.ultimo_mensaje + self.timeout_inactividad] if vigilada.con_inactividad else []
+        if vigilada.ping_pendiente is not None:
+            vence.append(vigilada.ping_pendiente + self.timeout_pong)
+        else:
+            vence.append(max(vigilada.ultimo_latido, vigilada.ultimo_ping) + self.intervalo_ping)
+        self.rueda.programar(vigilada, min(vence) - ahora)
+
+    def _cosechar(self, vigilada: ConexionVigilada, codigo: int, motivo: str) -> None:
+        if not self.soltar(vigilada):
+            return
+        self.cerradas[motivo] += 1
+        logger.info(f"[ws-supervisor] Conexión {vigilada.tipo} {vigilada.id} cerrada ({motivo})")
+        if vigilada.al_cerrar is not None:
+            try:
+                vigilada.al_cerrar()
+            except Exception as e:
+                logger.error(f"[ws-supervisor] Error liberando conexión {vigilada.id}: {e!r}")
+        asyncio.get_running_loop().create_task(self._cerrar_socket(vigilada.websocket, codigo))
+
+    @staticmethod
+    async def _cerrar_socket(websocket: WebSocket, codigo: int) -> None:
+        try:
+            await asyncio.wait_for(websocket.close(code=codigo), 5)
+        except Exception:
+            pass
+
+    async def cerrar(self) -> None:
+        """Detiene la revisión periódica (al apagar)"""
+        if self._tarea is not None:
+            self._tarea.cancel()
+            await asyncio.gather(self._tarea, return_exceptions=True)
+            self._tarea = None
+
+    def estadisticas(self) -> Dict[str, Any]:
+        # Solo contadores y copias atómicas: se consulta desde el threadpool
+        return {
+            'conexiones': len(self._conexiones),
+            'por_tipo': {tipo: n for tipo, n in dict(self.por_tipo).items() if n},
+            'max_conexiones': self.max_conexiones,
+            'abiertas_total': self.abiertas,
+            'responden_ping': self.responden_ping,
+            'pings': self.pings,
+            'pongs': self.pongs,
+            'cerradas': dict(self.cerradas),
+            'intervalo_ping_segundos': self.intervalo_ping,
+            'timeout_inactividad_segundos': self.timeout_inactividad,
+        }
+
+
+# Instancia global compartida por los WebSockets de chat y notificaciones
+supervisor_ws = SupervisorConexiones(
+    intervalo_ping=settings.WS_PING_INTERVALO_SEGUNDOS,
+    timeout_pong=settings.WS_PONG_TIMEOUT_SEGUNDOS,
+    timeout_inactividad=settings.WS_INACTIVIDAD_SEGUNDOS
+)
@@ -1,6 +1,9 @@
 # backend/scripts/actualizar_columnas.py
 """
-Script para agregar columnas necesarias a ninos y terapias
+Script para agregar columnas necesarias a ninos, terapias y perfiles vectorizados
+
+Las columnas modelo_embedding también las agrega la app al conectar
+(COLUMNAS_AGREGADAS en app/db/session.py) si el usuario de BD puede hacer ALTER.
 """
 import sys
 import os
@@ -21,6 +24,14 @@ updates = [
     {
         'nombre': 'terapias - tags',
         'sql': 'ALTER TABLE terapias ADD COLUMN tags TEXT'
+    },
+    {
+        'nombre': 'perfil_nino_vectorizado - modelo_embedding',
+        'sql': 'ALTER TABLE perfil_nino_vectorizado ADD COLUMN modelo_embedding VARCHAR(100)'
+    },
+    {
+        'nombre': 'perfil_actividad_vectorizada - modelo_embedding',
+        'sql': 'ALTER TABLE perfil_actividad_vectorizada ADD COLUMN modelo_embedding VARCHAR(100)'
     }
 ]
 
@@ -0,0 +1,88 @@
+"""
+Micro-benchmark de contención del rate limiter
+
+Varios hilos consumen fichas de IPs aleatorias a la vez y se mide el
+throughput de:
+- un solo lock (1 franja, equivalente al limitador anterior)
+- lock striping (RATE_LIMIT_FRANJAS franjas)
+- backend SQLite compartido entre procesos (archivo temporal)
+
+Además verifica que una IP que agota su cubeta recibe rechazo y que las
+cubetas inactivas se expiran. No requiere base de datos.
+
+Uso:
+    python scripts/benchmark_rate_limit.py [hilos] [operaciones_por_hilo] [ips]
+"""
+import sys
+import os
+import random
+import tempfile
+import threading
+import time
+from pathlib import Path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.core.rate_limit import MemoriaRateLimit, SQLiteRateLimit
+
+
+def medir(backend, hilos: int, operaciones: int, ips: int) -> float:
+    """Operaciones por segundo con `hilos` hilos concurrentes"""
+    claves = [f"bench:10.0.{i // 256}.{i % 256}" for i in range(ips)]
+    barrera = threading.Barrier(hilos + 1)
+
+    def trabajar(semilla: int):
+        rng = random.Random(semilla)
+        locales = [rng.choice(claves) for _ in range(operaciones)]
+        barrera.wait()
+        for clave in locales:
+            backend.consumir(clave, 20, 20 / 60)
+
+    trabajadores = [threading.Thread(target=trabajar, args=(i,)) for i in range(hilos)]
+    for t in trabajadores:
+        t.start()
+    barrera.wait()
+    inicio = time.perf_counter()
+    for t in trabajadores:
+        t.join()
+    return hilos * operaciones / (time.perf_counter() - inicio)
+
+
+def verificar(backend) -> None:
+    permitidas = sum(backend.consumir("check:1.2.3.4", 5, 5 / 60)[0] for _ in range(8))
+    assert permitidas == 5, f"se esperaban 5 permitidas, hubo {permitidas}"
+    permitido, espera = backend.consumir("check:1.2.3.4", 5, 5 / 60)
+    assert not permitido and 0 < espera <= 12
+
+
+def main():
+    hilos = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    operaciones = int(sys.argv[2]) if len(sys.argv) > 2 else 20000
+    ips = int(sys.argv[3]) if len(sys.argv) > 3 else 5000
+
+    print(f"Hilos: {hilos} | operaciones por hilo: {operaciones} | IPs distintas: {ips}\n")
+
+    un_lock = MemoriaRateLimit(franjas=1)
+    franjas = MemoriaRateLimit(franjas=64)
+    verificar(un_lock)
+    verificar(franjas)
+
+    ops_un_lock = medir(un_lock, hilos, operaciones, ips)
+    ops_franjas = medir(franjas, hilos, operaciones, ips)
+    print(f"  1 lock      : {ops_un_lock:>12,.0f} ops/s")
+    print(f"  64 franjas  : {ops_franjas:>12,.0f} ops/s  (x{ops_franjas / ops_un_lock:.2f})")
+
+    # Expiración: cubetas con tasa alta se llenan al instante y se retiran
+    expira = MemoriaRateLimit(franjas=4)
+    for i in range(10000):
+        expira.consumir(f"exp:{i}", 1, 1e9)
+    print(f"  cubetas vivas tras 10,000 IPs de una sola petición: {len(expira)}")
+
+    with tempfile.TemporaryDirectory() as directorio:
+        sqlite = SQLiteRateLimit(Path(directorio) / "rate_limit.sqlite3")
+        verificar(sqlite)
+        ops_sqlite = medir(sqlite, hilos, max(1, operaciones // 20), ips)
+        print(f"  SQLite      : {ops_sqlite:>12,.0f} ops/s  (compartido entre procesos)")
+
+
+if __name__ == "__main__":
+    main()
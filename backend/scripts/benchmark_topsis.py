@@ -0,0 +1,87 @@
+"""
+Micro-benchmark del motor TOPSIS vectorizado
+
+Compara el cálculo anterior (una llamada por escenario con bucle Python
+por criterio) contra una sola llamada a topsis_engine.topsis_lote sobre
+la pila completa de escenarios. No requiere base de datos.
+
+Uso:
+    python scripts/benchmark_topsis.py [escenarios] [alternativas] [criterios]
+"""
+import sys
+import os
+import time
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+from app.services import topsis_engine
+
+
+def topsis_bucle(matriz, pesos, tipos):
+    """Copia del algoritmo previo (bucle por criterio) como referencia"""
+    matriz_np = np.array(matriz, dtype=float)
+    pesos_np = np.array(pesos, dtype=float)
+
+    denominador = np.sqrt((matriz_np ** 2).sum(axis=0))
+    denominador[denominador == 0] = 1
+    matriz_ponderada = matriz_np / denominador * pesos_np
+
+    ideal_positivo = np.zeros(len(tipos))
+    ideal_negativo = np.zeros(len(tipos))
+    for i, tipo in enumerate(tipos):
+        if tipo == 'beneficio':
+            ideal_positivo[i] = matriz_ponderada[:, i].max()
+            ideal_negativo[i] = matriz_ponderada[:, i].min()
+        else:
+            ideal_positivo[i] = matriz_ponderada[:, i].min()
+            ideal_negativo[i] = matriz_ponderada[:, i].max()
+
+    d_pos = np.sqrt(((matriz_ponderada - ideal_positivo) ** 2).sum(axis=1))
+    d_neg = np.sqrt(((matriz_ponderada - ideal_negativo) ** 2).sum(axis=1))
+    return d_neg / (d_pos + d_neg + 1e-10)
+
+
+def medir(funcion, repeticiones=5):
+    """Mejor tiempo (segundos) de varias repeticiones"""
+    mejor = float('inf')
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        funcion()
+        mejor = min(mejor, time.perf_counter() - inicio)
+    return mejor
+
+
+def main():
+    escenarios = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    alternativas = int(sys.argv[2]) if len(sys.argv) > 2 else 80
+    criterios = int(sys.argv[3]) if len(sys.argv) > 3 else 4
+
+    rng = np.random.default_rng(42)
+    pila = rng.uniform(1, 50, size=(escenarios, alternativas, criterios))
+    pesos = rng.dirichlet(np.ones(criterios), size=escenarios)
+    tipos = ['costo'] + ['beneficio'] * (criterios - 1)
+    beneficio = topsis_engine.tipos_a_mascara(tipos)
+
+    print("=" * 70)
+    print(f"BENCHMARK TOPSIS: {escenarios} escenarios × {alternativas} alternativas × {criterios} criterios")
+    print("=" * 70)
+
+    # Verificar que ambos caminos coinciden antes de medir
+    referencia = np.array([topsis_bucle(pila[s], pesos[s], tipos) for s in range(escenarios)])
+    lote = topsis_engine.topsis_lote(pila, pesos, beneficio)
+    diferencia = np.abs(referencia - lote).max()
+    print(f"Diferencia máxima entre implementaciones: {diferencia:.2e}")
+
+    t_bucle = medir(lambda: [topsis_bucle(pila[s], pesos[s], tipos) for s in range(escenarios)])
+    t_por_escenario = medir(lambda: [topsis_engine.topsis_lote(pila[s], pesos[s], beneficio) for s in range(escenarios)])
+    t_lote = medir(lambda: topsis_engine.topsis_lote(pila, pesos, beneficio))
+
+    print(f"Bucle por criterio (N llamadas):   {t_bucle * 1000:9.2f} ms")
+    print(f"Motor, una llamada por escenario:  {t_por_escenario * 1000:9.2f} ms")
+    print(f"Motor, una sola llamada en lote:   {t_lote * 1000:9.2f} ms")
+    print(f"Aceleración lote vs bucle:         {t_bucle / t_lote:9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+"""
+Benchmark de difusión por WebSocket a conversaciones con muchos sockets
+
+Simula `conversaciones` conversaciones con `sockets` conexiones cada una
+(sockets falsos con latencia de envío; una fracción son clientes lentos) y
+publica `eventos` eventos por conversación. Compara:
+
+- envío secuencial (el ConnectionManager anterior: await send_json por
+  socket, serializando el dict en cada uno)
+- DifusorWebSocket: serialización única + cola acotada y escritor por
+  conexión
+
+Mide cuánto bloquea cada publicación al emisor y la latencia de entrega a
+los clientes rápidos, y verifica que los lentos quedan rezagados o se
+expulsan. No requiere base de datos ni red.
+
+Uso:
+    python scripts/benchmark_ws_fanout.py [conversaciones] [sockets] [eventos] [fraccion_lentos] [max_cola]
+
+Un cliente lento vacía 1/LATENCIA_LENTO eventos por segundo y se publican
+1/intervalo: acumula eventos * (1 - intervalo/LATENCIA_LENTO) pendientes.
+La cola por defecto (4) es menor que ese atraso, así el desborde se ejercita.
+"""
+import sys
+import os
+import asyncio
+import json
+import random
+import time
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services.ws_fanout import CIERRE_CONSUMIDOR_LENTO, DifusorWebSocket
+
+LATENCIA_RAPIDO = 0.0
+LATENCIA_LENTO = 0.2
+
+
+class SocketFalso:
+    """Imita send_text/send_json/close de un WebSocket de Starlette"""
+
+    def __init__(self, latencia: float):
+        self.latencia = latencia
+        self.recibidos = 0
+        self.rezagos = 0
+        self.cerrado_con = None
+        self.latencias = []
+
+    async def send_text(self, texto: str):
+        await asyncio.sleep(self.latencia)
+        evento = json.loads(texto)
+        if evento.get("tipo") == "rezagado":
+            self.rezagos += 1
+            return
+        self.recibidos += 1
+        self.latencias.append(time.perf_counter() - evento["t"])
+
+    async def send_json(self, datos: dict):
+        await self.send_text(json.dumps(datos, separators=(",", ":"), ensure_ascii=False))
+
+    async def close(self, code: int = 1000):
+        self.cerrado_con = code
+
+    @property
+    def lento(self) -> bool:
+        return self.latencia >= LATENCIA_LENTO
+
+
+def crear_sockets(conversaciones: int, sockets: int, fraccion_lentos: float, semilla: int = 7):
+    rng = random.Random(semilla)
+    return {
+        c: {
+            u: SocketFalso(LATENCIA_LENTO if rng.random() < fraccion_lentos else LATENCIA_RAPIDO)
+            for u in range(sockets)
+        }
+        for c in range(conversaciones)
+    }
+
+
+def evento(c: int, n: int) -> dict:
+    return {
+        "tipo": "nuevo_mensaje", "id": n, "conversacion_id": c, "emisor_id": 1,
+        "contenido": "Hola, ¿cómo les fue con la rutina de hoy? " * 3, "t": time.perf_counter()
+    }
+
+
+def percentil(valores, p: float) -> float:
+    if not valores:
+        return 0.0
+    valores = sorted(valores)
+    return valores[min(len(valores) - 1, int(len(valores) * p))]
+
+
+def resumen(nombre: str, bloqueos, sockets_por_conv) -> None:
+    rapidos = [s for conv in sockets_por_conv.values() for s in conv.values() if not s.lento]
+    latencias = [l for s in rapidos for l in s.latencias]
+    print(
+        f"{nombre:<12} bloqueo por publicación: p50={percentil(bloqueos, 0.5) * 1000:8.2f} ms "
+        f"p99={percentil(bloqueos, 0.99) * 1000:8.2f} ms | entrega a rápidos: "
+        f"p50={percentil(latencias, 0.5) * 1000:8.2f} ms p99={percentil(latencias, 0.99) * 1000:8.2f} ms"
+    )
+
+
+async def secuencial(sockets_por_conv, eventos: int, intervalo: float):
+    bloqueos = []
+
+    async def emisor(c, conv):
+        for n in range(eventos):
+            inicio = time.perf_counter()
+            datos = evento(c, n)
+            for ws in conv.values():
+                await ws.send_json(datos)
+            bloqueos.append(time.perf_counter() - inicio)
+            await asyncio.sleep(intervalo)
+
+    await asyncio.gather(*(emisor(c, conv) for c, conv in sockets_por_conv.items()))
+    return bloqueos
+
+
+async def difusor(sockets_por_conv, eventos: int, intervalo: float, max_cola: int):
+    d = DifusorWebSocket("benchmark", max_cola=max_cola, timeout_envio=5, max_rezagos=2)
+    for c, conv in sockets_por_conv.items():
+        for u, ws in conv.items():
+            d.registrar(c, u, ws)
+    bloqueos = []
+
+    async def emisor(c):
+        for n in range(eventos):
+            inicio = time.perf_counter()
+            d.publicar(c, evento(c, n))
+            bloqueos.append(time.perf_counter() - inicio)
+            await asyncio.sleep(intervalo)
+
+    await asyncio.gather(*(emisor(c) for c in sockets_por_conv))
+    # Esperar a que los rápidos vacíen sus colas
+    limite = time.perf_counter() + 10
+    while time.perf_counter() < limite:
+        pendientes = [
+            con for miembros in d.grupos.values() for con in miembros.values()
+            if not con.websocket.lento and not con.cola.empty()
+        ]
+        if not pendientes:
+            break
+        await asyncio.sleep(0.01)
+    estadisticas = d.estadisticas()
+    await d.cerrar()
+    return bloqueos, estadisticas
+
+
+def main():
+    conversaciones = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    sockets = int(sys.argv[2]) if len(sys.argv) > 2 else 300
+    eventos = int(sys.argv[3]) if len(sys.argv) > 3 else 20
+    fraccion_lentos = float(sys.argv[4]) if len(sys.argv) > 4 else 0.05
+    max_cola = int(sys.argv[5]) if len(sys.argv) > 5 else 4
+    intervalo = 0.05
+    # Eventos que se le acumulan a un cliente lento mientras se publica
+    atraso_lento = eventos * (1 - intervalo / LATENCIA_LENTO)
+
+    print(
+        f"{conversaciones} conversaciones x {sockets} sockets, {eventos} eventos cada una, "
+        f"{fraccion_lentos:.0%} clientes lentos ({LATENCIA_LENTO * 1000:.0f} ms por envío), "
+        f"cola de {max_cola} (atraso de un lento: {atraso_lento:.0f} eventos)\n"
+    )
+
+    base = crear_sockets(conversaciones, sockets, fraccion_lentos)
+    inicio = time.perf_counter()
+    bloqueos = asyncio.run(secuencial(base, eventos, intervalo))
+    total_secuencial = time.perf_counter() - inicio
+    resumen("secuencial", bloqueos, base)
+
+    nuevos = crear_sockets(conversaciones, sockets, fraccion_lentos)
+    inicio = time.perf_counter()
+    bloqueos, estadisticas = asyncio.run(difusor(nuevos, eventos, intervalo, max_cola))
+    total_difusor = time.perf_counter() - inicio
+    resumen("difusor", bloqueos, nuevos)
+
+    print(f"\nDuración total: secuencial {total_secuencial:.2f} s, difusor {total_difusor:.2f} s")
+    print(f"Estadísticas del difusor: {estadisticas}")
+
+    # Verificaciones
+    rapidos = [s for conv in nuevos.values() for s in conv.values() if not s.lento]
+    lentos = [s for conv in nuevos.values() for s in conv.values() if s.lento]
+    assert all(s.recibidos == eventos for s in rapidos), "un cliente rápido perdió eventos"
+    if lentos and atraso_lento > max_cola + 1:
+        assert all(s.rezagos or s.cerrado_con == CIERRE_CONSUMIDOR_LENTO for s in lentos), \
+            "un cliente lento no quedó rezagado ni expulsado"
+        print("\n✅ Clientes rápidos recibieron todo; los lentos quedaron rezagados o expulsados")
+    else:
+        print("\n✅ Clientes rápidos recibieron todo (el atraso de los lentos cabe en la cola: sin desborde)")
+
+
+if __name__ == "__main__":
+    main()
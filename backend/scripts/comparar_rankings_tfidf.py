@@ -0,0 +1,110 @@
+"""
+Compara los rankings TF-IDF anteriores y actuales de actividades y terapias
+
+Antes el TfidfVectorizer se ajustaba en cada petición sobre el catálogo MÁS
+el texto del niño; ahora se ajusta una vez solo sobre el catálogo
+(ModeloTfidf). Los scores absolutos cambian y los rankings también pueden
+cambiar:
+
+- el IDF se calcula sin el documento del niño (N y df distintos), lo que
+  cambia el peso relativo de los términos que comparte con el catálogo
+- max_features elige el vocabulario sin los términos del niño
+
+Este script mide cuánto: para cada niño activo compara el top-N de ambos
+cálculos (mismo orden exacto, mismos elementos y solapamiento promedio).
+
+Uso:
+    python scripts/comparar_rankings_tfidf.py [top_n]
+"""
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+from app.db.session import SessionLocal
+from app.services.recommend_service import (
+    catalogo_actividades,
+    catalogo_terapias,
+    textos_perfiles_ninos,
+)
+from app.services.vectorizer import ModeloTfidf, calcular_similitud
+
+
+def top_anterior(texto_nino: str, textos_catalogo, top_n: int):
+    """Cálculo anterior: TF-IDF ajustado sobre catálogo + niño en cada consulta"""
+    scores = calcular_similitud(texto_nino, textos_catalogo)
+    return list(np.argsort(-scores, kind='stable')[:top_n])
+
+
+def top_actual(modelo: ModeloTfidf, texto_nino: str, top_n: int):
+    """Cálculo actual: ModeloTfidf ajustado solo sobre el catálogo"""
+    scores = modelo.similitudes(texto_nino)
+    return list(np.argsort(-scores, kind='stable')[:top_n])
+
+
+def comparar(nombre: str, textos_ninos, textos_catalogo, top_n: int) -> dict:
+    modelo = ModeloTfidf(textos_catalogo)
+    iguales = mismos_elementos = 0
+    solapamientos = []
+    distintos = []
+    for nino_id, texto in textos_ninos.items():
+        antes = top_anterior(texto, textos_catalogo, top_n)
+        ahora = top_actual(modelo, texto, top_n)
+        if antes == ahora:
+            iguales += 1
+        else:
+            distintos.append(nino_id)
+        if set(antes) == set(ahora):
+            mismos_elementos += 1
+        solapamientos.append(len(set(antes) & set(ahora)) / max(1, len(antes)))
+
+    total = len(textos_ninos)
+    resultado = {
+        'catalogo': nombre,
+        'ninos': total,
+        'mismo_orden': iguales,
+        'mismos_elementos': mismos_elementos,
+        'solapamiento_promedio': round(float(np.mean(solapamientos)), 4) if solapamientos else 1.0,
+    }
+    print(
+        f"  {nombre:<12} {total} niños: mismo top-{top_n} en el mismo orden {iguales}/{total}, "
+        f"mismos elementos {mismos_elementos}/{total}, "
+        f"solapamiento promedio {resultado['solapamiento_promedio']:.0%}"
+    )
+    if distintos:
+        print(f"    niños con ranking distinto: {distintos[:20]}{' …' if len(distintos) > 20 else ''}")
+    return resultado
+
+
+def main():
+    top_n = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+
+    print("=" * 70)
+    print("COMPARACIÓN DE RANKINGS TF-IDF (catálogo + niño vs. solo catálogo)")
+    print("=" * 70)
+
+    db = SessionLocal()
+    try:
+        textos_ninos = textos_perfiles_ninos(db)
+        if not textos_ninos:
+            print("  (sin niños activos en la base de datos)")
+            sys.exit(0)
+        resultados = []
+        for nombre, catalogo in (("actividades", catalogo_actividades), ("terapias", catalogo_terapias)):
+            _, textos_catalogo = catalogo.cargar(db)
+            if not textos_catalogo:
+                print(f"  {nombre:<12} (catálogo vacío)")
+                continue
+            resultados.append(comparar(nombre, textos_ninos, textos_catalogo, top_n))
+    finally:
+        db.close()
+
+    if all(r['mismo_orden'] == r['ninos'] for r in resultados):
+        print("\n✓ Los rankings son idénticos con estos datos")
+    else:
+        print("\nℹ️  Los rankings difieren para algunos niños (ver arriba)")
+
+
+if __name__ == "__main__":
+    main()
@@ -8,7 +8,8 @@
 CREATE TABLE IF NOT EXISTS perfil_nino_vectorizado (
     id INT AUTO_INCREMENT PRIMARY KEY,
     nino_id INT NOT NULL UNIQUE,
-    embedding JSON NOT NULL COMMENT 'Vector de embeddings de Gemini (array de floats)',
+    embedding MEDIUMBLOB NOT NULL COMMENT 'Vector de embeddings de Gemini (binario: cabecera + floats)',
+    modelo_embedding VARCHAR(100) COMMENT 'Backend que generó el vector',
     edad INT,
     diagnosticos JSON COMMENT 'Array de diagnósticos: ["TEA", "TDAH"]',
     dificultades JSON COMMENT 'Array de dificultades identificadas',
@@ -29,7 +30,8 @@ COMMENT='Perfiles vectorizados de niños para recomendaciones basadas en conteni
 CREATE TABLE IF NOT EXISTS perfil_actividad_vectorizada (
     id INT AUTO_INCREMENT PRIMARY KEY,
     actividad_id INT NOT NULL UNIQUE,
-    embedding JSON NOT NULL COMMENT 'Vector de embeddings de Gemini',
+    embedding MEDIUMBLOB NOT NULL COMMENT 'Vector de embeddings de Gemini (binario)',
+    modelo_embedding VARCHAR(100) COMMENT 'Backend que generó el vector',
     areas_desarrollo JSON COMMENT 'Array de áreas: ["cognitivo", "motor"]',
     tags JSON COMMENT 'Tags de la actividad',
     nivel_dificultad SMALLINT DEFAULT 1 COMMENT '1=Bajo, 2=Medio, 3=Alto',
@@ -55,7 +57,7 @@ CREATE TABLE IF NOT EXISTS historial_progreso (
     notas_progreso TEXT COMMENT 'Notas del terapeuta sobre la sesión',
     fecha_sesion DATETIME NOT NULL,
     duracion_minutos INT,
-    embedding_notas JSON COMMENT 'Embedding de las notas para análisis de similitud',
+    embedding_notas MEDIUMBLOB COMMENT 'Embedding binario de las notas para análisis de similitud',
     fecha_registro DATETIME DEFAULT CURRENT_TIMESTAMP,
     FOREIGN KEY (nino_id) REFERENCES ninos(id) ON DELETE CASCADE,
     FOREIGN KEY (actividad_id) REFERENCES actividades(id),
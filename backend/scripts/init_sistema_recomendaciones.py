@@ -18,6 +18,7 @@ from app.db.session import SessionLocal
 from app.models.actividad import Actividad
 from app.models.nino import Nino
 from app.services.recomendacion_service import get_recomendacion_service
+from app.services.vector_index import actividad_vector_index
 
 
 def ejecutar_sql(db: Session, archivo_sql: str):
@@ -67,6 +68,8 @@ def vectorizar_actividades_existentes(db: Session):
             except Exception as e:
                 print(f"  [{i}/{len(actividades)}] ✗ Error en {actividad.nombre}: {e}")
         
+        # Escribir el índice vectorial una sola vez al terminar
+        actividad_vector_index.guardar_pendiente()
         print("\n✓ Vectorización de actividades completada")
         
     except Exception as e:
@@ -0,0 +1,47 @@
+"""
+Elimina sesiones de chat inactivas y sus mensajes, por bloques
+
+Usa el mismo trabajo que la retención programada de la aplicación
+(app.services.chat_retencion): commit por bloque, pausa entre bloques y
+reanudación automática si una ejecución anterior se interrumpió.
+
+Uso:
+    python scripts/limpiar_sesiones_chat.py [--dias 7] [--bloque 500] [--pausa-ms 100] [--max-bloques N]
+"""
+import sys
+import os
+import argparse
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.core.config import settings
+from app.services.chat_retencion import TrabajoRetencionChat
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--dias', type=int, default=settings.CHAT_RETENCION_DIAS, help='Días de inactividad')
+    parser.add_argument('--bloque', type=int, default=settings.CHAT_RETENCION_BLOQUE, help='Sesiones por transacción')
+    parser.add_argument('--pausa-ms', type=int, default=settings.CHAT_RETENCION_PAUSA_MS, help='Pausa entre bloques')
+    parser.add_argument('--max-bloques', type=int, default=None, help='Detenerse tras N bloques')
+    args = parser.parse_args()
+
+    try:
+        reporte = TrabajoRetencionChat().ejecutar(
+            dias=args.dias,
+            tamano_bloque=args.bloque,
+            pausa_segundos=args.pausa_ms / 1000,
+            max_bloques=args.max_bloques
+        )
+    except KeyboardInterrupt:
+        print("\n⏸ Interrumpido: la siguiente ejecución continúa desde el último bloque")
+        return
+
+    print(f"\n✅ Sesiones eliminadas: {reporte['sesiones_eliminadas']}")
+    print(f"   Mensajes eliminados: {reporte['mensajes_eliminados']}")
+    print(f"   Bloques: {reporte['bloques']} en {reporte['segundos']} s ({reporte['filas_por_segundo']} filas/s)")
+    if not reporte['completo']:
+        print("   Quedan sesiones por eliminar; vuelve a ejecutar para continuar")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+"""
+Migra las columnas de embeddings de JSON a BLOB binario
+
+Para cada columna:
+1. Agrega una columna temporal <columna>_bin MEDIUMBLOB
+2. Convierte en lotes (JSON -> cabecera + float32/float16) solo las filas
+   pendientes, por lo que el script se puede interrumpir y volver a correr
+3. Reemplaza la columna original por la binaria
+
+Correrlo antes de desplegar y reiniciar la API después: mientras una columna
+siga en JSON la app la detecta al conectar y escribe en ella texto JSON, no
+el formato binario.
+
+Uso:
+    python scripts/migrar_embeddings_binarios.py [--float16] [--lote 500]
+"""
+import sys
+import os
+import json
+import argparse
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from sqlalchemy import text
+from app.db.session import engine
+from app.db.tipos import codificar_vector, MAGIA
+
+COLUMNAS = [
+    {'tabla': 'perfil_nino_vectorizado', 'columna': 'embedding', 'nula': False},
+    {'tabla': 'perfil_actividad_vectorizada', 'columna': 'embedding', 'nula': False},
+    {'tabla': 'historial_progreso', 'columna': 'embedding_notas', 'nula': True},
+]
+
+
+def tipo_columna(connection, tabla: str, columna: str):
+    """Tipo de dato actual de la columna (None si no existe)"""
+    return connection.execute(text("""
+        SELECT DATA_TYPE FROM information_schema.COLUMNS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :tabla AND COLUMN_NAME = :columna
+    """), {'tabla': tabla, 'columna': columna}).scalar()
+
+
+def a_binario(valor, dtype: str):
+    """Convierte el valor JSON almacenado a bytes (None si está vacío)"""
+    if valor is None:
+        return None
+    if isinstance(valor, (bytes, bytearray)):
+        if bytes(valor[:2]) == MAGIA:
+            return bytes(valor)
+        valor = valor.decode('utf-8')
+    datos = json.loads(valor) if isinstance(valor, str) else valor
+    return codificar_vector(datos, dtype) if datos else None
+
+
+def migrar_columna(tabla: str, columna: str, nula: bool, dtype: str, lote: int) -> None:
+    temporal = f"{columna}_bin"
+
+    with engine.begin() as connection:
+        tipo = tipo_columna(connection, tabla, columna)
+        if tipo is None:
+            print(f"ℹ️  {tabla}.{columna} no existe, se omite")
+            return
+        if 'blob' in tipo.lower():
+            print(f"ℹ️  {tabla}.{columna} ya es binaria")
+            return
+        if tipo_columna(connection, tabla, temporal) is None:
+            connection.execute(text(f"ALTER TABLE {tabla} ADD COLUMN {temporal} MEDIUMBLOB NULL"))
+
+    convertidas = 0
+    ultimo_id = 0
+    while True:
+        # Cada lote en su propia transacción; se avanza por id (reanudable)
+        with engine.begin() as connection:
+            filas = connection.execute(text(f"""
+                SELECT id, {columna} AS valor FROM {tabla}
+                WHERE id > :ultimo AND {temporal} IS NULL AND {columna} IS NOT NULL
+                ORDER BY id LIMIT :lote
+            """), {'ultimo': ultimo_id, 'lote': lote}).all()
+            if not filas:
+                break
+
+            parametros = []
+            for fila in filas:
+                try:
+                    binario = a_binario(fila.valor, dtype)
+                except (ValueError, TypeError) as e:
+                    print(f"  ⚠️  {tabla}.id={fila.id}: embedding ilegible ({e})")
+                    continue
+                if binario is not None:
+                    parametros.append({'id': fila.id, 'valor': binario})
+
+            if parametros:
+                connection.execute(
+                    text(f"UPDATE {tabla} SET {temporal} = :valor WHERE id = :id"),
+                    parametros
+                )
+            convertidas += len(parametros)
+            ultimo_id = filas[-1].id
+        print(f"  … {tabla}.{columna}: {convertidas} filas convertidas")
+
+    with engine.begin() as connection:
+        if not nula:
+            pendientes = connection.execute(
+                text(f"SELECT COUNT(*) FROM {tabla} WHERE {temporal} IS NULL")
+            ).scalar()
+            if pendientes:
+                print(f"❌ {tabla}.{columna}: {pendientes} filas sin convertir, no se reemplaza la columna")
+                return
+        restriccion = "NULL" if nula else "NOT NULL"
+        connection.execute(text(f"ALTER TABLE {tabla} DROP COLUMN {columna}"))
+        connection.execute(text(
+            f"ALTER TABLE {tabla} CHANGE COLUMN {temporal} {columna} MEDIUMBLOB {restriccion}"
+        ))
+    print(f"✅ {tabla}.{columna} migrada ({convertidas} filas, {dtype})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--float16', action='store_true', help='Guardar en media precisión')
+    parser.add_argument('--lote', type=int, default=500, help='Filas por transacción')
+    args = parser.parse_args()
+
+    dtype = 'float16' if args.float16 else 'float32'
+    for columna in COLUMNAS:
+        try:
+            migrar_columna(columna['tabla'], columna['columna'], columna['nula'], dtype, args.lote)
+        except Exception as e:
+            print(f"❌ Error en {columna['tabla']}.{columna['columna']}: {e}")
+
+    print("\n🎉 Migración de embeddings completada")
+    if args.float16:
+        print("   Recuerda configurar EMBEDDING_DTYPE=float16 en .env para las escrituras nuevas")
+
+
+if __name__ == "__main__":
+    main()
@@ -9,6 +9,7 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from app.db.session import SessionLocal
 from app.models.nino import Nino
+from app.db.tipos import codificar_vector
 from sqlalchemy import text
 import numpy as np
 import json
@@ -403,7 +404,7 @@ def crear_perfil_nino(nino_id: int, nino_data: dict, db: SessionLocal):
     
     db.execute(query, {
         'nino_id': nino_id,
-        'embedding': json.dumps(embedding),
+        'embedding': codificar_vector(embedding),
         'edad': edad,
         'diagnosticos': json.dumps(diagnosticos),
         'dificultades': json.dumps(dificultades),
@@ -458,7 +459,7 @@ def crear_actividad(actividad_data: dict, area: str, db: SessionLocal):
     
     db.execute(query_perfil, {
         'actividad_id': actividad_id,
-        'embedding': json.dumps(embedding),
+        'embedding': codificar_vector(embedding),
         'areas_desarrollo': json.dumps([area]),
         'tags': json.dumps(actividad_data['tags']),
         'nivel_dificultad': actividad_data['dificultad'],
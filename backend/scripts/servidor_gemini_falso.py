@@ -0,0 +1,228 @@
+"""
+Servidor falso de la API REST de Gemini para pruebas locales
+
+Implementa generateContent, streamGenerateContent?alt=sse y
+batchEmbedContents con fallos y latencia configurables. Sin dependencias
+(http.server de la biblioteca estándar).
+
+Uso:
+    # Servidor para apuntar la app (GEMINI_API_BASE_URL=http://127.0.0.1:8765)
+    python scripts/servidor_gemini_falso.py --puerto 8765 [--tasa-error 0.3] [--latencia-ms 200]
+
+    # Verificación del cliente: reintentos, deadline, circuit breaker y stream
+    python scripts/servidor_gemini_falso.py --verificar
+"""
+import sys
+import os
+import argparse
+import json
+import random
+import threading
+import time
+from typing import Optional
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+
+class EstadoServidor:
+    """Comportamiento del servidor, modificable en caliente"""
+
+    def __init__(self, tasa_error: float = 0.0, latencia_ms: int = 0, estado_error: int = 503):
+        self.tasa_error = tasa_error
+        self.latencia_ms = latencia_ms
+        self.estado_error = estado_error
+        # Las próximas N peticiones fallan (además de tasa_error)
+        self.fallar_siguientes = 0
+        # Retry-After enviado con las fallas (None: sin cabecera)
+        self.retry_after: Optional[str] = None
+        self.peticiones = 0
+
+
+def crear_manejador(estado: EstadoServidor):
+    class Manejador(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def _json(self, codigo: int, datos: dict) -> None:
+            cuerpo = json.dumps(datos).encode()
+            self.send_response(codigo)
+            if codigo >= 400 and estado.retry_after is not None:
+                self.send_header("Retry-After", estado.retry_after)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(cuerpo)))
+            self.end_headers()
+            try:
+                self.wfile.write(cuerpo)
+            except (BrokenPipeError, ConnectionResetError):
+                # El cliente abandonó la petición (deadline agotado)
+                pass
+
+        def do_POST(self):
+            estado.peticiones += 1
+            datos = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            if estado.latencia_ms:
+                time.sleep(estado.latencia_ms / 1000)
+            if estado.fallar_siguientes > 0 or random.random() < estado.tasa_error:
+                estado.fallar_siguientes = max(0, estado.fallar_siguientes - 1)
+                self._json(estado.estado_error, {"error": {"code": estado.estado_error, "message": "falla simulada"}})
+                return
+            if not self.headers.get("x-goog-api-key"):
+                self._json(403, {"error": {"code": 403, "message": "API key requerida"}})
+                return
+
+            if ":batchEmbedContents" in self.path:
+                self._json(200, {"embeddings": [
+                    {"values": [float(len(r["content"]["parts"][0]["text"]))] * 8}
+                    for r in datos.get("requests", [])
+                ]})
+            elif ":streamGenerateContent" in self.path:
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Connection", "close")
+                self.end_headers()
+                for palabra in ["Respuesta ", "simulada ", "por ", "fragmentos."]:
+                    trozo = {"candidates": [{"content": {"parts": [{"text": palabra}], "role": "model"}}]}
+                    self.wfile.write(f"data: {json.dumps(trozo)}\r\n\r\n".encode())
+                    self.wfile.flush()
+                self.close_connection = True
+            elif ":generateContent" in self.path:
+                turnos = len(datos.get("contents", []))
+                self._json(200, {"candidates": [{"content": {
+                    "parts": [{"text": f"Respuesta simulada ({turnos} turnos)"}], "role": "model"
+                }}]})
+            else:
+                self._json(404, {"error": {"code": 404, "message": "ruta desconocida"}})
+
+    return Manejador
+
+
+def iniciar_servidor(estado: EstadoServidor, puerto: int = 0) -> ThreadingHTTPServer:
+    servidor = ThreadingHTTPServer(("127.0.0.1", puerto), crear_manejador(estado))
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    return servidor
+
+
+def verificar() -> None:
+    from app.services.gemini_async_client import (
+        CircuitBreaker, ClienteGemini, ErrorGemini, GeminiNoDisponible
+    )
+
+    estado = EstadoServidor()
+    servidor = iniciar_servidor(estado)
+    url = f"http://127.0.0.1:{servidor.server_address[1]}"
+    cliente = ClienteGemini(
+        api_key="falsa", base_url=url, timeout_segundos=2, max_reintentos=3,
+        backoff_base_segundos=0.01, backoff_max_segundos=0.05,
+        breaker=CircuitBreaker(umbral_errores=0.5, min_llamadas=6, ventana_segundos=10, enfriamiento_segundos=0.5)
+    )
+    try:
+        print("✓ generar:", cliente.generar_sync("hola"))
+        print("✓ stream:", "".join(cliente.stream_sync("hola")))
+        print("✓ embeddings:", [v[0] for v in cliente.embed_lote_sync(["a", "abc"], "embedding-001")])
+
+        # Fallos intermitentes: los reintentos los absorben
+        estado.tasa_error = 0.3
+        random.seed(1)
+        ok = sum(bool(cliente.generar_sync("hola")) for _ in range(20))
+        print(f"✓ 30% de errores 503: {ok}/20 respuestas, {cliente.reintentos} reintentos")
+
+        # Stream: los 503 antes del primer fragmento también se reintentan
+        random.seed(2)
+        antes = cliente.reintentos
+        ok = sum("".join(cliente.stream_sync("hola")) == "Respuesta simulada por fragmentos." for _ in range(20))
+        print(f"✓ stream con 30% de errores 503: {ok}/20 completos, {cliente.reintentos - antes} reintentos")
+
+        # Stream: se respeta Retry-After entre reintentos
+        estado.tasa_error, estado.fallar_siguientes, estado.retry_after = 0.0, 2, "0.04"
+        inicio = time.perf_counter()
+        texto = "".join(cliente.stream_sync("hola"))
+        transcurrido = time.perf_counter() - inicio
+        assert texto and transcurrido >= 0.08, transcurrido
+        print(f"✓ stream tras dos 503 con Retry-After 0.04s ({transcurrido:.2f}s)")
+        estado.retry_after = None
+
+        # Deadline por llamada (también en stream: hasta recibir la respuesta)
+        estado.latencia_ms = 500
+        inicio = time.perf_counter()
+        try:
+            "".join(cliente.stream_sync("hola", deadline=0.2))
+            raise AssertionError("se esperaba deadline agotado en stream")
+        except GeminiNoDisponible:
+            print(f"✓ deadline 0.2s respetado en stream ({time.perf_counter() - inicio:.2f}s)")
+        estado.tasa_error, estado.latencia_ms = 0.0, 500
+        inicio = time.perf_counter()
+        try:
+            cliente.generar_sync("hola", deadline=0.2)
+            raise AssertionError("se esperaba deadline agotado")
+        except GeminiNoDisponible:
+            print(f"✓ deadline 0.2s respetado ({time.perf_counter() - inicio:.2f}s)")
+        estado.latencia_ms = 0
+
+        # Caída total: el circuito se abre y las llamadas fallan al instante
+        cliente.breaker = CircuitBreaker(umbral_errores=0.5, min_llamadas=6, ventana_segundos=10, enfriamiento_segundos=0.5)
+        estado.tasa_error = 1.0
+        for _ in range(3):
+            try:
+                cliente.generar_sync("hola")
+            except GeminiNoDisponible:
+                pass
+        assert cliente.breaker.estado == CircuitBreaker.ABIERTO, cliente.breaker.estado
+        antes = estado.peticiones
+        inicio = time.perf_counter()
+        try:
+            cliente.generar_sync("hola")
+        except GeminiNoDisponible:
+            pass
+        assert estado.peticiones == antes
+        print(f"✓ circuito abierto: rechazo sin red en {(time.perf_counter() - inicio) * 1000:.2f} ms")
+
+        # Recuperación: tras el enfriamiento una llamada de prueba lo cierra
+        estado.tasa_error = 0.0
+        time.sleep(0.6)
+        cliente.generar_sync("hola")
+        assert cliente.breaker.estado == CircuitBreaker.CERRADO
+        print("✓ circuito cerrado tras la llamada de prueba")
+
+        # Errores del cliente (400) no se reintentan ni abren el circuito
+        estado.tasa_error, estado.estado_error = 1.0, 400
+        antes = estado.peticiones
+        try:
+            cliente.generar_sync("hola")
+            raise AssertionError("se esperaba ErrorGemini")
+        except GeminiNoDisponible:
+            raise AssertionError("un 400 no debe tratarse como caída")
+        except ErrorGemini as e:
+            assert e.status_code == 400 and estado.peticiones == antes + 1
+            assert cliente.breaker.estado == CircuitBreaker.CERRADO
+            print("✓ 400 sin reintentos ni apertura del circuito")
+        print("\n", cliente.estadisticas())
+    finally:
+        cliente.cerrar()
+        servidor.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--puerto', type=int, default=8765)
+    parser.add_argument('--tasa-error', type=float, default=0.0, help='Fracción de peticiones que fallan')
+    parser.add_argument('--estado-error', type=int, default=503, help='Código HTTP de las fallas')
+    parser.add_argument('--latencia-ms', type=int, default=0)
+    parser.add_argument('--verificar', action='store_true', help='Verificar el cliente y salir')
+    args = parser.parse_args()
+
+    if args.verificar:
+        verificar()
+        return
+
+    servidor = iniciar_servidor(EstadoServidor(args.tasa_error, args.latencia_ms, args.estado_error), args.puerto)
+    print(f"Servidor Gemini falso en http://127.0.0.1:{args.puerto} (Ctrl+C para salir)")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        servidor.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+"""
+Prueba de regresión del número de consultas SQL de la lista de chats
+
+La bandeja (GET /mensajes/chats) debe ejecutar UNA sola consulta sin
+importar cuántas conversaciones tenga el usuario (antes: 4 por
+conversación). Además compara el resultado con el cálculo anterior,
+conversación por conversación, para detectar diferencias.
+
+Uso:
+    python scripts/verificar_consultas_chats.py [usuario_id]
+    (sin usuario_id usa el que participa en más conversaciones)
+"""
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import desc, func
+
+from app.db.session import SessionLocal, engine
+from app.models.mensajes import (
+    Conversacion, ConversacionParticipante, Mensaje, MensajeArchivo, MensajeVisto
+)
+from app.models.nino import Nino
+from app.services.mensajes_service import listar_chats_usuario
+from scripts.verificar_consultas_topsis import ContadorConsultas
+
+MAX_CONSULTAS = 1
+
+
+def listar_chats_referencia(db, usuario_id: int, nino_id=None):
+    """Cálculo anterior (4 consultas por conversación), solo para comparar"""
+    conversacion_ids = [
+        cid for (cid,) in db.query(ConversacionParticipante.conversacion_id).filter(
+            ConversacionParticipante.usuario_id == usuario_id,
+            ConversacionParticipante.activo == True
+        )
+    ]
+    if not conversacion_ids:
+        return []
+    query = db.query(Conversacion).filter(
+        Conversacion.id.in_(conversacion_ids),
+        Conversacion.activa == True
+    )
+    if nino_id:
+        query = query.filter(Conversacion.nino_id == nino_id)
+
+    resultado = []
+    for conv in query.order_by(desc(Conversacion.updated_at)).all():
+        ultimo_msg = db.query(Mensaje).filter(
+            Mensaje.conversacion_id == conv.id,
+            Mensaje.eliminado == False
+        ).order_by(desc(Mensaje.created_at), desc(Mensaje.id)).first()
+
+        ultimo_mensaje = ""
+        if ultimo_msg:
+            if ultimo_msg.tipo == "TEXTO":
+                ultimo_mensaje = (ultimo_msg.contenido or "")[:50]
+            elif ultimo_msg.tipo == "AUDIO":
+                ultimo_mensaje = "🎤 Mensaje de audio"
+            elif ultimo_msg.tipo == "ARCHIVO":
+                archivo = db.query(MensajeArchivo).filter(
+                    MensajeArchivo.mensaje_id == ultimo_msg.id
+                ).order_by(MensajeArchivo.id).first()
+                ultimo_mensaje = f"📎 {archivo.nombre_original}" if archivo and archivo.nombre_original else "📎 Archivo"
+
+        no_leidos = db.query(func.count(MensajeVisto.id)).join(
+            Mensaje, Mensaje.id == MensajeVisto.mensaje_id
+        ).filter(
+            MensajeVisto.usuario_id == usuario_id,
+            MensajeVisto.visto == False,
+            Mensaje.conversacion_id == conv.id
+        ).scalar()
+
+        if conv.nino_id:
+            nino = db.query(Nino.nombre).filter(Nino.id == conv.nino_id).scalar()
+            titulo = f"Chat - {nino or 'Niño'}"
+        else:
+            titulo = "Chat General"
+
+        resultado.append({
+            "conversacionId": conv.id,
+            "titulo": titulo,
+            "ultimoMensaje": ultimo_mensaje,
+            "noLeidos": no_leidos or 0,
+            "ultimaActualizacion": conv.updated_at.isoformat()
+        })
+    return resultado
+
+
+def verificar(db, usuario_id: int, nino_id=None) -> bool:
+    with ContadorConsultas(engine) as contador:
+        chats = listar_chats_usuario(db, usuario_id, nino_id)
+
+    # El orden entre conversaciones con el mismo updated_at no está definido
+    def clave(chat):
+        return chat["conversacionId"]
+    referencia = listar_chats_referencia(db, usuario_id, nino_id)
+    iguales = sorted(chats, key=clave) == sorted(referencia, key=clave)
+
+    ok = contador.total <= MAX_CONSULTAS and iguales
+    marca = "✓" if ok else "✗"
+    print(
+        f"  {marca} usuario_id={usuario_id} nino_id={nino_id}: {len(chats)} conversaciones, "
+        f"{contador.total} consultas (máximo {MAX_CONSULTAS}), "
+        f"{'igual' if iguales else 'DISTINTO'} al cálculo anterior"
+    )
+    return ok
+
+
+def main():
+    print("=" * 70)
+    print("VERIFICACIÓN DE CONSULTAS - LISTA DE CHATS")
+    print("=" * 70)
+
+    db = SessionLocal()
+    try:
+        # Calentar el pool
+        db.connection()
+
+        if len(sys.argv) > 1:
+            usuario_id = int(sys.argv[1])
+        else:
+            usuario_id = db.query(ConversacionParticipante.usuario_id).filter(
+                ConversacionParticipante.activo == True
+            ).group_by(ConversacionParticipante.usuario_id).order_by(
+                desc(func.count(ConversacionParticipante.id))
+            ).limit(1).scalar()
+            if usuario_id is None:
+                print("  (sin conversaciones en la base de datos)")
+                sys.exit(0)
+
+        resultados = [verificar(db, usuario_id)]
+
+        # Filtrado por hijo con el primer niño que tenga conversación
+        nino_id = db.query(Conversacion.nino_id).join(
+            ConversacionParticipante,
+            ConversacionParticipante.conversacion_id == Conversacion.id
+        ).filter(
+            ConversacionParticipante.usuario_id == usuario_id,
+            Conversacion.nino_id.isnot(None)
+        ).limit(1).scalar()
+        if nino_id is not None:
+            resultados.append(verificar(db, usuario_id, nino_id))
+    finally:
+        db.close()
+
+    if all(resultados):
+        print("\n✓ El número de consultas es constante")
+        sys.exit(0)
+
+    print("\n✗ Regresión: la lista de chats emite consultas por conversación o cambió su resultado")
+    sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
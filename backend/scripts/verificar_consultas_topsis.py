@@ -0,0 +1,93 @@
+"""
+Prueba de regresión del número de consultas SQL de la evaluación TOPSIS
+
+La evaluación de terapeutas debe ejecutar un número CONSTANTE de consultas
+(1 para métricas de todos los terapeutas + 1 para el nombre de la terapia),
+sin importar cuántos terapeutas haya en la base de datos. La coincidencia de
+especialidad sale del índice precompilado (construido al arrancar).
+
+Uso:
+    python scripts/verificar_consultas_topsis.py [terapia_id]
+"""
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import event
+
+from app.db.session import SessionLocal, engine
+from app.schemas.topsis_terapeutas import TopsisEvaluacionRequest
+from app.services.topsis_terapeutas_service import TopsisEvaluacionService
+from app.services.especialidad_index import especialidad_index
+
+MAX_CONSULTAS_SIN_TERAPIA = 1
+MAX_CONSULTAS_CON_TERAPIA = 2
+
+
+class ContadorConsultas:
+    """Cuenta las sentencias SQL emitidas por el engine mientras está activo"""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.total = 0
+
+    def _contar(self, conn, cursor, statement, parameters, context, executemany):
+        self.total += 1
+
+    def __enter__(self):
+        event.listen(self.engine, "before_cursor_execute", self._contar)
+        return self
+
+    def __exit__(self, *args):
+        event.remove(self.engine, "before_cursor_execute", self._contar)
+
+
+def verificar(db, request: TopsisEvaluacionRequest, maximo: int) -> bool:
+    service = TopsisEvaluacionService(db)
+    with ContadorConsultas(engine) as contador:
+        resultado = service.evaluar_terapeutas(request)
+
+    ok = contador.total <= maximo
+    marca = "✓" if ok else "✗"
+    print(
+        f"  {marca} terapia_id={request.terapia_id}: {resultado.total_evaluados} terapeutas, "
+        f"{contador.total} consultas (máximo {maximo})"
+    )
+    return ok
+
+
+def main():
+    terapia_id = int(sys.argv[1]) if len(sys.argv) > 1 else 1
+
+    print("=" * 70)
+    print("VERIFICACIÓN DE CONSULTAS - EVALUACIÓN TOPSIS DE TERAPEUTAS")
+    print("=" * 70)
+
+    db = SessionLocal()
+    try:
+        # Calentar el pool y el índice de especialidades (se construye al arrancar)
+        db.connection()
+        especialidad_index.asegurar(db)
+
+        resultados = [
+            verificar(db, TopsisEvaluacionRequest(), MAX_CONSULTAS_SIN_TERAPIA),
+            verificar(db, TopsisEvaluacionRequest(terapia_id=terapia_id), MAX_CONSULTAS_CON_TERAPIA),
+            verificar(
+                db,
+                TopsisEvaluacionRequest(terapia_id=terapia_id, incluir_inactivos=True),
+                MAX_CONSULTAS_CON_TERAPIA
+            ),
+        ]
+    finally:
+        db.close()
+
+    if all(resultados):
+        print("\n✓ El número de consultas es constante")
+        sys.exit(0)
+
+    print("\n✗ Regresión: la evaluación TOPSIS emite consultas por terapeuta")
+    sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
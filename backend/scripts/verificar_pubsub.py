@@ -0,0 +1,174 @@
+"""
+Verificación del bus de eventos entre procesos (BusUnix)
+
+Arranca 3 procesos "worker" que comparten un socket Unix temporal y
+comprueba que:
+- un evento publicado en un worker llega a los workers suscritos a ese
+  canal y solo a ellos (el emisor lo entrega localmente, sin eco)
+- un canal sin suscriptores no se reenvía a nadie
+- si el worker que hospeda el broker muere, otro toma el relevo y los
+  demás se reconectan solos
+Además mide el throughput de un canal entre dos procesos.
+
+No requiere base de datos. Solo Linux/macOS (sockets Unix + fcntl).
+
+Uso:
+    python scripts/verificar_pubsub.py [eventos_throughput]
+"""
+import sys
+import os
+import asyncio
+import multiprocessing as mp
+import tempfile
+import time
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services.pubsub import BusUnix
+
+ESPERA = 0.5
+
+
+async def esperar(condicion, limite: float = 5.0) -> bool:
+    fin = time.monotonic() + limite
+    while time.monotonic() < fin:
+        if condicion():
+            return True
+        await asyncio.sleep(0.02)
+    return False
+
+
+def worker(indice: int, ruta: str, barrera, barrera_sobrevivientes, resultados, eventos: int):
+    async def principal():
+        bus = BusUnix(ruta, reintento_segundos=0.1)
+        await bus.iniciar()
+        recibidos = []
+        bus.suscribir(f"conversacion:{indice}", lambda texto, excluir: recibidos.append(texto))
+        bus.suscribir("conversacion:comun", lambda texto, excluir: recibidos.append(texto))
+        contador = {"n": 0}
+        bus.suscribir("rafaga", lambda texto, excluir: contador.__setitem__("n", contador["n"] + 1))
+        await asyncio.sleep(ESPERA)
+        await asyncio.to_thread(barrera.wait)
+
+        # Fase 1: enrutado por canal (publica el worker 0, desde otro hilo)
+        if indice == 0:
+            def publicar_desde_hilo():
+                for canal in ("conversacion:1", "conversacion:2", "conversacion:comun", "conversacion:99"):
+                    bus.publicar(canal, f'{{"canal":"{canal}"}}', excluir="7")
+            await asyncio.to_thread(publicar_desde_hilo)
+        await asyncio.sleep(ESPERA)
+        resultados.put(("enrutado", indice, sorted(recibidos), bus.estadisticas()))
+        await asyncio.to_thread(barrera.wait)
+
+        # Fase 2: throughput 0 -> 1
+        if indice == 1:
+            bus.desuscribir("conversacion:comun", next(iter(bus._receptores["conversacion:comun"])))
+        await asyncio.to_thread(barrera.wait)
+        if indice == 0:
+            inicio = time.perf_counter()
+            for n in range(eventos):
+                bus.publicar("rafaga", f'{{"n":{n}}}')
+                if n % 1000 == 0:
+                    await asyncio.sleep(0)
+            resultados.put(("publicacion", indice, time.perf_counter() - inicio, None))
+        if indice in (1, 2):
+            inicio = time.perf_counter()
+            await esperar(lambda: contador["n"] >= eventos, 30)
+            resultados.put(("rafaga", indice, contador["n"], time.perf_counter() - inicio))
+        await asyncio.to_thread(barrera.wait)
+
+        # Fase 3: muere el broker
+        if bus.estadisticas()["es_broker"]:
+            resultados.put(("broker_muere", indice, None, None))
+            resultados.close()
+            resultados.join_thread()
+            os._exit(0)
+        await asyncio.sleep(ESPERA)
+        reconectado = await esperar(lambda: bus.estadisticas()["conectado"] and bus.reconexiones > 0)
+        await asyncio.sleep(ESPERA)
+        await asyncio.to_thread(barrera_sobrevivientes.wait)
+        recibidos.clear()
+        otros = [i for i in range(3) if i != indice]
+        for otro in otros:
+            bus.publicar(f"conversacion:{otro}", f'{{"de":{indice}}}')
+        await asyncio.sleep(ESPERA)
+        resultados.put(("relevo", indice, (reconectado, sorted(recibidos)), bus.estadisticas()))
+        await bus.cerrar()
+
+    asyncio.run(principal())
+
+
+def main():
+    eventos = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    ruta = os.path.join(tempfile.mkdtemp(prefix="pubsub_"), "bus.sock")
+    ctx = mp.get_context("spawn")
+    barrera = ctx.Barrier(3)
+    barrera_sobrevivientes = ctx.Barrier(2)
+    resultados = ctx.Queue()
+    procesos = [
+        ctx.Process(target=worker, args=(i, ruta, barrera, barrera_sobrevivientes, resultados, eventos))
+        for i in range(3)
+    ]
+    for p in procesos:
+        p.start()
+
+    # Vaciar la cola antes de join (un proceso no termina con datos sin leer)
+    datos = {}
+    fin = time.monotonic() + 90
+    while time.monotonic() < fin and any(p.is_alive() for p in procesos):
+        try:
+            fase, indice, valor, extra = resultados.get(timeout=0.5)
+            datos[(fase, indice)] = (valor, extra)
+        except Exception:
+            pass
+    while not resultados.empty():
+        fase, indice, valor, extra = resultados.get()
+        datos[(fase, indice)] = (valor, extra)
+    for p in procesos:
+        p.join(timeout=5)
+        if p.is_alive():
+            p.terminate()
+
+    errores = []
+    esperado = {
+        0: ['{"canal":"conversacion:comun"}'],
+        1: ['{"canal":"conversacion:1"}', '{"canal":"conversacion:comun"}'],
+        2: ['{"canal":"conversacion:2"}', '{"canal":"conversacion:comun"}'],
+    }
+    for indice, mensajes in esperado.items():
+        recibido = datos.get(("enrutado", indice), (None,))[0]
+        estado = "✅" if recibido == mensajes else "❌"
+        print(f"{estado} worker {indice} recibió {recibido}")
+        if recibido != mensajes:
+            errores.append(f"enrutado worker {indice}")
+
+    publicacion = datos.get(("publicacion", 0), (None,))[0]
+    for indice, esperado_n in ((1, eventos), (2, eventos)):
+        n, segundos = datos.get(("rafaga", indice), (0, 0))
+        estado = "✅" if n == esperado_n else "❌"
+        print(f"{estado} ráfaga: worker {indice} recibió {n}/{esperado_n} en {segundos:.2f} s")
+        if n != esperado_n:
+            errores.append(f"ráfaga worker {indice}")
+    if publicacion:
+        print(f"   publicar {eventos} eventos: {publicacion * 1e6 / eventos:.1f} µs por evento")
+
+    muerto = [i for (fase, i) in datos if fase == "broker_muere"]
+    print(f"   broker original: worker {muerto[0] if muerto else '?'} (termina sin limpiar)")
+    for indice in (i for i in range(3) if i not in muerto):
+        (reconectado, recibidos), estadisticas = datos.get(("relevo", indice), ((False, []), {}))
+        otro = next(i for i in range(3) if i not in muerto and i != indice)
+        ok = reconectado and recibidos == [f'{{"de":{otro}}}']
+        print(
+            f"{'✅' if ok else '❌'} relevo: worker {indice} reconectado={reconectado} "
+            f"es_broker={estadisticas.get('es_broker')} recibió {recibidos}"
+        )
+        if not ok:
+            errores.append(f"relevo worker {indice}")
+
+    if errores:
+        print(f"\n❌ Fallos: {', '.join(errores)}")
+        sys.exit(1)
+    print("\n✅ Bus entre procesos verificado")
+
+
+if __name__ == "__main__":
+    main()
@@ -22,7 +22,8 @@ CREATE TABLE IF NOT EXISTS `chat_sessions` (
   PRIMARY KEY (`id`),
   UNIQUE KEY `uq_chat_sessions_session_id` (`session_id`),
   KEY `ix_chat_sessions_nino_id` (`nino_id`),
-  KEY `ix_chat_sessions_session_id` (`session_id`)
+  KEY `ix_chat_sessions_session_id` (`session_id`),
+  KEY `ix_chat_sessions_last_seen_at` (`last_seen_at`)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
 
 -- -----------------------------------------------------
@@ -36,8 +37,19 @@ CREATE TABLE IF NOT EXISTS `chat_messages` (
   `created_at` DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
   PRIMARY KEY (`id`),
   KEY `ix_chat_messages_session_id` (`session_id`),
+  KEY `ix_chat_messages_session_created` (`session_id`, `created_at`),
   CONSTRAINT `fk_chat_messages_session_id`
     FOREIGN KEY (`session_id`) REFERENCES `chat_sessions` (`session_id`)
     ON DELETE CASCADE
     ON UPDATE CASCADE
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+-- -----------------------------------------------------
+-- Migración para tablas ya existentes:
+-- índice del historial (últimos N mensajes por sesión) y
+-- de la retención (sesiones inactivas)
+-- -----------------------------------------------------
+-- ALTER TABLE `chat_messages`
+--   ADD KEY `ix_chat_messages_session_created` (`session_id`, `created_at`);
+-- ALTER TABLE `chat_sessions`
+--   ADD KEY `ix_chat_sessions_last_seen_at` (`last_seen_at`);
@@ -0,0 +1,18 @@
+-- -----------------------------------------------------
+-- Índices del chat entre usuarios (MySQL 8.x)
+-- Las tablas las crea SQLAlchemy (app/models/mensajes.py); este script
+-- añade los índices a tablas ya existentes.
+-- -----------------------------------------------------
+USE `autismo_mochis_ia`;
+
+-- Lista de chats: conversaciones activas de un usuario
+ALTER TABLE `conversacion_participantes`
+  ADD KEY `ix_conv_part_usuario_activo` (`usuario_id`, `activo`, `conversacion_id`);
+
+-- Lista de chats: último mensaje no eliminado por conversación (ROW_NUMBER)
+ALTER TABLE `mensajes`
+  ADD KEY `ix_mensajes_conv_eliminado_created` (`conversacion_id`, `eliminado`, `created_at`, `id`);
+
+-- Lista de chats: no leídos de un usuario agrupados por conversación
+ALTER TABLE `mensajes_vistos`
+  ADD KEY `ix_mensajes_vistos_usuario_visto` (`usuario_id`, `visto`, `mensaje_id`);
@@ -35,7 +35,28 @@ export class NotificacionesService {
     };
 
     this.ws.onmessage = (event) => {
-      const notificacion: Notificacion = JSON.parse(event.data);
+      let datos: any;
+      try {
+        datos = JSON.parse(event.data);
+      } catch {
+        return;
+      }
+
+      // Tramas de control: latido del servidor
+      if (datos?.tipo === 'ping') {
+        this.ws?.send(JSON.stringify({ tipo: 'pong' }));
+        return;
+      }
+      if (datos?.tipo === 'pong') {
+        return;
+      }
+      // Se perdieron notificaciones por ir lento: recargar la lista
+      if (datos?.tipo === 'rezagado') {
+        this.cargarNotificaciones(usuarioId, tipo);
+        return;
+      }
+
+      const notificacion: Notificacion = datos;
       
       // Agregar a la lista
       this.notificaciones.update(lista => [notificacion, ...lista]);
@@ -1,5 +1,5 @@
 import { Injectable, signal } from '@angular/core';
-import { BehaviorSubject } from 'rxjs';
+import { BehaviorSubject, Subject } from 'rxjs';
 import { AuthService } from '../auth/auth.service';
 import { environment } from '../../environments/environment';
 
@@ -42,6 +42,11 @@ export class WebsocketService {
   private usuariosConectadosSubject = new BehaviorSubject<Set<number>>(new Set());
   usuariosConectados$ = this.usuariosConectadosSubject.asObservable();
 
+  // El servidor descartó eventos de esta conexión (cola llena): hay que
+  // recargar la conversación por REST
+  private resincronizarSubject = new Subject<number>();
+  resincronizar$ = this.resincronizarSubject.asObservable();
+
   // ============================
   // RECONEXIÓN
   // ============================
@@ -160,6 +165,18 @@ export class WebsocketService {
   private procesarMensaje(data: WebSocketMensaje): void {
     switch (data.tipo) {
 
+      // Latido del servidor: responder para que no cierre la conexión
+      case 'ping':
+        this.ws?.send(JSON.stringify({ tipo: 'pong' }));
+        break;
+
+      // Se perdieron eventos por ir lento: recargar la conversación
+      case 'rezagado':
+        if (this.conversacionIdActual) {
+          this.resincronizarSubject.next(this.conversacionIdActual);
+        }
+        break;
+
       case 'nuevo_mensaje':
         this.nuevoMensajeSubject.next({
           id: data.id,
@@ -63,6 +63,12 @@ export class MensajesComponent implements OnDestroy {
       }
     });
 
+    this.svcWebSocket.resincronizar$.subscribe((conversacionId) => {
+      if (conversacionId === this.chatActivoId()) {
+        this.cargarMensajes(conversacionId);
+      }
+    });
+
     this.svcWebSocket.usuarioEscribiendo$.subscribe((mapa) => {
       this.usuariosEscribiendo.set(mapa);
     });